@@ -1 +1,32 @@
-from .mail_to_sms import *
\ No newline at end of file
+from .mail_to_sms import *
+from .gateway_registry import GatewayRegistry, get_gateway_registry, reload_gateway_registry
+from .mail_to_sms_batch import MailToSMSBatch
+from .smtp_pool import SMTPConnectionPool, SMTPPoolTimeout, get_default_pool
+from .mail_to_sms_parallel import MailToSMSParallel, DispatchReport
+from .number_cache import NumberCache, ParsedNumber, get_number_cache
+from .spool import Spool, SpoolWorker, get_default_spool
+from .resilience import RetryPolicy, CircuitBreaker, CircuitBreakerRegistry, CircuitOpenError, get_breaker_registry
+from .rate_limit import RateLimiter, RateLimitDeferred, TokenBucket
+from .recipient import Recipient
+from .resolver import Resolution, resolve_addresses
+from .metrics import MetricsRegistry, get_metrics
+from .message_template import MessageTemplate, TemplateMessage
+from .identities import Identity, IdentityPool, IdentityPoolExhausted
+from .direct import DirectDelivery, MXCache, MXRecord
+from .coalesce import Coalescer
+from .results import Delivery, ResultsStore, Undeliverable, UndeliverableAddress
+from .bounces import Bounce, BounceIngester, IngestReport
+
+
+def __getattr__(name):
+    ## AsyncMailToSMS pulls in asyncio and aiosmtplib, which are slow to import, so only import it once it's used
+    if(name == "AsyncMailToSMS"):
+        from .async_mail_to_sms import AsyncMailToSMS
+        return AsyncMailToSMS
+
+    ## The daemon pulls in the http modules (and ssl along with them), which the CLI only needs when it's serving
+    if(name in ("SendDaemon", "DaemonClient", "DaemonError")):
+        from . import daemon
+        return getattr(daemon, name)
+
+    raise AttributeError("module '{0}' has no attribute '{1}'".format(__name__, name))
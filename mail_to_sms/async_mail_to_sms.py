@@ -0,0 +1,266 @@
+from __future__ import print_function
+
+import asyncio
+import time
+
+import yagmail
+
+from . import segmentation
+from .mail_to_sms import Sender, SendResult, make_message_id
+from .message_template import add_fields, prepare_send
+from .metrics import CONNECT_SECONDS, DEFERRED, FAILED, RETRIES, SEND_SECONDS, SENT, get_failure_reason
+from .rate_limit import RateLimitDeferred
+from .resilience import call_with_retries_async, get_breaker_registry, get_default_retry_policy
+from .smtp_pool import bind_yagmail_args
+
+try:
+    import aiosmtplib
+except ImportError:
+    aiosmtplib = None
+
+
+class AsyncMailToSMS(Sender):
+    """AsyncMailToSMS
+
+    An asyncio counterpart to Sender. Recipients are validated and built exactly like Sender does, and yagmail still
+    prepares the messages, but they're sent over aiosmtplib so the event loop is never blocked. Sends are bounded by a
+    concurrency semaphore, and connections to the SMTP server are reused between sends.
+
+    Arguments:
+        username {string} [optional]: See MailToSMS.
+        password {string} [optional]: See MailToSMS.
+        keyworded args (for extra configuration):
+            quiet, region, mms, subject, yagmail, number_cache, retry, breakers, rate_limiter, long_messages,
+                mms_threshold, metrics, gateway_files, results: See MailToSMS. A rate_limiter in the "block" mode is
+                awaited without blocking the event loop. The direct, identities, and max_recipients args aren't
+                supported, and raise a ValueError.
+            concurrency {int}: The maximum number of messages in flight at once. Defaults to 10. (ex. concurrency=50)
+            connections {int}: The maximum number of open connections to the SMTP server. Defaults to 4.
+                (ex. connections=8)
+
+    Examples:
+        from mail_to_sms import AsyncMailToSMS
+
+        async with AsyncMailToSMS("username", "password") as mail:
+            await mail.send_to(5551234567, "att", "this is a message")
+
+            roster = [mail.recipient(number, carrier) for number, carrier in rows]
+            results = await mail.send_many([recipient for recipient in roster if recipient], "hello!")
+
+    Requirements:
+        aiosmtplib
+    """
+
+    ## Config
+    CONCURRENCY_KEY = "concurrency"
+    CONNECTIONS_KEY = "connections"
+
+    ## Defaults
+    DEFAULT_CONCURRENCY = 10
+    DEFAULT_CONNECTIONS = 4
+
+
+    def __init__(self, username=None, password=None, **kwargs):
+        if(aiosmtplib is None):
+            raise ImportError("AsyncMailToSMS requires aiosmtplib, install it with 'pip install aiosmtplib'.")
+
+        super(AsyncMailToSMS, self).__init__(username, password, **kwargs)
+        for key in (self.DIRECT_KEY, self.IDENTITIES_KEY, self.MAX_RECIPIENTS_KEY):
+            if(self.config[key] is not None):
+                raise ValueError("AsyncMailToSMS doesn't support the '{0}' arg.".format(key))
+
+        self.config["concurrency"] = kwargs.get(self.CONCURRENCY_KEY, self.DEFAULT_CONCURRENCY)
+        self.config["connections"] = kwargs.get(self.CONNECTIONS_KEY, self.DEFAULT_CONNECTIONS)
+
+        self._semaphore = asyncio.Semaphore(self.config["concurrency"])
+        self._connection_slots = asyncio.Semaphore(self.config["connections"])
+        self._idle = []
+        self._password = None
+
+        ## yagmail is only used to compose the messages, it never logs in
+        try:
+            self._composer = yagmail.SMTP(*self.yagmail_args)
+        except Exception as e:
+            self._print_error(e, "Unhandled error creating yagmail connection.")
+            self._composer = None
+        self._smtp_args = bind_yagmail_args(*self.yagmail_args) or {}
+
+
+    def __enter__(self):
+        raise TypeError("AsyncMailToSMS must be used with 'async with'.")
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+        return False
+
+    ## Methods
+
+    def _get_smtp_kwargs(self):
+        ## Mirror yagmail's connection defaults, so the same yagmail args work for both senders
+        ssl = self._smtp_args.get("smtp_ssl", True)
+        starttls = self._smtp_args.get("smtp_starttls")
+        port = self._smtp_args.get("port")
+
+        return {
+            "hostname": self._composer.host,
+            "port": int(port) if port is not None else (465 if ssl else 587),
+            "use_tls": bool(ssl),
+            "start_tls": bool(not ssl if starttls is None else starttls)
+        }
+
+
+    async def _connect(self):
+        started_at = time.perf_counter()
+        smtp = aiosmtplib.SMTP(**self._get_smtp_kwargs())
+        await smtp.connect()
+
+        if(not self._composer.smtp_skip_login):
+            if(self._password is None):
+                ## Keyring lookups (and password prompts) block, so keep them off of the event loop
+                loop = asyncio.get_running_loop()
+                self._password = await loop.run_in_executor(
+                    None, self._composer.handle_password, self._composer.user, self._composer.credentials
+                )
+            await smtp.login(self._composer.user, self._password)
+
+        self._get_metrics().observe(CONNECT_SECONDS, time.perf_counter() - started_at, host=self._composer.host)
+        return smtp
+
+
+    async def _acquire_smtp(self):
+        await self._connection_slots.acquire()
+        try:
+            while(self._idle):
+                smtp = self._idle.pop()
+                if(smtp.is_connected):
+                    return smtp
+            return await self._connect()
+        except BaseException:
+            self._connection_slots.release()
+            raise
+
+
+    def _release_smtp(self, smtp, discard=False):
+        if(discard or not smtp.is_connected):
+            smtp.close()
+        else:
+            self._idle.append(smtp)
+        self._connection_slots.release()
+
+
+    async def _deliver_async(self, address, contents):
+        prepared = segmentation.prepare(
+            address, contents, self.config["long_messages"], self.gateways, self.config["mms_threshold"],
+            self.config["subject"]
+        )
+        for prepared_address, prepared_contents in prepared:
+            await self._deliver_message_async(prepared_address, prepared_contents)
+
+
+    async def _deliver_message_async(self, address, contents):
+        metrics = self._get_metrics()
+        domain = address.rsplit("@", 1)[-1]
+
+        rate_limiter = self.config["rate_limiter"]
+        if(rate_limiter and not await rate_limiter.acquire_async(self._composer.user, address)):
+            metrics.increment(DEFERRED, domain=domain)
+            raise RateLimitDeferred("Sending to '{0}' was deferred by the rate limiter.".format(address))
+
+        ## Retry transient failures, and fail fast while the relay or the carrier's gateway is known to be down
+        policy = self.config["retry"] or get_default_retry_policy()
+        breakers = (self.config["breakers"] or get_breaker_registry()).for_send(self._composer.host, address)
+
+        message_id = make_message_id(self._composer.user) if self.config["results"] is not None else None
+
+        started_at = time.perf_counter()
+        try:
+            await call_with_retries_async(
+                lambda: self._send_message(address, contents, message_id),
+                policy,
+                breakers,
+                on_retry=lambda attempt, exception: metrics.increment(RETRIES, domain=domain)
+            )
+        except Exception as e:
+            metrics.increment(FAILED, reason=get_failure_reason(e))
+            self._record_result(message_id, address, e)
+            raise
+        else:
+            metrics.increment(SENT, domain=domain)
+            self._record_result(message_id, address)
+        finally:
+            metrics.observe(SEND_SECONDS, time.perf_counter() - started_at, domain=domain)
+
+
+    async def _send_message(self, address, contents, message_id=None):
+        recipients, message = prepare_send(self._composer, address, self.config["subject"], contents, message_id)
+
+        ## Try twice, in case the server dropped an idle connection
+        for attempt in range(2):
+            smtp = await self._acquire_smtp()
+            try:
+                await smtp.sendmail(self._composer.user, recipients, message)
+            except aiosmtplib.SMTPServerDisconnected:
+                self._release_smtp(smtp, discard=True)
+                if(attempt):
+                    raise
+            except BaseException:
+                self._release_smtp(smtp)
+                raise
+            else:
+                self._release_smtp(smtp)
+                return
+
+
+    async def _send_to(self, number, carrier, address, contents):
+        if(not address):
+            error = "Unable to build an address for '{0}' with carrier '{1}'.".format(number, carrier)
+            return SendResult(number, carrier, None, False, error)
+
+        if(not self._composer):
+            return SendResult(number, carrier, address, False, "No yagmail connection available.")
+
+        async with self._semaphore:
+            try:
+                self._check_deliverable(address)
+                await self._deliver_async(address, add_fields(contents, **self._template_fields(number, carrier)))
+            except RateLimitDeferred as e:
+                return SendResult(number, carrier, address, False, str(e), deferred=True)
+            except Exception as e:
+                return SendResult(number, carrier, address, False, self._print_error(e, "Unhandled error sending mail."))
+            else:
+                return SendResult(number, carrier, address, True, None)
+
+
+    async def send(self, recipient, contents):
+        """Sends contents to the Recipient, and returns its SendResult."""
+
+        address = recipient.get_address(self.config["mms"])
+        return await self._send_to(recipient.number, recipient.carrier, address, contents)
+
+
+    async def send_many(self, recipients, contents):
+        """Sends contents to every Recipient concurrently, and returns their SendResults in the same order as the
+        recipients."""
+
+        return list(await asyncio.gather(*(self.send(recipient, contents) for recipient in recipients)))
+
+
+    async def send_to(self, number, carrier, contents):
+        """Validates and sends contents to a single recipient, and returns its SendResult."""
+
+        return await self._send_to(number, carrier, self._build_address(number, carrier), contents)
+
+
+    async def close(self):
+        ## Politely close every idle connection
+        idle, self._idle = self._idle, []
+        for smtp in idle:
+            try:
+                await smtp.quit()
+            except Exception:
+                smtp.close()
@@ -0,0 +1,253 @@
+from __future__ import print_function
+
+import logging
+import re
+from collections import namedtuple
+
+from .results import BOUNCED, OPTED_OUT
+
+
+logger = logging.getLogger(__name__)
+
+
+## A single recipient's bounce (or opt out reply) parsed out of an email. Permanent bounces and opt outs mark the
+## address as undeliverable, and anything else is just recorded.
+Bounce = namedtuple("Bounce", ["address", "message_id", "status", "reason", "permanent", "kind"])
+
+## The outcome of ingesting a batch of emails
+IngestReport = namedtuple("IngestReport", ["messages", "bounces", "matched", "undeliverable"])
+
+## Config
+STOP_WORDS = frozenset(("STOP", "STOPALL", "UNSUBSCRIBE", "CANCEL", "END", "QUIT"))
+BOUNCE_SENDERS = ("mailer-daemon", "postmaster")
+BOUNCE_SUBJECTS = ("undeliver", "delivery status", "delivery failure", "failure notice", "returned mail")
+ADDRESS_PATTERN = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+MESSAGE_ID_PATTERN = re.compile(r"^Message-ID:\s*(<[^>\s]+>)", re.IGNORECASE | re.MULTILINE)
+STATUS_PATTERN = re.compile(r"\b([245]\.\d{1,3}\.\d{1,3})\b")
+SMTP_CODE_PATTERN = re.compile(r"\b([45]\d\d)[ -]")
+## Message-IDs look just like addresses, so they're dropped before scanning for addresses
+MESSAGE_ID_LINE_PATTERN = re.compile(r"^(Message-ID|In-Reply-To|References):.*$", re.IGNORECASE | re.MULTILINE)
+
+
+def _get_text(part):
+    payload = part.get_payload(decode=True)
+    if(payload is None):
+        return ""
+    return payload.decode(part.get_content_charset() or "utf-8", "replace")
+
+
+def _get_original_message_id(message):
+    ## DSNs carry the original message (or just its headers), and other bounces usually quote its headers in the body
+    for part in message.walk():
+        content_type = part.get_content_type()
+        if(content_type == "message/rfc822"):
+            original = part.get_payload(0)
+            if(original["Message-ID"]):
+                return original["Message-ID"].strip()
+        elif(content_type == "text/rfc822-headers"):
+            match = MESSAGE_ID_PATTERN.search(_get_text(part))
+            if(match):
+                return match.group(1)
+
+    for part in message.walk():
+        if(part.get_content_maintype() == "text"):
+            match = MESSAGE_ID_PATTERN.search(_get_text(part))
+            if(match):
+                return match.group(1)
+
+    in_reply_to = message["In-Reply-To"]
+    return in_reply_to.strip() if in_reply_to else None
+
+
+def _strip_address_type(value):
+    ## ex. "rfc822; 5551234567@txt.att.net"
+    return value.split(";", 1)[-1].strip().strip("<>") if value else None
+
+
+def _parse_delivery_status(message, message_id):
+    bounces = []
+    for part in message.walk():
+        if(part.get_content_type() != "message/delivery-status"):
+            continue
+
+        ## The first block of fields is about the whole message, and each one after it is about a single recipient
+        for fields in part.get_payload()[1:]:
+            address = _strip_address_type(fields["Final-Recipient"] or fields["Original-Recipient"])
+            action = (fields["Action"] or "").strip().lower()
+            if(not address or action not in ("failed", "delayed")):
+                continue
+
+            status = (fields["Status"] or "").strip() or None
+            reason = _strip_address_type(fields["Diagnostic-Code"]) or status
+            permanent = action == "failed" and not (status or "").startswith("4")
+            bounces.append(Bounce(address, message_id, status, reason, permanent, BOUNCED))
+
+    return bounces
+
+
+def _is_bounce(message):
+    sender = (message["From"] or "").lower()
+    subject = (message["Subject"] or "").lower()
+    return (
+        message.get_content_type() == "multipart/report" or
+        any(name in sender for name in BOUNCE_SENDERS) or
+        any(phrase in subject for phrase in BOUNCE_SUBJECTS)
+    )
+
+
+def parse_message(message):
+    """Returns the Bounces in an email (an email.message.Message, or its bytes).
+
+    Standard delivery status notifications (RFC 3464) are read recipient by recipient. Other bounces (ex. qmail's) are
+    scanned for the addresses they mention along with any status or SMTP code, so they can be matched to the addresses
+    that were sent to. Replies whose first word is a stop word (ex. "STOP") are opt outs from the reply's sender.
+    """
+
+    if(isinstance(message, (bytes, str))):
+        import email
+        from email import policy
+
+        parse = email.message_from_bytes if isinstance(message, bytes) else email.message_from_string
+        message = parse(message, policy=policy.compat32)
+
+    if(_is_bounce(message)):
+        message_id = _get_original_message_id(message)
+        bounces = _parse_delivery_status(message, message_id)
+        if(bounces):
+            return bounces
+
+        ## Without a delivery status, the best that can be done is every address mentioned alongside any status
+        text = "\n".join(_get_text(part) for part in message.walk() if part.get_content_type() == "text/plain")
+        status = STATUS_PATTERN.search(text)
+        code = SMTP_CODE_PATTERN.search(text)
+        status = status.group(1) if status else (code.group(1) if code else None)
+        ## Only an explicit 5.x.x (or 5xx) is permanent, plenty of these are just warnings or delay notices
+        permanent = (status or "").startswith("5")
+        reason = text.strip().splitlines()[0] if text.strip() else None
+
+        addresses = dict.fromkeys(
+            address.lower() for address in ADDRESS_PATTERN.findall(MESSAGE_ID_LINE_PATTERN.sub("", text))
+        )
+        return [Bounce(address, message_id, status, reason, permanent, BOUNCED) for address in addresses]
+
+    ## Replies from the gateway come from the recipient's own address
+    from email.utils import parseaddr
+
+    _, sender = parseaddr(message["From"] or "")
+    text = "\n".join(_get_text(part) for part in message.walk() if part.get_content_type() == "text/plain")
+    words = text.split()
+    if(sender and words and words[0].strip(".!").upper() in STOP_WORDS):
+        message_id = message["In-Reply-To"].strip() if message["In-Reply-To"] else None
+        return [Bounce(sender.lower(), message_id, None, words[0], True, OPTED_OUT)]
+
+    return []
+
+
+class BounceIngester:
+    """BounceIngester
+
+    Reads bounces and replies out of a mailbox (an mbox file, or an IMAP folder), matches each one back to the message
+    it's for in a ResultsStore, and marks the addresses that bounced permanently (or replied STOP) as undeliverable.
+    Bounces for addresses that were never sent to are ignored, so unrelated mail in the mailbox is harmless.
+
+    Arguments:
+        store {ResultsStore}: The store to match against and mark addresses in.
+
+    Examples:
+        from mail_to_sms import BounceIngester, ResultsStore
+
+        ingester = BounceIngester(ResultsStore())
+        report = ingester.ingest_imap("imap.gmail.com", "username", "password")
+        print(report.undeliverable)
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    ## Methods
+
+    def ingest_message(self, message):
+        """Matches every Bounce in the email (a Message, or its bytes) against the store. Returns a list of
+        (Bounce, matched) pairs, where matched is True if it was matched to a message that was sent."""
+
+        outcomes = []
+        for bounce in parse_message(message):
+            matched = self.store.record_bounce(bounce.message_id, bounce.address, bounce.status, bounce.reason)
+            if(matched is not None and bounce.permanent):
+                self.store.mark_undeliverable(bounce.address, bounce.kind, bounce.reason)
+            outcomes.append((bounce, matched is not None))
+
+        return outcomes
+
+
+    def ingest(self, messages):
+        """Ingests every email in the messages iterable, and returns an IngestReport."""
+
+        counts = {"messages": 0, "bounces": 0, "matched": 0}
+        undeliverable = []
+        for message in messages:
+            counts["messages"] += 1
+            try:
+                outcomes = self.ingest_message(message)
+            except Exception as e:
+                ## One malformed email shouldn't stop the rest from being read
+                logger.warning("Skipping an email that couldn't be parsed: %s", e)
+                continue
+
+            for bounce, matched in outcomes:
+                counts["bounces"] += 1
+                if(matched):
+                    counts["matched"] += 1
+                    if(bounce.permanent):
+                        undeliverable.append(bounce.address)
+
+        return IngestReport(counts["messages"], counts["bounces"], counts["matched"], undeliverable)
+
+
+    def ingest_mbox(self, path):
+        """Ingests every email in the mbox file at path, and returns an IngestReport."""
+
+        import mailbox
+
+        mbox = mailbox.mbox(path, create=False)
+        try:
+            return self.ingest(mbox)
+        finally:
+            mbox.close()
+
+
+    def ingest_imap(self, host, username, password, port=None, mailbox="INBOX", ssl=True, delete=False, timeout=30):
+        """Ingests the unseen emails in an IMAP folder, and returns an IngestReport. Ingested emails are flagged as
+        seen so they aren't read again, or deleted if delete is truthy."""
+
+        import imaplib
+
+        if(ssl):
+            imap = imaplib.IMAP4_SSL(host, port or imaplib.IMAP4_SSL_PORT, timeout=timeout)
+        else:
+            imap = imaplib.IMAP4(host, port or imaplib.IMAP4_PORT, timeout=timeout)
+
+        try:
+            imap.login(username, password)
+            imap.select(mailbox)
+            _, data = imap.uid("SEARCH", None, "UNSEEN")
+            uids = data[0].split() if data and data[0] else []
+
+            def fetch():
+                ## Fetched lazily, so only one email is held in memory at a time
+                for uid in uids:
+                    _, data = imap.uid("FETCH", uid, "(RFC822)")
+                    for item in data:
+                        if(isinstance(item, tuple)):
+                            yield item[1]
+                    imap.uid("STORE", uid, "+FLAGS", "(\\Deleted)" if delete else "(\\Seen)")
+
+            report = self.ingest(fetch())
+            if(delete):
+                imap.expunge()
+            return report
+        finally:
+            try:
+                imap.logout()
+            except Exception:
+                pass
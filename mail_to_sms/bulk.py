@@ -0,0 +1,153 @@
+from __future__ import print_function
+
+import csv
+import itertools
+import json
+from collections import namedtuple
+
+from .mail_to_sms import SendResult
+from .resolver import resolve_addresses
+
+
+## Config
+CSV = "csv"
+JSONL = "jsonl"
+NUMBER_KEY = "number"
+CARRIER_KEY = "carrier"
+MESSAGE_KEY = "message"
+COLUMNS = (NUMBER_KEY, CARRIER_KEY, MESSAGE_KEY)
+
+
+## A single recipient read from a bulk input file. Rows that couldn't be read have an error instead.
+BulkRow = namedtuple("BulkRow", ["line", "number", "carrier", "message", "error"])
+
+
+def _sniff_format(line):
+    return JSONL if line.lstrip().startswith("{") else CSV
+
+
+def _read_csv(lines):
+    reader = csv.reader(lines)
+    columns = None
+    for fields in reader:
+        if(not any(field.strip() for field in fields)):
+            continue
+
+        ## A header row (ex. "number,carrier,message") can put the columns in any order
+        if(columns is None):
+            header = [field.strip().lower() for field in fields]
+            if(NUMBER_KEY in header and CARRIER_KEY in header):
+                columns = header
+                continue
+            columns = COLUMNS
+
+        row = dict(zip(columns, (field.strip() for field in fields)))
+        number = row.get(NUMBER_KEY)
+        carrier = row.get(CARRIER_KEY)
+        if(not number or not carrier):
+            yield BulkRow(reader.line_num, number, carrier, None, "Expected a number and a carrier.")
+        else:
+            yield BulkRow(reader.line_num, number, carrier, row.get(MESSAGE_KEY) or None, None)
+
+
+def _read_jsonl(lines):
+    for line_number, line in enumerate(lines, 1):
+        if(not line.strip()):
+            continue
+
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield BulkRow(line_number, None, None, None, "Invalid JSON: {0}".format(e))
+            continue
+
+        if(not isinstance(row, dict)):
+            yield BulkRow(line_number, None, None, None, "Expected a JSON object.")
+            continue
+
+        number = row.get(NUMBER_KEY)
+        carrier = row.get(CARRIER_KEY)
+        if(number in (None, "") or not carrier):
+            yield BulkRow(line_number, number, carrier, None, "Expected a number and a carrier.")
+        else:
+            yield BulkRow(line_number, number, carrier, row.get(MESSAGE_KEY) or None, None)
+
+
+def read_rows(lines, input_format=None):
+    """Lazily reads recipients from an iterable of lines (ex. an open file), yielding a BulkRow for each.
+
+    Arguments:
+        lines {iterable}: The lines of the input. They're only read as the rows are consumed.
+        input_format {string} [optional]: Either CSV or JSONL. Sniffed from the first non-blank line if omitted.
+
+    CSV input has number, carrier, and optional message columns, either in that order or in any order under a header
+    row. JSONL input has one {"number": ..., "carrier": ..., "message": ...} object per line, with message optional.
+    """
+
+    lines = iter(lines)
+    if(input_format is None):
+        ## Peek at the first real line, and then put it back
+        skipped = []
+        for line in lines:
+            skipped.append(line)
+            if(line.strip()):
+                input_format = _sniff_format(line)
+                break
+        lines = itertools.chain(skipped, lines)
+
+    if(input_format == JSONL):
+        return _read_jsonl(lines)
+    return _read_csv(lines)
+
+
+def dispatch(batch, rows, message=None):
+    """Lazily sends each row over the MailToSMSBatch's connection, yielding (BulkRow, SendResult) pairs as it goes.
+    Rows without a message of their own get the default message, and rows that couldn't be read are never sent."""
+
+    with batch:
+        for row in rows:
+            contents = row.message or message
+            if(row.error):
+                yield row, SendResult(row.number, row.carrier, None, False, row.error)
+            elif(not contents):
+                yield row, SendResult(row.number, row.carrier, None, False, "No message to send.")
+            else:
+                yield row, batch.send_to(row.number, row.carrier, contents)
+
+
+def resolve(rows, message=None, **kwargs):
+    """Like dispatch(), but only validates and resolves each row's address without sending anything. Yields
+    (BulkRow, SendResult) pairs, where a successful result means that the row would have been sent. Any keyworded args
+    are passed on to resolve_addresses()."""
+
+    ## Resolve the rows in batches while walking them in order. The tee only buffers the rows that resolve_addresses()
+    ## has read ahead, so memory use stays bounded.
+    rows, pending = itertools.tee(rows)
+    resolutions = resolve_addresses(((row.number, row.carrier) for row in pending if not row.error), **kwargs)
+
+    for row in rows:
+        if(row.error):
+            yield row, SendResult(row.number, row.carrier, None, False, row.error)
+            continue
+
+        resolution = next(resolutions)
+        if(not resolution.address):
+            yield row, SendResult(row.number, row.carrier, None, False, resolution.error)
+        elif(not (row.message or message)):
+            yield row, SendResult(row.number, row.carrier, resolution.address, False, "No message to send.")
+        else:
+            yield row, SendResult(row.number, row.carrier, resolution.address, True, None)
+
+
+def to_record(row, result):
+    """Returns a JSON serializable dict describing the outcome of sending to the row."""
+
+    return {
+        "line": row.line,
+        "number": row.number,
+        "carrier": row.carrier,
+        "address": result.address,
+        "success": result.success,
+        "deferred": result.deferred,
+        "error": result.error
+    }
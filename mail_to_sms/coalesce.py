@@ -0,0 +1,173 @@
+from __future__ import print_function
+
+import threading
+import time
+from collections import OrderedDict
+
+from .metrics import COALESCED, get_metrics
+from .segmentation import get_text
+
+
+## Config
+REPEAT_SUFFIX = " (x{0})"
+OVERFLOW_LINE = "(and {0} more)"
+
+
+class _Digest:
+    __slots__ = ("recipient", "opened_at", "messages", "overflow")
+
+    def __init__(self, recipient, opened_at):
+        self.recipient = recipient
+        self.opened_at = opened_at
+        self.messages = OrderedDict()
+        self.overflow = 0
+
+
+class Coalescer:
+    """Coalescer
+
+    Sits in front of a Sender, and merges the messages for each recipient that arrive within a window of each other
+    into a single digest. Recipients are matched on their normalized number and gateway address, so "555-123-4567"
+    and "+15551234567" on the same carrier share a digest, and repeats of the same message are only listed once along
+    with how many times they came in. During alert storms, this turns dozens of texts into one.
+
+    Digests are sent window seconds after their first message arrives, either by calling flush() or by a background
+    thread when used as a context manager (or with run()). Anything still waiting is sent by close().
+
+    Arguments:
+        sender {Sender}: The sender to resolve recipients with, and to send the digests from.
+        keyworded args (for extra configuration):
+            window {float}: Seconds to collect messages for, after the first one arrives. Defaults to 60.
+            max_messages {int}: The most distinct messages listed in a digest. Any more are counted in an "(and N
+                more)" line instead. Defaults to 10.
+            separator {string}: What goes between the messages in a digest. Defaults to a newline.
+            clock {callable}: Returns the current time in seconds. Defaults to time.monotonic.
+            metrics {MetricsRegistry}: Where coalesced messages are counted. Defaults to the process wide registry.
+
+    Examples:
+        from mail_to_sms import Coalescer, Sender
+
+        with Coalescer(Sender("username", "password"), window=120) as coalescer:
+            for alert in alerts:
+                coalescer.add(on_call_number, "att", alert.summary)
+    """
+
+    ## Defaults
+    DEFAULT_WINDOW = 60
+    DEFAULT_MAX_MESSAGES = 10
+    DEFAULT_SEPARATOR = "\n"
+    DEFAULT_POLL_INTERVAL = 1.0
+
+
+    def __init__(self, sender, **kwargs):
+        self.sender = sender
+        self.window = kwargs.get("window", self.DEFAULT_WINDOW)
+        self.max_messages = kwargs.get("max_messages", self.DEFAULT_MAX_MESSAGES)
+        self.separator = kwargs.get("separator", self.DEFAULT_SEPARATOR)
+        self.clock = kwargs.get("clock", time.monotonic)
+        self.metrics = kwargs.get("metrics") or get_metrics()
+
+        self._digests = OrderedDict()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._digests)
+
+
+    def __enter__(self):
+        ## Cleared before the thread starts (rather than in run()), so that a stop() which beats it to run() sticks
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    ## Methods
+
+    def _get_key(self, recipient):
+        return (recipient.number, recipient.get_address(self.sender.config["mms"]))
+
+
+    def _render(self, digest):
+        lines = [
+            text + (REPEAT_SUFFIX.format(count) if count > 1 else "") for text, count in digest.messages.items()
+        ]
+        if(digest.overflow):
+            lines.append(OVERFLOW_LINE.format(digest.overflow))
+
+        return self.separator.join(lines)
+
+
+    def add(self, number, carrier, contents):
+        """Adds a text message for the recipient to their digest. Returns the address it'll be sent to, or None if
+        the number and carrier couldn't be resolved to one."""
+
+        text = get_text(contents)
+        if(text is None):
+            raise TypeError("Only text messages can be coalesced.")
+
+        recipient = self.sender.recipient(number, carrier)
+        if(not recipient):
+            return None
+
+        key = self._get_key(recipient)
+        with self._lock:
+            digest = self._digests.get(key)
+            if(digest is None):
+                digest = _Digest(recipient, self.clock())
+                self._digests[key] = digest
+            else:
+                self.metrics.increment(COALESCED)
+
+            if(text in digest.messages):
+                digest.messages[text] += 1
+            elif(len(digest.messages) < self.max_messages):
+                digest.messages[text] = 1
+            else:
+                digest.overflow += 1
+
+        return key[1]
+
+
+    def flush(self, force=False):
+        """Sends every digest whose window has passed (or every digest, if force is truthy), and returns their
+        SendResults."""
+
+        with self._lock:
+            now = self.clock()
+            due = [
+                key for key, digest in self._digests.items() if force or now - digest.opened_at >= self.window
+            ]
+            digests = [self._digests.pop(key) for key in due]
+
+        ## Sending happens outside of the lock, so new messages can keep coming in meanwhile
+        return [self.sender.send(digest.recipient, self._render(digest)) for digest in digests]
+
+
+    def run(self, poll_interval=DEFAULT_POLL_INTERVAL):
+        """Sends digests as they come due, until stop() is called."""
+
+        while(not self._stopped.is_set()):
+            self.flush()
+            self._stopped.wait(poll_interval)
+
+
+    def stop(self):
+        self._stopped.set()
+        if(self._thread is not None):
+            self._thread.join()
+            self._thread = None
+
+
+    def close(self):
+        """Stops the background thread (if there is one), and sends everything that's still waiting. Returns the
+        SendResults of those digests."""
+
+        self.stop()
+        return self.flush(force=True)
@@ -0,0 +1,590 @@
+from __future__ import print_function
+
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import stat
+import threading
+import time
+from collections import OrderedDict
+from http import client as http_client
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from .mail_to_sms import Sender, SendResult
+from .metrics import get_metrics
+from .smtp_pool import SMTPConnectionPool
+
+
+logger = logging.getLogger(__name__)
+
+## Config
+SEND_PATH = "/send"
+HEALTH_PATH = "/health"
+METRICS_PATH = "/metrics"
+JSON_CONTENT_TYPE = "application/json"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+## Send requests bigger than this are refused before any of them is read
+MAX_BODY_SIZE = 1024 * 1024
+SOCKET_MODE = 0o600
+
+## Defaults
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8725
+DEFAULT_URL = "http://{0}:{1}".format(DEFAULT_HOST, DEFAULT_PORT)
+DEFAULT_TIMEOUT = 60
+
+
+class DaemonError(Exception):
+    """Raised by a DaemonClient when the daemon can't be reached, or it rejects a request."""
+    pass
+
+
+def parse_request(body):
+    """Returns the (number, carrier, message) triples in a send request's JSON body, which is either a single message
+    object, a list of them, or an object with a "messages" list. Raises ValueError if it isn't valid."""
+
+    try:
+        payload = json.loads(body.decode("utf-8") if isinstance(body, bytes) else body)
+    except ValueError as e:
+        raise ValueError("The request body isn't valid JSON: {0}".format(e))
+
+    if(isinstance(payload, dict) and "messages" in payload):
+        payload = payload["messages"]
+    messages = payload if isinstance(payload, list) else [payload]
+    if(not messages):
+        raise ValueError("The request doesn't have any messages.")
+
+    parsed = []
+    for index, message in enumerate(messages):
+        if(not isinstance(message, dict)):
+            raise ValueError("Message {0} isn't a JSON object.".format(index))
+
+        values = [message.get(key) for key in ("number", "carrier", "message")]
+        if(any(value is None or value == "" for value in values)):
+            raise ValueError("Message {0} needs a number, carrier, and message.".format(index))
+        parsed.append((str(values[0]), str(values[1]), str(values[2])))
+
+    return parsed
+
+
+def to_record(number, carrier, result):
+    """Returns a JSON serializable dict describing the outcome of a daemon send."""
+
+    return {
+        "number": number,
+        "carrier": carrier,
+        "address": result.address,
+        "success": result.success,
+        "deferred": result.deferred,
+        "error": result.error
+    }
+
+
+class _Pending:
+    ## A message waiting in the daemon's queue, and the request thread waiting on it
+    __slots__ = ("number", "carrier", "contents", "result", "done")
+
+    def __init__(self, number, carrier, contents):
+        self.number = number
+        self.carrier = carrier
+        self.contents = contents
+        self.result = None
+        self.done = threading.Event()
+
+    def finish(self, result):
+        if(not self.done.is_set()):
+            self.result = result
+            self.done.set()
+
+
+class _DaemonHandler(BaseHTTPRequestHandler):
+    ## Keep alive, so that a client's connection (and its handler thread) is reused between messages. The headers and
+    ## body are written separately, so Nagle's algorithm would otherwise hold each response for a delayed ACK.
+    protocol_version = "HTTP/1.1"
+    server_version = "mail_to_sms"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        ## Unix domain sockets don't have a client address, and every request would be too noisy to log by default
+        logger.debug("Daemon request: " + format, *args)
+
+
+    def _respond(self, status, body, content_type=JSON_CONTENT_TYPE, close=False):
+        data = (body if isinstance(body, str) else json.dumps(body)).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        if(close):
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(data)
+
+
+    def do_GET(self):
+        daemon = self.server.send_daemon
+        if(self.path == HEALTH_PATH):
+            self._respond(200, daemon.health())
+        elif(self.path == METRICS_PATH):
+            self._respond(200, daemon.metrics.to_prometheus(), PROMETHEUS_CONTENT_TYPE)
+        else:
+            self._respond(404, {"error": "Not found."})
+
+
+    def do_POST(self):
+        ## Bodies that are too big (or of an unknown size) are never read, so the connection can't be reused after them
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if(length < 0):
+            self._respond(400, {"error": "Invalid Content-Length."}, close=True)
+            return
+        if(length > MAX_BODY_SIZE):
+            error = "Request bodies can't be larger than {0} bytes.".format(MAX_BODY_SIZE)
+            self._respond(413, {"error": error}, close=True)
+            return
+
+        ## Always read the body, so the connection stays usable for the next request
+        body = self.rfile.read(length)
+        if(self.path != SEND_PATH):
+            self._respond(404, {"error": "Not found."})
+            return
+
+        try:
+            messages = parse_request(body)
+        except ValueError as e:
+            self._respond(400, {"error": str(e)})
+            return
+
+        daemon = self.server.send_daemon
+        if(daemon.stopped):
+            self._respond(503, {"error": "The daemon is shutting down."})
+            return
+
+        results = daemon.submit(messages)
+        self._respond(200, {
+            "results": [to_record(number, carrier, result) for (number, carrier, _), result in zip(messages, results)]
+        })
+
+
+class _UnixDaemonHandler(_DaemonHandler):
+    ## Unix domain sockets don't have Nagle's algorithm (or TCP options at all) to disable
+    disable_nagle_algorithm = False
+
+
+class _TCPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        ## A socket left behind by a daemon that didn't shut down cleanly would otherwise block binding. Anything else
+        ## at the path is left alone, and binding fails instead.
+        try:
+            if(stat.S_ISSOCK(os.lstat(self.server_address).st_mode)):
+                os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+        socketserver.UnixStreamServer.server_bind(self)
+
+        ## Anyone who can connect can send as the daemon's account, so only its own user gets to
+        os.chmod(self.server_address, SOCKET_MODE)
+
+
+class _UnixHTTPConnection(http_client.HTTPConnection):
+    def __init__(self, path, timeout):
+        http_client.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class SendDaemon:
+    """SendDaemon
+
+    A long running sender that takes send requests as JSON over HTTP, on a local TCP port or a Unix domain socket.
+    The gateways, phone number cache, and pooled SMTP connections stay warm between requests, so each message only
+    costs the send itself rather than interpreter startup, imports, gateway parsing, and an SMTP login.
+
+    Requests are queued and sent in batches by a few worker threads, each with its own Sender. Whatever is queued when
+    a worker frees up goes out together over one connection, and with max_recipients set, identical messages to the
+    same gateway domain share SMTP transactions.
+
+    Send requests are POSTed to /send, as a single {"number", "carrier", "message"} object, a list of them, or an
+    object with a "messages" list. The response has a "results" list with each message's outcome, in order. GET
+    /health returns the daemon's status, and GET /metrics returns its metrics in the Prometheus text format.
+
+    Arguments:
+        username {string} [optional]: See MailToSMS.
+        password {string} [optional]: See MailToSMS.
+        keyworded args (for extra configuration): See MailToSMS, along with:
+            host {string}: The host to listen on. Defaults to "127.0.0.1".
+            port {int}: The port to listen on, or 0 for any free port. Defaults to 8725.
+            socket_path {string}: Listen on this Unix domain socket instead of a TCP port. The socket is only
+                accessible to the daemon's own user.
+            workers {int}: The number of threads (and SMTP connections) sending batches. Defaults to 4.
+            batch_size {int}: The most messages a worker sends at once. Defaults to 100.
+            batch_window {float}: Seconds a worker waits for more messages to batch up before sending. Defaults to 0,
+                which sends whatever is already queued without waiting.
+            timeout {float}: Seconds a request waits for its messages to be sent. Defaults to 60.
+            pool {SMTPConnectionPool}: See MailToSMS. Defaults to a new pool with one connection per worker.
+
+    Examples:
+        from mail_to_sms import SendDaemon
+
+        SendDaemon("username", "password", socket_path="/tmp/mail_to_sms.sock", max_recipients=50).serve_forever()
+
+        ## curl --unix-socket /tmp/mail_to_sms.sock localhost/send -d '{"number": 5551234567, "carrier": "att",
+        ##     "message": "hello"}'
+    """
+
+    ## Config
+    HOST_KEY = "host"
+    PORT_KEY = "port"
+    SOCKET_PATH_KEY = "socket_path"
+    WORKERS_KEY = "workers"
+    BATCH_SIZE_KEY = "batch_size"
+    BATCH_WINDOW_KEY = "batch_window"
+    TIMEOUT_KEY = "timeout"
+    POLL_INTERVAL = 0.5
+
+    ## Defaults
+    DEFAULT_WORKERS = 4
+    DEFAULT_BATCH_SIZE = 100
+    DEFAULT_BATCH_WINDOW = 0
+    DEFAULT_TIMEOUT = 60
+
+
+    def __init__(self, username=None, password=None, **kwargs):
+        self.host = kwargs.pop(self.HOST_KEY, DEFAULT_HOST)
+        self.port = kwargs.pop(self.PORT_KEY, DEFAULT_PORT)
+        self.socket_path = kwargs.pop(self.SOCKET_PATH_KEY, None)
+        self.workers = kwargs.pop(self.WORKERS_KEY, self.DEFAULT_WORKERS)
+        self.batch_size = max(kwargs.pop(self.BATCH_SIZE_KEY, self.DEFAULT_BATCH_SIZE), 1)
+        self.batch_window = kwargs.pop(self.BATCH_WINDOW_KEY, self.DEFAULT_BATCH_WINDOW)
+        self.timeout = kwargs.pop(self.TIMEOUT_KEY, self.DEFAULT_TIMEOUT)
+
+        self._owns_pool = not kwargs.get(Sender.POOL_KEY)
+        if(self._owns_pool):
+            kwargs[Sender.POOL_KEY] = SMTPConnectionPool(size=self.workers)
+        self.pool = kwargs[Sender.POOL_KEY]
+        self.metrics = kwargs.get(Sender.METRICS_KEY) or get_metrics()
+
+        ## A Sender per worker, since a Sender holds its connection for the length of a batch. They share everything
+        ## else (the pool, the gateways, and the number cache) so it's all loaded once.
+        self._senders = [Sender(username, password, **kwargs) for _ in range(self.workers)]
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        ## Held while checking _stopped and queueing, so that nothing is queued after stop() drains the queue
+        self._submit_lock = threading.Lock()
+        self._threads = []
+        self._server = None
+        self._started_at = None
+
+
+    def __enter__(self):
+        self.start()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    @property
+    def stopped(self):
+        return self._stopped.is_set()
+
+    @property
+    def address(self):
+        """The socket path, or the (host, port) that the daemon is listening on."""
+
+        if(self.socket_path):
+            return self.socket_path
+        return self._server.server_address[:2] if self._server else (self.host, self.port)
+
+    @property
+    def url(self):
+        """The URL to reach the daemon at, or None if it's listening on a Unix domain socket."""
+
+        return None if self.socket_path else "http://{0}:{1}".format(*self.address)
+
+    ## Methods
+
+    def _warm(self):
+        ## Log in up front, so the first request doesn't pay for it and bad credentials show up right away
+        sender = self._senders[0]
+        try:
+            with sender._lease():
+                pass
+        except Exception as e:
+            sender._print_error(e, "Unable to connect to the SMTP server yet, it'll be retried on the first send.")
+
+
+    def _next_batch(self):
+        ## None is queued by stop() to wake the workers up
+        try:
+            batch = [self._queue.get(timeout=self.POLL_INTERVAL)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.batch_window
+        while(len(batch) < self.batch_size):
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return [pending for pending in batch if pending is not None]
+
+
+    def _send_batch(self, sender, batch):
+        ## Identical messages are sent together, so that they can share transactions
+        groups = OrderedDict()
+        for pending in batch:
+            groups.setdefault(pending.contents, []).append(pending)
+
+        try:
+            for contents, group in groups.items():
+                recipients = []
+                waiting = []
+                for pending in group:
+                    recipient = sender.recipient(pending.number, pending.carrier)
+                    if(recipient is None):
+                        error = "Unable to build an address for '{0}' with carrier '{1}'.".format(
+                            pending.number, pending.carrier
+                        )
+                        pending.finish(SendResult(pending.number, pending.carrier, None, False, error))
+                    else:
+                        recipients.append(recipient)
+                        waiting.append(pending)
+
+                if(recipients):
+                    for pending, result in zip(waiting, sender.send_many(recipients, contents)):
+                        pending.finish(result)
+        except Exception as e:
+            error = sender._print_error(e, "Unhandled error sending a batch.")
+            for pending in batch:
+                pending.finish(SendResult(pending.number, pending.carrier, None, False, error))
+
+
+    def _work(self, sender):
+        while(not self._stopped.is_set()):
+            batch = self._next_batch()
+            if(batch):
+                self._send_batch(sender, batch)
+
+
+    def submit(self, messages):
+        """Queues each (number, carrier, message) triple to be sent, waits for them, and returns their SendResults in
+        the same order. Messages that weren't sent within the timeout are reported as failures, though they may still
+        be sent later, and fails them right away if the daemon is stopping."""
+
+        pending = [_Pending(number, carrier, contents) for number, carrier, contents in messages]
+        with self._submit_lock:
+            if(self._stopped.is_set()):
+                for item in pending:
+                    item.finish(SendResult(item.number, item.carrier, None, False, "The daemon is shutting down."))
+                return [item.result for item in pending]
+
+            for item in pending:
+                self._queue.put(item)
+
+        deadline = time.monotonic() + self.timeout
+        for item in pending:
+            if(not item.done.wait(max(deadline - time.monotonic(), 0))):
+                item.finish(SendResult(item.number, item.carrier, None, False, "Timed out waiting to be sent."))
+
+        return [item.result for item in pending]
+
+
+    def health(self):
+        return {
+            "status": "stopping" if self.stopped else "ok",
+            "uptime": time.monotonic() - self._started_at if self._started_at else 0,
+            "queued": self._queue.qsize(),
+            "workers": self.workers
+        }
+
+
+    def start(self):
+        """Starts listening, and sending on background threads. Returns right away."""
+
+        self._stopped.clear()
+        self._started_at = time.monotonic()
+        self._warm()
+
+        if(self.socket_path):
+            self._server = _UnixServer(self.socket_path, _UnixDaemonHandler)
+        else:
+            self._server = _TCPServer((self.host, self.port), _DaemonHandler)
+        self._server.send_daemon = self
+
+        self._threads = [threading.Thread(target=self._work, args=(sender,), daemon=True) for sender in self._senders]
+        self._threads.append(threading.Thread(target=self._server.serve_forever, daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+        logger.info("mail_to_sms daemon listening on %s", self.socket_path or "{0}:{1}".format(*self.address))
+
+
+    def serve_forever(self):
+        """Starts the daemon and blocks until stop() is called, or the process is interrupted (ex. with Ctrl+C)."""
+
+        self.start()
+        try:
+            while(not self._stopped.wait(self.POLL_INTERVAL)):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+
+    def stop(self):
+        """Stops listening, finishes the batches in progress, and fails anything still queued."""
+
+        if(self._server is None):
+            return
+
+        with self._submit_lock:
+            self._stopped.set()
+        for _ in self._senders:
+            self._queue.put(None)
+        self._server.shutdown()
+        self._server.server_close()
+        for thread in self._threads:
+            thread.join()
+
+        while(True):
+            try:
+                pending = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if(pending is not None):
+                pending.finish(SendResult(
+                    pending.number, pending.carrier, None, False, "The daemon is shutting down."
+                ))
+
+        for sender in self._senders:
+            sender.close()
+        if(self._owns_pool):
+            self.pool.close()
+        if(self.socket_path and os.path.exists(self.socket_path)):
+            os.unlink(self.socket_path)
+        self._server = None
+
+
+class DaemonClient:
+    """DaemonClient
+
+    A tiny client for a SendDaemon. Its connection is kept open between requests, so each message is a single round
+    trip to the daemon.
+
+    Arguments:
+        url {string} [optional]: The daemon's URL. Defaults to "http://127.0.0.1:8725".
+        socket_path {string} [optional]: The daemon's Unix domain socket, used instead of the URL.
+        timeout {float} [optional]: Seconds to wait for the daemon to respond. Defaults to 60.
+
+    Examples:
+        from mail_to_sms import DaemonClient
+
+        with DaemonClient(socket_path="/tmp/mail_to_sms.sock") as client:
+            result = client.send(5551234567, "att", "this is a message")
+            print(result["success"], result["error"])
+    """
+
+    def __init__(self, url=None, socket_path=None, timeout=DEFAULT_TIMEOUT):
+        self.url = url or DEFAULT_URL
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._connection = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    ## Methods
+
+    def _connect(self):
+        if(self.socket_path):
+            return _UnixHTTPConnection(self.socket_path, self.timeout)
+
+        from urllib.parse import urlsplit
+
+        url = urlsplit(self.url)
+        return http_client.HTTPConnection(url.hostname or DEFAULT_HOST, url.port or DEFAULT_PORT, timeout=self.timeout)
+
+
+    def _request(self, method, path, body=None):
+        headers = {"Content-Type": JSON_CONTENT_TYPE} if body is not None else {}
+
+        ## A kept alive connection may have been closed by a restarted daemon, so reconnect once if it was
+        for attempt in range(2):
+            reused = self._connection is not None
+            if(not reused):
+                self._connection = self._connect()
+
+            try:
+                self._connection.request(method, path, body, headers)
+                response = self._connection.getresponse()
+                data = response.read()
+            except (http_client.HTTPException, OSError) as e:
+                self.close()
+                if(reused and not attempt and isinstance(e, (http_client.RemoteDisconnected, ConnectionError))):
+                    continue
+                raise DaemonError("Unable to reach the mail_to_sms daemon: {0}".format(e))
+            break
+
+        if(response.status != 200):
+            try:
+                error = json.loads(data.decode("utf-8"))["error"]
+            except (ValueError, KeyError, TypeError):
+                error = data.decode("utf-8", "replace")
+            raise DaemonError("The mail_to_sms daemon responded with {0}: {1}".format(response.status, error))
+
+        return data
+
+
+    def send(self, number, carrier, message):
+        """Sends a message through the daemon, and returns its outcome as a dict (see to_record())."""
+
+        return self.send_many([(number, carrier, message)])[0]
+
+
+    def send_many(self, messages):
+        """Sends every (number, carrier, message) triple through the daemon in one request, and returns their
+        outcomes in the same order."""
+
+        body = json.dumps({
+            "messages": [
+                {"number": number, "carrier": carrier, "message": message} for number, carrier, message in messages
+            ]
+        })
+        return json.loads(self._request("POST", SEND_PATH, body).decode("utf-8"))["results"]
+
+
+    def health(self):
+        return json.loads(self._request("GET", HEALTH_PATH).decode("utf-8"))
+
+
+    def close(self):
+        if(self._connection is not None):
+            self._connection.close()
+            self._connection = None
@@ -0,0 +1,305 @@
+from __future__ import print_function
+
+import threading
+import time
+from collections import namedtuple
+
+from .metrics import CONNECT_SECONDS, get_metrics
+from .smtp_pool import SMTPConnectionPool
+
+
+## An MX record, where lower preferences are tried first
+MXRecord = namedtuple("MXRecord", ["preference", "host"])
+
+## Config
+SMTP_PORT = 25
+IMPLICIT_MX_TTL = 300
+
+
+def resolve_mx(domain):
+    """Looks up the domain's MX records with dnspython, and returns a list of MXRecords along with their TTL (in
+    seconds). Domains without any MX records fall back to the domain itself, as per RFC 5321."""
+
+    try:
+        import dns.resolver
+    except ImportError:
+        raise ImportError("Direct delivery needs dnspython to look up MX records (pip install mail_to_sms[direct]).")
+
+    try:
+        answer = dns.resolver.resolve(domain, "MX")
+    except dns.resolver.NoAnswer:
+        return [MXRecord(0, domain)], IMPLICIT_MX_TTL
+
+    records = [MXRecord(record.preference, str(record.exchange).rstrip(".")) for record in answer]
+    return records, answer.rrset.ttl
+
+
+class MXCache:
+    """MXCache
+
+    A thread safe cache of the MX hosts for each domain, which keeps every answer for as long as its TTL says to
+    (within min_ttl and max_ttl). Failed lookups are cached too, for negative_ttl seconds.
+
+    Arguments:
+        resolver {callable} [optional]: Takes a domain, and returns a list of MXRecords (or (preference, host)
+            tuples) along with their TTL in seconds. Defaults to resolve_mx(), which uses dnspython.
+        min_ttl {float} [optional]: The shortest time an answer is kept for, in seconds. Defaults to 30.
+        max_ttl {float} [optional]: The longest time an answer is kept for, in seconds. Defaults to 3600.
+        negative_ttl {float} [optional]: How long failed lookups are kept for, in seconds. Defaults to 30.
+        clock {callable} [optional]: Returns the current time in seconds. Defaults to time.monotonic.
+    """
+
+    ## Defaults
+    DEFAULT_MIN_TTL = 30
+    DEFAULT_MAX_TTL = 3600
+    DEFAULT_NEGATIVE_TTL = 30
+
+
+    def __init__(self, resolver=None, min_ttl=DEFAULT_MIN_TTL, max_ttl=DEFAULT_MAX_TTL,
+                 negative_ttl=DEFAULT_NEGATIVE_TTL, clock=time.monotonic):
+        self.resolver = resolver or resolve_mx
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    ## Methods
+
+    def lookup(self, domain):
+        """Returns the domain's MX hosts in the order they should be tried. Raises LookupError if it has none, or if
+        the lookup failed."""
+
+        domain = domain.lower()
+        with self._lock:
+            entry = self._entries.get(domain)
+            if(entry is not None and entry[0] > self.clock()):
+                self.hits += 1
+                hosts, error = entry[1:]
+                if(error is not None):
+                    raise error
+                return hosts
+            self.misses += 1
+
+        ## The lookup happens outside of the lock, so one slow domain doesn't hold up the others
+        try:
+            records, ttl = self.resolver(domain)
+            hosts = [host for _, host in sorted(records, key=lambda record: record[0])]
+            if(not hosts):
+                raise LookupError("'{0}' doesn't have any MX hosts.".format(domain))
+        except Exception as e:
+            error = e
+            if(not isinstance(error, LookupError)):
+                error = LookupError("Couldn't look up the MX hosts for '{0}': {1}".format(domain, e))
+            with self._lock:
+                self._entries[domain] = (self.clock() + self.negative_ttl, None, error)
+            raise error
+
+        ttl = min(max(ttl, self.min_ttl), self.max_ttl)
+        with self._lock:
+            self._entries[domain] = (self.clock() + ttl, hosts, None)
+
+        return hosts
+
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class MXConnection:
+    """MXConnection
+
+    An unauthenticated SMTP session with a single MX host, which looks like a yagmail connection to the rest of
+    mail_to_sms. STARTTLS is used whenever the host offers it.
+    """
+
+    def __init__(self, user=None, host=None, port=SMTP_PORT, timeout=30, local_hostname=None, starttls=True):
+        self.user = user
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.local_hostname = local_hostname
+        self.starttls = starttls
+
+        self.smtp = None
+        self.is_closed = None
+        self._composer = None
+
+    ## Methods
+
+    def login(self):
+        import smtplib
+
+        self.close()
+        smtp = smtplib.SMTP(self.host, self.port, local_hostname=self.local_hostname, timeout=self.timeout)
+        try:
+            smtp.ehlo()
+            if(self.starttls and smtp.has_extn("starttls")):
+                import ssl
+
+                ## Opportunistic TLS (RFC 7435), since carrier gateways rarely have certificates matching their MX names
+                context = ssl.create_default_context()
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+                smtp.starttls(context=context)
+                smtp.ehlo()
+        except BaseException:
+            smtp.close()
+            raise
+
+        self.smtp = smtp
+        self.is_closed = False
+
+
+    def prepare_send(self, to=None, subject=None, contents=None, message_id=None):
+        ## yagmail still builds the messages (with the Message-ID, if one is given), it just never connects
+        if(self._composer is None):
+            import yagmail
+
+            self._composer = yagmail.SMTP(self.user, smtp_skip_login=True)
+
+        return self._composer.prepare_send(to=to, subject=subject, contents=contents, message_id=message_id)
+
+
+    def close(self):
+        if(self.smtp is not None):
+            try:
+                self.smtp.quit()
+            except Exception:
+                self.smtp.close()
+        self.smtp = None
+        self.is_closed = True
+
+
+class DirectDelivery:
+    """DirectDelivery
+
+    Delivers straight to each carrier gateway's MX hosts (ex. the MX for "txt.att.net"), rather than through an
+    authenticated relay. That skips a hop along with the relay's quota, but the sending address's domain needs SPF
+    (and ideally DKIM) records that cover the machine being sent from, or carriers will likely drop the messages.
+
+    MX lookups are cached for their TTL, and sessions are pooled per MX host so consecutive messages to the same
+    carrier share a connection. Hosts are tried in order of preference until one accepts a connection.
+
+    Arguments:
+        sender {string}: The address to send from (ex. "alerts@example.com").
+        resolver {callable} [optional]: See MXCache. Defaults to looking up MX records with dnspython.
+        port {int} [optional]: The port to deliver to. Defaults to 25.
+        local_hostname {string} [optional]: The name to EHLO with. Defaults to this machine's FQDN.
+        timeout {float} [optional]: Seconds to wait on each MX host. Defaults to 30.
+        starttls {boolean} [optional]: Use STARTTLS when it's offered. Defaults to True.
+        cache {MXCache} [optional]: The MX cache to use. Defaults to a new MXCache with the resolver.
+        pool {SMTPConnectionPool} [optional]: The pool of MX sessions. Defaults to a new pool.
+        metrics {MetricsRegistry} [optional]: Where connection times are recorded. Defaults to the process wide
+            registry.
+
+    Examples:
+        from mail_to_sms import DirectDelivery, MailToSMSBatch
+
+        MailToSMSBatch(recipients, contents="hello", direct=DirectDelivery("alerts@example.com"))
+    """
+
+    ## Defaults
+    DEFAULT_TIMEOUT = 30
+
+
+    def __init__(self, sender, resolver=None, port=SMTP_PORT, local_hostname=None, timeout=DEFAULT_TIMEOUT,
+                 starttls=True, cache=None, pool=None, metrics=None):
+        self.sender = sender
+        self.port = port
+        self.local_hostname = local_hostname
+        self.timeout = timeout
+        self.starttls = starttls
+        self.cache = cache if cache is not None else MXCache(resolver)
+        self.pool = pool or SMTPConnectionPool(connection_factory=MXConnection)
+        self.metrics = metrics or get_metrics()
+
+    ## Methods
+
+    def get_args(self, host):
+        """Returns the connection args for the MX host, which also key its sessions in the pool."""
+
+        return [self.sender, host, self.port, self.timeout, self.local_hostname, self.starttls]
+
+
+    def lease(self):
+        return MXLease(self)
+
+
+    def close(self):
+        self.pool.close()
+
+
+class MXLease:
+    """MXLease
+
+    Holds an MX session for each carrier gateway domain that's been sent to, for as long as it's leased. It stands in
+    for a yagmail connection, with for_address() picking the session to actually send over.
+    """
+
+    def __init__(self, direct):
+        self.direct = direct
+        self.user = direct.sender
+        self.host = None
+
+        self._connections = {}
+
+    ## Methods
+
+    def _connect(self, host):
+        import smtplib
+
+        connection = self.direct.pool.acquire(*self.direct.get_args(host))
+        if(connection.smtp is None or connection.is_closed):
+            started_at = time.perf_counter()
+            try:
+                connection.login()
+            except (OSError, smtplib.SMTPException):
+                self.direct.pool.release(connection, discard=True)
+                raise
+            self.direct.metrics.observe(CONNECT_SECONDS, time.perf_counter() - started_at, host=host)
+
+        return connection
+
+
+    def for_address(self, address):
+        """Returns an open session with the address's MX, reusing this lease's session with that host if it has one.
+        Falls back through the MX hosts in order of preference, and raises the last error if none of them connect."""
+
+        error = None
+        for host in self.direct.cache.lookup(address.rsplit("@", 1)[-1]):
+            ## Several gateway domains can share an MX host, and so its session
+            connection = self._connections.get(host)
+            if(connection is not None):
+                if(not connection.is_closed):
+                    return connection
+                ## It was closed under us (ex. a failed re-login), so give its slot back before reconnecting
+                del self._connections[host]
+                self.direct.pool.release(connection, discard=True)
+
+            try:
+                connection = self._connect(host)
+            except Exception as e:
+                error = e
+                continue
+
+            self._connections[host] = connection
+            return connection
+
+        raise error
+
+
+    def close(self, discard=False):
+        connections = list(self._connections.values())
+        self._connections = {}
+        for connection in connections:
+            self.direct.pool.release(connection, discard=discard)
@@ -0,0 +1,357 @@
+from __future__ import print_function
+
+import json
+import logging
+import os
+import re
+import threading
+from collections import namedtuple
+from types import MappingProxyType
+
+
+## Config
+GATEWAYS_JSON_PATH = os.path.join(os.path.dirname(__file__), "gateways.json")
+GATEWAYS_KEY = "gateways"
+CARRIER_NAMES_KEY = "carrier_names"
+SMS_KEY = "sms"
+MMS_KEY = "mms"
+GATEWAYS_ENV_VAR = "MAIL_TO_SMS_GATEWAYS"
+COMPILED_DIR_ENV_VAR = "MAIL_TO_SMS_GATEWAYS_CACHE"
+COMPILED_VERSION = 2
+
+## Defaults
+DEFAULT_COMPILED_DIR = os.path.join(os.path.expanduser("~"), ".mail_to_sms", "gateways")
+
+DOMAIN_PATTERN = re.compile(r"^(?=.{1,253}$)([a-z0-9]([a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z]{2,63}$")
+
+
+logger = logging.getLogger(__name__)
+
+
+Gateway = namedtuple("Gateway", ["carrier_names", "sms", "mms"])
+
+
+class GatewayRegistry:
+    """GatewayRegistry
+
+    An immutable, hash indexed view of the carrier gateways. Every carrier alias maps directly onto its gateway, and
+    its already resolved SMS and MMS domains, so lookups don't have to scan the gateway list.
+
+    Registries are built once per set of gateways files and shared process wide, see get_gateway_registry() and
+    reload_gateway_registry(). Extra gateways files (ex. for international carriers) are merged over the bundled
+    gateways.json, see get_gateway_paths().
+
+    Arguments:
+        gateways {list}: A list of gateway dicts, in the same format as the "gateways" list in gateways.json.
+    """
+
+    __slots__ = ("gateways", "_index", "_sms_index", "_mms_index", "_mms_by_domain")
+    _STATE = __slots__
+
+    def __init__(self, gateways):
+        index = {}
+        sms_index = {}
+        mms_index = {}
+        mms_by_domain = {}
+
+        built = []
+        for gateway in gateways:
+            carrier_names = tuple(self.normalize_carrier(name) for name in gateway[CARRIER_NAMES_KEY])
+            entry = Gateway(carrier_names, gateway.get(SMS_KEY), gateway.get(MMS_KEY))
+            built.append(entry)
+
+            ## Map each gateway domain onto the MMS domain of the same carrier, for promoting long messages to MMS
+            if(entry.sms):
+                mms_by_domain.setdefault(entry.sms, entry.mms)
+            if(entry.mms):
+                mms_by_domain.setdefault(entry.mms, entry.mms)
+
+            for name in carrier_names:
+                ## The first gateway to claim an alias wins, which mirrors the old linear scan's behavior
+                if(name in index):
+                    continue
+
+                index[name] = entry
+                ## Prefer the requested gateway type, but fall back to the other one if it's missing
+                sms_index[name] = entry.sms or entry.mms
+                mms_index[name] = entry.mms or entry.sms
+
+        self._set_state((tuple(built), index, sms_index, mms_index, mms_by_domain))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("GatewayRegistry is immutable")
+
+    def __contains__(self, carrier):
+        return self.normalize_carrier(carrier) in self._index
+
+    def __len__(self):
+        return len(self.gateways)
+
+    def __iter__(self):
+        return iter(self.gateways)
+
+    ## Methods
+
+    def _set_state(self, state):
+        gateways, indexes = state[0], state[1:]
+        object.__setattr__(self, "gateways", gateways)
+        for name, index in zip(self._STATE[1:], indexes):
+            object.__setattr__(self, name, MappingProxyType(index))
+
+
+    def _get_state(self):
+        ## A JSON friendly copy of the gateways and their indexes, where the carrier index points at gateway positions
+        positions = {id(gateway): position for position, gateway in enumerate(self.gateways)}
+        return {
+            "gateways": [list(gateway) for gateway in self.gateways],
+            "index": {name: positions[id(gateway)] for name, gateway in self._index.items()},
+            "sms": dict(self._sms_index),
+            "mms": dict(self._mms_index),
+            "mms_by_domain": dict(self._mms_by_domain)
+        }
+
+
+    @classmethod
+    def _from_state(cls, state):
+        ## Skips building the indexes, for registries loaded from a compiled gateways file
+        gateways = tuple(Gateway(tuple(names), sms, mms) for names, sms, mms in state["gateways"])
+        index = {name: gateways[position] for name, position in state["index"].items()}
+
+        registry = cls.__new__(cls)
+        registry._set_state((gateways, index, dict(state["sms"]), dict(state["mms"]), dict(state["mms_by_domain"])))
+        return registry
+
+
+    @staticmethod
+    def normalize_carrier(carrier):
+        return str(carrier).strip()
+
+
+    @classmethod
+    def from_json(cls, path=GATEWAYS_JSON_PATH):
+        return cls(load_gateways_file(path))
+
+
+    @classmethod
+    def from_files(cls, paths, compiled_dir=None):
+        """Builds a registry from several gateways files, where the gateways in later files take precedence over the
+        earlier ones for any carrier names they share.
+
+        The merged registry is compiled to a JSON file in compiled_dir (see get_compiled_dir()), keyed on each file's
+        path and a hash of its contents, so that later processes can load it without parsing or validating any of the
+        files again. Pass an empty compiled_dir to skip it."""
+
+        paths = [os.path.abspath(path) for path in paths]
+        if(len(paths) < 2):
+            ## The bundled gateways file on its own is quicker to parse than it is to hash and check for staleness
+            return cls.from_json(*paths)
+
+        compiled_dir = get_compiled_dir() if compiled_dir is None else compiled_dir
+        if(not compiled_dir):
+            return cls(merge_gateways([load_gateways_file(path) for path in paths]))
+
+        ## Hash the files before reading them, so any change made while compiling leaves the compiled file stale
+        sources = _get_sources(paths)
+        compiled_path = _get_compiled_path(compiled_dir, paths)
+        state = _read_compiled(compiled_path, sources)
+        if(state is not None):
+            return cls._from_state(state)
+
+        registry = cls(merge_gateways([load_gateways_file(path) for path in paths]))
+        _write_compiled(compiled_path, sources, registry._get_state())
+        return registry
+
+
+    def carriers(self):
+        return tuple(self._index.keys())
+
+
+    def get(self, carrier):
+        return self._index.get(self.normalize_carrier(carrier))
+
+
+    def resolve(self, carrier, mms=False):
+        """Returns the SMS (or MMS if mms is truthy) gateway domain for the carrier, falling back to the other gateway
+        type if the preferred one doesn't exist. Returns None for unknown carriers."""
+
+        index = self._mms_index if mms else self._sms_index
+        return index.get(self.normalize_carrier(carrier))
+
+
+    def get_mms_domain(self, domain):
+        """Returns the MMS gateway domain of the carrier that owns the gateway domain (which is the domain itself if
+        it's already an MMS gateway), or None if the carrier doesn't have an MMS gateway."""
+
+        return self._mms_by_domain.get(domain)
+
+
+def validate_gateways(gateways, source="gateways"):
+    """Checks that gateways is a list of gateway dicts in the gateways.json format, and returns them normalized (with
+    stripped carrier names, and lower cased domains). Raises a ValueError describing the first problem otherwise."""
+
+    if(not isinstance(gateways, list)):
+        raise ValueError("{0}: '{1}' should be a list of gateways.".format(source, GATEWAYS_KEY))
+
+    validated = []
+    for position, gateway in enumerate(gateways):
+        where = "{0}: gateway #{1}".format(source, position + 1)
+        if(not isinstance(gateway, dict)):
+            raise ValueError("{0} should be an object.".format(where))
+
+        carrier_names = gateway.get(CARRIER_NAMES_KEY)
+        if(not isinstance(carrier_names, list) or not carrier_names):
+            raise ValueError("{0} should have a non-empty list of '{1}'.".format(where, CARRIER_NAMES_KEY))
+        for name in carrier_names:
+            if(not isinstance(name, str) or not name.strip()):
+                raise ValueError("{0} has an invalid carrier name {1!r}.".format(where, name))
+
+        entry = {CARRIER_NAMES_KEY: [GatewayRegistry.normalize_carrier(name) for name in carrier_names]}
+        for key in (SMS_KEY, MMS_KEY):
+            domain = gateway.get(key)
+            if(domain is None):
+                continue
+            if(not isinstance(domain, str) or not DOMAIN_PATTERN.match(domain.strip().lower())):
+                raise ValueError("{0} has an invalid '{1}' domain {2!r}.".format(where, key, domain))
+            entry[key] = domain.strip().lower()
+
+        if(SMS_KEY not in entry and MMS_KEY not in entry):
+            raise ValueError("{0} needs an '{1}' or '{2}' domain.".format(where, SMS_KEY, MMS_KEY))
+
+        validated.append(entry)
+
+    return validated
+
+
+def load_gateways_file(path):
+    """Parses and validates the gateways file at path, and returns its list of gateways."""
+
+    with open(path, "r") as fd:
+        try:
+            data = json.load(fd)
+        except ValueError as e:
+            raise ValueError("{0}: {1}".format(path, e))
+
+    if(not isinstance(data, dict) or GATEWAYS_KEY not in data):
+        raise ValueError("{0}: should be an object with a '{1}' list.".format(path, GATEWAYS_KEY))
+
+    return validate_gateways(data[GATEWAYS_KEY], path)
+
+
+def merge_gateways(gateway_lists):
+    """Merges several lists of gateways into one, where later lists take precedence over earlier ones for any carrier
+    names they share."""
+
+    ## GatewayRegistry gives each alias to the first gateway that claims it, so the later lists go first
+    merged = []
+    for gateways in reversed(gateway_lists):
+        merged.extend(gateways)
+
+    return merged
+
+
+def get_gateway_paths(extra_paths=None, path=GATEWAYS_JSON_PATH):
+    """Returns the gateways files to load in order of increasing precedence: the bundled gateways.json (or path), then
+    any listed in the MAIL_TO_SMS_GATEWAYS environment variable (separated by os.pathsep), then extra_paths."""
+
+    paths = [path]
+    paths.extend(entry for entry in os.environ.get(GATEWAYS_ENV_VAR, "").split(os.pathsep) if entry)
+    paths.extend(extra_paths or [])
+
+    return [os.path.abspath(entry) for entry in paths]
+
+
+def get_compiled_dir():
+    """Returns where compiled gateways files are kept. Defaults to ~/.mail_to_sms/gateways, or the
+    MAIL_TO_SMS_GATEWAYS_CACHE environment variable if it's set (where an empty value disables compiling)."""
+
+    return os.environ.get(COMPILED_DIR_ENV_VAR, DEFAULT_COMPILED_DIR)
+
+
+def _get_sources(paths):
+    ## Hashing the contents is far cheaper than parsing and validating them, and catches edits that keep the same
+    ## modification time and size
+    import hashlib
+
+    sources = []
+    for path in paths:
+        with open(path, "rb") as fd:
+            sources.append([path, hashlib.sha256(fd.read()).hexdigest()])
+
+    return sources
+
+
+def _get_compiled_path(compiled_dir, paths):
+    ## Each combination of gateways files gets its own compiled file
+    import hashlib
+
+    digest = hashlib.sha1("\0".join(paths).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(compiled_dir, "gateways-{0}.json".format(digest))
+
+
+def _read_compiled(compiled_path, sources):
+    ## Returns the compiled registry state, or None if it's missing, stale, or unreadable. It's only ever read as JSON,
+    ## since anyone who can write to the compiled directory could otherwise run code in every process that loads it.
+    try:
+        with open(compiled_path, "r") as fd:
+            compiled = json.load(fd)
+        if(compiled["version"] != COMPILED_VERSION or compiled["sources"] != sources):
+            return None
+        return compiled["state"]
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.debug("Ignoring unreadable compiled gateways file '%s': %s", compiled_path, e)
+        return None
+
+
+def _write_compiled(compiled_path, sources, state):
+    ## Compiling is only an optimization, so failing to write (ex. a read only home directory) isn't an error
+    temporary_path = "{0}.{1}.tmp".format(compiled_path, os.getpid())
+    try:
+        directory = os.path.dirname(compiled_path)
+        if(not os.path.isdir(directory)):
+            os.makedirs(directory)
+        with open(temporary_path, "w") as fd:
+            json.dump({"version": COMPILED_VERSION, "sources": sources, "state": state}, fd, separators=(",", ":"))
+        ## Atomically swap it in, so concurrent processes never read a partially written file
+        os.replace(temporary_path, compiled_path)
+    except OSError as e:
+        logger.debug("Couldn't write the compiled gateways file '%s': %s", compiled_path, e)
+        try:
+            os.remove(temporary_path)
+        except OSError:
+            pass
+
+
+## Process wide registry cache, keyed on the gateways file paths
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_gateway_registry(path=GATEWAYS_JSON_PATH, extra_paths=None):
+    """Returns the shared GatewayRegistry for the gateways file at path merged with any extra gateways files (see
+    get_gateway_paths()), lazily building it on first use."""
+
+    key = tuple(get_gateway_paths(extra_paths, path))
+    registry = _registries.get(key)
+    if(registry is None):
+        with _registries_lock:
+            ## Check again now that the lock is held, another thread may have beaten us to it
+            registry = _registries.get(key)
+            if(registry is None):
+                registry = GatewayRegistry.from_files(key)
+                _registries[key] = registry
+
+    return registry
+
+
+def reload_gateway_registry(path=GATEWAYS_JSON_PATH, extra_paths=None):
+    """Rebuilds the shared GatewayRegistry for the gateways files, for use after any of them have changed. Existing
+    MailToSMS instances keep the registry they were built with."""
+
+    key = tuple(get_gateway_paths(extra_paths, path))
+    registry = GatewayRegistry.from_files(key)
+    with _registries_lock:
+        _registries[key] = registry
+
+    return registry
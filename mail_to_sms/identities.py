@@ -0,0 +1,338 @@
+from __future__ import print_function
+
+import threading
+import time
+
+from .metrics import FAILOVERS, get_metrics
+
+
+## Config
+ROUND_ROBIN = "round_robin"
+LEAST_LOADED = "least_loaded"
+AUTH = "auth"
+QUOTA = "quota"
+
+## SMTP responses that mean the account can't send right now, rather than anything being wrong with the message
+AUTH_CODES = (530, 534, 535)
+QUOTA_PHRASES = ("quota", "limit exceeded", "rate limit", "too many messages", "5.4.5")
+
+
+class IdentityPoolExhausted(Exception):
+    """Raised when every identity in an IdentityPool is over its quota or cooling down after an auth failure."""
+    pass
+
+
+class Identity:
+    """Identity
+
+    A single account that messages can be sent from, with its own credentials and yagmail args.
+
+    Arguments:
+        username {string} [optional]: See MailToSMS.
+        password {string} [optional]: See MailToSMS.
+        yagmail {list} [optional]: See MailToSMS's yagmail arg. (ex. ["smtp.example.com", 587])
+        weight {int} [optional]: The identity's share of the traffic, relative to the others. Defaults to 1.
+        quota {int} [optional]: The most messages it can send per quota period. Defaults to no limit.
+        name {string} [optional]: The name it's reported under. Defaults to the username (or host).
+    """
+
+    def __init__(self, username=None, password=None, yagmail=None, weight=1, quota=None, name=None):
+        self.username = username
+        self.weight = weight
+        self.quota = quota
+
+        self.yagmail_args = list(yagmail or [])
+        if(username):
+            self.yagmail_args[0:0] = [username, password]
+        self.name = name or username or (str(self.yagmail_args[0]) if self.yagmail_args else "default")
+
+    def __repr__(self):
+        return "Identity({0!r})".format(self.name)
+
+
+class _IdentityState:
+    __slots__ = ("sent", "period", "in_flight", "current_weight", "disabled_until")
+
+    def __init__(self):
+        self.sent = 0
+        self.period = None
+        self.in_flight = 0
+        self.current_weight = 0
+        self.disabled_until = 0
+
+
+class IdentityPool:
+    """IdentityPool
+
+    Spreads sends across several accounts (and relays), so that traffic can grow past any single account's quota.
+    Identities are picked by smooth weighted round robin, or by whichever has the fewest sends in flight for its
+    weight. Each one's sends are counted against its quota for the current period (a UTC day by default), and
+    identities that run out of quota or fail to authenticate are skipped until their quota resets or their cooldown
+    passes, with sends failing over to the next identity.
+
+    Arguments:
+        identities {iterable}: The Identities to send from.
+        strategy {string} [optional]: Either "round_robin" or "least_loaded". Defaults to "round_robin".
+        cooldown {float} [optional]: Seconds to skip an identity for after it fails to authenticate. Defaults to 600.
+        quota_period {float} [optional]: The length of each quota period, in seconds. Defaults to a day.
+        clock {callable} [optional]: Returns the current (epoch) time. Defaults to time.time.
+        metrics {MetricsRegistry} [optional]: Where failovers are counted. Defaults to the process wide registry.
+
+    Examples:
+        from mail_to_sms import Identity, IdentityPool, MailToSMSBatch
+
+        identities = IdentityPool([
+            Identity("alerts1@gmail.com", "password", quota=500),
+            Identity("alerts@example.com", "password", ["smtp.example.com", 587], weight=3, quota=10000)
+        ])
+        MailToSMSBatch(recipients, contents="hello", identities=identities)
+    """
+
+    ## Defaults
+    DEFAULT_STRATEGY = ROUND_ROBIN
+    DEFAULT_COOLDOWN = 600
+    DEFAULT_QUOTA_PERIOD = 24 * 60 * 60
+
+
+    def __init__(self, identities, strategy=DEFAULT_STRATEGY, cooldown=DEFAULT_COOLDOWN,
+                 quota_period=DEFAULT_QUOTA_PERIOD, clock=time.time, metrics=None):
+        if(strategy not in (ROUND_ROBIN, LEAST_LOADED)):
+            raise ValueError("Unknown identity selection strategy '{0}'.".format(strategy))
+
+        self.identities = list(identities)
+        if(not self.identities):
+            raise ValueError("An IdentityPool needs at least one identity.")
+
+        self.strategy = strategy
+        self.cooldown = cooldown
+        self.quota_period = quota_period
+        self.clock = clock
+        self.metrics = metrics or get_metrics()
+
+        self._states = {id(identity): _IdentityState() for identity in self.identities}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.identities)
+
+    ## Methods
+
+    def _get_state(self, identity, now):
+        ## Quota counts start over at the beginning of every period
+        state = self._states[id(identity)]
+        period = int(now // self.quota_period)
+        if(state.period != period):
+            state.period = period
+            state.sent = 0
+
+        return state
+
+
+    def _is_available(self, identity, now):
+        state = self._get_state(identity, now)
+        if(state.disabled_until > now):
+            return False
+        return identity.quota is None or state.sent < identity.quota
+
+
+    def is_available(self, identity):
+        """Returns True if the identity has quota left, and isn't cooling down."""
+
+        with self._lock:
+            return self._is_available(identity, self.clock())
+
+
+    def acquire(self, exclude=()):
+        """Picks the next identity to send from (skipping any in exclude), and counts it as in flight until it's
+        handed back with release(). Raises IdentityPoolExhausted if none are available."""
+
+        with self._lock:
+            now = self.clock()
+            available = [
+                identity for identity in self.identities
+                if identity not in exclude and self._is_available(identity, now)
+            ]
+            if(not available):
+                raise IdentityPoolExhausted("Every identity is over its quota or cooling down.")
+
+            if(self.strategy == LEAST_LOADED):
+                ## Fewest sends in flight for its weight, then the most quota left
+                def get_load(identity):
+                    state = self._states[id(identity)]
+                    used = state.sent / float(identity.quota) if identity.quota else 0
+                    return (state.in_flight / float(identity.weight), used)
+
+                identity = min(available, key=get_load)
+            else:
+                ## Smooth weighted round robin, so heavier identities are interleaved with the rest rather than bunched
+                total = 0
+                identity = None
+                for candidate in available:
+                    state = self._states[id(candidate)]
+                    state.current_weight += candidate.weight
+                    total += candidate.weight
+                    if(identity is None or state.current_weight > self._states[id(identity)].current_weight):
+                        identity = candidate
+                self._states[id(identity)].current_weight -= total
+
+            self._states[id(identity)].in_flight += 1
+            return identity
+
+
+    def release(self, identity):
+        with self._lock:
+            self._states[id(identity)].in_flight -= 1
+
+
+    def record_sent(self, identity, count=1):
+        with self._lock:
+            self._get_state(identity, self.clock()).sent += count
+
+
+    def get_failure_kind(self, exception):
+        """Returns AUTH or QUOTA if the exception means the identity can't send right now, otherwise None."""
+
+        import smtplib
+
+        if(isinstance(exception, smtplib.SMTPAuthenticationError)):
+            return AUTH
+
+        if(isinstance(exception, smtplib.SMTPRecipientsRefused)):
+            responses = list(exception.recipients.values())
+        else:
+            responses = [(getattr(exception, "smtp_code", None), getattr(exception, "smtp_error", None))]
+
+        for code, message in responses:
+            if(code in AUTH_CODES):
+                return AUTH
+            if(isinstance(message, bytes)):
+                message = message.decode("utf-8", "replace")
+            if(code and message and any(phrase in message.lower() for phrase in QUOTA_PHRASES)):
+                return QUOTA
+
+        return None
+
+
+    def mark_failed(self, identity, kind):
+        """Takes the identity out of rotation, until the end of the quota period for QUOTA failures or for the
+        cooldown after AUTH failures."""
+
+        with self._lock:
+            now = self.clock()
+            state = self._get_state(identity, now)
+            if(kind == QUOTA):
+                state.disabled_until = (state.period + 1) * self.quota_period
+            else:
+                state.disabled_until = now + self.cooldown
+
+        self.metrics.increment(FAILOVERS, identity=identity.name, reason=kind)
+
+
+    def snapshot(self):
+        """Returns a dict of identity names to their usage."""
+
+        with self._lock:
+            now = self.clock()
+            snapshot = {}
+            for identity in self.identities:
+                state = self._get_state(identity, now)
+                snapshot[identity.name] = {
+                    "sent": state.sent,
+                    "quota": identity.quota,
+                    "in_flight": state.in_flight,
+                    "available": self._is_available(identity, now)
+                }
+
+            return snapshot
+
+
+class IdentityLease:
+    """IdentityLease
+
+    A pooled connection for an identity picked from an IdentityPool, which stands in for the yagmail connection itself.
+    When a send fails because of the identity (a failed login or an exhausted quota), fail_over() swaps it for a
+    connection from the next available identity.
+    """
+
+    def __init__(self, identities, pool):
+        self.identities = identities
+        self.pool = pool
+        self.identity = None
+        self.connection = None
+
+        self._failed = []
+        self._switch()
+
+    def __getattr__(self, name):
+        ## Everything else is the current connection's (ex. user, host, smtp, login(), and prepare_send())
+        connection = self.__dict__.get("connection")
+        if(connection is None):
+            raise AttributeError(name)
+        return getattr(connection, name)
+
+    ## Methods
+
+    def _switch(self, discard=False):
+        ## Connect with the next identity, skipping over any that fail to log in. The current connection is only
+        ## discarded if something's wrong with it, a connection that's just out of quota can be reused later.
+        while True:
+            identity = self.identities.acquire(exclude=self._failed)
+            try:
+                connection = self.pool.acquire(*identity.yagmail_args)
+            except Exception as e:
+                self.identities.release(identity)
+                kind = self.identities.get_failure_kind(e)
+                if(kind is None):
+                    raise
+                self.identities.mark_failed(identity, kind)
+                self._failed.append(identity)
+                continue
+
+            self._drop(discard)
+            self.identity = identity
+            self.connection = connection
+            return
+
+
+    def _drop(self, discard=False):
+        if(self.connection is not None):
+            self.pool.release(self.connection, discard=discard)
+            self.identities.release(self.identity)
+            self.connection = None
+            self.identity = None
+
+
+    def fail_over(self, exception):
+        """Switches to another identity if the exception was caused by the current one. Returns True if it did, and
+        False if the exception is unrelated or there's no other identity to switch to."""
+
+        kind = self.identities.get_failure_kind(exception)
+        if(kind is None):
+            return False
+
+        self.identities.mark_failed(self.identity, kind)
+        self._failed.append(self.identity)
+        try:
+            self._switch(discard=(kind == AUTH))
+        except IdentityPoolExhausted:
+            return False
+
+        return True
+
+
+    def check_available(self):
+        """Switches to another identity if the current one has run out of quota (ex. partway through a batch). Raises
+        IdentityPoolExhausted if there's no other identity to switch to."""
+
+        if(not self.identities.is_available(self.identity)):
+            self._switch()
+
+
+    def record_sent(self, count=1):
+        self.identities.record_sent(self.identity, count)
+
+
+    def close(self, discard=False):
+        """Hands the connection back to the pool, and the identity back to the IdentityPool."""
+
+        self._drop(discard)
@@ -0,0 +1,231 @@
+import asyncio
+import math
+import platform
+import time
+
+from .mail_to_sms import Sender
+from .mail_to_sms_batch import MailToSMSBatch
+from .mail_to_sms_parallel import MailToSMSParallel
+from .metrics import COUNTER, FAILED, RETRIES, MetricsRegistry
+from .resilience import CircuitBreakerRegistry, RetryPolicy
+from .smtp_pool import SMTPConnectionPool
+from .local_smtp_server import LocalSMTPServer
+
+## Usage: mail_to_sms loadtest [--path single] [--path async] [--rate 100] [--throttle-rate 0.01] ...
+##
+## Pushes messages at a steady offered rate through each send path (single, batch, parallel, and async) against an
+## in-process SMTP server that misbehaves like a carrier under load (latency, 421 throttling, random disconnects, and
+## per gateway domain rate limits), and reports the throughput, latency percentiles, and error rates as JSON.
+##
+## The messages are handed to each path in batches (of one, for the single path) as soon as the batch's last message
+## is due. Latencies are measured from when each message was due, so a path that can't keep up with the offered rate
+## shows it in its latencies rather than just quietly sending slower.
+
+
+## Config
+SENDER = "sender@example.com"
+PATHS = ("single", "batch", "parallel", "async")
+CARRIERS = ("att", "verizon", "tmobile")
+MESSAGE = "load test message"
+LATENCY_PERCENTILES = (50, 95, 99)
+
+
+def get_numbers(count):
+    ## Distinct, valid (toll free) US numbers
+    return ["86634{0:05d}".format(index) for index in range(count)]
+
+
+def percentile(values, percent):
+    ## Nearest-rank percentile, to match DispatchReport.latency_percentile()
+    values = sorted(values)
+    if(not values):
+        return None
+    return values[max(int(math.ceil(percent / 100.0 * len(values))), 1) - 1]
+
+
+def get_recipients(count):
+    ## Spread over a few carriers, so that the per domain limits have something to do
+    return [(number, CARRIERS[index % len(CARRIERS)]) for index, number in enumerate(get_numbers(count))]
+
+
+def get_ticks(count, rate, batch_size):
+    ## Yields (start, end, due) for each batch, where due is the seconds (from the start of the run) that the batch's
+    ## last message arrives at the offered rate. Without a rate, everything is due immediately.
+    for start in range(0, count, batch_size):
+        end = min(start + batch_size, count)
+        yield start, end, (end - 1) / float(rate) if rate else 0
+
+
+def summarize(path, results, latencies, elapsed, metrics, server):
+    sent = sum(result.success for result in results)
+    deferred = sum(bool(result.deferred) for result in results)
+    failed = len(results) - sent - deferred
+    counters = metrics.snapshot()[COUNTER]
+
+    summary = {
+        "path": path,
+        "messages": len(results),
+        "seconds": elapsed,
+        "sent": sent,
+        "failed": failed,
+        "deferred": deferred,
+        "throughput": sent / elapsed if elapsed else None,
+        "error_rate": failed / float(len(results)) if results else None,
+        "errors": {labels.split("=", 1)[-1]: count for labels, count in counters.get(FAILED, {}).items()},
+        "retries": sum(counters.get(RETRIES, {}).values()),
+        "server": {
+            "accepted": server.message_count,
+            "connections": server.connection_count,
+            "throttled": server.throttled_count,
+            "disconnected": server.disconnected_count,
+            "rate_limited": server.rate_limited_count
+        }
+    }
+
+    for percent in LATENCY_PERCENTILES:
+        value = percentile(latencies, percent)
+        summary["p{0}_latency_ms".format(percent)] = value * 1000 if value is not None else None
+
+    return summary
+
+
+def build_kwargs(server, metrics, max_attempts, max_recipients):
+    ## Every run gets its own metrics and breakers, so nothing carries over between paths
+    return {
+        "quiet": True,
+        "yagmail": server.yagmail_args,
+        "retry": RetryPolicy(max_attempts=max_attempts, base_delay=0.05, max_delay=1),
+        "breakers": CircuitBreakerRegistry(),
+        "metrics": metrics,
+        "max_recipients": max_recipients
+    }
+
+
+def get_dispatcher(path, kwargs, workers):
+    """Returns a (dispatch, close) pair for the path, where dispatch sends MESSAGE to a list of (number, carrier)
+    pairs and returns their SendResults. Returns None if the path can't be run here (ex. aiosmtplib is missing)."""
+
+    if(path == "single"):
+        sender = Sender(SENDER, None, pool=SMTPConnectionPool(), **kwargs)
+
+        def dispatch(recipients):
+            return [sender.send(sender.recipient(number, carrier), MESSAGE) for number, carrier in recipients]
+
+        return dispatch, sender.pool.close
+
+    if(path == "batch"):
+        pool = SMTPConnectionPool()
+
+        def dispatch(recipients):
+            return MailToSMSBatch(recipients, SENDER, None, pool=pool, **kwargs).send(MESSAGE)
+
+        return dispatch, pool.close
+
+    if(path == "parallel"):
+        pool = SMTPConnectionPool(size=workers)
+
+        def dispatch(recipients):
+            ## The gateway limit would otherwise keep most of the workers idle, the server's limits are what's tested
+            parallel = MailToSMSParallel(
+                recipients, SENDER, None, pool=pool, workers=workers, gateway_limit=workers, **kwargs
+            )
+            return list(parallel.send(MESSAGE))
+
+        return dispatch, pool.close
+
+    if(path == "async"):
+        try:
+            from .async_mail_to_sms import AsyncMailToSMS
+            ## Async sends aren't grouped into shared transactions
+            async_mail = AsyncMailToSMS(
+                SENDER, None, concurrency=workers, connections=workers, **dict(kwargs, max_recipients=None)
+            )
+        except ImportError:
+            return None
+
+        ## One loop for the whole run, so that the idle connections are kept between batches
+        loop = asyncio.new_event_loop()
+
+        def dispatch(recipients):
+            roster = [async_mail.recipient(number, carrier) for number, carrier in recipients]
+            return loop.run_until_complete(async_mail.send_many(roster, MESSAGE))
+
+        def close():
+            loop.run_until_complete(async_mail.close())
+            loop.close()
+
+        return dispatch, close
+
+    raise ValueError("'{0}' isn't a send path, expected one of: {1}".format(path, ", ".join(PATHS)))
+
+
+def run_path(path, server, messages, rate=None, batch_size=50, workers=8, max_attempts=3, max_recipients=None):
+    """Pushes messages through the path at the offered rate (messages per second, or as fast as possible if it's
+    None), and returns its summary. Returns None if the path can't be run here."""
+
+    metrics = MetricsRegistry()
+    dispatcher = get_dispatcher(path, build_kwargs(server, metrics, max_attempts, max_recipients), workers)
+    if(dispatcher is None):
+        return None
+    dispatch, close = dispatcher
+
+    recipients = get_recipients(messages)
+    batch_size = 1 if path == "single" else max(batch_size, 1)
+    results = []
+    latencies = []
+
+    started_at = time.perf_counter()
+    try:
+        for start, end, due in get_ticks(messages, rate, batch_size):
+            wait = started_at + due - time.perf_counter()
+            if(wait > 0):
+                time.sleep(wait)
+
+            dispatched_at = time.perf_counter()
+            batch = dispatch(recipients[start:end])
+            finished_at = time.perf_counter()
+
+            for index, result in enumerate(batch, start):
+                ## Time spent waiting to be dispatched, plus the send itself (or the whole call, if it wasn't timed)
+                arrived_at = started_at + index / float(rate) if rate else dispatched_at
+                if(result.latency is not None):
+                    latencies.append(dispatched_at - arrived_at + result.latency)
+                elif(not result.deferred):
+                    latencies.append(finished_at - arrived_at)
+            results.extend(batch)
+    finally:
+        close()
+
+    summary = summarize(path, results, latencies, time.perf_counter() - started_at, metrics, server)
+    summary.update({"offered_rate": rate, "batch_size": batch_size})
+    if(path in ("parallel", "async")):
+        summary["workers"] = workers
+    return summary
+
+
+def run(paths=PATHS, messages=500, rate=None, batch_size=50, workers=8, max_attempts=3, max_recipients=None,
+        latency=0, throttle_rate=0, disconnect_rate=0, domain_limits=None, seed=None):
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {
+            "messages": messages, "rate": rate, "batch_size": batch_size, "workers": workers,
+            "max_attempts": max_attempts, "max_recipients": max_recipients, "latency": latency,
+            "throttle_rate": throttle_rate, "disconnect_rate": disconnect_rate, "domain_limits": domain_limits,
+            "seed": seed
+        },
+        "paths": {}
+    }
+
+    for path in paths:
+        ## A fresh server per path, so that their counters (and domain limits) don't bleed into each other
+        server = LocalSMTPServer(
+            latency=latency, keep_messages=False, throttle_rate=throttle_rate, disconnect_rate=disconnect_rate,
+            domain_limits=domain_limits, seed=seed
+        )
+        with server:
+            results["paths"][path] = run_path(
+                path, server, messages, rate, batch_size, workers, max_attempts, max_recipients
+            )
+
+    return results
@@ -0,0 +1,234 @@
+import collections
+import random
+import socketserver
+import threading
+import time
+
+
+## Config
+THROTTLE = "throttle"
+DISCONNECT = "disconnect"
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    ## Speaks just enough SMTP for smtplib (and so yagmail) to send through it
+
+    def _reply(self, code, *lines):
+        lines = lines or ("OK",)
+        for line in lines[:-1]:
+            self.wfile.write("{0}-{1}\r\n".format(code, line).encode("ascii"))
+        self.wfile.write("{0} {1}\r\n".format(code, lines[-1]).encode("ascii"))
+
+
+    def _read_data(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if(not line or line in (b".\r\n", b".\n")):
+                return b"".join(lines)
+            ## Undo the dot stuffing
+            lines.append(line[1:] if line.startswith(b"..") else line)
+
+
+    def handle(self):
+        server = self.server.stand_in
+        server._record_connection()
+        self._reply(220, "localhost ESMTP stand-in")
+
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if(not line):
+                return
+
+            command = line[:4].upper()
+            if(command == b"EHLO"):
+                extensions = ["8BITMIME", "SMTPUTF8"] + (["PIPELINING"] if server.pipelining else [])
+                self._reply(250, "localhost", *extensions)
+            elif(command == b"HELO"):
+                self._reply(250, "localhost")
+            elif(command == b"MAIL"):
+                recipients = []
+                fault = server._get_fault()
+                if(fault == DISCONNECT):
+                    ## Hang up mid session without a reply, like a carrier's overloaded edge
+                    return
+                elif(fault == THROTTLE):
+                    self._reply(421, "4.7.0 Too many messages, try again later")
+                    return
+                self._reply(250)
+            elif(command == b"RCPT"):
+                recipient = line[8:].strip(b" <>\r\n").decode("utf-8", "replace")
+                if(recipient in server.rejected):
+                    self._reply(550, "No such user")
+                elif(server.max_recipients and len(recipients) >= server.max_recipients):
+                    self._reply(452, "Too many recipients")
+                elif(not server._take_domain_slot(recipient)):
+                    self._reply(450, "4.7.1 Rate limit exceeded for this domain")
+                else:
+                    recipients.append(recipient)
+                    self._reply(250)
+            elif(command == b"DATA"):
+                if(not recipients):
+                    self._reply(554, "No valid recipients")
+                    continue
+                self._reply(354, "End data with <CR><LF>.<CR><LF>")
+                data = self._read_data()
+                if(server.latency):
+                    time.sleep(server.latency)
+                server._record_message(recipients, data)
+                self._reply(250)
+            elif(command in (b"RSET", b"NOOP")):
+                self._reply(250)
+            elif(command == b"QUIT"):
+                self._reply(221, "Bye")
+                return
+            else:
+                self._reply(502, "Command not implemented")
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class LocalSMTPServer:
+    """LocalSMTPServer
+
+    A tiny in-process SMTP server stand-in, which accepts every message and keeps track of what it was sent. It runs on
+    a background thread, with a thread per connection. It can also misbehave like a carrier under load, by throttling
+    (421), hanging up, and rate limiting each gateway domain, which is what "mail_to_sms loadtest" drives it with.
+
+    Arguments:
+        host {string} [optional]: The host to listen on. Defaults to "127.0.0.1".
+        port {int} [optional]: The port to listen on. Defaults to any free port.
+        latency {float} [optional]: Seconds to wait before accepting each message, to mimic a real server's processing
+            time. Defaults to 0.
+        keep_messages {boolean} [optional]: Keep every (recipients, data) pair in the messages list. Defaults to True,
+            turn it off for long running benchmarks.
+        pipelining {boolean} [optional]: Advertise ESMTP PIPELINING. Defaults to True.
+        rejected {iterable} [optional]: Recipients to refuse with a 550. Defaults to none.
+        max_recipients {int} [optional]: The most recipients per transaction, with any more refused with a 452.
+            Defaults to no limit.
+        throttle_rate {float} [optional]: The fraction (0 - 1) of transactions answered with a 421 at MAIL FROM,
+            after which the connection is closed. Defaults to 0.
+        disconnect_rate {float} [optional]: The fraction (0 - 1) of transactions where the connection is dropped at
+            MAIL FROM without any reply. Defaults to 0.
+        domain_limits {dict} [optional]: The most recipients accepted per second for each domain, with any more
+            refused with a 450. (ex. {"vtext.com": 5}) Defaults to no limits.
+        seed {int} [optional]: Seeds the random throttling and disconnects, so that runs can be repeated.
+
+    Examples:
+        with LocalSMTPServer() as server:
+            MailToSMS(5551234567, "att", "sender@example.com", None, "hello", yagmail=server.yagmail_args)
+            print(server.message_count)
+
+        ## A flaky carrier
+        with LocalSMTPServer(latency=0.05, throttle_rate=0.01, disconnect_rate=0.005, domain_limits={"vtext.com": 5}):
+            ...
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0, keep_messages=True, pipelining=True, rejected=(),
+                 max_recipients=None, throttle_rate=0, disconnect_rate=0, domain_limits=None, seed=None):
+        self.latency = latency
+        self.keep_messages = keep_messages
+        self.pipelining = pipelining
+        self.rejected = set(rejected)
+        self.max_recipients = max_recipients
+        self.throttle_rate = throttle_rate
+        self.disconnect_rate = disconnect_rate
+        self.domain_limits = dict(domain_limits or {})
+        self.messages = []
+        self.message_count = 0
+        self.connection_count = 0
+        self.throttled_count = 0
+        self.disconnected_count = 0
+        self.rate_limited_count = 0
+
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        ## The times of each domain's recipients accepted in the last second
+        self._domain_windows = collections.defaultdict(collections.deque)
+        self._server = _ThreadingServer((host, port), _SMTPHandler)
+        self._server.stand_in = self
+        self._thread = None
+
+    @property
+    def host(self):
+        return self._server.server_address[0]
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    @property
+    def yagmail_args(self):
+        ## host, port, smtp_starttls, smtp_ssl, smtp_set_debuglevel, smtp_skip_login
+        return [self.host, self.port, False, False, 0, True]
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    ## Methods
+
+    def _record_connection(self):
+        with self._lock:
+            self.connection_count += 1
+
+
+    def _get_fault(self):
+        ## Decides how (if at all) to misbehave for the next transaction
+        if(not self.throttle_rate and not self.disconnect_rate):
+            return None
+
+        with self._lock:
+            roll = self._random.random()
+            if(roll < self.disconnect_rate):
+                self.disconnected_count += 1
+                return DISCONNECT
+            if(roll < self.disconnect_rate + self.throttle_rate):
+                self.throttled_count += 1
+                return THROTTLE
+        return None
+
+
+    def _take_domain_slot(self, recipient):
+        ## Returns False if the recipient's domain has already had its fill of recipients in the last second
+        domain = recipient.rsplit("@", 1)[-1].lower()
+        limit = self.domain_limits.get(domain)
+        if(limit is None):
+            return True
+
+        now = time.monotonic()
+        with self._lock:
+            window = self._domain_windows[domain]
+            while(window and now - window[0] >= 1):
+                window.popleft()
+            if(len(window) >= limit):
+                self.rate_limited_count += 1
+                return False
+            window.append(now)
+        return True
+
+
+    def _record_message(self, recipients, data):
+        with self._lock:
+            self.message_count += 1
+            if(self.keep_messages):
+                self.messages.append((recipients, data))
+
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
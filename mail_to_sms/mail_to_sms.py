@@ -1,74 +1,165 @@
 from __future__ import print_function
 
-import json
-import os
+import logging
+import time
+from collections import namedtuple
+from contextlib import contextmanager
 
-import yagmail
-import phonenumbers
+from . import gateway_registry, message_template, segmentation
+from .direct import MXLease
+from .identities import IdentityLease
+from .message_template import MessageTemplate, TemplateMessage
+from .metrics import (
+    CONNECT_SECONDS, DEFERRED, FAILED, PARSE_SECONDS, RETRIES, SEND_SECONDS, SENT, get_failure_reason, get_metrics
+)
+from .number_cache import get_number_cache
+from .pipelining import send_transaction
+from .rate_limit import RateLimitDeferred
+from .recipient import Recipient
+from .results import UndeliverableAddress
+from .resilience import call_with_retries, get_breaker_registry, get_default_retry_policy
+from .smtp_pool import get_default_pool
 
 
-class MailToSMS:
-    """MailToSMS
+logger = logging.getLogger(__name__)
 
-    This module implements a basic api for sending text messages via email using yagmail.
+## Why an address couldn't be built, as recorded in the failure metrics (and reported by resolve_addresses())
+INVALID_NUMBER = "invalid_number"
+UNKNOWN_CARRIER = "unknown_carrier"
+NO_GATEWAY = "no_gateway"
+UNDELIVERABLE = "undeliverable"
 
-    Arguments:
-        number {string|int}: The destination phone number (ex. 5551234567)
-        carrier {string}: The destination phone number's carrier (ex. "att")
-        username {string} [optional]: The username for accessing the SMTP server (ex. "username").
-            If omitted, it'll try to use the username stored in the .yagmail file.
-            See: https://github.com/kootenpv/yagmail#username-and-password
-        password {string} [optional]: The password for accessing the SMTP server (ex. "password").
-            If using Gmail and 2FA, you may want to use an app password.
-            If omitted, it'll try to use yagmail's password in the keyring, otherwise it'll prompt you for the password.
-            See: https://github.com/kootenpv/yagmail#username-and-password
-        contents {yagmail contents} [optional]: A yagmail friendly contents argument (ex. "This is a message."). 
-            See: https://github.com/kootenpv/yagmail#magical-contents
-            If omitted, you can manually use MailToSMS's send method.
-        keyworded args (for extra configuration):
-            quiet {boolean}: Choose to disable printed statements. Defaults to False. (ex. quiet=True)
-            region {string}: The region of the destination phone number. Defaults to "US". (ex. region="US")
-                This should only be necessary when using a non international phone number that's not US based.
-                See: https://github.com/daviddrysdale/python-phonenumbers
-            mms {boolean}: Choose to send a MMS message instead of a SMS message, but will fallback to SMS if MMS isn't present. Defaults to False. (ex. mms=True)
-            subject {string}: The subject of the email to send (ex. subject="This is a subject.")
-            yagmail {list}: A list of arguments to send to the yagmail.SMTP() constructor. (ex. yagmail=["my.smtp.server.com", "12345"])
-                As of 4/30/17, the args and their defaults (after the username and password) are:
-                    host='smtp.gmail.com', port='587', smtp_starttls=True, smtp_set_debuglevel=0, smtp_skip_login=False, encoding="utf-8"
-                This is unnecessary if you're planning on using the basic Gmail interface, 
-                    in which case you'll just need the username and password.
-                See: https://github.com/kootenpv/yagmail/blob/master/yagmail/yagmail.py#L49
+## The outcome of sending a message to a single recipient. Latency is the number of seconds spent sending, if measured,
+## and deferred messages were held back by a RateLimiter so they can be tried again later.
+SendResult = namedtuple(
+    "SendResult", ["number", "carrier", "address", "success", "error", "latency", "deferred"], defaults=(None, False)
+)
 
-    Examples:
-        from mail_to_sms import MailToSMS
 
-        MailToSMS(5551234567, "att", "username@gmail.com", "password", "this is a message")
+def _login(connection, metrics):
+    started_at = time.perf_counter()
+    connection.login()
+    metrics.observe(CONNECT_SECONDS, time.perf_counter() - started_at, host=getattr(connection, "host", None))
 
-        MailToSMS("5551234567", "att", "username", "password", ["hello", "world"], subject="hey!")
 
-        MailToSMS(5551234567, "att", "username", "password", "hello world!", yagmail=["smtp.gmail.com", "587"])
+def make_message_id(sender):
+    """Returns a new, unique Message-ID on the sender address's domain."""
 
-        MailToSMS("5551234567", "att", "username@gmail.com", "password", ["line one"], yagmail=["smtp.gmail.com"])
+    from email.utils import make_msgid
 
-        mail = MailToSMS(5551234567, "att", "username", "password")
-        mail.send("this is a string!")
+    ## make_msgid() looks up this machine's FQDN without a domain, which can be slow
+    return make_msgid(domain=sender.rsplit("@", 1)[-1] if sender and "@" in sender else "localhost")
 
-    Requirements:
-        yagmail
-        phonenumbers
-        click (for the CLI)
+
+def deliver(connection, address, subject, contents, metrics=None, message_id=None):
+    """Sends a message to the address over a yagmail connection, logging in first if needed. Raises on failure. The
+    time spent logging in is recorded into metrics (or the shared MetricsRegistry), and the message gets the
+    Message-ID, if one is given."""
+
+    import smtplib
+
+    metrics = metrics or get_metrics()
+
+    ## Newer yagmail releases log in again on every send() call, so prepare the message with yagmail and push it
+    ## through the already open SMTP session instead. This lets many messages share one login.
+    if(not hasattr(connection, "prepare_send")):
+        if(isinstance(contents, (MessageTemplate, TemplateMessage))):
+            contents = contents.get_text(address)
+        connection.send(to=address, subject=subject, contents=contents)
+        return
+
+    if(connection.smtp is None or connection.is_closed):
+        _login(connection, metrics)
+
+    ## Templates are rendered directly, rather than having yagmail build a whole MIME message for each one
+    recipients, message = message_template.prepare_send(connection, address, subject, contents, message_id)
+    try:
+        connection.smtp.sendmail(connection.user, recipients, message)
+    except smtplib.SMTPServerDisconnected:
+        ## The server dropped the idle session, so log in again and give it one more try
+        _login(connection, metrics)
+        connection.smtp.sendmail(connection.user, recipients, message)
+
+
+def deliver_many(connection, addresses, subject, contents, metrics=None, message_id=None):
+    """Sends the same message to every address in a single SMTP transaction over a yagmail connection (pipelining the
+    commands if the server supports it), logging in first if needed. Returns a dict of the refused addresses to their
+    (code, response), and raises if every address was refused or the transaction failed."""
+
+    import smtplib
+
+    metrics = metrics or get_metrics()
+
+    if(not hasattr(connection, "prepare_send")):
+        ## Without access to the SMTP session there's nothing to group over, so send them one at a time
+        refused = {}
+        for address in addresses:
+            try:
+                deliver(connection, address, subject, contents, metrics, message_id)
+            except smtplib.SMTPResponseException as e:
+                refused[address] = (e.smtp_code, e.smtp_error)
+        if(len(refused) == len(addresses)):
+            raise smtplib.SMTPRecipientsRefused(refused)
+        return refused
+
+    if(connection.smtp is None or connection.is_closed):
+        _login(connection, metrics)
+
+    ## Every recipient gets the same message, so address it to the sender rather than listing everyone in the headers
+    _, message = message_template.prepare_send(connection, connection.user, subject, contents, message_id)
+    try:
+        return send_transaction(connection.smtp, connection.user, addresses, message)
+    except smtplib.SMTPServerDisconnected:
+        _login(connection, metrics)
+        return send_transaction(connection.smtp, connection.user, addresses, message)
+
+
+class Sender:
+    """Sender
+
+    Holds the config and SMTP connection used to send text messages, and sends them to any number of Recipients. It
+    has no recipient of its own, so one Sender (and its config) can be shared by every recipient in a roster.
+
+    Arguments:
+        username {string} [optional]: See MailToSMS.
+        password {string} [optional]: See MailToSMS.
+        keyworded args (for extra configuration): See MailToSMS.
+
+    Examples:
+        from mail_to_sms import Sender
+
+        with Sender("username", "password", subject="hey!") as sender:
+            recipient = sender.recipient(5551234567, "att")
+            result = sender.send(recipient, "this is a message")
+
+            roster = [sender.recipient(number, carrier) for number, carrier in rows]
+            results = sender.send_many([recipient for recipient in roster if recipient], "hello everyone!")
     """
 
     ## Config
-    GATEWAYS_JSON_PATH = os.path.join(os.path.dirname(__file__), "gateways.json")
-    GATEWAYS_KEY = "gateways"
-    CARRIER_NAMES_KEY = "carrier_names"
-    SMS_KEY = "sms"
-    MMS_KEY = "mms"
+    GATEWAYS_JSON_PATH = gateway_registry.GATEWAYS_JSON_PATH
+    GATEWAYS_KEY = gateway_registry.GATEWAYS_KEY
+    CARRIER_NAMES_KEY = gateway_registry.CARRIER_NAMES_KEY
+    SMS_KEY = gateway_registry.SMS_KEY
+    MMS_KEY = gateway_registry.MMS_KEY
     QUIET_KEY = "quiet"
     REGION_KEY = "region"
     SUBJECT_KEY = "subject"
     YAGMAIL_KEY = "yagmail"
+    POOL_KEY = "pool"
+    NUMBER_CACHE_KEY = "number_cache"
+    SPOOL_KEY = "spool"
+    RETRY_KEY = "retry"
+    BREAKERS_KEY = "breakers"
+    RATE_LIMITER_KEY = "rate_limiter"
+    LONG_MESSAGES_KEY = "long_messages"
+    MMS_THRESHOLD_KEY = "mms_threshold"
+    METRICS_KEY = "metrics"
+    IDENTITIES_KEY = "identities"
+    DIRECT_KEY = "direct"
+    GATEWAY_FILES_KEY = "gateway_files"
+    MAX_RECIPIENTS_KEY = "max_recipients"
+    RESULTS_KEY = "results"
 
     ## Defaults
     DEFAULT_QUIET = False
@@ -76,43 +167,70 @@ class MailToSMS:
     DEFAULT_REGION = "US"
     DEFAULT_SUBJECT = None
     DEFAULT_YAGMAIL_ARGS = []
+    DEFAULT_POOL = None
+    DEFAULT_NUMBER_CACHE = None
+    DEFAULT_SPOOL = None
+    DEFAULT_RETRY = None
+    DEFAULT_BREAKERS = None
+    DEFAULT_RATE_LIMITER = None
+    DEFAULT_LONG_MESSAGES = None
+    DEFAULT_MMS_THRESHOLD = None
+    DEFAULT_METRICS = None
+    DEFAULT_IDENTITIES = None
+    DEFAULT_DIRECT = None
+    DEFAULT_GATEWAY_FILES = None
+    DEFAULT_MAX_RECIPIENTS = None
+    DEFAULT_RESULTS = None
+
+
+    def __init__(self, username=None, password=None, **kwargs):
+        self.config = self._build_config(kwargs)
+        self.pool = self.config["pool"] or get_default_pool()
+        self.yagmail_args = self._build_yagmail_args(username, password)
+        self.connection = None
+        self.gateways = self._load_gateways()
 
+    ## Methods
 
-    def __init__(self, number, carrier, username=None, password=None, contents=None, **kwargs):
-        ## Explicitly define the available configs and their defaults (if necessary)
-        self.config = {
+    def _build_config(self, kwargs):
+        return {
             "quiet": kwargs.get(self.QUIET_KEY, self.DEFAULT_QUIET),
             "region": kwargs.get(self.REGION_KEY, self.DEFAULT_REGION),
             "subject": kwargs.get(self.SUBJECT_KEY, self.DEFAULT_SUBJECT),
             "mms": kwargs.get(self.MMS_KEY, self.DEFAULT_TO_MMS),
-            "yagmail": kwargs.get(self.YAGMAIL_KEY, self.DEFAULT_YAGMAIL_ARGS)
+            "yagmail": kwargs.get(self.YAGMAIL_KEY, self.DEFAULT_YAGMAIL_ARGS),
+            "pool": kwargs.get(self.POOL_KEY, self.DEFAULT_POOL),
+            "number_cache": kwargs.get(self.NUMBER_CACHE_KEY, self.DEFAULT_NUMBER_CACHE),
+            "spool": kwargs.get(self.SPOOL_KEY, self.DEFAULT_SPOOL),
+            "retry": kwargs.get(self.RETRY_KEY, self.DEFAULT_RETRY),
+            "breakers": kwargs.get(self.BREAKERS_KEY, self.DEFAULT_BREAKERS),
+            "rate_limiter": kwargs.get(self.RATE_LIMITER_KEY, self.DEFAULT_RATE_LIMITER),
+            "long_messages": kwargs.get(self.LONG_MESSAGES_KEY, self.DEFAULT_LONG_MESSAGES),
+            "mms_threshold": kwargs.get(self.MMS_THRESHOLD_KEY, self.DEFAULT_MMS_THRESHOLD),
+            "metrics": kwargs.get(self.METRICS_KEY, self.DEFAULT_METRICS),
+            "identities": kwargs.get(self.IDENTITIES_KEY, self.DEFAULT_IDENTITIES),
+            "direct": kwargs.get(self.DIRECT_KEY, self.DEFAULT_DIRECT),
+            "gateway_files": kwargs.get(self.GATEWAY_FILES_KEY, self.DEFAULT_GATEWAY_FILES),
+            "max_recipients": kwargs.get(self.MAX_RECIPIENTS_KEY, self.DEFAULT_MAX_RECIPIENTS),
+            "results": kwargs.get(self.RESULTS_KEY, self.DEFAULT_RESULTS)
         }
 
-        ## Prepare the address to send to, return if it couldn't be generated
-        self.address = self._build_address(number, carrier)
-        if(not self.address):
-            return
 
-        ## Prepare the passthru args for yagmail
-        yagmail_args = self.config["yagmail"]
-        if(username):
-            yagmail_args.insert(0, username)
-            yagmail_args.insert(1, password)
+    def __enter__(self):
+        ## Hold onto a single pooled connection for the duration of the with block
+        if(self.connection is None and self._wants_connection()):
+            self.connection = self._acquire()
+        return self
 
-        ## Init the yagmail connection
-        try:
-            self.connection = yagmail.SMTP(*yagmail_args)
-        except Exception as e:
-            ## You might want to look into using an app password for this.
-            self._print_error(e, "Unhandled error creating yagmail connection.")
-            return
 
-        ## Send the mail if the contents arg has been provided, otherwise
-        ## the send() method can be called manually.
-        if(contents):
-            self.send(contents)
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+    def _wants_connection(self):
+        return True
 
-    ## Methods
 
     def _print_error(self, exception, message=None):
         output = []
@@ -123,79 +241,85 @@ class MailToSMS:
 
         if(output):
             joined = " ".join(output)
-            ## Inefficient logic to aid in testing
-            if(not self.config["quiet"]):
-                print(joined)
+            ## Quiet errors are still available to anyone listening at the DEBUG level. Returned to aid in testing.
+            logger.log(logging.DEBUG if self.config["quiet"] else logging.ERROR, joined)
             return joined
         else:
             return None
 
 
-    def _load_gateways(self):
-        with open(self.GATEWAYS_JSON_PATH, "r") as fd:
-            try:
-                return json.load(fd)[self.GATEWAYS_KEY]
-            except Exception as e:
-                self._print_error(e, "Unhandled error loading gateways.json.")
-                return []
-
+    def _get_metrics(self):
+        return self.config["metrics"] or get_metrics()
 
-    def _validate_number(self, number, region):
-        number = str(number).strip()
 
+    def _load_gateways(self):
+        ## The registry is parsed once per process (per set of gateways files) and shared between instances
         try:
-            parsed = phonenumbers.parse(number, region)
-        except phonenumbers.phonenumberutil.NumberParseException as e:
-            self._print_error(e, "NumberParseException when parsing the phone number.")
-            return False
+            return gateway_registry.get_gateway_registry(self.GATEWAYS_JSON_PATH, self.config["gateway_files"])
         except Exception as e:
-            self._print_error(e, "Unhandled error when parsing the phone number.")
-            return False
+            self._print_error(e, "Unhandled error loading the gateways files.")
+            return None
 
+
+    def _parse_number(self, number, region):
+        ## An empty cache is falsy, so check for None explicitly
+        number_cache = self.config["number_cache"]
+        return (get_number_cache() if number_cache is None else number_cache).get(number, region)
+
+
+    def _validate_number(self, number, region):
+        metrics = self._get_metrics()
+        started_at = time.perf_counter()
+        parsed = self._parse_number(number, region)
+        metrics.observe(PARSE_SECONDS, time.perf_counter() - started_at)
+
+        if(parsed.valid):
+            return True
         else:
-            if (phonenumbers.is_possible_number(parsed) and
-                phonenumbers.is_valid_number(parsed)):
-                return True
-            else:
-                self._print_error(None, "'{0}' isn't a valid phone number".format(number))
-                return False
+            metrics.increment(FAILED, reason=INVALID_NUMBER)
+            self._print_error(*parsed.error)
+            return False
 
 
     def _validate_carrier(self, carrier):
         carrier = str(carrier).strip()
 
-        for gateway in self.gateways:
-            if(carrier in gateway[self.CARRIER_NAMES_KEY]):
-                return True
+        if(carrier in self.gateways):
+            return True
         else:
+            self._get_metrics().increment(FAILED, reason=UNKNOWN_CARRIER)
             self._print_error(None, "'{0}' isn't a valid carrier.".format(carrier))
             return False
 
 
     def _get_gateway(self, carrier):
-        for gateway in self.gateways:
-            if(carrier in gateway[self.CARRIER_NAMES_KEY]):
-                if(self.config.get(self.MMS_KEY)):
-                    ## Return mms gateway if possible, else return the sms gateway
-                    if(self.MMS_KEY in gateway):
-                        return gateway[self.MMS_KEY]
-                    elif(self.SMS_KEY in gateway):
-                        return gateway[self.SMS_KEY]
-                else:
-                    ## Return sms gateway if possible, else return the mms gateway
-                    if(self.SMS_KEY in gateway):
-                        return gateway[self.SMS_KEY]
-                    elif(self.MMS_KEY in gateway):
-                        return gateway[self.MMS_KEY]
+        ## Returns the mms gateway if requested and possible, else the sms gateway (and vice versa)
+        gateway = self.gateways.resolve(carrier, self.config.get(self.MMS_KEY))
+        if(gateway):
+            return gateway
         else:
             ## This shouldn't happen.
+            self._get_metrics().increment(FAILED, reason=NO_GATEWAY)
             self._print_error(None, "Carrier '{0}' doesn't have any valid SMS or MMS gateways.".format(carrier))
             return None
 
 
     def _build_address(self, number, carrier):
-        ## Load and ensure that there are gateways to check
-        self.gateways = self._load_gateways()
+        recipient = self.recipient(number, carrier)
+        return recipient.get_address(self.config["mms"]) if recipient else None
+
+
+    def _template_fields(self, number, carrier):
+        ## The fields that templates get for a valid recipient, in the same form as a Recipient's national number and
+        ## carrier, so $number reads the same however the message is sent
+        parsed = self._parse_number(number, self.config["region"])
+        return {"number": parsed.national, "carrier": self.gateways.normalize_carrier(carrier)}
+
+
+    def recipient(self, number, carrier):
+        """Validates the number and carrier, and returns their Recipient. Returns None if either of them isn't valid."""
+
+        ## Make sure that there are gateways to check, they're resolved once when the instance is made
         if(not self.gateways):
             return None
 
@@ -204,28 +328,517 @@ class MailToSMS:
             not self._validate_carrier(carrier)):
             return None
 
-        ## Get the SMS/MMS gateway for the carrier
-        gateway = self._get_gateway(carrier)
-        if(not gateway):
+        ## Make sure that the carrier has a SMS/MMS gateway
+        if(not self._get_gateway(carrier)):
             return None
 
-        return "{0}@{1}".format(number, gateway)
+        ## Use the normalized digits, so formatting like "555-123-4567" doesn't end up in the address
+        parsed = self._parse_number(number, self.config["region"])
+        return Recipient(
+            parsed.e164,
+            parsed.national,
+            self.gateways.normalize_carrier(carrier),
+            self.gateways.resolve(carrier, False),
+            self.gateways.resolve(carrier, True)
+        )
 
 
-    def send(self, contents):
-        ## Prepare kwargs for yagmail.send()
-        yagmail_kwargs = {
-            "to": self.address,
-            "subject": self.config["subject"],
-            "contents": contents
-        }
+    def _build_yagmail_args(self, username, password):
+        ## Prepare the passthru args for yagmail. Copy them so the shared default list never gets mutated.
+        yagmail_args = list(self.config["yagmail"])
+        if(username):
+            yagmail_args.insert(0, username)
+            yagmail_args.insert(1, password)
+
+        return yagmail_args
+
+
+    def _open(self):
+        ## Connect with the next identity when sending from an IdentityPool, otherwise with the yagmail args. Direct
+        ## delivery connects to each gateway's MX as it's sent to.
+        if(self.config["direct"] is not None):
+            return self.config["direct"].lease()
+        if(self.config["identities"] is not None):
+            return IdentityLease(self.config["identities"], self.pool)
+        return self.pool.acquire(*self.yagmail_args)
+
+
+    def _release(self, connection, discard=False):
+        if(isinstance(connection, (IdentityLease, MXLease))):
+            connection.close(discard)
+        else:
+            self.pool.release(connection, discard)
+
+
+    def _acquire(self):
+        try:
+            return self._open()
+        except Exception as e:
+            ## You might want to look into using an app password for this.
+            self._print_error(e, "Unhandled error creating yagmail connection.")
+            return None
+
+
+    @contextmanager
+    def _lease(self):
+        ## Use the connection held by the with block if there is one, otherwise borrow one from the pool
+        if(self.connection is not None):
+            yield self.connection
+        elif(self.config["identities"] is None and self.config["direct"] is None):
+            with self.pool.connection(*self.yagmail_args) as connection:
+                yield connection
+        else:
+            import smtplib
+
+            connection = self._open()
+            discard = False
+            try:
+                yield connection
+            except smtplib.SMTPServerDisconnected:
+                discard = True
+                raise
+            finally:
+                self._release(connection, discard)
+
+
+    def _is_undeliverable(self, address):
+        results = self.config["results"]
+        return results is not None and results.is_undeliverable(address)
+
+
+    def _check_deliverable(self, address):
+        ## Addresses that have bounced (or opted out) are skipped before any network work happens
+        if(self._is_undeliverable(address)):
+            self._get_metrics().increment(FAILED, reason=UNDELIVERABLE)
+            raise UndeliverableAddress("'{0}' has been marked as undeliverable.".format(address))
+
+
+    def _record_result(self, message_id, address, error=None):
+        results = self.config["results"]
+        if(results is None):
+            return
+
+        if(error is None):
+            results.record(message_id, address, True)
+        else:
+            code = (self.config["retry"] or get_default_retry_policy()).get_smtp_code(error)
+            results.record(message_id, address, False, code, str(error))
+
+
+    def _deliver(self, connection, address, contents, subject=None):
+        ## Split long messages up (or promote them to MMS) first, and send every piece over the same connection. The
+        ## subject defaults to the subject config.
+        subject = self.config["subject"] if subject is None else subject
+        prepared = segmentation.prepare(
+            address, contents, self.config["long_messages"], self.gateways, self.config["mms_threshold"], subject
+        )
+        for prepared_address, prepared_contents in prepared:
+            self._deliver_message(connection, prepared_address, prepared_contents, subject)
+
+
+    def _deliver_message(self, connection, address, contents, subject=None):
+        metrics = self._get_metrics()
+        domain = address.rsplit("@", 1)[-1]
+
+        ## Wait for (or in the defer mode, check for) capacity on the account and the carrier's gateway
+        rate_limiter = self.config["rate_limiter"]
+        if(rate_limiter and not rate_limiter.acquire(getattr(connection, "user", None), address)):
+            metrics.increment(DEFERRED, domain=domain)
+            raise RateLimitDeferred("Sending to '{0}' was deferred by the rate limiter.".format(address))
+
+        ## Retry transient failures, and fail fast while the relay or the carrier's gateway is known to be down
+        policy = self.config["retry"] or get_default_retry_policy()
+        breakers = self.config["breakers"] or get_breaker_registry()
+
+        ## Messages are only given a Message-ID of their own when there's somewhere to record it for matching bounces
+        message_id = None
+        if(self.config["results"] is not None):
+            message_id = make_message_id(getattr(connection, "user", None))
+        subject = self.config["subject"] if subject is None else subject
+
+        def send():
+            ## Direct deliveries go over a session with the gateway's own MX
+            target = connection.for_address(address) if isinstance(connection, MXLease) else connection
+            call_with_retries(
+                lambda: deliver(target, address, subject, contents, metrics, message_id),
+                policy,
+                breakers.for_send(getattr(target, "host", None), address),
+                on_retry=lambda attempt, exception: metrics.increment(RETRIES, domain=domain)
+            )
+
+        started_at = time.perf_counter()
+        try:
+            self._send_with_failover(connection, send)
+        except Exception as e:
+            metrics.increment(FAILED, reason=get_failure_reason(e))
+            self._record_result(message_id, address, e)
+            raise
+        else:
+            metrics.increment(SENT, domain=domain)
+            self._record_result(message_id, address)
+        finally:
+            metrics.observe(SEND_SECONDS, time.perf_counter() - started_at, domain=domain)
+
+
+    def _send_with_failover(self, connection, send):
+        ## When sending from an IdentityPool, problems with the identity itself (a failed login or an exhausted quota)
+        ## are retried from the next identity rather than failing the message
+        while True:
+            try:
+                if(isinstance(connection, IdentityLease)):
+                    connection.check_available()
+                sent = send()
+            except Exception as e:
+                if(not isinstance(connection, IdentityLease) or not connection.fail_over(e)):
+                    raise
+            else:
+                ## Grouped sends return how many recipients they reached, which all count against the quota
+                if(isinstance(connection, IdentityLease)):
+                    connection.record_sent(1 if sent is None else sent)
+                return
+
+
+    def _can_group(self, contents):
+        ## Templates are rendered separately for each recipient, so only identical messages can share a transaction
+        return bool(self.config["max_recipients"]) and not isinstance(contents, (MessageTemplate, TemplateMessage))
+
+
+    def _deliver_transactions(self, connection, addresses, contents):
+        ## Sends contents to the addresses (which share a gateway domain) in transactions of up to max_recipients each,
+        ## and returns a dict of the addresses that weren't sent to, onto the exception explaining why
+        import smtplib
+
+        metrics = self._get_metrics()
+        domain = addresses[0].rsplit("@", 1)[-1]
+        failed = {}
+
+        rate_limiter = self.config["rate_limiter"]
+        if(rate_limiter):
+            for address in addresses:
+                if(not rate_limiter.acquire(getattr(connection, "user", None), address)):
+                    metrics.increment(DEFERRED, domain=domain)
+                    failed[address] = RateLimitDeferred(
+                        "Sending to '{0}' was deferred by the rate limiter.".format(address)
+                    )
+
+        policy = self.config["retry"] or get_default_retry_policy()
+        breakers = self.config["breakers"] or get_breaker_registry()
+        size = self.config["max_recipients"]
+
+        pending = [address for address in addresses if address not in failed]
+        while(pending):
+            chunk, pending = pending[:size], pending[size:]
+            refused = {}
+            message_id = None
+            if(self.config["results"] is not None):
+                message_id = make_message_id(getattr(connection, "user", None))
+
+            def send():
+                target = connection.for_address(chunk[0]) if isinstance(connection, MXLease) else connection
+                refused.clear()
+                refused.update(call_with_retries(
+                    lambda: deliver_many(target, chunk, self.config["subject"], contents, metrics, message_id),
+                    policy,
+                    breakers.for_send(getattr(target, "host", None), chunk[0]),
+                    on_retry=lambda attempt, exception: metrics.increment(RETRIES, domain=domain)
+                ))
+                return len(chunk) - len(refused)
+
+            started_at = time.perf_counter()
+            try:
+                self._send_with_failover(connection, send)
+            except Exception as e:
+                metrics.increment(FAILED, len(chunk), reason=get_failure_reason(e))
+                for address in chunk:
+                    failed[address] = e
+                    self._record_result(message_id, address, e)
+                continue
+            finally:
+                metrics.observe(SEND_SECONDS, time.perf_counter() - started_at, domain=domain)
+
+            ## Recipients past the server's own per transaction limit are refused with a 452, and go in the next one
+            overflow = [address for address in chunk if refused.get(address, (None,))[0] == 452]
+            if(overflow and len(refused) < len(chunk)):
+                pending = overflow + pending
+                for address in overflow:
+                    del refused[address]
+
+            metrics.increment(SENT, len(chunk) - len(refused) - len(overflow), domain=domain)
+            for address in chunk:
+                if(address in refused):
+                    error = smtplib.SMTPRecipientsRefused({address: refused[address]})
+                    metrics.increment(FAILED, reason=get_failure_reason(error))
+                    failed[address] = error
+                    self._record_result(message_id, address, error)
+                elif(address not in overflow):
+                    self._record_result(message_id, address)
+
+        return failed
+
+
+    def _deliver_group(self, connection, addresses, contents):
+        ## Like _deliver, but for many addresses on the same gateway domain. They all get the same pieces, so long
+        ## messages are prepared once and each piece goes to everyone who hasn't already failed.
+        prepared = segmentation.prepare(
+            addresses[0], contents, self.config["long_messages"], self.gateways, self.config["mms_threshold"],
+            self.config["subject"]
+        )
+        local_parts = [address.rsplit("@", 1)[0] for address in addresses]
+
+        failed = {}
+        for prepared_address, prepared_contents in prepared:
+            ## Promoting to MMS changes the domain, so rebuild every address on the piece's domain
+            domain = prepared_address.rsplit("@", 1)[-1]
+            pending = {
+                "{0}@{1}".format(local, domain): address
+                for local, address in zip(local_parts, addresses) if address not in failed
+            }
+            if(not pending):
+                break
+
+            piece_failed = self._deliver_transactions(connection, list(pending), prepared_contents)
+            for piece_address, error in piece_failed.items():
+                failed[pending[piece_address]] = error
+
+        return failed
+
+
+    def _send_grouped(self, connection, rows, contents):
+        ## Sends contents to each (number, carrier, address) row, with the addresses on the same gateway domain
+        ## sharing transactions, and returns their SendResults in the same order as the rows
+        groups = {}
+        outcomes = {}
+        for _, _, address in rows:
+            if(address in outcomes):
+                continue
+            try:
+                self._check_deliverable(address)
+            except UndeliverableAddress as e:
+                outcomes[address] = (e, None)
+                continue
+
+            addresses = groups.setdefault(address.rsplit("@", 1)[-1], {})
+            addresses[address] = None
+
+        for addresses in groups.values():
+            started_at = time.perf_counter()
+            failed = self._deliver_group(connection, list(addresses), contents)
+            latency = time.perf_counter() - started_at
+            for address in addresses:
+                outcomes[address] = (failed.get(address), latency)
+
+        results = []
+        for number, carrier, address in rows:
+            error, latency = outcomes[address]
+            if(error is None):
+                results.append(SendResult(number, carrier, address, True, None, latency))
+            elif(isinstance(error, RateLimitDeferred)):
+                results.append(SendResult(number, carrier, address, False, str(error), deferred=True))
+            else:
+                message = self._print_error(error, "Unhandled error sending mail.")
+                results.append(SendResult(number, carrier, address, False, message, latency))
+
+        return results
+
+
+    def send(self, recipient, contents):
+        """Sends contents to the Recipient, and returns its SendResult."""
+
+        address = recipient.get_address(self.config["mms"])
+        contents = message_template.add_fields(contents, number=recipient.national, carrier=recipient.carrier)
+        sent_at = time.perf_counter()
+        try:
+            self._check_deliverable(address)
+            with self._lease() as connection:
+                self._deliver(connection, address, contents)
+        except RateLimitDeferred as e:
+            return SendResult(recipient.number, recipient.carrier, address, False, str(e), deferred=True)
+        except Exception as e:
+            error = self._print_error(e, "Unhandled error sending mail.")
+            return SendResult(recipient.number, recipient.carrier, address, False, error, time.perf_counter() - sent_at)
+        else:
+            return SendResult(recipient.number, recipient.carrier, address, True, None, time.perf_counter() - sent_at)
+
+
+    def send_many(self, recipients, contents):
+        """Sends contents to every Recipient over a single connection, and returns their SendResults in the same
+        order as the recipients. With max_recipients set, recipients on the same gateway domain share SMTP
+        transactions."""
+
+        if(not self._can_group(contents)):
+            with self:
+                return [self.send(recipient, contents) for recipient in recipients]
+
+        rows = [
+            (recipient.number, recipient.carrier, recipient.get_address(self.config["mms"])) for recipient in recipients
+        ]
+        try:
+            with self._lease() as connection:
+                return self._send_grouped(connection, rows, contents)
+        except Exception as e:
+            error = self._print_error(e, "Unhandled error creating yagmail connection.")
+            return [SendResult(number, carrier, address, False, error) for number, carrier, address in rows]
+
+
+    def close(self):
+        ## Hand the held connection (if any) back to the pool
+        if(self.connection is not None):
+            self._release(self.connection)
+            self.connection = None
+
+
+class MailToSMS(Sender):
+    """MailToSMS
+
+    This module implements a basic api for sending text messages via email using yagmail.
+
+    Arguments:
+        number {string|int}: The destination phone number (ex. 5551234567)
+        carrier {string}: The destination phone number's carrier (ex. "att")
+        username {string} [optional]: The username for accessing the SMTP server (ex. "username").
+            If omitted, it'll try to use the username stored in the .yagmail file.
+            See: https://github.com/kootenpv/yagmail#username-and-password
+        password {string} [optional]: The password for accessing the SMTP server (ex. "password").
+            If using Gmail and 2FA, you may want to use an app password.
+            If omitted, it'll try to use yagmail's password in the keyring, otherwise it'll prompt you for the password.
+            See: https://github.com/kootenpv/yagmail#username-and-password
+        contents {yagmail contents} [optional]: A yagmail friendly contents argument (ex. "This is a message."). 
+            See: https://github.com/kootenpv/yagmail#magical-contents
+            If omitted, you can manually use MailToSMS's send method.
+        keyworded args (for extra configuration):
+            quiet {boolean}: Choose to disable error logging (they're still logged at the DEBUG level). Defaults to
+                False. (ex. quiet=True)
+            region {string}: The region of the destination phone number. Defaults to "US". (ex. region="US")
+                This should only be necessary when using a non international phone number that's not US based.
+                See: https://github.com/daviddrysdale/python-phonenumbers
+            mms {boolean}: Choose to send a MMS message instead of a SMS message, but will fallback to SMS if MMS isn't present. Defaults to False. (ex. mms=True)
+            subject {string}: The subject of the email to send (ex. subject="This is a subject.")
+            yagmail {list}: A list of arguments to send to the yagmail.SMTP() constructor. (ex. yagmail=["my.smtp.server.com", "12345"])
+                As of 4/30/17, the args and their defaults (after the username and password) are:
+                    host='smtp.gmail.com', port='587', smtp_starttls=True, smtp_set_debuglevel=0, smtp_skip_login=False, encoding="utf-8"
+                This is unnecessary if you're planning on using the basic Gmail interface, 
+                    in which case you'll just need the username and password.
+                See: https://github.com/kootenpv/yagmail/blob/master/yagmail/yagmail.py#L49
+            pool {SMTPConnectionPool}: The pool to draw yagmail connections from. Defaults to a process wide pool.
+                (ex. pool=SMTPConnectionPool(size=8))
+            number_cache {NumberCache}: The cache of parsed phone numbers to use. Defaults to a process wide cache.
+                (ex. number_cache=NumberCache(size=10000))
+            spool {Spool}: The spool that enqueue() adds messages to. Defaults to a process wide spool.
+                (ex. spool=Spool("/var/spool/mail_to_sms.sqlite3"))
+            retry {RetryPolicy}: How transient send failures are retried. Defaults to 3 attempts with exponential
+                backoff. (ex. retry=RetryPolicy(max_attempts=5))
+            breakers {CircuitBreakerRegistry}: The circuit breakers guarding each SMTP host and carrier gateway domain.
+                Defaults to a process wide registry. (ex. breakers=CircuitBreakerRegistry(failure_threshold=3))
+            rate_limiter {RateLimiter}: Throttles sends per SMTP account and per carrier gateway domain. Defaults to
+                no rate limiting. (ex. rate_limiter=RateLimiter(account_rate=1, gateway_rate=0.5))
+            long_messages {string}: How to handle text longer than a single SMS (160 GSM-7 or 70 UCS-2 characters).
+                "segment" splits it into numbered segments sent over the same connection, and "mms" sends it to the
+                carrier's MMS gateway instead (or segments it if there isn't one). Defaults to None, which sends it
+                as is. (ex. long_messages="mms")
+            mms_threshold {int}: With long_messages="mms", messages up to this length are segmented rather than
+                promoted to MMS. Defaults to the length of a single SMS. (ex. mms_threshold=480)
+            metrics {MetricsRegistry}: Where sends, failures, retries, and timings are recorded. Defaults to a process
+                wide registry. (ex. metrics=MetricsRegistry())
+            identities {IdentityPool}: Spread sends across several accounts instead of the username, password, and
+                yagmail args, failing over between them on auth and quota errors. Defaults to None.
+                (ex. identities=IdentityPool([Identity("one", "password"), Identity("two", "password", weight=2)]))
+            max_recipients {int}: Send identical messages to up to this many recipients on the same gateway domain in
+                a single SMTP transaction (pipelining the commands if the server supports it), when sending to many
+                recipients at once. Defaults to None, which sends each recipient their own. (ex. max_recipients=50)
+            results {ResultsStore}: Record every message sent (with its Message-ID and SMTP response) for matching
+                bounces back to, and skip addresses that it's marked as undeliverable. Defaults to None.
+                (ex. results=ResultsStore("/var/lib/mail_to_sms/results.sqlite3"))
+            direct {DirectDelivery}: Deliver straight to each carrier gateway's MX hosts, instead of through the SMTP
+                server (and identities). Defaults to None. (ex. direct=DirectDelivery("alerts@example.com"))
+            gateway_files {list}: Extra gateways files (in the gateways.json format) to merge over the bundled one,
+                along with any in the MAIL_TO_SMS_GATEWAYS environment variable. Later files take precedence for the
+                carrier names they share. Defaults to None. (ex. gateway_files=["/etc/mail_to_sms/regional.json"])
+
+    Examples:
+        from mail_to_sms import MailToSMS
+
+        MailToSMS(5551234567, "att", "username@gmail.com", "password", "this is a message")
+
+        MailToSMS("5551234567", "att", "username", "password", ["hello", "world"], subject="hey!")
+
+        MailToSMS(5551234567, "att", "username", "password", "hello world!", yagmail=["smtp.gmail.com", "587"])
+
+        MailToSMS("5551234567", "att", "username@gmail.com", "password", ["line one"], yagmail=["smtp.gmail.com"])
+
+        mail = MailToSMS(5551234567, "att", "username", "password")
+        mail.send("this is a string!")
+
+        with MailToSMS(5551234567, "att", "username", "password") as mail:
+            mail.send("this is a string!")
+            mail.send("and it's using the same connection!")
+
+        ## Queue the message to be sent later by a SpoolWorker (ex. "mail_to_sms worker")
+        MailToSMS(5551234567, "att").enqueue("this is a string!")
+
+    Requirements:
+        yagmail
+        phonenumbers
+        click (for the CLI)
+    """
+
+    def __init__(self, number, carrier, username=None, password=None, contents=None, **kwargs):
+        super(MailToSMS, self).__init__(username, password, **kwargs)
+        self.number = number
+        self.carrier = carrier
+
+        ## Prepare the address to send to, return if it couldn't be generated
+        self.address = self._build_address(number, carrier)
+        if(not self.address):
+            return
+
+        ## Make sure that a yagmail connection can be made, and leave it warm in the pool for send(). Undeliverable
+        ## addresses are never sent to, so there's no need to connect for them.
+        if(not self._is_undeliverable(self.address)):
+            connection = self._acquire()
+            if(not connection):
+                return
+            self._release(connection)
+
+        ## Send the mail if the contents arg has been provided, otherwise
+        ## the send() method can be called manually.
+        if(contents):
+            self.send(contents)
 
+    ## Methods
+
+    def _wants_connection(self):
+        return bool(self.address) and not self._is_undeliverable(self.address)
+
+
+    def send(self, contents):
         ## Send the mail
         try:
-            self.connection.send(**yagmail_kwargs)
+            self._check_deliverable(self.address)
+            contents = message_template.add_fields(contents, **self._template_fields(self.number, self.carrier))
+            with self._lease() as connection:
+                self._deliver(connection, self.address, contents)
         except Exception as e:
             self._print_error(e, "Unhandled error sending mail.")
             return False
         else:
-
             return True
+
+
+    def enqueue(self, contents):
+        ## Hand the message off to the spool, rather than waiting on the SMTP server. Returns the message's id.
+        if(not self.address):
+            return None
+
+        import sqlite3
+
+        ## Imported here since the spool depends on this module
+        from .spool import get_default_spool
+
+        contents = message_template.add_fields(contents, **self._template_fields(self.number, self.carrier))
+        try:
+            return (self.config["spool"] or get_default_spool()).enqueue(self.address, contents, self.config["subject"])
+        except (OSError, sqlite3.Error) as e:
+            ## Only problems reaching the spool are logged. Contents that can't be spooled (ex. a template that's
+            ## missing a field) are the caller's mistake, so they're raised.
+            self._print_error(e, "Unhandled error enqueueing mail.")
+            return None
@@ -0,0 +1,149 @@
+from __future__ import print_function
+
+from .mail_to_sms import Sender, SendResult
+from .message_template import add_fields
+from .rate_limit import RateLimitDeferred
+
+
+class MailToSMSBatch(Sender):
+    """MailToSMSBatch
+
+    Sends the same message to many recipients over a single authenticated yagmail connection. Every recipient is
+    validated and resolved up front, and only one login happens for the whole batch.
+
+    Arguments:
+        recipients {iterable}: An iterable of (number, carrier) pairs (ex. [(5551234567, "att"), ("5557654321", "vzw")])
+        username {string} [optional]: See MailToSMS.
+        password {string} [optional]: See MailToSMS.
+        contents {yagmail contents} [optional]: See MailToSMS. If provided, the message is sent to every recipient
+            immediately and the per-recipient SendResults are stored in the results attribute.
+        keyworded args (for extra configuration): See MailToSMS. The region and mms args apply to every recipient.
+            With a rate_limiter in the "defer" mode, recipients without capacity get a deferred SendResult, and with
+            max_recipients set, recipients on the same gateway domain share SMTP transactions.
+
+    Examples:
+        from mail_to_sms import MailToSMSBatch
+
+        batch = MailToSMSBatch([(5551234567, "att"), (5557654321, "verizon")], "username", "password")
+        for result in batch.send("this is a message"):
+            print(result.number, result.success, result.error)
+
+        ## Queue the message for each recipient, to be sent later by a SpoolWorker (ex. "mail_to_sms worker")
+        MailToSMSBatch([(5551234567, "att"), (5557654321, "verizon")]).enqueue("this is a message")
+    """
+
+    def __init__(self, recipients, username=None, password=None, contents=None, **kwargs):
+        super(MailToSMSBatch, self).__init__(username, password, **kwargs)
+        self.results = None
+
+        ## Validate and resolve everyone before connecting, so bad rows never cost any network time
+        self.recipients = self._resolve_recipients(recipients)
+
+        if(contents):
+            self.results = self.send(contents)
+
+    ## Methods
+
+    def _wants_connection(self):
+        ## Only bother connecting if someone can be sent to. Batches without any recipients up front are streamed with
+        ## send_to(), so they hold one for the with block too.
+        return not self.recipients or any(address for _, _, address in self.recipients)
+
+
+    def _resolve_recipients(self, recipients):
+        resolved = []
+        for number, carrier in recipients:
+            resolved.append((number, carrier, self._build_address(number, carrier)))
+
+        return resolved
+
+
+    def _send_to(self, connection, number, carrier, address, contents):
+        if(not address):
+            error = "Unable to build an address for '{0}' with carrier '{1}'.".format(number, carrier)
+            return SendResult(number, carrier, None, False, error)
+
+        if(not connection):
+            return SendResult(number, carrier, address, False, "No yagmail connection available.")
+
+        try:
+            self._check_deliverable(address)
+            self._deliver(connection, address, add_fields(contents, **self._template_fields(number, carrier)))
+        except RateLimitDeferred as e:
+            return SendResult(number, carrier, address, False, str(e), deferred=True)
+        except Exception as e:
+            error = self._print_error(e, "Unhandled error sending mail.")
+            return SendResult(number, carrier, address, False, error)
+        else:
+            return SendResult(number, carrier, address, True, None)
+
+
+    def send(self, contents):
+        """Sends contents to every recipient, returning a list of SendResults in the same order as the recipients."""
+
+        ## Hold a single connection for the whole batch
+        with self:
+            if(not self.connection or not self._can_group(contents)):
+                return [
+                    self._send_to(self.connection, number, carrier, address, contents)
+                    for number, carrier, address in self.recipients
+                ]
+
+            ## Identical messages to the same gateway domain share transactions, everyone else fails as usual
+            grouped = iter(self._send_grouped(self.connection, [row for row in self.recipients if row[2]], contents))
+            return [
+                next(grouped) if address else self._send_to(None, number, carrier, address, contents)
+                for number, carrier, address in self.recipients
+            ]
+
+
+    def send_to(self, number, carrier, contents):
+        """Validates and sends contents to a single recipient, and returns its SendResult. A connection is leased for
+        just this call, so use it inside of a with block to keep the same connection between calls."""
+
+        address = self._build_address(number, carrier)
+        if(not address):
+            return self._send_to(None, number, carrier, address, contents)
+
+        try:
+            with self._lease() as connection:
+                return self._send_to(connection, number, carrier, address, contents)
+        except Exception as e:
+            error = self._print_error(e, "Unhandled error creating yagmail connection.")
+            return SendResult(number, carrier, address, False, error)
+
+
+    def send_stream(self, messages):
+        """Lazily sends each (number, carrier, contents) triple from the messages iterable over a single connection,
+        yielding a SendResult for each as it goes. Nothing is resolved up front, so memory use stays flat no matter
+        how many messages there are."""
+
+        with self:
+            for number, carrier, contents in messages:
+                yield self.send_to(number, carrier, contents)
+
+
+    def enqueue(self, contents):
+        """Hands the message off to the spool for every recipient, rather than waiting on the SMTP server. Returns a
+        list of the queued message ids in the same order as the recipients, with None for any that weren't queued.
+        Templates are filled in for each recipient as they're queued, see Spool.enqueue()."""
+
+        import sqlite3
+
+        ## Imported here since the spool depends on the mail_to_sms module
+        from .spool import get_default_spool
+
+        ids = []
+        for number, carrier, address in self.recipients:
+            message_id = None
+            if(address):
+                try:
+                    message_id = (self.config["spool"] or get_default_spool()).enqueue(
+                        address, add_fields(contents, **self._template_fields(number, carrier)), self.config["subject"]
+                    )
+                except (OSError, sqlite3.Error) as e:
+                    ## Contents that can't be spooled are raised, see MailToSMS.enqueue()
+                    self._print_error(e, "Unhandled error enqueueing mail.")
+            ids.append(message_id)
+
+        return ids
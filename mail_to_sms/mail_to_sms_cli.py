@@ -1,19 +1,262 @@
 from __future__ import print_function
 
-from mail_to_sms import MailToSMS
+import json
+import logging
+import os
+import sys
+
+from mail_to_sms import (
+    BounceIngester, MailToSMS, MailToSMSBatch, MessageTemplate, ResultsStore, Sender, Spool, SpoolWorker, get_metrics,
+    resolve_addresses
+)
+from mail_to_sms import bulk
 
 import click
 
 
+class DefaultCommandGroup(click.Group):
+    ## Falls back to the default command when the first arg isn't a subcommand, so the original
+    ## "mail_to_sms 5551234567 att 'message'" style invocation keeps working.
+    default_command = "send"
+
+    def parse_args(self, ctx, args):
+        if(args and args[0] not in self.commands and args[0] not in ctx.help_option_names):
+            args.insert(0, self.default_command)
+        return super(DefaultCommandGroup, self).parse_args(ctx, args)
+
+
+@click.group(cls=DefaultCommandGroup)
+def main():
+    ## Errors are logged, so show them on stderr like the prints that they replaced
+    logging.basicConfig(format="%(message)s")
+
+
 ## See MailToSMS docstring for information about the arguments
-@click.command()
+@main.command()
 @click.argument("phone-number", type=str)
 @click.argument("carrier", type=str)
 @click.argument("message", type=str)
 @click.option("--yagmail-username", "-u", type=str, help="Specify a specific username for the SMTP server (ex. 'username'). Not necessary if a yagmail keyring and a .yagmail file are in use.")
 @click.option("--yagmail-password", "-p", type=str, help="Specify a specific password for the SMTP server (ex. 'password'). Not necessary if a yagmail keyring and a .yagmail file are in use.")
-def main(phone_number, carrier, message, yagmail_username, yagmail_password):
-    MailToSMS(phone_number, carrier, yagmail_username, yagmail_password, message)
+@click.option("--enqueue", "-q", is_flag=True, help="Add the message to the spool for 'mail_to_sms worker' to send, instead of sending it now.")
+@click.option("--spool", type=click.Path(dir_okay=False), help="The spool database to enqueue into. Defaults to ~/.mail_to_sms/spool.sqlite3 or $MAIL_TO_SMS_SPOOL.")
+@click.option("--dry-run", is_flag=True, help="Only validate the number and carrier, and print the address that would be sent to.")
+def send(phone_number, carrier, message, yagmail_username, yagmail_password, enqueue, spool, dry_run):
+    if(dry_run):
+        resolution = next(resolve_addresses([(phone_number, carrier)]))
+        if(not resolution.address):
+            click.echo(resolution.error, err=True)
+            sys.exit(1)
+        click.echo(resolution.address)
+    elif(enqueue):
+        ## Only the address is needed to queue the message, the worker is what connects to the SMTP server
+        sender = Sender()
+        recipient = sender.recipient(phone_number, carrier)
+        if(recipient is None):
+            sys.exit(1)
+        with Spool(spool) as queued:
+            queued.enqueue(recipient.get_address(sender.config["mms"]), message, sender.config["subject"])
+    else:
+        MailToSMS(phone_number, carrier, yagmail_username, yagmail_password, message)
+
+
+@main.command()
+@click.option("--yagmail-username", "-u", type=str, help="Specify a specific username for the SMTP server (ex. 'username'). Not necessary if a yagmail keyring and a .yagmail file are in use.")
+@click.option("--yagmail-password", "-p", type=str, help="Specify a specific password for the SMTP server (ex. 'password'). Not necessary if a yagmail keyring and a .yagmail file are in use.")
+@click.option("--spool", type=click.Path(dir_okay=False), help="The spool database to drain. Defaults to ~/.mail_to_sms/spool.sqlite3 or $MAIL_TO_SMS_SPOOL.")
+@click.option("--batch-size", type=int, default=SpoolWorker.DEFAULT_BATCH_SIZE, show_default=True, help="The number of messages to send per connection.")
+@click.option("--max-attempts", type=int, default=SpoolWorker.DEFAULT_MAX_ATTEMPTS, show_default=True, help="The number of attempts before a message is dead lettered.")
+@click.option("--poll-interval", type=float, default=SpoolWorker.DEFAULT_POLL_INTERVAL, show_default=True, help="Seconds to wait between polls when the spool is empty.")
+@click.option("--drain", is_flag=True, help="Exit once the spool is empty, instead of waiting for more messages.")
+def worker(yagmail_username, yagmail_password, spool, batch_size, max_attempts, poll_interval, drain):
+    yagmail_args = [yagmail_username, yagmail_password] if yagmail_username else []
+    spool_worker = SpoolWorker(Spool(spool), yagmail_args, batch_size=batch_size, max_attempts=max_attempts)
+
+    try:
+        spool_worker.run(poll_interval=poll_interval, drain=drain)
+    except KeyboardInterrupt:
+        spool_worker.stop()
+
+
+@main.command("bulk")
+@click.argument("recipients", type=click.File("r"), default="-")
+@click.option("--message", "-m", type=str, help="The message for every recipient that doesn't have a message of its own.")
+@click.option("--template", "-t", is_flag=True, help="Treat the message as a template, filling in $number, $carrier, and $address for each recipient (ex. 'Hi $number').")
+@click.option("--format", "input_format", type=click.Choice([bulk.CSV, bulk.JSONL]), help="The format of the recipients file. Sniffed from the first line if omitted.")
+@click.option("--results", "-r", type=click.File("w"), default="-", help="Where to write a JSON line describing the outcome of each recipient. Defaults to stdout.")
+@click.option("--progress-every", type=int, default=100, show_default=True, help="Report progress to stderr after this many recipients, or never if 0.")
+@click.option("--dry-run", is_flag=True, help="Only validate and resolve each recipient's address, without sending anything.")
+@click.option("--processes", type=int, help="With --dry-run, parse the phone numbers across this many processes.")
+@click.option("--metrics-file", type=click.Path(dir_okay=False), help="Write the send metrics to this file in the Prometheus text format when done (ex. for node_exporter's textfile collector).")
+@click.option("--results-db", type=click.Path(dir_okay=False), help="Record every message in this results database, and skip recipients it's marked as undeliverable. Defaults to not recording, unless $MAIL_TO_SMS_RESULTS is set.")
+@click.option("--yagmail-username", "-u", type=str, help="Specify a specific username for the SMTP server (ex. 'username'). Not necessary if a yagmail keyring and a .yagmail file are in use.")
+@click.option("--yagmail-password", "-p", type=str, help="Specify a specific password for the SMTP server (ex. 'password'). Not necessary if a yagmail keyring and a .yagmail file are in use.")
+def bulk_send(recipients, message, template, input_format, results, progress_every, dry_run, processes, metrics_file, results_db, yagmail_username, yagmail_password):
+    ## Recipients are read, sent, and written out one at a time over a single connection, so memory use stays flat no
+    ## matter how big the file is. RECIPIENTS is a CSV or JSONL file, or "-" for stdin.
+    rows = bulk.read_rows(recipients, input_format)
+    if(template and message):
+        ## Parse the template once up front, rather than having every message built from scratch
+        try:
+            message = MessageTemplate(message)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="--message")
+    if(dry_run):
+        outcomes = bulk.resolve(rows, message, processes=processes)
+    else:
+        store = ResultsStore(results_db) if results_db or os.environ.get(ResultsStore.PATH_ENV_VAR) else None
+        batch = MailToSMSBatch([], yagmail_username, yagmail_password, quiet=True, results=store)
+        outcomes = bulk.dispatch(batch, rows, message)
+    counts = {"sent": 0, "failed": 0, "deferred": 0}
+
+    def report():
+        click.echo("{0} {1}, {2} failed, {3} deferred".format(
+            counts["sent"], "resolved" if dry_run else "sent", counts["failed"], counts["deferred"]
+        ), err=True)
+
+    for index, (row, result) in enumerate(outcomes, 1):
+        results.write(json.dumps(bulk.to_record(row, result)) + "\n")
+        counts["sent" if result.success else "deferred" if result.deferred else "failed"] += 1
+
+        if(progress_every and index % progress_every == 0):
+            results.flush()
+            report()
+
+    results.flush()
+    report()
+    if(metrics_file):
+        get_metrics().write_prometheus(metrics_file)
+    if(counts["failed"]):
+        sys.exit(1)
+
+
+
+@main.command()
+@click.option("--mbox", type=click.Path(exists=True, dir_okay=False), multiple=True, help="An mbox file of bounces and replies to read. Can be given more than once.")
+@click.option("--imap-host", type=str, help="Read the unseen bounces and replies from this IMAP server.")
+@click.option("--imap-port", type=int, help="The IMAP server's port. Defaults to 993, or 143 with --no-ssl.")
+@click.option("--imap-username", type=str, help="The username for the IMAP server.")
+@click.option("--imap-password", type=str, help="The password for the IMAP server.")
+@click.option("--mailbox", type=str, default="INBOX", show_default=True, help="The IMAP folder to read.")
+@click.option("--no-ssl", is_flag=True, help="Connect to the IMAP server without SSL.")
+@click.option("--delete", is_flag=True, help="Delete the IMAP emails once they're read, instead of flagging them as seen.")
+@click.option("--results-db", type=click.Path(dir_okay=False), help="The results database to match against. Defaults to ~/.mail_to_sms/results.sqlite3 or $MAIL_TO_SMS_RESULTS.")
+def bounces(mbox, imap_host, imap_port, imap_username, imap_password, mailbox, no_ssl, delete, results_db):
+    ## Matches bounces and STOP replies back to the messages that were sent, and marks those addresses as undeliverable
+    if(not mbox and not imap_host):
+        raise click.UsageError("Give at least one --mbox file, or an --imap-host.")
+
+    reports = []
+    with ResultsStore(results_db) as store:
+        ingester = BounceIngester(store)
+        for path in mbox:
+            reports.append(ingester.ingest_mbox(path))
+        if(imap_host):
+            reports.append(ingester.ingest_imap(
+                imap_host, imap_username, imap_password, imap_port, mailbox, ssl=not no_ssl, delete=delete
+            ))
+
+    for report in reports:
+        for address in report.undeliverable:
+            click.echo(address)
+    click.echo("{0} emails, {1} bounces, {2} matched, {3} marked undeliverable".format(
+        sum(report.messages for report in reports),
+        sum(report.bounces for report in reports),
+        sum(report.matched for report in reports),
+        sum(len(report.undeliverable) for report in reports)
+    ), err=True)
+
+
+
+@main.command()
+@click.option("--host", type=str, help="The host to listen on. Defaults to 127.0.0.1.")
+@click.option("--port", type=int, help="The port to listen on. Defaults to 8725.")
+@click.option("--socket", "socket_path", type=click.Path(dir_okay=False), help="Listen on this Unix domain socket instead of a TCP port.")
+@click.option("--workers", type=int, help="The number of threads (and SMTP connections) sending messages. Defaults to 4.")
+@click.option("--batch-size", type=int, help="The most queued messages a worker sends at once. Defaults to 100.")
+@click.option("--batch-window", type=float, help="Seconds a worker waits for more messages to batch up before sending. Defaults to 0, which only batches what's already queued.")
+@click.option("--max-recipients", type=int, help="Send identical messages to the same gateway domain in shared SMTP transactions of up to this many recipients.")
+@click.option("--results-db", type=click.Path(dir_okay=False), help="Record every message in this results database, and skip recipients it's marked as undeliverable. Defaults to not recording, unless $MAIL_TO_SMS_RESULTS is set.")
+@click.option("--yagmail-username", "-u", type=str, help="Specify a specific username for the SMTP server (ex. 'username'). Not necessary if a yagmail keyring and a .yagmail file are in use.")
+@click.option("--yagmail-password", "-p", type=str, help="Specify a specific password for the SMTP server (ex. 'password'). Not necessary if a yagmail keyring and a .yagmail file are in use.")
+def daemon(host, port, socket_path, workers, batch_size, batch_window, max_recipients, results_db, yagmail_username, yagmail_password):
+    ## Keeps the gateways, number cache, and SMTP connections warm, and sends the messages POSTed to it as JSON. Only
+    ## the options that were given are passed along, so everything else gets SendDaemon's defaults.
+    from mail_to_sms import SendDaemon
+
+    options = {
+        "host": host, "port": port, "socket_path": socket_path, "workers": workers, "batch_size": batch_size,
+        "batch_window": batch_window, "max_recipients": max_recipients
+    }
+    kwargs = {key: value for key, value in options.items() if value is not None}
+    if(results_db or os.environ.get(ResultsStore.PATH_ENV_VAR)):
+        kwargs["results"] = ResultsStore(results_db)
+
+    logging.getLogger("mail_to_sms.daemon").setLevel(logging.INFO)
+    SendDaemon(yagmail_username, yagmail_password, **kwargs).serve_forever()
+
+
+@main.command()
+@click.argument("phone-number", type=str)
+@click.argument("carrier", type=str)
+@click.argument("message", type=str)
+@click.option("--url", type=str, help="The URL of the daemon to send through. Defaults to http://127.0.0.1:8725.")
+@click.option("--socket", "socket_path", type=click.Path(dir_okay=False), help="The Unix domain socket of the daemon to send through, instead of a URL.")
+@click.option("--timeout", type=float, default=60, show_default=True, help="Seconds to wait for the daemon to send the message.")
+def client(phone_number, carrier, message, url, socket_path, timeout):
+    ## Sends a message through a running 'mail_to_sms daemon', and prints the address that it was sent to
+    from mail_to_sms import DaemonClient, DaemonError
+
+    try:
+        with DaemonClient(url, socket_path, timeout) as daemon_client:
+            result = daemon_client.send(phone_number, carrier, message)
+    except DaemonError as e:
+        click.echo(str(e), err=True)
+        sys.exit(1)
+
+    if(not result["success"]):
+        click.echo(result["error"], err=True)
+        sys.exit(1)
+    click.echo(result["address"])
+
+
+def parse_domain_limits(ctx, param, values):
+    ## ex. ("vtext.com=5",) -> {"vtext.com": 5.0}
+    limits = {}
+    for value in values:
+        domain, _, limit = value.partition("=")
+        try:
+            limits[domain.strip().lower()] = float(limit)
+        except ValueError:
+            raise click.BadParameter("Expected a DOMAIN=MESSAGES_PER_SECOND pair, got '{0}'.".format(value))
+    return limits
+
+
+@main.command()
+@click.option("--path", "paths", type=click.Choice(["single", "batch", "parallel", "async"]), multiple=True, help="A send path to drive. Can be given more than once. Defaults to all of them.")
+@click.option("--messages", type=int, default=500, show_default=True, help="Messages per send path.")
+@click.option("--rate", type=float, help="Offered messages per second. Defaults to as fast as possible.")
+@click.option("--batch-size", type=int, default=50, show_default=True, help="Messages handed to the batch paths at once.")
+@click.option("--workers", type=int, default=8, show_default=True, help="Threads (or async concurrency) for concurrent sends.")
+@click.option("--max-attempts", type=int, default=3, show_default=True, help="Send attempts per message, including retries.")
+@click.option("--max-recipients", type=int, help="Recipients per SMTP transaction for grouped sends.")
+@click.option("--latency", type=float, default=0, show_default=True, help="Seconds the server takes per message.")
+@click.option("--throttle-rate", type=float, default=0, show_default=True, help="Fraction of transactions refused with a 421.")
+@click.option("--disconnect-rate", type=float, default=0, show_default=True, help="Fraction of transactions hung up on.")
+@click.option("--domain-limit", "domain_limits", multiple=True, metavar="DOMAIN=RATE", callback=parse_domain_limits, help="Recipients per second the server accepts for a domain (ex. vtext.com=5). Can be given more than once.")
+@click.option("--seed", type=int, help="Seeds the server's throttling and disconnects, so that runs can be repeated.")
+@click.option("--output", "-o", type=click.File("w"), default="-", help="Where to write the results as JSON. Defaults to stdout.")
+def loadtest(paths, messages, rate, batch_size, workers, max_attempts, max_recipients, latency, throttle_rate, disconnect_rate, domain_limits, seed, output):
+    ## Drives the send paths against an in-process SMTP server that misbehaves like a carrier under load, and reports
+    ## each path's throughput, latency percentiles, and error rates. Nothing is sent anywhere but that local server.
+    from mail_to_sms import loadgen
+
+    results = loadgen.run(
+        paths or loadgen.PATHS, messages, rate, batch_size, workers, max_attempts, max_recipients, latency,
+        throttle_rate, disconnect_rate, domain_limits, seed
+    )
+    output.write(json.dumps(results, indent=4) + "\n")
+
 
 if(__name__ == "__main__"):
-    main()
\ No newline at end of file
+    main()
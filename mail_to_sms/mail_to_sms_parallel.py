@@ -0,0 +1,218 @@
+from __future__ import print_function
+
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from .mail_to_sms import SendResult
+from .mail_to_sms_batch import MailToSMSBatch
+from .message_template import add_fields
+from .rate_limit import RateLimitDeferred
+from .smtp_pool import SMTPConnectionPool
+
+
+class DispatchReport:
+    """DispatchReport
+
+    The per-recipient SendResults of a parallel dispatch (in the same order as the recipients), along with some
+    aggregate stats about them.
+    """
+
+    def __init__(self, results, elapsed):
+        self.results = results
+        self.elapsed = elapsed
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self):
+        return len(self.results)
+
+    def __getitem__(self, index):
+        return self.results[index]
+
+    @property
+    def succeeded(self):
+        return [result for result in self.results if result.success]
+
+    @property
+    def failed(self):
+        return [result for result in self.results if not result.success and not result.deferred]
+
+    @property
+    def deferred(self):
+        return [result for result in self.results if result.deferred]
+
+    @property
+    def throughput(self):
+        ## Successful messages per second
+        return len(self.succeeded) / self.elapsed if self.elapsed else 0.0
+
+    ## Methods
+
+    def latency_percentile(self, percentile):
+        """Returns the nearest-rank latency percentile (0 - 100) of the sends that were attempted, or None if none were."""
+
+        latencies = sorted(result.latency for result in self.results if result.latency is not None)
+        if(not latencies):
+            return None
+
+        rank = max(int(math.ceil(percentile / 100.0 * len(latencies))), 1)
+        return latencies[rank - 1]
+
+
+class MailToSMSParallel(MailToSMSBatch):
+    """MailToSMSParallel
+
+    Sends the same message to many recipients across a pool of worker threads, with each worker holding its own
+    yagmail connection. Carriers throttle aggressively, so the number of messages in flight to any one gateway domain
+    (ex. "txt.att.net") is capped as well.
+
+    Arguments:
+        recipients {iterable}: An iterable of (number, carrier) pairs (ex. [(5551234567, "att"), ("5557654321", "vzw")])
+        username {string} [optional]: See MailToSMS.
+        password {string} [optional]: See MailToSMS.
+        contents {yagmail contents} [optional]: See MailToSMS. If provided, the message is sent to every recipient
+            immediately and the DispatchReport is stored in the results attribute.
+        keyworded args (for extra configuration): See MailToSMS, along with:
+            workers {int}: The number of worker threads (and connections). Defaults to 8. (ex. workers=16)
+            gateway_limit {int}: The default maximum number of messages in flight per gateway domain. Defaults to 4.
+                (ex. gateway_limit=2)
+            gateway_limits {dict}: Per gateway domain overrides of gateway_limit. (ex. gateway_limits={"vtext.com": 1})
+            pool {SMTPConnectionPool}: See MailToSMS. Defaults to a new pool with one connection per worker, whose
+                connections are closed once each send is done.
+            rate_limiter {RateLimiter}: See MailToSMS. In the "defer" mode, recipients without capacity are reported in
+                the DispatchReport's deferred list.
+
+    Examples:
+        from mail_to_sms import MailToSMSParallel
+
+        parallel = MailToSMSParallel(recipients, "username", "password", workers=16, gateway_limits={"vtext.com": 2})
+        report = parallel.send("this is a message")
+        print(len(report.failed), report.latency_percentile(99))
+    """
+
+    ## Config
+    WORKERS_KEY = "workers"
+    GATEWAY_LIMIT_KEY = "gateway_limit"
+    GATEWAY_LIMITS_KEY = "gateway_limits"
+
+    ## Defaults
+    DEFAULT_WORKERS = 8
+    DEFAULT_GATEWAY_LIMIT = 4
+
+
+    def __init__(self, recipients, username=None, password=None, contents=None, **kwargs):
+        self._gateway_semaphores = {}
+        self._gateway_semaphores_lock = threading.Lock()
+
+        workers = kwargs.get(self.WORKERS_KEY, self.DEFAULT_WORKERS)
+        ## A pool made here is only used by this instance, so its connections are closed once each dispatch is done
+        self._owns_pool = not kwargs.get(self.POOL_KEY)
+        if(self._owns_pool):
+            kwargs[self.POOL_KEY] = SMTPConnectionPool(size=workers)
+
+        super(MailToSMSParallel, self).__init__(recipients, username, password, None, **kwargs)
+
+        self.config["workers"] = workers
+        self.config["gateway_limit"] = kwargs.get(self.GATEWAY_LIMIT_KEY, self.DEFAULT_GATEWAY_LIMIT)
+        self.config["gateway_limits"] = dict(kwargs.get(self.GATEWAY_LIMITS_KEY) or {})
+
+        if(contents):
+            self.results = self.send(contents)
+
+    ## Methods
+
+    def _wants_connection(self):
+        ## Each worker leases its own connection, so one held for a with block would just take up a worker's slot
+        return False
+
+
+    def _get_gateway_semaphore(self, domain):
+        with self._gateway_semaphores_lock:
+            semaphore = self._gateway_semaphores.get(domain)
+            if(semaphore is None):
+                limit = self.config["gateway_limits"].get(domain, self.config["gateway_limit"])
+                semaphore = threading.BoundedSemaphore(limit)
+                self._gateway_semaphores[domain] = semaphore
+
+            return semaphore
+
+
+    def _interleave(self, recipients):
+        ## Round robin the recipients across their gateway domains, so workers aren't all stuck waiting on one domain's
+        ## limit while other domains have capacity to spare
+        by_domain = OrderedDict()
+        for index, (number, carrier, address) in enumerate(recipients):
+            domain = address.rsplit("@", 1)[-1] if address else None
+            by_domain.setdefault(domain, []).append((index, number, carrier, address))
+
+        queues = list(by_domain.values())
+        for position in range(max(len(queue) for queue in queues) if queues else 0):
+            for queue in queues:
+                if(position < len(queue)):
+                    yield queue[position]
+
+
+    def send(self, contents):
+        """Sends contents to every recipient in parallel, and returns a DispatchReport."""
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        started_at = time.monotonic()
+        results = [None] * len(self.recipients)
+        local = threading.local()
+        leased = []
+        leased_lock = threading.Lock()
+
+        def get_connection():
+            ## Each worker thread keeps the same connection for the whole dispatch
+            connection = getattr(local, "connection", None)
+            if(connection is None):
+                connection = self._open()
+                local.connection = connection
+                with leased_lock:
+                    leased.append(connection)
+
+            return connection
+
+        def send_one(recipient):
+            index, number, carrier, address = recipient
+            if(not address):
+                error = "Unable to build an address for '{0}' with carrier '{1}'.".format(number, carrier)
+                results[index] = SendResult(number, carrier, None, False, error)
+                return
+
+            with self._get_gateway_semaphore(address.rsplit("@", 1)[-1]):
+                sent_at = time.monotonic()
+                try:
+                    self._check_deliverable(address)
+                    fields = self._template_fields(number, carrier)
+                    self._deliver(get_connection(), address, add_fields(contents, **fields))
+                except RateLimitDeferred as e:
+                    results[index] = SendResult(number, carrier, address, False, str(e), deferred=True)
+                except Exception as e:
+                    error = self._print_error(e, "Unhandled error sending mail.")
+                    results[index] = SendResult(number, carrier, address, False, error, time.monotonic() - sent_at)
+                else:
+                    results[index] = SendResult(number, carrier, address, True, None, time.monotonic() - sent_at)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.config["workers"]) as executor:
+                ## Consume the map so that any unexpected errors are raised here
+                list(executor.map(send_one, self._interleave(self.recipients)))
+        finally:
+            for connection in leased:
+                self._release(connection)
+            if(self._owns_pool):
+                self.pool.close()
+
+        return DispatchReport(results, time.monotonic() - started_at)
+
+
+    def close(self):
+        ## Hand back the held connection (if any), and close the pool's connections if it's this instance's own
+        super(MailToSMSParallel, self).close()
+        if(self._owns_pool):
+            self.pool.close()
@@ -0,0 +1,195 @@
+from __future__ import print_function
+
+import string
+
+from . import segmentation
+
+
+## Config
+TEXT_HEADERS = ("Content-Type: text/plain; charset=\"{0}\"", "MIME-Version: 1.0")
+SEVEN_BIT = "7bit"
+QUOTED_PRINTABLE = "quoted-printable"
+MAX_LINE_LENGTH = 998
+
+## Defaults
+DEFAULT_CHARSET = "utf-8"
+
+
+class MessageTemplate:
+    """MessageTemplate
+
+    A plain text message that's parsed once and sent to many recipients, with $placeholders (ex. "$name" or "${name}")
+    filled in for each of them. The MIME headers (content type, encoded subject, and sender) are rendered once and
+    reused, so only the body is built per message rather than yagmail building and encoding a whole new MIME message
+    for every send.
+
+    Every template can use $address, $number, and $carrier (when sending through a Sender, MailToSMSBatch, or
+    MailToSMSParallel), along with any fields given to bind(). Use $$ for a literal $.
+
+    Arguments:
+        contents {string}: The text of the message (ex. "Hi $name, your order shipped!"). A list of strings is joined
+            by newlines, like yagmail does.
+        subject {string} [optional]: The subject of the message. Defaults to the sender's subject config.
+        charset {string} [optional]: The charset of the message. Defaults to "utf-8".
+
+    Examples:
+        from mail_to_sms import MailToSMSBatch, MessageTemplate
+
+        template = MessageTemplate("Server $host is down! (sent to $number)")
+        batch = MailToSMSBatch(on_call, "username", "password")
+        batch.send(template.bind(host="db01"))
+    """
+
+    def __init__(self, contents, subject=None, charset=DEFAULT_CHARSET):
+        self.text = segmentation.get_text(contents)
+        if(self.text is None):
+            raise TypeError("MessageTemplate only supports text contents.")
+
+        self.subject = subject
+        self.charset = charset
+
+        self._pieces = self._parse(self.text)
+        self.fields = frozenset(field for _, field in self._pieces if field)
+
+        ## Pre-rendered header blocks, keyed on the sender and subject
+        self._headers = {}
+
+    ## Methods
+
+    @staticmethod
+    def _parse(text):
+        ## Split the text up into (literal, field) pieces once, so rendering is just a join
+        pieces = []
+        literal = []
+        position = 0
+        for match in string.Template.pattern.finditer(text):
+            literal.append(text[position:match.start()])
+            position = match.end()
+
+            if(match.group("escaped") is not None):
+                literal.append("$")
+            elif(match.group("invalid") is not None):
+                raise ValueError("Invalid placeholder in template at position {0}.".format(match.start("invalid")))
+            else:
+                pieces.append(("".join(literal), match.group("named") or match.group("braced")))
+                literal = []
+
+        literal.append(text[position:])
+        pieces.append(("".join(literal), None))
+        return pieces
+
+
+    def _get_headers(self, sender, subject):
+        key = (sender, subject)
+        headers = self._headers.get(key)
+        if(headers is not None):
+            return headers
+
+        from email.header import Header
+
+        lines = [header.format(self.charset) for header in TEXT_HEADERS]
+        subject = self.subject if self.subject is not None else subject
+        if(subject):
+            ## Only non ASCII subjects need to be RFC 2047 encoded
+            charset = None if subject.isascii() else self.charset
+            lines.append("Subject: {0}".format(Header(subject, charset).encode()))
+        lines.append("From: {0}".format(sender))
+
+        domain = sender.rsplit("@", 1)[-1] if "@" in sender else "localhost"
+        headers = ("\n".join(lines) + "\n", domain)
+        self._headers[key] = headers
+        return headers
+
+
+    def _encode_body(self, body):
+        ## Most texts are plain ASCII, and can be sent as is
+        if(body.isascii() and all(len(line) <= MAX_LINE_LENGTH for line in body.splitlines())):
+            return SEVEN_BIT, body
+
+        import quopri
+
+        return QUOTED_PRINTABLE, quopri.encodestring(body.encode(self.charset)).decode("ascii")
+
+
+    def substitute(self, fields):
+        """Returns the text with every placeholder filled in from the fields dict. Raises a KeyError if a field is
+        missing."""
+
+        try:
+            return "".join(
+                literal + (str(fields[field]) if field else "") for literal, field in self._pieces
+            )
+        except KeyError as e:
+            raise KeyError("The template field {0} wasn't given.".format(e))
+
+
+    def get_text(self, address, fields=None):
+        """Returns the text to send to address, with every placeholder filled in."""
+
+        values = {"address": address}
+        values.update(fields or {})
+        return self.substitute(values)
+
+
+    def render(self, sender, address, subject=None, fields=None, message_id=None):
+        """Returns the complete message to send from sender to address, ready for smtplib's sendmail(). A Message-ID
+        is generated unless one is given."""
+
+        from email.utils import formatdate, make_msgid
+
+        encoding, body = self._encode_body(self.get_text(address, fields))
+        headers, domain = self._get_headers(sender, subject)
+
+        return "{0}To: {1}\nDate: {2}\nMessage-ID: {3}\nContent-Transfer-Encoding: {4}\n\n{5}".format(
+            headers, address, formatdate(), message_id or make_msgid(domain=domain), encoding, body
+        )
+
+
+    def bind(self, **fields):
+        """Returns a TemplateMessage of this template with the fields filled in, which can be sent like any other
+        contents."""
+
+        return TemplateMessage(self, fields)
+
+
+class TemplateMessage:
+    """TemplateMessage
+
+    A MessageTemplate along with some of its fields, as returned by MessageTemplate.bind(). It can be passed anywhere
+    that contents are sent.
+    """
+
+    __slots__ = ("template", "fields")
+
+    def __init__(self, template, fields):
+        self.template = template
+        self.fields = fields
+
+    ## Methods
+
+    def get_text(self, address):
+        return self.template.get_text(address, self.fields)
+
+
+    def render(self, sender, address, subject=None, message_id=None):
+        return self.template.render(sender, address, subject, self.fields, message_id)
+
+
+def add_fields(contents, **fields):
+    """Returns templated contents with any of the fields that aren't already bound added to them. Other contents are
+    returned as is."""
+
+    if(isinstance(contents, MessageTemplate)):
+        return TemplateMessage(contents, fields)
+    if(isinstance(contents, TemplateMessage)):
+        return TemplateMessage(contents.template, dict(fields, **contents.fields))
+    return contents
+
+
+def prepare_send(composer, address, subject, contents, message_id=None):
+    """Returns the (recipients, message) to send to the address, rendering templated contents directly and handing
+    anything else to the yagmail composer's prepare_send(). The message gets the Message-ID, if one is given."""
+
+    if(isinstance(contents, (MessageTemplate, TemplateMessage))):
+        return [address], contents.render(composer.user, address, subject, message_id)
+    return composer.prepare_send(to=address, subject=subject, contents=contents, message_id=message_id)
@@ -0,0 +1,266 @@
+from __future__ import print_function
+
+import bisect
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from .resilience import RetryPolicy
+
+
+## Config
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+## The metrics recorded by mail_to_sms itself
+SENT = "mail_to_sms_sent_total"
+FAILED = "mail_to_sms_failed_total"
+DEFERRED = "mail_to_sms_deferred_total"
+RETRIES = "mail_to_sms_retries_total"
+PARSE_SECONDS = "mail_to_sms_parse_seconds"
+CONNECT_SECONDS = "mail_to_sms_connect_seconds"
+SEND_SECONDS = "mail_to_sms_send_seconds"
+POOL_CONNECTIONS = "mail_to_sms_pool_connections"
+SPOOL_MESSAGES = "mail_to_sms_spool_messages"
+FAILOVERS = "mail_to_sms_failovers_total"
+COALESCED = "mail_to_sms_coalesced_total"
+
+DESCRIPTIONS = {
+    SENT: "Messages accepted by the SMTP server, by gateway domain.",
+    FAILED: "Messages that couldn't be built or sent, by reason.",
+    DEFERRED: "Messages deferred by the rate limiter, by gateway domain.",
+    RETRIES: "Send attempts that failed transiently and were retried, by gateway domain.",
+    PARSE_SECONDS: "Time spent parsing and validating phone numbers.",
+    CONNECT_SECONDS: "Time spent connecting and logging in to the SMTP server, by host.",
+    SEND_SECONDS: "Time spent sending each message (including retries), by gateway domain.",
+    POOL_CONNECTIONS: "Pooled SMTP connections, by host, username, and state (open or idle).",
+    SPOOL_MESSAGES: "Messages in the spool, by status.",
+    FAILOVERS: "Identities taken out of rotation after an auth or quota failure, by identity and reason.",
+    COALESCED: "Messages merged into another message's digest, rather than being sent on their own."
+}
+
+## Defaults
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _get_key(name, labels):
+    ## Label values are stringified, so that they always sort (and export) the same way
+    return (name, tuple(sorted((label, str(value)) for label, value in labels.items())))
+
+
+def get_failure_reason(exception):
+    """Returns a short, low cardinality reason for a send failure (ex. "smtp_550" or "SMTPServerDisconnected")."""
+
+    code = RetryPolicy().get_smtp_code(exception)
+    return "smtp_{0}".format(code) if code is not None else type(exception).__name__
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """MetricsRegistry
+
+    A thread safe registry of labelled counters, gauges, and histograms, which mail_to_sms records its sends, failures,
+    retries, and timings into. Hooks are called with every recorded value, for forwarding them on to another metrics
+    system, and the whole registry can be exported in the Prometheus text format.
+
+    Arguments:
+        buckets {tuple} [optional]: The upper bounds (in seconds) of the histogram buckets. Defaults to 100us - 30s.
+
+    Examples:
+        from mail_to_sms import MailToSMS, MetricsRegistry
+
+        metrics = MetricsRegistry()
+        metrics.add_hook(lambda kind, name, value, labels: print(kind, name, value, labels))
+        MailToSMS(5551234567, "att", "username", "password", "hello", metrics=metrics)
+        print(metrics.to_prometheus())
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._hooks = []
+        self._lock = threading.Lock()
+
+    ## Methods
+
+    def _call_hooks(self, kind, name, value, labels):
+        for hook in self._hooks:
+            hook(kind, name, value, labels)
+
+
+    def add_hook(self, hook):
+        """Calls hook(kind, name, value, labels) with every value recorded from now on, where kind is one of COUNTER,
+        GAUGE, or HISTOGRAM."""
+
+        with self._lock:
+            self._hooks = self._hooks + [hook]
+
+
+    def remove_hook(self, hook):
+        with self._lock:
+            self._hooks = [existing for existing in self._hooks if existing is not hook]
+
+
+    def increment(self, name, value=1, **labels):
+        key = _get_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._call_hooks(COUNTER, name, value, labels)
+
+
+    def set_gauge(self, name, value, **labels):
+        key = _get_key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+        self._call_hooks(GAUGE, name, value, labels)
+
+
+    def observe(self, name, value, **labels):
+        key = _get_key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if(histogram is None):
+                histogram = _Histogram(self.buckets)
+                self._histograms[key] = histogram
+            histogram.observe(value)
+        self._call_hooks(HISTOGRAM, name, value, labels)
+
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observes how long the with block took, in seconds."""
+
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started_at, **labels)
+
+
+    def get(self, name, **labels):
+        """Returns the current value of a counter or gauge, or the (count, sum) of a histogram. Returns None if
+        nothing has been recorded for it."""
+
+        key = _get_key(name, labels)
+        with self._lock:
+            if(key in self._counters):
+                return self._counters[key]
+            if(key in self._gauges):
+                return self._gauges[key]
+            histogram = self._histograms.get(key)
+            return (histogram.count, histogram.sum) if histogram else None
+
+
+    def snapshot(self):
+        """Returns a JSON serializable dict of every recorded metric."""
+
+        def format_labels(labels):
+            return ",".join("{0}={1}".format(label, value) for label, value in labels)
+
+        with self._lock:
+            snapshot = {COUNTER: {}, GAUGE: {}, HISTOGRAM: {}}
+            for (name, labels), value in self._counters.items():
+                snapshot[COUNTER].setdefault(name, {})[format_labels(labels)] = value
+            for (name, labels), value in self._gauges.items():
+                snapshot[GAUGE].setdefault(name, {})[format_labels(labels)] = value
+            for (name, labels), histogram in self._histograms.items():
+                snapshot[HISTOGRAM].setdefault(name, {})[format_labels(labels)] = {
+                    "count": histogram.count, "sum": histogram.sum
+                }
+
+        return snapshot
+
+
+    def to_prometheus(self):
+        """Returns every recorded metric in the Prometheus text exposition format."""
+
+        def format_labels(labels, extra=()):
+            labels = tuple(labels) + tuple(extra)
+            if(not labels):
+                return ""
+            escaped = (
+                (label, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n"))
+                for label, value in labels
+            )
+            return "{" + ",".join("{0}=\"{1}\"".format(label, value) for label, value in escaped) + "}"
+
+        def format_value(value):
+            return "+Inf" if value == math.inf else repr(float(value))
+
+        with self._lock:
+            series = {}
+            for kind, metrics in ((COUNTER, self._counters), (GAUGE, self._gauges), (HISTOGRAM, self._histograms)):
+                for (name, labels), value in metrics.items():
+                    series.setdefault((name, kind), []).append((labels, value))
+
+            lines = []
+            for (name, kind), values in sorted(series.items()):
+                if(name in DESCRIPTIONS):
+                    lines.append("# HELP {0} {1}".format(name, DESCRIPTIONS[name]))
+                lines.append("# TYPE {0} {1}".format(name, kind))
+
+                for labels, value in sorted(values, key=lambda pair: pair[0]):
+                    if(kind != HISTOGRAM):
+                        lines.append("{0}{1} {2}".format(name, format_labels(labels), format_value(value)))
+                        continue
+
+                    cumulative = 0
+                    for bound, count in zip(value.buckets + (math.inf,), value.counts):
+                        cumulative += count
+                        bucket_labels = format_labels(labels, [("le", format_value(bound))])
+                        lines.append("{0}_bucket{1} {2}".format(name, bucket_labels, cumulative))
+                    lines.append("{0}_sum{1} {2}".format(name, format_labels(labels), format_value(value.sum)))
+                    lines.append("{0}_count{1} {2}".format(name, format_labels(labels), value.count))
+
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+    def write_prometheus(self, path):
+        """Atomically writes the Prometheus text export to path, for node_exporter's textfile collector."""
+
+        import tempfile
+
+        directory = os.path.dirname(os.path.abspath(path))
+        descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "w") as fd:
+                fd.write(self.to_prometheus())
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+
+## Process wide registry, used whenever no registry is given
+_default_metrics = MetricsRegistry()
+
+
+def get_metrics():
+    return _default_metrics
@@ -0,0 +1,121 @@
+from __future__ import print_function
+
+import threading
+from collections import OrderedDict, namedtuple
+
+
+## The result of parsing a phone number. Error is an (exception message, message) pair when the number isn't valid.
+ParsedNumber = namedtuple("ParsedNumber", ["valid", "e164", "national", "error"])
+
+
+class NumberCache:
+    """NumberCache
+
+    A thread safe, bounded LRU cache of parsed and normalized phone numbers, keyed on the (raw number, region) pair.
+    phonenumbers' parsing and validation is the most expensive part of building an address, and the same numbers tend
+    to get messaged over and over again.
+
+    Arguments:
+        size {int} [optional]: The maximum number of parsed numbers to keep. Defaults to 4096.
+
+    Examples:
+        cache = NumberCache(size=10000)
+        cache.get("555-123-4567", "US").e164
+        cache.info()
+    """
+
+    ## Defaults
+    DEFAULT_SIZE = 4096
+
+
+    def __init__(self, size=DEFAULT_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    ## Methods
+
+    @staticmethod
+    def parse(number, region):
+        """Parses and validates a number without touching the cache, and returns a ParsedNumber."""
+
+        ## phonenumbers is slow to import, so it's only imported once a number actually needs parsing. It already loads
+        ## each region's metadata lazily, so only the regions that are used ever get loaded.
+        import phonenumbers
+
+        try:
+            parsed = phonenumbers.parse(number, region)
+        except phonenumbers.phonenumberutil.NumberParseException as e:
+            return ParsedNumber(False, None, None, (str(e), "NumberParseException when parsing the phone number."))
+        except Exception as e:
+            return ParsedNumber(False, None, None, (str(e), "Unhandled error when parsing the phone number."))
+
+        if (phonenumbers.is_possible_number(parsed) and
+            phonenumbers.is_valid_number(parsed)):
+            return ParsedNumber(
+                True,
+                phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164),
+                phonenumbers.national_significant_number(parsed),
+                None
+            )
+        else:
+            return ParsedNumber(False, None, None, (None, "'{0}' isn't a valid phone number".format(number)))
+
+
+    def get(self, number, region):
+        """Returns the ParsedNumber for the number in the region, parsing it only if it isn't already cached."""
+
+        number = str(number).strip()
+        key = (number, region)
+
+        with self._lock:
+            parsed = self._entries.get(key)
+            if(parsed is not None):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return parsed
+            self.misses += 1
+
+        ## Parse outside of the lock, the worst case is that two threads parse the same number at once
+        parsed = self.parse(number, region)
+
+        with self._lock:
+            self._entries[key] = parsed
+            self._entries.move_to_end(key)
+            while(len(self._entries) > self.size):
+                self._entries.popitem(last=False)
+
+        return parsed
+
+
+    def resize(self, size):
+        with self._lock:
+            self.size = size
+            while(len(self._entries) > self.size):
+                self._entries.popitem(last=False)
+
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+    def info(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": self.size, "length": len(self._entries)}
+
+
+## Process wide cache, used by MailToSMS when no cache is given
+_default_cache = NumberCache()
+
+
+def get_number_cache():
+    return _default_cache
@@ -0,0 +1,102 @@
+from __future__ import print_function
+
+
+## Config
+PIPELINING_EXTENSION = "pipelining"
+CRLF = b"\r\n"
+
+
+def _encode_message(message):
+    ## Mirrors smtplib.SMTP.sendmail, which only takes ASCII strings (yagmail's messages are already MIME encoded)
+    import smtplib
+
+    if(isinstance(message, str)):
+        message = smtplib._fix_eols(message).encode("ascii")
+    return message
+
+
+def _quote_data(message):
+    ## Dot stuffing and the terminating "." line, as per smtplib.SMTP.data
+    import smtplib
+
+    quoted = smtplib._quote_periods(message)
+    if(quoted[-2:] != CRLF):
+        quoted += CRLF
+    return quoted + b"." + CRLF
+
+
+def supports_pipelining(smtp):
+    """Returns True if the server behind the (already greeted) smtplib session advertised ESMTP PIPELINING."""
+
+    smtp.ehlo_or_helo_if_needed()
+    return bool(smtp.does_esmtp and smtp.has_extn(PIPELINING_EXTENSION))
+
+
+def send_transaction(smtp, sender, recipients, message, pipelining=None):
+    """Sends the message to every recipient in a single SMTP transaction (one MAIL FROM, a RCPT TO per recipient, and
+    one DATA), and returns a dict of the refused recipients to their (code, response), just like smtplib's sendmail().
+
+    When the server supports PIPELINING (RFC 2920), the MAIL, RCPT, and DATA commands are written all at once and their
+    replies read back afterwards, so the whole envelope costs a single round trip instead of one per command. Otherwise
+    it falls back to smtplib's sendmail(), which waits on each command in turn.
+
+    Raises smtplib.SMTPRecipientsRefused if every recipient was refused, and the other smtplib exceptions when the
+    transaction itself fails (in which case nothing was sent).
+
+    Arguments:
+        smtp {smtplib.SMTP}: A connected session.
+        sender {string}: The envelope sender.
+        recipients {list}: The envelope recipients.
+        message {string|bytes}: The whole message, headers and all.
+        pipelining {boolean} [optional]: Whether to pipeline the commands. Defaults to what the server advertised.
+    """
+
+    import smtplib
+
+    if(pipelining is None):
+        pipelining = supports_pipelining(smtp)
+    if(not pipelining):
+        return smtp.sendmail(sender, recipients, message)
+
+    message = _encode_message(message)
+    mail_options = []
+    if(smtp.has_extn("size")):
+        mail_options.append("SIZE={0}".format(len(message)))
+
+    ## The whole envelope goes out as one command group, with DATA last as RFC 2920 requires
+    commands = ["MAIL FROM:{0}{1}".format(smtplib.quoteaddr(sender), "".join(" " + option for option in mail_options))]
+    commands.extend("RCPT TO:{0}".format(smtplib.quoteaddr(recipient)) for recipient in recipients)
+    commands.append("DATA")
+    smtp.send("".join(command + "\r\n" for command in commands))
+
+    ## Every command gets a reply, even after an earlier one in the group has failed
+    mail_reply = smtp.getreply()
+    refused = {}
+    for recipient in recipients:
+        code, response = smtp.getreply()
+        if(code not in (250, 251)):
+            refused[recipient] = (code, response)
+    data_code, data_response = smtp.getreply()
+
+    if(data_code == 354 and (mail_reply[0] != 250 or len(refused) == len(recipients))):
+        ## The server shouldn't have started DATA without a sender and a recipient, so end it with an empty message
+        smtp.send(b"." + CRLF)
+        smtp.getreply()
+
+    if(mail_reply[0] != 250):
+        smtp._rset()
+        raise smtplib.SMTPSenderRefused(mail_reply[0], mail_reply[1], sender)
+    if(len(refused) == len(recipients)):
+        smtp._rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+    if(data_code != 354):
+        smtp._rset()
+        raise smtplib.SMTPDataError(data_code, data_response)
+
+    smtp.send(_quote_data(message))
+    code, response = smtp.getreply()
+    if(code != 250):
+        smtp._rset()
+        raise smtplib.SMTPDataError(code, response)
+
+    return refused
@@ -0,0 +1,227 @@
+from __future__ import print_function
+
+import threading
+import time
+
+
+class RateLimitDeferred(Exception):
+    """Raised instead of sending when a non-blocking RateLimiter has no capacity for the message right now."""
+    pass
+
+
+class TokenBucket:
+    """TokenBucket
+
+    A thread safe token bucket. Tokens refill continuously at rate per second, up to capacity, and each message spends
+    one of them.
+
+    Arguments:
+        rate {float}: The number of tokens added per second (ex. 20 / 60.0 for 20 messages a minute)
+        capacity {float} [optional]: The most tokens that can be saved up, which is the largest allowed burst.
+            Defaults to the larger of rate and 1.
+    """
+
+    def __init__(self, rate, capacity=None):
+        ## Without a positive rate the bucket would never refill, and with less than a token's capacity it'd never
+        ## fill up enough to spend one, so acquire() would wait forever
+        if(rate <= 0):
+            raise ValueError("The rate should be greater than 0, not {0}.".format(rate))
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        if(self.capacity < 1):
+            raise ValueError("The capacity should be at least 1, not {0}.".format(capacity))
+
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def tokens(self):
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    ## Methods
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+
+    def _take(self, tokens):
+        ## Returns 0 and spends the tokens if they're available, otherwise returns how long to wait for them
+        with self._lock:
+            self._refill()
+            if(self._tokens >= tokens):
+                self._tokens -= tokens
+                return 0
+            return (tokens - self._tokens) / self.rate
+
+
+    def try_acquire(self, tokens=1):
+        """Spends the tokens and returns True if they're available right now, otherwise returns False."""
+
+        return self._take(tokens) == 0
+
+
+    def refund(self, tokens=1):
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + tokens)
+
+
+    def acquire(self, tokens=1, timeout=None):
+        """Blocks until the tokens are available and spends them. Returns False if that would take longer than timeout
+        seconds."""
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._take(tokens)
+            if(not wait):
+                return True
+            if(deadline is not None and time.monotonic() + wait > deadline):
+                return False
+            time.sleep(wait)
+
+
+    async def acquire_async(self, tokens=1):
+        """Waits (without blocking the event loop) until the tokens are available, and spends them."""
+
+        import asyncio
+
+        while True:
+            wait = self._take(tokens)
+            if(not wait):
+                return True
+            await asyncio.sleep(wait)
+
+
+class RateLimiter:
+    """RateLimiter
+
+    Client side rate limiting, with a token bucket per SMTP account (username) and per carrier gateway domain. Relays
+    cap messages per account, and carriers silently drop bursts to their gateways, so a message is only sent once both
+    its account's and its gateway's buckets have room for it.
+
+    In the "block" mode, senders wait for capacity (AsyncMailToSMS awaits it without blocking the event loop). In the
+    "defer" mode, messages without capacity are skipped and reported as deferred so that the caller can try them again
+    later, by every sender including AsyncMailToSMS.
+
+    Arguments:
+        account_rate {float} [optional]: Messages per second allowed per account. Unlimited if omitted.
+        account_burst {float} [optional]: The largest burst allowed per account. Defaults to account_rate (or 1).
+        gateway_rate {float} [optional]: Messages per second allowed per gateway domain. Unlimited if omitted.
+        gateway_burst {float} [optional]: The largest burst allowed per gateway domain. Defaults to gateway_rate (or 1).
+        gateway_rates {dict} [optional]: Per gateway domain overrides of gateway_rate, as either a rate or a
+            (rate, burst) pair. (ex. {"vtext.com": (0.5, 5)})
+        mode {string} [optional]: Either "block" or "defer". Defaults to "block".
+
+    Examples:
+        ## 20 messages a minute per account, and 1 message a second to any one carrier (with bursts of up to 5)
+        limiter = RateLimiter(account_rate=20 / 60.0, gateway_rate=1, gateway_burst=5)
+        MailToSMSParallel(recipients, "username", "password", "hello", rate_limiter=limiter)
+    """
+
+    ## Config
+    BLOCK = "block"
+    DEFER = "defer"
+
+
+    def __init__(self, account_rate=None, account_burst=None, gateway_rate=None, gateway_burst=None,
+                 gateway_rates=None, mode=BLOCK):
+        if(mode not in (self.BLOCK, self.DEFER)):
+            raise ValueError("'{0}' isn't a valid rate limiting mode.".format(mode))
+
+        ## Buckets are only made once they're needed, so check that their rates and bursts are valid up front
+        limits = [(account_rate, account_burst), (gateway_rate, gateway_burst)]
+        for rate in (gateway_rates or {}).values():
+            limits.append(rate if isinstance(rate, (tuple, list)) else (rate, gateway_burst))
+        for rate, burst in limits:
+            if(rate is not None):
+                TokenBucket(rate, burst)
+
+        self.account_rate = account_rate
+        self.account_burst = account_burst
+        self.gateway_rate = gateway_rate
+        self.gateway_burst = gateway_burst
+        self.gateway_rates = dict(gateway_rates or {})
+        self.mode = mode
+
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    ## Methods
+
+    def _get_bucket(self, key, rate, burst):
+        bucket = self._buckets.get(key)
+        if(bucket is None):
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if(bucket is None):
+                    bucket = TokenBucket(rate, burst)
+                    self._buckets[key] = bucket
+
+        return bucket
+
+
+    def buckets_for(self, username, address):
+        """Returns the buckets that sending to the address from the username's account has to draw from."""
+
+        buckets = []
+        if(self.account_rate is not None):
+            buckets.append(self._get_bucket(("account", username), self.account_rate, self.account_burst))
+
+        domain = address.rsplit("@", 1)[-1]
+        rate = self.gateway_rates.get(domain, self.gateway_rate)
+        if(rate is not None):
+            rate, burst = rate if isinstance(rate, (tuple, list)) else (rate, self.gateway_burst)
+            buckets.append(self._get_bucket(("gateway", domain), rate, burst))
+
+        return buckets
+
+
+    def try_acquire(self, username, address):
+        """Spends a token from every bucket if they all have one right now, otherwise spends nothing and returns
+        False."""
+
+        acquired = []
+        for bucket in self.buckets_for(username, address):
+            if(not bucket.try_acquire()):
+                for other in acquired:
+                    other.refund()
+                return False
+            acquired.append(bucket)
+
+        return True
+
+
+    def acquire(self, username, address):
+        """Waits for (or in the defer mode, tries for) capacity to send a message. Returns False if it was deferred."""
+
+        if(self.mode == self.DEFER):
+            return self.try_acquire(username, address)
+
+        for bucket in self.buckets_for(username, address):
+            bucket.acquire()
+        return True
+
+
+    async def acquire_async(self, username, address):
+        """Waits for capacity to send a message without blocking the event loop. Returns False if it was deferred."""
+
+        if(self.mode == self.DEFER):
+            return self.try_acquire(username, address)
+
+        for bucket in self.buckets_for(username, address):
+            await bucket.acquire_async()
+        return True
+
+
+    def snapshot(self):
+        """Returns a dict of bucket names (ex. "gateway:vtext.com") to their currently available tokens."""
+
+        with self._lock:
+            buckets = dict(self._buckets)
+
+        return {"{0}:{1}".format(*key): bucket.tokens for key, bucket in buckets.items()}
@@ -0,0 +1,71 @@
+from __future__ import print_function
+
+import sys
+
+
+class Recipient:
+    """Recipient
+
+    A compact, immutable, and hashable phone number that's already been validated and resolved onto its carrier's
+    gateways. Recipients don't hold onto any config or connections, and their carrier and gateway strings are shared
+    between every recipient on the same carrier, so large rosters of them stay small. Build them with
+    Sender.recipient().
+
+    Arguments:
+        number {string}: The E.164 formatted phone number (ex. "+15551234567")
+        national {string}: The national significant number, which is what gateway addresses use (ex. "5551234567")
+        carrier {string}: The normalized carrier name (ex. "att")
+        sms {string}: The carrier's SMS gateway domain (ex. "txt.att.net"), or its MMS one if it doesn't have one.
+        mms {string}: The carrier's MMS gateway domain (ex. "mms.att.net"), or its SMS one if it doesn't have one.
+
+    Examples:
+        from mail_to_sms import Sender
+
+        with Sender("username", "password") as sender:
+            roster = [sender.recipient(number, carrier) for number, carrier in rows]
+            results = sender.send_many(roster, "hello!")
+    """
+
+    __slots__ = ("number", "national", "carrier", "sms", "mms")
+
+    def __init__(self, number, national, carrier, sms, mms):
+        object.__setattr__(self, "number", number)
+        object.__setattr__(self, "national", national)
+        object.__setattr__(self, "carrier", sys.intern(carrier))
+        object.__setattr__(self, "sms", sms)
+        object.__setattr__(self, "mms", mms)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Recipient is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Recipient is immutable")
+
+    def __eq__(self, other):
+        if(not isinstance(other, Recipient)):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return "Recipient({0!r}, {1!r}, {2!r}, {3!r}, {4!r})".format(
+            self.number, self.national, self.carrier, self.sms, self.mms
+        )
+
+    def __reduce__(self):
+        ## Immutable slotted objects can't be unpickled attribute by attribute, so rebuild them through __init__
+        return (Recipient, self._key())
+
+    ## Methods
+
+    def _key(self):
+        return (self.number, self.national, self.carrier, self.sms, self.mms)
+
+
+    def get_address(self, mms=False):
+        """Returns the gateway address to send to (ex. "5551234567@txt.att.net"), using the MMS gateway if mms is
+        truthy."""
+
+        return "{0}@{1}".format(self.national, self.mms if mms else self.sms)
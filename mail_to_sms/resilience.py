@@ -0,0 +1,380 @@
+from __future__ import print_function
+
+import random
+import threading
+import time
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending when a circuit breaker for the destination is open."""
+    pass
+
+
+class RetryPolicy:
+    """RetryPolicy
+
+    Decides which send errors are worth retrying, and how long to wait between attempts. Delays grow exponentially
+    from base_delay up to max_delay, and are randomly reduced by up to the jitter fraction so that many senders don't
+    all retry in lockstep.
+
+    Transient errors are connection problems (disconnects, timeouts, refused connections) and SMTP 4xx responses in
+    retryable_codes. Permanent errors (like a 550 for a number that doesn't exist) are never retried.
+
+    Arguments:
+        max_attempts {int} [optional]: The total number of attempts, including the first one. Defaults to 3.
+        base_delay {float} [optional]: Seconds to wait before the first retry. Defaults to 0.5.
+        max_delay {float} [optional]: The longest that any retry will wait, in seconds. Defaults to 30.
+        jitter {float} [optional]: The fraction (0 - 1) of each delay to randomize. Defaults to 0.5.
+        retryable_codes {iterable} [optional]: The SMTP response codes to retry. Defaults to 421, 450, 451 and 452.
+
+    Examples:
+        MailToSMS(5551234567, "att", "username", "password", "hello", retry=RetryPolicy(max_attempts=5))
+
+        ## Disable retrying entirely
+        MailToSMS(5551234567, "att", "username", "password", "hello", retry=RetryPolicy(max_attempts=1))
+    """
+
+    ## Defaults
+    DEFAULT_MAX_ATTEMPTS = 3
+    DEFAULT_BASE_DELAY = 0.5
+    DEFAULT_MAX_DELAY = 30
+    DEFAULT_JITTER = 0.5
+    DEFAULT_RETRYABLE_CODES = (421, 450, 451, 452)
+
+
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY,
+                 jitter=DEFAULT_JITTER, retryable_codes=DEFAULT_RETRYABLE_CODES):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.retryable_codes = frozenset(retryable_codes)
+
+    ## Methods
+
+    def get_smtp_code(self, exception):
+        """Returns the SMTP response code carried by the exception, or None if it doesn't have one."""
+
+        ## smtplib and asyncio are imported as they're needed, to keep the package quick to import
+        import smtplib
+
+        codes = None
+        if(isinstance(exception, smtplib.SMTPRecipientsRefused)):
+            codes = [code for code, _ in exception.recipients.values()]
+        elif(type(exception).__name__ == "SMTPRecipientsRefused" and isinstance(exception.recipients, list)):
+            ## aiosmtplib's version holds a list of its SMTPRecipientRefused errors, rather than a dict of replies
+            codes = [getattr(recipient, "code", None) for recipient in exception.recipients]
+
+        if(codes is not None):
+            ## Only as retryable as the least retryable recipient
+            non_retryable = [code for code in codes if code not in self.retryable_codes]
+            return (non_retryable or codes or [None])[0]
+
+        code = getattr(exception, "smtp_code", None)
+        if(code is None):
+            code = getattr(exception, "code", None)
+        return code if isinstance(code, int) else None
+
+
+    def is_retryable(self, exception):
+        import asyncio
+        import smtplib
+        import socket
+
+        if(isinstance(exception, CircuitOpenError)):
+            return False
+
+        code = self.get_smtp_code(exception)
+        if(code is not None):
+            return code in self.retryable_codes
+
+        ## Connection level problems, that are probably gone by the next attempt
+        return isinstance(exception, (
+            smtplib.SMTPServerDisconnected,
+            smtplib.SMTPConnectError,
+            socket.timeout,
+            ConnectionError,
+            asyncio.TimeoutError
+        )) or type(exception).__name__ in ("SMTPServerDisconnected", "SMTPConnectError", "SMTPTimeoutError")
+
+
+    def get_delay(self, attempt):
+        """Returns the number of seconds to wait after the given (1-indexed) attempt fails."""
+
+        delay = min(self.base_delay * (2 ** (attempt - 1)), self.max_delay)
+        return delay * (1 - random.uniform(0, self.jitter))
+
+
+class CircuitBreaker:
+    """CircuitBreaker
+
+    Tracks the health of a single destination (an SMTP relay or a carrier's gateway domain). After failure_threshold
+    consecutive transient failures the breaker opens, and sends to that destination fail fast. Once reset_timeout
+    seconds have passed, a single trial send is let through (half open), and its outcome closes or reopens the breaker.
+
+    Arguments:
+        name {string}: The destination being tracked, prefixed with its kind (ex. "gateway:vtext.com"). Host breakers
+            are only charged for connection and login failures, and gateway breakers for refused recipients and
+            messages, see get_failure_kind().
+        failure_threshold {int} [optional]: Consecutive failures before the breaker opens. Defaults to 5.
+        reset_timeout {float} [optional]: Seconds to stay open before allowing a trial send. Defaults to 30.
+    """
+
+    ## Config
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    ## Defaults
+    DEFAULT_FAILURE_THRESHOLD = 5
+    DEFAULT_RESET_TIMEOUT = 30
+
+
+    def __init__(self, name, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.name = name
+        self.kind = name.split(":", 1)[0]
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.successes = 0
+        self.failures = 0
+        self.rejections = 0
+        self.opens = 0
+
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if(self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout):
+                return self.HALF_OPEN
+            return self._state
+
+    ## Methods
+
+    def allow(self):
+        """Returns True if a send to the destination should be attempted right now."""
+
+        with self._lock:
+            if(self._state == self.CLOSED):
+                return True
+
+            if(self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout):
+                self._state = self.HALF_OPEN
+
+            ## Only one trial send at a time while half open
+            if(self._state == self.HALF_OPEN and not self._trial_in_flight):
+                self._trial_in_flight = True
+                return True
+
+            self.rejections += 1
+            return False
+
+
+    def release(self):
+        """Gives up a trial send without counting it as a success or a failure (ex. for unrelated errors)."""
+
+        with self._lock:
+            self._trial_in_flight = False
+
+
+    def record_success(self):
+        with self._lock:
+            self.successes += 1
+            self._consecutive_failures = 0
+            self._trial_in_flight = False
+            self._state = self.CLOSED
+
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._consecutive_failures += 1
+            self._trial_in_flight = False
+
+            if(self._state == self.HALF_OPEN or self._consecutive_failures >= self.failure_threshold):
+                if(self._state != self.OPEN):
+                    self.opens += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+    def snapshot(self):
+        state = self.state
+        with self._lock:
+            return {
+                "state": state,
+                "consecutive_failures": self._consecutive_failures,
+                "successes": self.successes,
+                "failures": self.failures,
+                "rejections": self.rejections,
+                "opens": self.opens
+            }
+
+
+class CircuitBreakerRegistry:
+    """CircuitBreakerRegistry
+
+    Lazily creates and holds one CircuitBreaker per destination, all sharing the same thresholds.
+
+    Arguments:
+        failure_threshold {int} [optional]: See CircuitBreaker.
+        reset_timeout {float} [optional]: See CircuitBreaker.
+
+    Examples:
+        breakers = CircuitBreakerRegistry(failure_threshold=3)
+        MailToSMS(5551234567, "att", "username", "password", "hello", breakers=breakers)
+        breakers.snapshot()  ## {"host:smtp.gmail.com": {"state": "closed", ...}, "gateway:txt.att.net": {...}}
+    """
+
+    ## Config
+    HOST = "host"
+    GATEWAY = "gateway"
+
+
+    def __init__(self, failure_threshold=CircuitBreaker.DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout=CircuitBreaker.DEFAULT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    ## Methods
+
+    def get(self, kind, name):
+        key = "{0}:{1}".format(kind, name)
+        breaker = self._breakers.get(key)
+        if(breaker is None):
+            with self._lock:
+                breaker = self._breakers.get(key)
+                if(breaker is None):
+                    breaker = CircuitBreaker(key, self.failure_threshold, self.reset_timeout)
+                    self._breakers[key] = breaker
+
+        return breaker
+
+
+    def for_send(self, host, address):
+        """Returns the breakers that guard sending to the address through the host."""
+
+        return [self.get(self.HOST, host), self.get(self.GATEWAY, address.rsplit("@", 1)[-1])]
+
+
+    def snapshot(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+
+        return {breaker.name: breaker.snapshot() for breaker in breakers}
+
+
+def get_failure_kind(exception):
+    """Returns the kind of breaker that a transient failure is charged to. Failures after RCPT (refused recipients,
+    or a refused message) are the carrier gateway's, and everything else (connecting, logging in, the relay turning
+    the sender away, or a 421 closing the session) is the SMTP host's."""
+
+    ## Checked by name, so aiosmtplib's exceptions are treated just like smtplib's
+    name = type(exception).__name__
+    code = getattr(exception, "smtp_code", getattr(exception, "code", None))
+    if(name in ("SMTPRecipientsRefused", "SMTPRecipientRefused") or (name == "SMTPDataError" and code != 421)):
+        return CircuitBreakerRegistry.GATEWAY
+    return CircuitBreakerRegistry.HOST
+
+
+def _record_failure(breakers, exception):
+    ## Only the breaker for whichever end is at fault is charged, the other one's trial send (if any) is given up.
+    ## Breakers that aren't a host or a gateway are charged for every failure.
+    kind = get_failure_kind(exception)
+    for breaker in breakers:
+        if(breaker.kind in (CircuitBreakerRegistry.HOST, CircuitBreakerRegistry.GATEWAY) and breaker.kind != kind):
+            breaker.release()
+        else:
+            breaker.record_failure()
+
+
+def _check_breakers(breakers):
+    allowed = []
+    for breaker in breakers:
+        if(not breaker.allow()):
+            ## Don't leave any trial sends that were just granted hanging
+            for other in allowed:
+                other.release()
+            raise CircuitOpenError("Circuit breaker '{0}' is open.".format(breaker.name))
+        allowed.append(breaker)
+
+
+def call_with_retries(func, policy, breakers=(), sleep=time.sleep, on_retry=None):
+    """Calls func until it succeeds, the policy gives up, or one of the breakers opens. Only transient failures are
+    retried (and counted against the breaker at fault, see get_failure_kind()), everything else is raised immediately.
+    If given, on_retry is called with the (1-indexed) attempt number and its exception before each retry."""
+
+    attempt = 1
+    while True:
+        _check_breakers(breakers)
+        try:
+            result = func()
+        except Exception as e:
+            if(not policy.is_retryable(e)):
+                for breaker in breakers:
+                    breaker.release()
+                raise
+
+            _record_failure(breakers, e)
+            if(attempt >= policy.max_attempts):
+                raise
+
+            if(on_retry):
+                on_retry(attempt, e)
+            sleep(policy.get_delay(attempt))
+            attempt += 1
+        else:
+            for breaker in breakers:
+                breaker.record_success()
+            return result
+
+
+async def call_with_retries_async(func, policy, breakers=(), on_retry=None):
+    """The asyncio version of call_with_retries(), where func returns an awaitable."""
+
+    import asyncio
+
+    attempt = 1
+    while True:
+        _check_breakers(breakers)
+        try:
+            result = await func()
+        except Exception as e:
+            if(not policy.is_retryable(e)):
+                for breaker in breakers:
+                    breaker.release()
+                raise
+
+            _record_failure(breakers, e)
+            if(attempt >= policy.max_attempts):
+                raise
+
+            if(on_retry):
+                on_retry(attempt, e)
+            await asyncio.sleep(policy.get_delay(attempt))
+            attempt += 1
+        else:
+            for breaker in breakers:
+                breaker.record_success()
+            return result
+
+
+## Process wide defaults, used when no policy or registry is given
+_default_retry_policy = RetryPolicy()
+_default_breakers = CircuitBreakerRegistry()
+
+
+def get_default_retry_policy():
+    return _default_retry_policy
+
+
+def get_breaker_registry():
+    return _default_breakers
@@ -0,0 +1,118 @@
+from __future__ import print_function
+
+import itertools
+from collections import deque, namedtuple
+
+from .gateway_registry import get_gateway_registry
+from .mail_to_sms import INVALID_NUMBER, NO_GATEWAY, UNKNOWN_CARRIER, MailToSMS
+from .number_cache import NumberCache, get_number_cache
+
+
+## Defaults
+DEFAULT_BATCH_SIZE = 1000
+
+
+## The outcome of resolving a single (number, carrier) row. Rows that couldn't be resolved have no address, and instead
+## have a machine readable reason (one of INVALID_NUMBER, UNKNOWN_CARRIER, or NO_GATEWAY) and a human readable error.
+Resolution = namedtuple("Resolution", ["number", "carrier", "address", "reason", "error"])
+
+
+def _batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if(not batch):
+            return
+        yield batch
+
+
+def _parse_numbers(numbers, region):
+    ## Runs in the worker processes, so it has to be importable at the module level
+    return [NumberCache.parse(number, region) for number in numbers]
+
+
+def _unique_numbers(batch):
+    return list(dict.fromkeys(str(number).strip() for number, _ in batch))
+
+
+def _resolve_batch(batch, parsed_numbers, registry, mms):
+    ## Mirrors MailToSMS._build_address: validate the number, then the carrier, then look up the gateway
+    resolved = []
+    for number, carrier in batch:
+        parsed = parsed_numbers[str(number).strip()]
+        if(not parsed.valid):
+            error = " ".join(str(part) for part in parsed.error if part)
+            resolved.append(Resolution(number, carrier, None, INVALID_NUMBER, error))
+            continue
+
+        if(carrier not in registry):
+            error = "'{0}' isn't a valid carrier.".format(str(carrier).strip())
+            resolved.append(Resolution(number, carrier, None, UNKNOWN_CARRIER, error))
+            continue
+
+        gateway = registry.resolve(carrier, mms)
+        if(not gateway):
+            error = "Carrier '{0}' doesn't have any valid SMS or MMS gateways.".format(carrier)
+            resolved.append(Resolution(number, carrier, None, NO_GATEWAY, error))
+            continue
+
+        resolved.append(Resolution(number, carrier, "{0}@{1}".format(parsed.national, gateway), None, None))
+
+    return resolved
+
+
+def resolve_addresses(rows, region=MailToSMS.DEFAULT_REGION, mms=MailToSMS.DEFAULT_TO_MMS,
+                      batch_size=DEFAULT_BATCH_SIZE, processes=None, registry=None, number_cache=None):
+    """Validates and resolves the gateway address of every (number, carrier) row without connecting to anything, and
+    lazily yields a Resolution for each, in the same order as the rows.
+
+    Rows are read and resolved in batches, so memory use is bounded by the batch size rather than by the number of
+    rows. Each distinct number in a batch is only parsed once.
+
+    Arguments:
+        rows {iterable}: An iterable of (number, carrier) pairs (ex. [(5551234567, "att"), ("5557654321", "vzw")])
+        region {string} [optional]: See MailToSMS. Defaults to "US".
+        mms {boolean} [optional]: See MailToSMS. Defaults to False.
+        batch_size {int} [optional]: The number of rows to resolve at a time. Defaults to 1000.
+        processes {int} [optional]: Parse the phone numbers across a pool of this many processes, which is worthwhile
+            for very large lists of mostly distinct numbers. Defaults to parsing them in this process, through the
+            number cache.
+        registry {GatewayRegistry} [optional]: The gateways to resolve against. Defaults to the shared registry.
+        number_cache {NumberCache} [optional]: The cache used when parsing in this process. Defaults to the shared
+            cache.
+
+    Examples:
+        from mail_to_sms import resolve_addresses
+
+        for resolution in resolve_addresses([(5551234567, "att"), ("555", "vzw")]):
+            print(resolution.address or resolution.reason)
+    """
+
+    registry = get_gateway_registry() if registry is None else registry
+
+    if(not processes or processes < 2):
+        ## An empty cache is falsy, so check for None explicitly
+        number_cache = get_number_cache() if number_cache is None else number_cache
+        for batch in _batches(rows, batch_size):
+            parsed_numbers = {number: number_cache.get(number, region) for number in _unique_numbers(batch)}
+            for resolution in _resolve_batch(batch, parsed_numbers, registry, mms):
+                yield resolution
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    ## Keep a couple of batches per process in flight, so the workers stay busy without reading the whole input
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = deque()
+        for batch in itertools.chain(_batches(rows, batch_size), [None]):
+            if(batch is not None):
+                numbers = _unique_numbers(batch)
+                pending.append((batch, numbers, executor.submit(_parse_numbers, numbers, region)))
+                if(len(pending) < processes * 2):
+                    continue
+
+            while(pending and (batch is None or len(pending) >= processes * 2)):
+                done_batch, numbers, future = pending.popleft()
+                parsed_numbers = dict(zip(numbers, future.result()))
+                for resolution in _resolve_batch(done_batch, parsed_numbers, registry, mms):
+                    yield resolution
@@ -0,0 +1,211 @@
+from __future__ import print_function
+
+import os
+import threading
+import time
+from collections import namedtuple
+
+
+## A single message sent (or attempted) to an address, along with the bounce that came back for it, if any
+Delivery = namedtuple("Delivery", [
+    "id", "message_id", "number", "address", "gateway", "sent_at", "success", "code", "response", "bounced_at",
+    "bounce_status", "bounce_reason"
+])
+
+## Why an address was marked as undeliverable, and when
+Undeliverable = namedtuple("Undeliverable", ["address", "reason", "detail", "marked_at"])
+
+## Config
+BOUNCED = "bounced"
+OPTED_OUT = "opted_out"
+
+
+class UndeliverableAddress(Exception):
+    """Raised instead of sending to an address that a ResultsStore has marked as undeliverable."""
+    pass
+
+
+def _normalize_address(address):
+    return str(address).strip().lower()
+
+
+class ResultsStore:
+    """ResultsStore
+
+    A SQLite backed record of every message sent through a Sender, with its Message-ID, recipient, gateway, time, and
+    SMTP response. Bounces and opt out replies are matched back to those records by a BounceIngester, which marks the
+    addresses as undeliverable so that later sends to them are skipped before any network work happens.
+
+    Arguments:
+        path {string} [optional]: The path to the SQLite database. Defaults to ~/.mail_to_sms/results.sqlite3, or the
+            MAIL_TO_SMS_RESULTS environment variable if it's set.
+
+    Examples:
+        from mail_to_sms import MailToSMSBatch, ResultsStore
+
+        results = ResultsStore()
+        MailToSMSBatch(recipients, "username", "password", "this is a message", results=results)
+        print(results.get_undeliverable())
+    """
+
+    ## Config
+    PATH_ENV_VAR = "MAIL_TO_SMS_RESULTS"
+
+    ## Defaults
+    DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".mail_to_sms", "results.sqlite3")
+
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get(self.PATH_ENV_VAR) or self.DEFAULT_PATH
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if(not os.path.isdir(directory)):
+            os.makedirs(directory)
+
+        import sqlite3
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        ## WAL lets the ingestion job write while senders are reading, and NORMAL syncing keeps inserts fast
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS deliveries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                message_id TEXT,
+                number TEXT NOT NULL,
+                address TEXT NOT NULL,
+                gateway TEXT NOT NULL,
+                sent_at REAL NOT NULL,
+                success INTEGER NOT NULL,
+                code INTEGER,
+                response TEXT,
+                bounced_at REAL,
+                bounce_status TEXT,
+                bounce_reason TEXT
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS deliveries_message_id ON deliveries (message_id)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS deliveries_address ON deliveries (address, sent_at)")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS undeliverable (
+                address TEXT PRIMARY KEY,
+                reason TEXT NOT NULL,
+                detail TEXT,
+                marked_at REAL NOT NULL
+            )"""
+        )
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    ## Methods
+
+    def record(self, message_id, address, success, code=None, response=None):
+        """Records a message sent to the address, and returns its id."""
+
+        address = _normalize_address(address)
+        number, gateway = address.rsplit("@", 1)
+        with self._lock:
+            cursor = self._db.execute(
+                """INSERT INTO deliveries (message_id, number, address, gateway, sent_at, success, code, response)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                (message_id, number, address, gateway, time.time(), int(bool(success)), code, response)
+            )
+            return cursor.lastrowid
+
+
+    def get_deliveries(self, message_id=None, address=None, limit=None):
+        """Returns the Deliveries with the Message-ID and/or to the address, newest first."""
+
+        clauses = []
+        args = []
+        if(message_id is not None):
+            clauses.append("message_id = ?")
+            args.append(message_id)
+        if(address is not None):
+            clauses.append("address = ?")
+            args.append(_normalize_address(address))
+
+        query = "SELECT * FROM deliveries{0} ORDER BY sent_at DESC, id DESC".format(
+            " WHERE " + " AND ".join(clauses) if clauses else ""
+        )
+        if(limit):
+            query += " LIMIT {0:d}".format(limit)
+
+        with self._lock:
+            rows = self._db.execute(query, args).fetchall()
+
+        return [Delivery(*row[:6], bool(row[6]), *row[7:]) for row in rows]
+
+
+    def record_bounce(self, message_id, address, status, reason):
+        """Matches a bounce back to the message it's for (by its Message-ID if known, otherwise the latest message to
+        the address), and records it. Returns the matched Delivery's id, or None if nothing matched."""
+
+        address = _normalize_address(address)
+        with self._lock:
+            row = None
+            if(message_id):
+                row = self._db.execute(
+                    "SELECT id FROM deliveries WHERE message_id = ? AND address = ? ORDER BY id DESC LIMIT 1",
+                    (message_id, address)
+                ).fetchone()
+            if(row is None):
+                row = self._db.execute(
+                    "SELECT id FROM deliveries WHERE address = ? ORDER BY sent_at DESC, id DESC LIMIT 1", (address,)
+                ).fetchone()
+            if(row is None):
+                return None
+
+            self._db.execute(
+                "UPDATE deliveries SET bounced_at = ?, bounce_status = ?, bounce_reason = ? WHERE id = ?",
+                (time.time(), status, reason, row[0])
+            )
+            return row[0]
+
+
+    def mark_undeliverable(self, address, reason=BOUNCED, detail=None):
+        """Marks the address as undeliverable, so that Senders using this store skip it from now on."""
+
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO undeliverable (address, reason, detail, marked_at) VALUES (?, ?, ?, ?)",
+                (_normalize_address(address), reason, detail, time.time())
+            )
+
+
+    def clear_undeliverable(self, address):
+        """Lets messages be sent to the address again (ex. after the number has been reassigned)."""
+
+        with self._lock:
+            self._db.execute("DELETE FROM undeliverable WHERE address = ?", (_normalize_address(address),))
+
+
+    def is_undeliverable(self, address):
+        with self._lock:
+            return self._db.execute(
+                "SELECT 1 FROM undeliverable WHERE address = ?", (_normalize_address(address),)
+            ).fetchone() is not None
+
+
+    def get_undeliverable(self):
+        """Returns every address that's been marked as undeliverable, as Undeliverables."""
+
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT address, reason, detail, marked_at FROM undeliverable ORDER BY marked_at, address"
+            ).fetchall()
+
+        return [Undeliverable(*row) for row in rows]
+
+
+    def close(self):
+        with self._lock:
+            self._db.close()
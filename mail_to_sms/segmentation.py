@@ -0,0 +1,179 @@
+from __future__ import print_function
+
+import math
+
+
+## Config
+GSM7 = "gsm7"
+UCS2 = "ucs2"
+SEGMENT = "segment"
+MMS = "mms"
+SEGMENT_LIMITS = {GSM7: 160, UCS2: 70}
+SEGMENT_PREFIX = "({0}/{1}) "
+## Gateways put the subject in front of the text, on its own line
+SUBJECT_SEPARATOR = "\n"
+
+## The GSM 03.38 basic character set, and the extension table whose characters take up two septets
+GSM7_BASIC = frozenset(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠ"
+    "ΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?¡ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    "ÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+GSM7_EXTENDED = frozenset("\f^{}\\[~]|€")
+
+
+def get_encoding(text):
+    """Returns the encoding a carrier would need for the text, GSM7 if every character fits in the GSM-7 alphabet and
+    UCS2 otherwise."""
+
+    for character in text:
+        if(character not in GSM7_BASIC and character not in GSM7_EXTENDED):
+            return UCS2
+    return GSM7
+
+
+def measure(text, encoding=None):
+    """Returns the length of the text in the units a carrier counts: septets for GSM-7, and UTF-16 code units for
+    UCS-2."""
+
+    encoding = encoding or get_encoding(text)
+    if(encoding == GSM7):
+        return sum(2 if character in GSM7_EXTENDED else 1 for character in text)
+    return len(text.encode("utf-16-le")) // 2
+
+
+def get_text(contents):
+    """Returns the plain text of a yagmail contents argument, or None if it contains anything besides text (ex.
+    attachments), which can't be measured or split."""
+
+    if(isinstance(contents, str)):
+        return contents
+    if(isinstance(contents, (list, tuple)) and all(isinstance(item, str) for item in contents)):
+        return "\n".join(contents)
+    return None
+
+
+def _get_template(contents):
+    ## Returns the MessageTemplate behind templated contents, or None for anything else. Imported here since the
+    ## message_template module depends on this one.
+    from .message_template import MessageTemplate, TemplateMessage
+
+    if(isinstance(contents, TemplateMessage)):
+        return contents.template
+    if(isinstance(contents, MessageTemplate)):
+        return contents
+    return None
+
+
+def _split(text, budget, encoding):
+    ## Greedily fill each chunk up to the budget, preferring to break on whitespace
+    chunks = []
+    while(text):
+        length = 0
+        end = 0
+        last_space = None
+        for index, character in enumerate(text):
+            size = measure(character, encoding)
+            if(length + size > budget):
+                break
+            length += size
+            end = index + 1
+            if(character.isspace()):
+                last_space = end
+
+        if(end < len(text) and last_space):
+            end = last_space
+
+        chunks.append(text[:end].strip())
+        text = text[end:].lstrip()
+
+    return [chunk for chunk in chunks if chunk]
+
+
+def segment(text, encoding=None, reserved=0):
+    """Splits the text into numbered segments (ex. "(1/3) ...") that each fit into a single SMS, along with reserved
+    units of something else that's sent with every segment (ex. the subject)."""
+
+    encoding = encoding or get_encoding(text)
+    limit = SEGMENT_LIMITS[encoding] - reserved
+    if(measure(text, encoding) <= limit):
+        return [text]
+
+    ## The prefix eats into each segment's budget, and it grows with the number of segments, so re-split until the
+    ## prefix that was budgeted for is big enough
+    count = int(math.ceil(measure(text, encoding) / float(limit)))
+    while True:
+        budget = limit - measure(SEGMENT_PREFIX.format(count, count), encoding)
+        if(budget < 2):
+            ## Characters take up to two units, so a smaller budget couldn't be split into
+            raise ValueError("There isn't room in a segment for any of the text.")
+        chunks = _split(text, budget, encoding)
+        if(len(chunks) <= count):
+            break
+        count = len(chunks)
+
+    return [SEGMENT_PREFIX.format(index + 1, len(chunks)) + chunk for index, chunk in enumerate(chunks)]
+
+
+def prepare(address, contents, mode, registry, mms_threshold=None, subject=None):
+    """Prepares a message for sending to an SMS gateway address, and returns a list of (address, contents) pairs to
+    send in order.
+
+    Arguments:
+        address {string}: The gateway address (ex. "5551234567@txt.att.net")
+        contents {yagmail contents}: The message.
+        mode {string}: Either SEGMENT to split long messages into numbered SMS segments, or MMS to send long messages
+            to the carrier's MMS gateway instead (falling back to segments if it doesn't have one). Anything else
+            leaves the message alone.
+        registry {GatewayRegistry}: The registry used to find the carrier's MMS gateway.
+        mms_threshold {int} [optional]: With the MMS mode, messages up to this length are still segmented rather than
+            promoted. Defaults to the length of a single SMS.
+        subject {string} [optional]: The subject that the message is sent with, which counts towards its length.
+            Templates with a subject of their own count that one instead.
+
+    Templates are measured as they'll be rendered for the address, and their segments are templates too, so that they
+    keep the template's subject and charset.
+    """
+
+    if(mode not in (SEGMENT, MMS)):
+        return [(address, contents)]
+
+    template = _get_template(contents)
+    if(template):
+        text = contents.get_text(address)
+        subject = template.subject if template.subject is not None else subject
+    else:
+        text = get_text(contents)
+    if(text is None):
+        return [(address, contents)]
+
+    local, domain = address.rsplit("@", 1)
+    mms_domain = registry.get_mms_domain(domain)
+    ## MMS gateways (and gateways shared between SMS and MMS) take long messages as they are
+    if(mms_domain == domain):
+        return [(address, contents)]
+
+    ## The subject takes up room in every SMS, and any characters in it outside GSM-7 switch the whole SMS to UCS-2
+    subject = subject + SUBJECT_SEPARATOR if subject else ""
+    encoding = get_encoding(subject + text)
+    reserved = measure(subject, encoding)
+    length = measure(text, encoding) + reserved
+    limit = SEGMENT_LIMITS[encoding]
+    if(length <= limit):
+        return [(address, contents)]
+
+    if(mode == MMS and mms_domain and length > (mms_threshold or limit)):
+        return [("{0}@{1}".format(local, mms_domain), contents)]
+
+    try:
+        chunks = segment(text, encoding, reserved)
+    except ValueError:
+        ## The subject fills up a whole SMS, so leave splitting it to the gateway
+        return [(address, contents)]
+
+    if(template):
+        from .message_template import MessageTemplate
+
+        ## The chunks are already rendered, so escape them so that nothing in them is taken for a placeholder
+        chunks = [MessageTemplate(chunk.replace("$", "$$"), template.subject, template.charset) for chunk in chunks]
+    return [(address, chunk) for chunk in chunks]
@@ -0,0 +1,292 @@
+from __future__ import print_function
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from .metrics import POOL_CONNECTIONS, get_metrics
+
+
+def _get_yagmail_smtp():
+    ## yagmail (and keyring along with it) is slow to import, so wait until a connection is actually needed
+    import yagmail
+
+    return yagmail.SMTP
+
+
+## Signature cache for bind_yagmail_args(), keyed on the connection factory
+_signatures = {}
+
+
+def bind_yagmail_args(*yagmail_args, **kwargs):
+    """Maps positional yagmail args onto the names (and defaults) of the connection factory's arguments. Returns None
+    if the args can't be bound to the factory's signature.
+
+    Arguments:
+        factory {callable} [optional]: The connection factory whose signature the args are for. Defaults to yagmail.SMTP.
+    """
+
+    import inspect
+
+    factory = kwargs.get("factory") or _get_yagmail_smtp()
+    signature = _signatures.get(factory)
+    if(signature is None):
+        try:
+            signature = inspect.signature(factory)
+        except (TypeError, ValueError):
+            signature = False
+        _signatures[factory] = signature
+
+    if(not signature):
+        return None
+
+    try:
+        bound = signature.bind_partial(*yagmail_args)
+    except TypeError:
+        return None
+
+    arguments = {
+        name: parameter.default for name, parameter in signature.parameters.items()
+        if parameter.default is not inspect.Parameter.empty
+    }
+    arguments.update(bound.arguments)
+    return arguments
+
+
+class SMTPPoolTimeout(Exception):
+    """Raised when a connection couldn't be acquired from the pool before the acquire timeout elapsed."""
+    pass
+
+
+class SMTPConnectionPool:
+    """SMTPConnectionPool
+
+    A thread safe pool of yagmail connections, keyed on the (host, port, username) that the yagmail args resolve to.
+    Idle connections are health checked with a NOOP before they're handed out again, and connections that have been
+    idle for too long are closed rather than reused.
+
+    Arguments:
+        size {int} [optional]: The maximum number of open connections per (host, port, username). Defaults to 4.
+        idle_timeout {float} [optional]: Seconds a connection can sit idle before it's closed instead of reused.
+            Defaults to 60.
+        acquire_timeout {float} [optional]: Seconds to wait for a connection when the pool is exhausted before raising
+            SMTPPoolTimeout. Defaults to 30.
+        connection_factory {callable} [optional]: Creates new connections from the yagmail args. Defaults to
+            yagmail.SMTP.
+        metrics {MetricsRegistry} [optional]: Where the open and idle connection gauges are recorded. Defaults to the
+            process wide registry.
+
+    Examples:
+        pool = SMTPConnectionPool(size=8)
+
+        with pool.connection("username", "password") as connection:
+            connection.send(to="5551234567@txt.att.net", contents="hello")
+
+        MailToSMS(5551234567, "att", "username", "password", "hello", pool=pool)
+    """
+
+    ## Defaults
+    DEFAULT_SIZE = 4
+    DEFAULT_IDLE_TIMEOUT = 60
+    DEFAULT_ACQUIRE_TIMEOUT = 30
+    DEFAULT_HOST = "smtp.gmail.com"
+    NOOP_OK = 250
+
+
+    def __init__(self, size=DEFAULT_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT, acquire_timeout=DEFAULT_ACQUIRE_TIMEOUT,
+                 connection_factory=None, metrics=None):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.connection_factory = connection_factory
+        self.metrics = metrics or get_metrics()
+
+        self._condition = threading.Condition()
+        self._idle = {}
+        self._open = {}
+        self._leased = {}
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    ## Methods
+
+    def _get_factory(self):
+        ## Looked up at call time so yagmail.SMTP can be swapped out (ex. in tests)
+        return self.connection_factory or _get_yagmail_smtp()
+
+
+    def key_for(self, *yagmail_args):
+        """Returns the (host, port, username) that the given yagmail args will connect with."""
+
+        arguments = bind_yagmail_args(*yagmail_args, factory=self._get_factory())
+        if(arguments is None):
+            return tuple(yagmail_args)
+
+        port = arguments.get("port")
+        return (arguments.get("host", self.DEFAULT_HOST), str(port) if port is not None else None, arguments.get("user"))
+
+
+    def _is_healthy(self, connection):
+        if(getattr(connection, "is_closed", False)):
+            return False
+
+        ## Connections that haven't logged in yet will do so on their first send
+        smtp = getattr(connection, "smtp", None)
+        if(smtp is None):
+            return True
+
+        try:
+            return smtp.noop()[0] == self.NOOP_OK
+        except Exception:
+            return False
+
+
+    def _record_gauges(self, key):
+        with self._condition:
+            open_count = self._open.get(key, 0)
+            idle_count = len(self._idle.get(key, ()))
+
+        host, _, user = key if len(key) == 3 else (key, None, None)
+        self.metrics.set_gauge(POOL_CONNECTIONS, open_count, host=host, user=user, state="open")
+        self.metrics.set_gauge(POOL_CONNECTIONS, idle_count, host=host, user=user, state="idle")
+
+
+    def _close_connection(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+    def acquire(self, *yagmail_args):
+        """Returns a healthy connection for the yagmail args, reusing an idle one when possible. Blocks while the pool
+        is exhausted, and raises SMTPPoolTimeout if nothing frees up in time. Every acquired connection must be handed
+        back with release()."""
+
+        key = self.key_for(*yagmail_args)
+        deadline = time.monotonic() + self.acquire_timeout
+
+        while True:
+            candidate = None
+            with self._condition:
+                idle = self._idle.get(key)
+                if(idle):
+                    ## Hand out the most recently used connection first, since it's the most likely to still be alive
+                    candidate = idle.pop()
+                elif(self._open.get(key, 0) < self.size):
+                    self._open[key] = self._open.get(key, 0) + 1
+                else:
+                    remaining = deadline - time.monotonic()
+                    if(remaining <= 0):
+                        raise SMTPPoolTimeout("Timed out waiting for a connection to {0}.".format(key))
+                    self._condition.wait(remaining)
+                    continue
+
+            ## Network work (NOOPs, QUITs and logins) happens outside of the lock
+            if(candidate):
+                connection, released_at = candidate
+                if(time.monotonic() - released_at > self.idle_timeout or not self._is_healthy(connection)):
+                    self._discard(key, connection)
+                    continue
+            else:
+                try:
+                    connection = self._get_factory()(*yagmail_args)
+                except Exception:
+                    with self._condition:
+                        self._open[key] -= 1
+                        self._condition.notify()
+                    raise
+
+            with self._condition:
+                self._leased[id(connection)] = key
+            self._record_gauges(key)
+            return connection
+
+
+    def _discard(self, key, connection):
+        self._close_connection(connection)
+        with self._condition:
+            self._open[key] -= 1
+            self._condition.notify()
+
+
+    def release(self, connection, discard=False):
+        """Hands a connection back to the pool. Discarded connections are closed instead of being reused."""
+
+        with self._condition:
+            key = self._leased.pop(id(connection))
+            if(not discard):
+                self._idle.setdefault(key, deque()).append((connection, time.monotonic()))
+                self._condition.notify()
+
+        if(discard):
+            self._discard(key, connection)
+        self._record_gauges(key)
+
+
+    @contextmanager
+    def connection(self, *yagmail_args):
+        """Context manager form of acquire() and release(). Connections that were dropped by the server are discarded
+        rather than returned to the pool."""
+
+        import smtplib
+
+        connection = self.acquire(*yagmail_args)
+        try:
+            yield connection
+        except smtplib.SMTPServerDisconnected:
+            self.release(connection, discard=True)
+            raise
+        except BaseException:
+            self.release(connection)
+            raise
+        else:
+            self.release(connection)
+
+
+    def stats(self):
+        """Returns a dict of (host, port, username) keys to their open and idle connection counts."""
+
+        with self._condition:
+            return {
+                key: {"open": count, "idle": len(self._idle.get(key, ()))}
+                for key, count in self._open.items()
+            }
+
+
+    def close(self):
+        """Closes every idle connection. Leased connections are closed when they're released with discard=True, or on
+        the next close() after they've been released."""
+
+        with self._condition:
+            idle = [(key, connection) for key, connections in self._idle.items() for connection, _ in connections]
+            self._idle = {}
+
+        for key, connection in idle:
+            self._discard(key, connection)
+        for key in set(key for key, _ in idle):
+            self._record_gauges(key)
+
+
+## Process wide pool, used by MailToSMS when no pool is given
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_default_pool():
+    global _default_pool
+
+    if(_default_pool is None):
+        with _default_pool_lock:
+            if(_default_pool is None):
+                _default_pool = SMTPConnectionPool()
+
+    return _default_pool
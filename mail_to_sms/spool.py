@@ -0,0 +1,377 @@
+from __future__ import print_function
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+from .mail_to_sms import Sender
+from .message_template import MessageTemplate, TemplateMessage
+from .metrics import SPOOL_MESSAGES, get_metrics
+from .rate_limit import RateLimitDeferred
+from .resilience import CircuitOpenError, RetryPolicy, get_default_retry_policy
+from .smtp_pool import get_default_pool
+
+
+logger = logging.getLogger(__name__)
+
+
+## A message that's been claimed from the spool by a worker
+SpoolMessage = namedtuple("SpoolMessage", ["id", "address", "subject", "contents", "attempts"])
+
+
+class Spool:
+    """Spool
+
+    A durable, SQLite backed queue of outbound messages. Enqueueing is just a local insert, so callers don't have to
+    wait on the SMTP server, and queued messages survive restarts until a SpoolWorker sends them.
+
+    Messages are claimed by workers with a lease, so if a worker dies mid-batch its messages become available again
+    once the lease expires. Messages that keep failing are moved to the dead letters.
+
+    Arguments:
+        path {string} [optional]: The path to the SQLite database. Defaults to ~/.mail_to_sms/spool.sqlite3, or the
+            MAIL_TO_SMS_SPOOL environment variable if it's set.
+
+    Examples:
+        spool = Spool("/var/spool/mail_to_sms.sqlite3")
+        spool.enqueue("5551234567@txt.att.net", "this is a message")
+
+        MailToSMS(5551234567, "att", spool=spool).enqueue("this is a message")
+    """
+
+    ## Config
+    PATH_ENV_VAR = "MAIL_TO_SMS_SPOOL"
+    PENDING = "pending"
+    SENDING = "sending"
+    DEAD = "dead"
+
+    ## Defaults
+    DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".mail_to_sms", "spool.sqlite3")
+    DEFAULT_LEASE = 300
+
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get(self.PATH_ENV_VAR) or self.DEFAULT_PATH
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if(not os.path.isdir(directory)):
+            os.makedirs(directory)
+
+        import sqlite3
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        ## WAL lets the workers read while callers are enqueueing, and NORMAL syncing keeps inserts fast
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                address TEXT NOT NULL,
+                subject TEXT,
+                contents TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                last_error TEXT
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS messages_available ON messages (status, available_at)")
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    ## Methods
+
+    def enqueue(self, address, contents, subject=None):
+        """Queues a message for the address, and returns its id. Templated contents are filled in for the address
+        now (raising a KeyError if a field is missing), since only JSON is stored. Anything else must be JSON
+        serializable, or a TypeError is raised."""
+
+        if(isinstance(contents, (MessageTemplate, TemplateMessage))):
+            template = contents if isinstance(contents, MessageTemplate) else contents.template
+            subject = template.subject if template.subject is not None else subject
+            contents = contents.get_text(address)
+        data = json.dumps(contents)
+
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO messages (address, subject, contents, status, available_at, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (address, subject, data, self.PENDING, now, now)
+            )
+            return cursor.lastrowid
+
+
+    def claim(self, limit, lease=DEFAULT_LEASE):
+        """Claims up to limit messages that are ready to be sent, leasing them to the caller for lease seconds."""
+
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                ## Messages whose lease has expired were claimed by a worker that never finished them
+                rows = self._db.execute(
+                    """SELECT id, address, subject, contents, attempts FROM messages
+                    WHERE status IN (?, ?) AND available_at <= ? ORDER BY available_at, id LIMIT ?""",
+                    (self.PENDING, self.SENDING, now, limit)
+                ).fetchall()
+                self._db.executemany(
+                    "UPDATE messages SET status = ?, available_at = ? WHERE id = ?",
+                    [(self.SENDING, now + lease, row[0]) for row in rows]
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+        return [SpoolMessage(row[0], row[1], row[2], json.loads(row[3]), row[4]) for row in rows]
+
+
+    def ack(self, message_id):
+        """Removes a successfully sent message from the spool."""
+
+        with self._lock:
+            self._db.execute("DELETE FROM messages WHERE id = ?", (message_id,))
+
+
+    def retry(self, message_id, error, delay):
+        """Puts a failed message back in the queue, to be tried again after delay seconds."""
+
+        with self._lock:
+            self._db.execute(
+                "UPDATE messages SET status = ?, attempts = attempts + 1, available_at = ?, last_error = ? WHERE id = ?",
+                (self.PENDING, time.time() + delay, error, message_id)
+            )
+
+
+    def release(self, message_ids, delay=0):
+        """Puts claimed messages back in the queue as they were, without using up any of their attempts. They're
+        available again after delay seconds."""
+
+        with self._lock:
+            self._db.executemany(
+                "UPDATE messages SET status = ?, available_at = ? WHERE id = ?",
+                [(self.PENDING, time.time() + delay, message_id) for message_id in message_ids]
+            )
+
+
+    def bury(self, message_id, error):
+        """Moves a message that can't be sent into the dead letters."""
+
+        with self._lock:
+            self._db.execute(
+                "UPDATE messages SET status = ?, attempts = attempts + 1, last_error = ? WHERE id = ?",
+                (self.DEAD, error, message_id)
+            )
+
+
+    def dead_letters(self):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, address, subject, contents, attempts, last_error FROM messages WHERE status = ? ORDER BY id",
+                (self.DEAD,)
+            ).fetchall()
+
+        return [(SpoolMessage(row[0], row[1], row[2], json.loads(row[3]), row[4]), row[5]) for row in rows]
+
+
+    def counts(self):
+        """Returns a dict of message statuses to the number of messages with that status."""
+
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM messages GROUP BY status").fetchall()
+
+        counts = {self.PENDING: 0, self.SENDING: 0, self.DEAD: 0}
+        counts.update(dict(rows))
+        return counts
+
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class SpoolWorker:
+    """SpoolWorker
+
+    Drains a Spool in batches over pooled yagmail connections. Every message is sent through a Sender, so spooled
+    messages get the same rate limiting, segmenting, circuit breakers, and results recording as any other send.
+    Failed messages are retried with exponential backoff, and moved to the dead letters once they've used up all of
+    their attempts. Permanent failures (ex. a 550 for a number that doesn't exist, or an address marked as
+    undeliverable) are moved to the dead letters right away. Messages that are deferred by the rate limiter or an open
+    circuit breaker go back in the queue without using up an attempt.
+
+    Arguments:
+        spool {Spool}: The spool to drain.
+        yagmail_args {list} [optional]: The args to create yagmail connections with, including the username and
+            password. (ex. ["username", "password", "smtp.gmail.com"])
+        keyworded args (for extra configuration):
+            quiet {boolean}: Choose to disable warning logs (they're still logged at the DEBUG level). Defaults to
+                False.
+            pool {SMTPConnectionPool}: The pool to draw yagmail connections from. Defaults to a process wide pool.
+            metrics {MetricsRegistry}: Where sends, failures, timings, and the spool's depth are recorded. Defaults to
+                a process wide registry.
+            retry {RetryPolicy}: Decides which failures are worth retrying. The worker's own max_attempts and backoff
+                are used for the retries themselves. Defaults to the process wide policy.
+            batch_size {int}: The number of messages to claim and send per connection. Defaults to 50.
+            max_attempts {int}: The number of attempts before a message is dead lettered. Defaults to 5.
+            backoff {float}: Seconds to wait before the first retry, doubling with each attempt. Defaults to 30.
+            max_backoff {float}: The longest a retry will wait, in seconds. Defaults to 3600.
+            Along with any of MailToSMS's keyworded args (ex. rate_limiter, breakers, long_messages, results, or
+                identities), which are applied to every send. See MailToSMS.
+
+    Examples:
+        worker = SpoolWorker(Spool(), ["username", "password"])
+        worker.run()
+
+        SpoolWorker(Spool(), ["username", "password"], rate_limiter=RateLimiter(account_rate=1)).run()
+    """
+
+    ## Defaults
+    DEFAULT_BATCH_SIZE = 50
+    DEFAULT_MAX_ATTEMPTS = 5
+    DEFAULT_BACKOFF = 30
+    DEFAULT_MAX_BACKOFF = 3600
+    DEFAULT_POLL_INTERVAL = 1.0
+
+
+    def __init__(self, spool, yagmail_args=None, **kwargs):
+        self.spool = spool
+        self.yagmail_args = list(yagmail_args or [])
+        self.quiet = kwargs.get("quiet", False)
+        self.pool = kwargs.get("pool") or get_default_pool()
+        self.metrics = kwargs.get("metrics") or get_metrics()
+        self.retry = kwargs.get("retry") or get_default_retry_policy()
+        self.batch_size = kwargs.get("batch_size", self.DEFAULT_BATCH_SIZE)
+        self.max_attempts = kwargs.get("max_attempts", self.DEFAULT_MAX_ATTEMPTS)
+        self.backoff = kwargs.get("backoff", self.DEFAULT_BACKOFF)
+        self.max_backoff = kwargs.get("max_backoff", self.DEFAULT_MAX_BACKOFF)
+        ## Retries are left to the spool's backoff, rather than the Sender also retrying them in place
+        self.sender = Sender(**dict(
+            kwargs, quiet=self.quiet, yagmail=self.yagmail_args, pool=self.pool, metrics=self.metrics,
+            retry=RetryPolicy(max_attempts=1)
+        ))
+
+        self._stopped = threading.Event()
+
+    ## Methods
+
+    def _log(self, message):
+        logger.log(logging.DEBUG if self.quiet else logging.WARNING, message)
+
+
+    def _fail(self, message, exception, retryable=None):
+        attempts = message.attempts + 1
+        error = str(exception)
+        if(retryable is None):
+            retryable = self.retry.is_retryable(exception)
+
+        if(not retryable):
+            ## Another attempt would just fail the same way
+            self.spool.bury(message.id, error)
+            self._log("Message {0} to {1} was dead lettered after a permanent failure: {2}".format(
+                message.id, message.address, error
+            ))
+        elif(attempts >= self.max_attempts):
+            self.spool.bury(message.id, error)
+            self._log("Message {0} to {1} was dead lettered after {2} attempts: {3}".format(
+                message.id, message.address, attempts, error
+            ))
+        else:
+            self.spool.retry(message.id, error, min(self.backoff * (2 ** (attempts - 1)), self.max_backoff))
+
+
+    def _send_batch(self, connection, messages):
+        import smtplib
+
+        discard = False
+        try:
+            for position, message in enumerate(messages):
+                try:
+                    self.sender._check_deliverable(message.address)
+                    self.sender._deliver(connection, message.address, message.contents, message.subject)
+                except (RateLimitDeferred, CircuitOpenError) as e:
+                    ## Not the message's fault, so it waits out the backoff without being charged an attempt
+                    self.spool.release([message.id], self.backoff)
+                    self._log("Message {0} to {1} was put back: {2}".format(message.id, message.address, e))
+                except smtplib.SMTPServerDisconnected as e:
+                    ## deliver() already logged in again once, so the server's gone. Only this message was actually
+                    ## tried, so the rest go back as they were rather than each being charged for it.
+                    self._fail(message, e)
+                    self.spool.release([remaining.id for remaining in messages[position + 1:]])
+                    self._log("{0} Stopping the batch, the SMTP server disconnected.".format(e))
+                    discard = True
+                    break
+                except Exception as e:
+                    self._fail(message, e)
+                else:
+                    self.spool.ack(message.id)
+        finally:
+            self.sender._release(connection, discard)
+
+
+    def run_once(self):
+        """Claims and sends a single batch of messages, and returns the number of messages that were claimed."""
+
+        messages = self.spool.claim(self.batch_size)
+        if(not messages):
+            return 0
+
+        try:
+            connection = self.sender._open()
+        except Exception as e:
+            ## Couldn't get a connection at all, which isn't any message's fault, so they all get another try later
+            for message in messages:
+                self._fail(message, e, retryable=True)
+            self._log("{0} Unhandled error creating yagmail connection.".format(e))
+        else:
+            self._send_batch(connection, messages)
+
+        for status, count in self.spool.counts().items():
+            self.metrics.set_gauge(SPOOL_MESSAGES, count, status=status)
+
+        return len(messages)
+
+
+    def run(self, poll_interval=DEFAULT_POLL_INTERVAL, drain=False):
+        """Sends messages until stop() is called, polling the spool every poll_interval seconds when it's empty. If
+        drain is truthy, it returns as soon as there's nothing left to claim instead."""
+
+        self._stopped.clear()
+        while(not self._stopped.is_set()):
+            if(self.run_once()):
+                continue
+            if(drain):
+                return
+            self._stopped.wait(poll_interval)
+
+
+    def stop(self):
+        self._stopped.set()
+
+
+## Process wide spool, used by MailToSMS.enqueue() when no spool is given
+_default_spool = None
+_default_spool_lock = threading.Lock()
+
+
+def get_default_spool():
+    global _default_spool
+
+    if(_default_spool is None):
+        with _default_spool_lock:
+            if(_default_spool is None):
+                _default_spool = Spool()
+
+    return _default_spool
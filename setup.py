@@ -28,6 +28,14 @@ paramaters = dict(
         "phonenumbers >= 8.4 ",
         "click >= 6.7",
     ],
+    extras_require = {
+        "async": [
+            "aiosmtplib >= 1.1",
+        ],
+        "direct": [
+            "dnspython >= 2.0",
+        ],
+    },
     entry_points = {
         "console_scripts": [
             "mail_to_sms = mail_to_sms.mail_to_sms_cli:main",
@@ -0,0 +1,118 @@
+import asyncio
+import socket
+import unittest
+from mail_to_sms import AsyncMailToSMS, CircuitBreakerRegistry, RetryPolicy
+
+try:
+    import aiosmtplib
+    from aiosmtpd.controller import Controller
+except ImportError:
+    aiosmtplib = None
+    Controller = None
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class RecordingHandler:
+    def __init__(self):
+        self.envelopes = []
+        self.sessions = set()
+
+    async def handle_DATA(self, server, session, envelope):
+        self.envelopes.append(envelope)
+        self.sessions.add(id(session))
+        return "250 OK"
+
+
+@unittest.skipUnless(aiosmtplib and Controller, "aiosmtplib and aiosmtpd are required for the async tests")
+class TestAsyncMailToSMS(unittest.TestCase):
+    def setUp(self):
+        self.handler = RecordingHandler()
+        self.controller = Controller(self.handler, hostname="127.0.0.1", port=get_free_port())
+        self.controller.start()
+        self.addCleanup(self.controller.stop)
+
+        ## host, port, smtp_starttls, smtp_ssl, smtp_set_debuglevel, smtp_skip_login
+        self.yagmail_args = ["127.0.0.1", self.controller.port, False, False, 0, True]
+
+
+    def build(self, **kwargs):
+        return AsyncMailToSMS("sender@example.com", None, quiet=True, yagmail=self.yagmail_args, **kwargs)
+
+
+    def test_send(self):
+        async def run():
+            async with self.build(subject="hey") as mail:
+                return await mail.send_to(8663454897, "att", "hello world")
+
+        result = asyncio.run(run())
+
+        self.assertTrue(result.success)
+        self.assertEqual(result.address, "8663454897@txt.att.net")
+        self.assertEqual(len(self.handler.envelopes), 1)
+        self.assertEqual(self.handler.envelopes[0].rcpt_tos, ["8663454897@txt.att.net"])
+        self.assertIn(b"Subject: hey", self.handler.envelopes[0].content)
+
+
+    def test_send_many(self):
+        recipients = [(8663454897, "att"), ("abcdefg", "att"), ("8663454897", "sprint"), ("8663454897", "vzw")]
+
+        async def run():
+            async with self.build(concurrency=2, connections=1) as mail:
+                roster = [mail.recipient(number, carrier) for number, carrier in recipients]
+                self.assertIsNone(roster[1])
+                return await mail.send_many([recipient for recipient in roster if recipient], "hello")
+
+        results = asyncio.run(run())
+
+        self.assertEqual([result.success for result in results], [True, True, True])
+        self.assertEqual(
+            [result.address for result in results],
+            ["8663454897@txt.att.net", "8663454897@messaging.sprintpcs.com", "8663454897@vtext.com"]
+        )
+        self.assertEqual(len(self.handler.envelopes), 3)
+        ## With a single connection slot, every message should've gone through the same session
+        self.assertEqual(len(self.handler.sessions), 1)
+
+
+    def test_send_unreachable(self):
+        breakers = CircuitBreakerRegistry(failure_threshold=2)
+
+        async def run():
+            mail = AsyncMailToSMS(
+                "sender@example.com", None, quiet=True, yagmail=["127.0.0.1", get_free_port(), False, False, 0, True],
+                retry=RetryPolicy(max_attempts=2, base_delay=0), breakers=breakers
+            )
+            return await mail.send_to(8663454897, "att", "hello")
+
+        result = asyncio.run(run())
+
+        self.assertFalse(result.success)
+        self.assertIsNotNone(result.error)
+        ## Both attempts failed, which opened the relay's breaker
+        self.assertEqual(breakers.snapshot()["host:127.0.0.1"]["state"], "open")
+
+
+    def test_unsupported(self):
+        testTuples = [
+            ## (Keyworded args)
+            {"direct": object()},
+            {"identities": object()},
+            {"max_recipients": 10}
+        ]
+
+        for kwargs in testTuples:
+            try:
+                with self.assertRaises(ValueError):
+                    self.build(**kwargs)
+            except AssertionError as e:
+                print("Failed on:", kwargs)
+                raise e
+
+
+if(__name__ == "__main__"):
+    unittest.main()
@@ -0,0 +1,211 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+
+## Assumes this file is at /<root>/tests/benchmark.py, so make sure that /<root>/ can be imported from
+sys.path.insert(0, os.path.sep.join(os.path.realpath(__file__).split(os.path.sep)[:-2]))
+
+from mail_to_sms import (
+    MailToSMS, MailToSMSBatch, MailToSMSParallel, MessageTemplate, NumberCache, RetryPolicy, CircuitBreakerRegistry,
+    SMTPConnectionPool
+)
+from mail_to_sms.message_template import prepare_send
+from mail_to_sms.local_smtp_server import LocalSMTPServer
+from mail_to_sms.loadgen import SENDER, get_numbers, percentile
+
+## Usage: python tests/benchmark.py [--output results.json]
+##
+## Benchmarks address building and validation, along with end-to-end send throughput and latency against an in-process
+## SMTP server stand-in. The results are printed (or written) as JSON so they can be compared between releases.
+
+
+## Config
+NUMBER = 8663454897
+CARRIER = "att"
+
+
+def summarize(operations, elapsed, latencies=None):
+    summary = {
+        "operations": operations,
+        "seconds": elapsed,
+        "operations_per_second": operations / elapsed if elapsed else None,
+        "microseconds_per_operation": elapsed / operations * 1e6 if operations else None
+    }
+
+    if(latencies):
+        for percent in (50, 90, 99):
+            summary["p{0}_latency_ms".format(percent)] = percentile(latencies, percent) * 1000
+
+    return summary
+
+
+def time_call(func, iterations):
+    ## Best of a few repeats, which is the least noisy measure of what the call itself costs
+    elapsed = min(timeit.repeat(func, number=iterations, repeat=3))
+    return summarize(iterations, elapsed)
+
+
+def build_kwargs(server, **kwargs):
+    ## Keep retries and breakers out of the numbers, and never share state with the other benchmarks
+    kwargs.setdefault("quiet", True)
+    kwargs.setdefault("yagmail", server.yagmail_args)
+    kwargs.setdefault("retry", RetryPolicy(max_attempts=1))
+    kwargs.setdefault("breakers", CircuitBreakerRegistry())
+    return kwargs
+
+
+def benchmark_address_building(iterations):
+    mail = MailToSMS(None, None, quiet=True)
+    uncached = MailToSMS(None, None, quiet=True, number_cache=NumberCache(size=0))
+
+    return {
+        "load_gateways": time_call(mail._load_gateways, iterations),
+        "validate_number": time_call(lambda: mail._validate_number(NUMBER, "US"), iterations),
+        "validate_number_uncached": time_call(lambda: uncached._validate_number(NUMBER, "US"), iterations),
+        "validate_carrier": time_call(lambda: mail._validate_carrier(CARRIER), iterations),
+        "get_gateway": time_call(lambda: mail._get_gateway(CARRIER), iterations),
+        "build_address": time_call(lambda: mail._build_address(NUMBER, CARRIER), iterations),
+        "build_address_uncached": time_call(lambda: uncached._build_address(NUMBER, CARRIER), iterations)
+    }
+
+
+def benchmark_message_building(iterations):
+    ## yagmail's composer doesn't need a connection to build messages
+    import yagmail
+
+    composer = yagmail.SMTP(SENDER, None, smtp_skip_login=True)
+    address = "{0}@txt.att.net".format(NUMBER)
+    template = MessageTemplate("benchmark message for $number").bind(number=NUMBER)
+
+    return {
+        "yagmail": time_call(lambda: prepare_send(composer, address, "subject", "benchmark message"), iterations),
+        "template": time_call(lambda: prepare_send(composer, address, "subject", template), iterations)
+    }
+
+
+def benchmark_construction(server, iterations):
+    pool = SMTPConnectionPool()
+    kwargs = build_kwargs(server, pool=pool)
+
+    try:
+        return time_call(lambda: MailToSMS(NUMBER, CARRIER, SENDER, None, **kwargs), iterations)
+    finally:
+        pool.close()
+
+
+def benchmark_single(server, messages):
+    pool = SMTPConnectionPool()
+    latencies = []
+
+    started_at = time.perf_counter()
+    with MailToSMS(NUMBER, CARRIER, SENDER, None, **build_kwargs(server, pool=pool)) as mail:
+        for index in range(messages):
+            sent_at = time.perf_counter()
+            mail.send("benchmark message {0}".format(index))
+            latencies.append(time.perf_counter() - sent_at)
+    elapsed = time.perf_counter() - started_at
+
+    pool.close()
+    return summarize(messages, elapsed, latencies)
+
+
+def benchmark_batch(server, messages):
+    pool = SMTPConnectionPool()
+    recipients = [(number, CARRIER) for number in get_numbers(messages)]
+
+    started_at = time.perf_counter()
+    batch = MailToSMSBatch(recipients, SENDER, None, **build_kwargs(server, pool=pool))
+    results = batch.send("benchmark message")
+    elapsed = time.perf_counter() - started_at
+
+    pool.close()
+    summary = summarize(sum(result.success for result in results), elapsed)
+    summary["failed"] = len(results) - summary["operations"]
+    return summary
+
+
+def benchmark_parallel(server, messages, workers):
+    recipients = [(number, CARRIER) for number in get_numbers(messages)]
+
+    ## The gateway limit would otherwise cap every recipient (they're all on the same gateway) to a few in flight
+    parallel = MailToSMSParallel(recipients, SENDER, None, **build_kwargs(server, workers=workers, gateway_limit=workers))
+    report = parallel.send("benchmark message")
+    parallel.pool.close()
+
+    latencies = [result.latency for result in report if result.latency is not None]
+    summary = summarize(len(report.succeeded), report.elapsed, latencies)
+    summary["failed"] = len(report.failed)
+    summary["workers"] = workers
+    return summary
+
+
+def benchmark_async(server, messages, concurrency):
+    try:
+        from mail_to_sms import AsyncMailToSMS
+        async_mail = AsyncMailToSMS(SENDER, None, concurrency=concurrency, **build_kwargs(server))
+    except ImportError:
+        return None
+
+    numbers = get_numbers(messages)
+
+    async def run():
+        async with async_mail:
+            recipients = [async_mail.recipient(number, CARRIER) for number in numbers]
+            return await async_mail.send_many(recipients, "benchmark message")
+
+    started_at = time.perf_counter()
+    results = asyncio.run(run())
+    elapsed = time.perf_counter() - started_at
+
+    summary = summarize(sum(result.success for result in results), elapsed)
+    summary["failed"] = len(results) - summary["operations"]
+    summary["concurrency"] = concurrency
+    return summary
+
+
+def run(iterations, messages, workers, latency):
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {"iterations": iterations, "messages": messages, "workers": workers, "latency": latency},
+        "address_building": benchmark_address_building(iterations),
+        "message_building": benchmark_message_building(max(iterations // 10, 1))
+    }
+
+    with LocalSMTPServer(latency=latency, keep_messages=False) as server:
+        results["construction"] = benchmark_construction(server, max(iterations // 100, 1))
+        results["send"] = {
+            "single": benchmark_single(server, messages),
+            "batch": benchmark_batch(server, messages),
+            "parallel": benchmark_parallel(server, messages, workers),
+            "async": benchmark_async(server, messages, workers)
+        }
+        results["smtp_connections"] = server.connection_count
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks mail_to_sms, and outputs the results as JSON.")
+    parser.add_argument("--iterations", type=int, default=10000, help="Calls per address building benchmark.")
+    parser.add_argument("--messages", type=int, default=500, help="Messages per send benchmark.")
+    parser.add_argument("--workers", type=int, default=8, help="Threads (or async concurrency) for concurrent sends.")
+    parser.add_argument("--latency", type=float, default=0, help="Seconds the SMTP stand-in takes per message.")
+    parser.add_argument("--output", "-o", help="Write the results to this file instead of stdout.")
+    args = parser.parse_args()
+
+    results = json.dumps(run(args.iterations, args.messages, args.workers, args.latency), indent=4)
+    if(args.output):
+        with open(args.output, "w") as fd:
+            fd.write(results + "\n")
+    else:
+        print(results)
+
+
+if(__name__ == "__main__"):
+    main()
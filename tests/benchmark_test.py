@@ -0,0 +1,37 @@
+import unittest
+import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_run(self):
+        ## Just make sure that the benchmarks still run, the numbers themselves don't mean anything at this size
+        results = benchmark.run(iterations=10, messages=5, workers=2, latency=0)
+
+        self.assertIn("build_address", results["address_building"])
+        self.assertEqual(results["construction"]["operations"], 1)
+        for name in ("single", "batch", "parallel"):
+            try:
+                self.assertEqual(results["send"][name]["operations"], 5)
+            except AssertionError as e:
+                print(name, results["send"][name])
+                raise e
+
+
+    def test_percentile(self):
+        testTuples = [
+            ([], 50, None),
+            ([3, 1, 2], 50, 2),
+            ([3, 1, 2], 99, 3),
+            ([1], 0, 1)
+        ]
+
+        for values, percent, expected in testTuples:
+            try:
+                self.assertEqual(benchmark.percentile(values, percent), expected)
+            except AssertionError as e:
+                print(values, percent, expected)
+                raise e
+
+
+if(__name__ == "__main__"):
+    unittest.main()
@@ -0,0 +1,206 @@
+import email
+import mailbox
+import os
+import shutil
+import tempfile
+import unittest
+from email.mime.text import MIMEText
+from mail_to_sms import (
+    BounceIngester, CircuitBreakerRegistry, MailToSMSBatch, MetricsRegistry, ResultsStore, RetryPolicy,
+    SMTPConnectionPool
+)
+from mail_to_sms.bounces import parse_message
+from mail_to_sms.metrics import FAILED
+from imap_server import LocalIMAPServer
+from mail_to_sms.local_smtp_server import LocalSMTPServer
+
+
+def build_dsn(recipients, message_id):
+    ## An RFC 3464 delivery status notification, with a (Final-Recipient, Action, Status) triple for each recipient
+    blocks = ["Reporting-MTA: dns; mx.att.net"]
+    for address, action, status in recipients:
+        blocks.append("Final-Recipient: rfc822; {0}\nAction: {1}\nStatus: {2}\nDiagnostic-Code: smtp; {3} {2} nope".format(
+            address, action, status, "550" if status.startswith("5") else "450"
+        ))
+
+    return "\n".join([
+        "From: Mail Delivery System <MAILER-DAEMON@mx.att.net>",
+        "Subject: Undelivered Mail Returned to Sender",
+        "MIME-Version: 1.0",
+        'Content-Type: multipart/report; report-type=delivery-status; boundary="BOUNDARY"',
+        "",
+        "--BOUNDARY",
+        "Content-Type: text/plain",
+        "",
+        "This is the mail system at host mx.att.net.",
+        "--BOUNDARY",
+        "Content-Type: message/delivery-status",
+        "",
+        "\n\n".join(blocks),
+        "",
+        "--BOUNDARY",
+        "Content-Type: text/rfc822-headers",
+        "",
+        "From: alerts@example.com",
+        "Message-ID: {0}".format(message_id),
+        "Subject: alert",
+        "",
+        "--BOUNDARY--",
+        ""
+    ]).encode("utf-8")
+
+
+def build_message(sender, subject, text, **headers):
+    message = MIMEText(text)
+    message["From"] = sender
+    message["Subject"] = subject
+    for name, value in headers.items():
+        message[name.replace("_", "-")] = value
+    return message.as_bytes()
+
+
+class TestParseMessage(unittest.TestCase):
+    def test_dsn(self):
+        bounces = parse_message(build_dsn([
+            ("8663454897@txt.att.net", "failed", "5.1.1"),
+            ("8663454898@txt.att.net", "delayed", "4.4.1"),
+            ("8663454899@txt.att.net", "delivered", "2.0.0")
+        ], "<abc@example.com>"))
+
+        self.assertEqual(
+            [(bounce.address, bounce.message_id, bounce.status, bounce.permanent) for bounce in bounces],
+            [("8663454897@txt.att.net", "<abc@example.com>", "5.1.1", True),
+             ("8663454898@txt.att.net", "<abc@example.com>", "4.4.1", False)]
+        )
+        self.assertEqual(bounces[0].reason, "550 5.1.1 nope")
+
+
+    def test_other_messages(self):
+        testTuples = [
+            ## (Email, Expected (address, status, permanent, kind) tuples)
+            (build_message(
+                "MAILER-DAEMON@vtext.com",
+                "failure notice",
+                "Hi. This is the qmail-send program.\n\n<8663454897@vtext.com>:\n550 Invalid recipient\n\n"
+                "--- Below this line is a copy of the message.\nMessage-ID: <abc@example.com>\n"
+            ), [("8663454897@vtext.com", "550", True, "bounced")]),
+            (build_message(
+                "MAILER-DAEMON@vtext.com",
+                "Undeliverable: alert",
+                "Delivery to the following recipient has been delayed:\n\n8663454897@vtext.com\n\n"
+                "Message-ID: <abc@example.com>\n"
+            ), [("8663454897@vtext.com", None, False, "bounced")]),
+            (build_message(
+                "MAILER-DAEMON@vtext.com",
+                "failure notice",
+                "<8663454897@vtext.com>:\nRemote host said: 5.1.1 unknown user\nMessage-ID: <abc@example.com>\n"
+            ), [("8663454897@vtext.com", "5.1.1", True, "bounced")]),
+            (build_message("8663454897@txt.att.net", "", "Stop!", In_Reply_To="<abc@example.com>"),
+                [("8663454897@txt.att.net", None, True, "opted_out")]),
+            (build_message("8663454897@txt.att.net", "", "don't stop"), []),
+            (build_message("friend@example.com", "hello", ""), [])
+        ]
+
+        for message, expected in testTuples:
+            try:
+                bounces = parse_message(message)
+                self.assertEqual(
+                    [(bounce.address, bounce.status, bounce.permanent, bounce.kind) for bounce in bounces], expected
+                )
+                self.assertTrue(all(bounce.message_id == "<abc@example.com>" for bounce in bounces))
+            except AssertionError as e:
+                print("Failed on:", message, expected)
+                raise e
+
+
+class TestBounceIngester(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.store = ResultsStore(os.path.join(self.directory, "results.sqlite3"))
+        self.addCleanup(self.store.close)
+        self.metrics = MetricsRegistry()
+        self.recipients = [(8663454897, "att"), (8663454898, "att"), (8663454899, "verizon")]
+
+
+    def _send(self, server):
+        batch = MailToSMSBatch(
+            self.recipients,
+            "alerts@example.com",
+            None,
+            quiet=True,
+            yagmail=server.yagmail_args,
+            pool=SMTPConnectionPool(),
+            retry=RetryPolicy(max_attempts=1),
+            breakers=CircuitBreakerRegistry(),
+            metrics=self.metrics,
+            results=self.store
+        )
+        return batch.send("hello")
+
+
+    def _get_message_id(self, data):
+        return email.message_from_bytes(data)["Message-ID"]
+
+
+    def _bounces(self, server):
+        ## A DSN for the first recipient, and a STOP reply from the third
+        return [
+            build_dsn([("8663454897@txt.att.net", "failed", "5.1.1")], self._get_message_id(server.messages[0][1])),
+            build_message("8663454899@vtext.com", "", "STOP", In_Reply_To=self._get_message_id(server.messages[2][1])),
+            build_message("friend@example.com", "lunch?", "are you free?")
+        ]
+
+
+    def test_mbox(self):
+        with LocalSMTPServer() as server:
+            self.assertEqual([result.success for result in self._send(server)], [True, True, True])
+            message_ids = [self._get_message_id(data) for _, data in server.messages]
+            self.assertEqual(len(set(message_ids)), 3)
+            self.assertEqual(
+                [delivery.message_id for delivery in self.store.get_deliveries()], list(reversed(message_ids))
+            )
+
+            path = os.path.join(self.directory, "bounces.mbox")
+            mbox = mailbox.mbox(path)
+            for message in self._bounces(server):
+                mbox.add(message)
+            mbox.close()
+
+            report = BounceIngester(self.store).ingest_mbox(path)
+            self.assertEqual(report.messages, 3)
+            self.assertEqual(report.matched, 2)
+            self.assertEqual(report.undeliverable, ["8663454897@txt.att.net", "8663454899@vtext.com"])
+            bounced = self.store.get_deliveries(message_id=message_ids[0])[0]
+            self.assertEqual(bounced.bounce_status, "5.1.1")
+
+            ## Undeliverable addresses are skipped without sending anything
+            results = self._send(server)
+            self.assertEqual([result.success for result in results], [False, True, False])
+            self.assertIn("undeliverable", results[0].error)
+            self.assertEqual(server.message_count, 4)
+            self.assertEqual(self.metrics.get(FAILED, reason="undeliverable"), 2)
+
+
+    def test_imap(self):
+        with LocalSMTPServer() as smtp_server:
+            self._send(smtp_server)
+            bounces = self._bounces(smtp_server)
+
+        with LocalIMAPServer(bounces) as server:
+            ingester = BounceIngester(self.store)
+            report = ingester.ingest_imap(server.host, "user", "password", server.port, ssl=False)
+            self.assertEqual((report.messages, report.matched), (3, 2))
+            self.assertTrue(all("\\Seen" in message["flags"] for message in server.messages))
+
+            ## Emails that have already been read are skipped
+            self.assertEqual(ingester.ingest_imap(server.host, "user", "password", server.port, ssl=False).messages, 0)
+            self.assertEqual(len(self.store.get_undeliverable()), 2)
+
+            server.messages[0]["flags"].clear()
+            ingester.ingest_imap(server.host, "user", "password", server.port, ssl=False, delete=True)
+            self.assertEqual(len(server.messages), 2)
+
+
+if(__name__ == "__main__"):
+    unittest.main()
@@ -0,0 +1,38 @@
+import io
+import unittest
+from mail_to_sms import bulk
+
+
+class TestBulk(unittest.TestCase):
+    def test_read_rows(self):
+        testTuples = [
+            ("8663454897,att\n", None, [(1, "8663454897", "att", None, None)]),
+            ("8663454897,att,hello\n", bulk.CSV, [(1, "8663454897", "att", "hello", None)]),
+            ("message,carrier,number\nhi,vzw,8663454897\n", None, [(2, "8663454897", "vzw", "hi", None)]),
+            ("\n8663454897\n", None, [(2, "8663454897", None, None, "Expected a number and a carrier.")]),
+            ('\n{"number": 8663454897, "carrier": "att"}\n', None, [(2, 8663454897, "att", None, None)]),
+            ('{"number": 8663454897}\n', bulk.JSONL, [(1, 8663454897, None, None, "Expected a number and a carrier.")]),
+            ("[1, 2]\n", bulk.JSONL, [(1, None, None, None, "Expected a JSON object.")]),
+            ("", None, [])
+        ]
+
+        for lines, input_format, expected in testTuples:
+            try:
+                self.assertEqual([tuple(row) for row in bulk.read_rows(io.StringIO(lines), input_format)], expected)
+            except AssertionError as e:
+                print(lines, input_format, expected)
+                raise e
+
+
+    def test_read_rows_lazily(self):
+        ## Rows should only be read as they're needed
+        def lines():
+            yield "8663454897,att\n"
+            raise AssertionError("Read too far")
+
+        rows = bulk.read_rows(lines())
+        self.assertEqual(next(rows).number, "8663454897")
+
+
+if(__name__ == "__main__"):
+    unittest.main()
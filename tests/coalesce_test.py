@@ -0,0 +1,101 @@
+import threading
+import unittest
+from mail_to_sms import Coalescer, Sender, MetricsRegistry, SMTPConnectionPool, RetryPolicy, CircuitBreakerRegistry
+from mail_to_sms.metrics import COALESCED
+from fakes import FakeConnection, get_body
+
+
+class Clock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestCoalescer(unittest.TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+        self.metrics = MetricsRegistry()
+        self.sender = Sender(
+            "username",
+            "password",
+            quiet=True,
+            pool=SMTPConnectionPool(connection_factory=FakeConnection),
+            retry=RetryPolicy(max_attempts=1),
+            breakers=CircuitBreakerRegistry(),
+            metrics=self.metrics
+        )
+        self.clock = Clock()
+
+
+    def _sent(self):
+        return [
+            (recipients[0], get_body(message))
+            for connection in FakeConnection.instances for _, recipients, message in connection.smtp.sent
+        ]
+
+
+    def test_window(self):
+        coalescer = Coalescer(self.sender, window=60, clock=self.clock, metrics=self.metrics)
+
+        self.assertEqual(coalescer.add(8663454897, "att", "disk full"), "8663454897@txt.att.net")
+        self.clock.now = 10
+        coalescer.add("866-345-4897", "att", "cpu high")
+        coalescer.add("+18663454897", "att", "disk full")
+        coalescer.add(8663454897, "verizon", "disk full")
+        self.assertIsNone(coalescer.add(123, "att", "disk full"))
+
+        ## Nothing is due until the first message's window has passed
+        self.assertEqual(coalescer.flush(), [])
+        self.assertEqual(len(coalescer), 2)
+
+        self.clock.now = 60
+        results = coalescer.flush()
+        self.assertEqual([result.address for result in results], ["8663454897@txt.att.net"])
+        self.assertEqual(self._sent(), [("8663454897@txt.att.net", "disk full (x2)\ncpu high")])
+
+        self.clock.now = 70
+        self.assertEqual([result.address for result in coalescer.flush()], ["8663454897@vtext.com"])
+        self.assertEqual(len(coalescer), 0)
+        self.assertEqual(self.metrics.get(COALESCED), 2)
+
+        with self.assertRaises(TypeError):
+            coalescer.add(8663454897, "att", {"not": "text"})
+
+
+    def test_max_messages(self):
+        coalescer = Coalescer(self.sender, window=60, max_messages=2, separator=" | ", clock=self.clock)
+
+        for text in ("one", "two", "one", "three", "four"):
+            coalescer.add(8663454897, "att", text)
+
+        self.assertEqual([result.success for result in coalescer.close()], [True])
+        self.assertEqual(self._sent(), [("8663454897@txt.att.net", "one (x2) | two | (and 2 more)")])
+
+
+    def test_background(self):
+        with Coalescer(self.sender, window=0) as coalescer:
+            coalescer.add(8663454897, "att", "hello")
+
+        self.assertEqual(self._sent(), [("8663454897@txt.att.net", "hello")])
+        self.assertEqual(len(coalescer), 0)
+
+
+    def test_stop_before_run(self):
+        ## A stop() that beats the background thread to run() still stops it
+        coalescer = Coalescer(self.sender, window=0)
+        coalescer.stop()
+        thread = threading.Thread(target=coalescer.run, daemon=True)
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+        ## And it can be started again afterwards
+        with coalescer:
+            coalescer.add(8663454897, "att", "hello")
+        self.assertEqual(self._sent(), [("8663454897@txt.att.net", "hello")])
+
+
+if(__name__ == "__main__"):
+    unittest.main()
@@ -0,0 +1,203 @@
+import json
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+import unittest
+from http import client as http_client
+from mail_to_sms import CircuitBreakerRegistry, DaemonClient, DaemonError, MetricsRegistry, RetryPolicy, SendDaemon
+from mail_to_sms.daemon import MAX_BODY_SIZE, parse_request
+from mail_to_sms.local_smtp_server import LocalSMTPServer
+
+
+class TestSendDaemon(unittest.TestCase):
+    def setUp(self):
+        self.server = LocalSMTPServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+
+    def _start(self, **kwargs):
+        kwargs.setdefault("port", 0)
+        kwargs.update({
+            "quiet": True,
+            "yagmail": self.server.yagmail_args,
+            "retry": RetryPolicy(max_attempts=1),
+            "breakers": CircuitBreakerRegistry(),
+            "metrics": MetricsRegistry()
+        })
+        daemon = SendDaemon("sender@example.com", None, **kwargs)
+        daemon.start()
+        self.addCleanup(daemon.stop)
+        return daemon
+
+
+    def test_send(self):
+        daemon = self._start()
+
+        with DaemonClient(daemon.url) as client:
+            result = client.send(8663454897, "att", "hello")
+            self.assertTrue(result["success"], result)
+            self.assertEqual(result["address"], "8663454897@txt.att.net")
+            self.assertEqual(result["number"], "8663454897")
+
+            results = client.send_many([(8663454897, "vzw", "one"), ("123", "att", "two"), (8663454898, "att", "x")])
+            self.assertEqual([result["success"] for result in results], [True, False, True])
+            self.assertIn("Unable to build an address", results[1]["error"])
+
+            self.assertEqual(client.health()["status"], "ok")
+
+        self.assertEqual(self.server.message_count, 3)
+        ## The SMTP login was done up front, and the connection was kept for every request after it
+        self.assertEqual(self.server.connection_count, 1)
+
+
+    def test_unix_socket(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "mail_to_sms.sock")
+
+        daemon = self._start(socket_path=path)
+        self.assertIsNone(daemon.url)
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o600)
+
+        with DaemonClient(socket_path=path) as client:
+            self.assertTrue(client.send(8663454897, "att", "hello")["success"])
+
+        daemon.stop()
+        self.assertFalse(os.path.exists(path))
+
+        ## Only stale sockets are replaced, anything else at the path is left alone
+        with open(path, "w") as fd:
+            fd.write("not a socket")
+        with self.assertRaises(OSError):
+            self._start(socket_path=path)
+        with open(path, "r") as fd:
+            self.assertEqual(fd.read(), "not a socket")
+
+
+    def test_batching(self):
+        ## Everything queued together goes out together, and identical messages share a transaction
+        daemon = self._start(workers=1, max_recipients=10)
+        numbers = [8663454890 + index for index in range(5)]
+
+        results = daemon.submit([(number, "att", "hello") for number in numbers] + [(8663454897, "vzw", "hello")])
+
+        self.assertTrue(all(result.success for result in results), results)
+        self.assertEqual(sorted(len(recipients) for recipients, _ in self.server.messages), [1, 5])
+
+
+    def test_concurrent_clients(self):
+        daemon = self._start(workers=2)
+        failures = []
+
+        def send(index):
+            with DaemonClient(daemon.url) as client:
+                for offset in range(5):
+                    result = client.send(8663454800 + index * 10 + offset, "att", "hello")
+                    if(not result["success"]):
+                        failures.append(result)
+
+        threads = [threading.Thread(target=send, args=(index,)) for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(failures, [])
+        self.assertEqual(self.server.message_count, 20)
+
+
+    def test_bad_requests(self):
+        daemon = self._start()
+        host, port = daemon.address
+
+        testTuples = [
+            ## (Method, Path, Body, Expected status)
+            ("POST", "/send", "not json", 400),
+            ("POST", "/send", "[]", 400),
+            ("POST", "/send", '{"number": 8663454897, "carrier": "att"}', 400),
+            ("POST", "/nope", "{}", 404),
+            ("GET", "/nope", None, 404),
+            ("GET", "/metrics", None, 200)
+        ]
+
+        ## One connection for all of them, which also checks that errors leave it usable
+        connection = http_client.HTTPConnection(host, port, timeout=10)
+        self.addCleanup(connection.close)
+        for method, path, body, status in testTuples:
+            try:
+                connection.request(method, path, body)
+                response = connection.getresponse()
+                data = response.read()
+                self.assertEqual(response.status, status)
+                if(status == 400):
+                    self.assertIn("error", json.loads(data))
+            except AssertionError as e:
+                print("Failed on:", method, path, body, status)
+                raise e
+
+        with self.assertRaises(DaemonError):
+            DaemonClient("http://127.0.0.1:{0}".format(port), timeout=1)._request("POST", "/send", "[]")
+
+        ## Bodies that are too big are refused from their headers alone, before the daemon reads any of them
+        connection = http_client.HTTPConnection(host, port, timeout=10)
+        self.addCleanup(connection.close)
+        connection.putrequest("POST", "/send")
+        connection.putheader("Content-Length", str(MAX_BODY_SIZE + 1))
+        connection.endheaders()
+        response = connection.getresponse()
+        self.assertEqual(response.status, 413)
+        self.assertEqual(response.getheader("Connection"), "close")
+        self.assertIn("error", json.loads(response.read()))
+
+
+    def test_unreachable(self):
+        daemon = self._start()
+        url = daemon.url
+        daemon.stop()
+
+        with self.assertRaises(DaemonError):
+            DaemonClient(url, timeout=1).send(8663454897, "att", "hello")
+
+
+    def test_submit_after_stop(self):
+        ## A request that got past the handler's check before stop() shouldn't wait out the timeout
+        daemon = self._start(timeout=30)
+        daemon.stop()
+
+        started = time.monotonic()
+        results = daemon.submit([(8663454897, "att", "hello")])
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertFalse(results[0].success)
+        self.assertEqual(results[0].error, "The daemon is shutting down.")
+        self.assertEqual(daemon.health()["queued"], 0)
+
+
+    def test_parse_request(self):
+        testTuples = [
+            ## (Body, Expected messages)
+            ('{"number": 8663454897, "carrier": "att", "message": "hi"}', [("8663454897", "att", "hi")]),
+            ('[{"number": "1", "carrier": "a", "message": "b"}]', [("1", "a", "b")]),
+            ('{"messages": [{"number": "1", "carrier": "a", "message": "b"}]}', [("1", "a", "b")]),
+            ('{"number": "1", "carrier": "a", "message": ""}', ValueError),
+            ('["nope"]', ValueError),
+            ('{"messages": []}', ValueError)
+        ]
+
+        for body, expected in testTuples:
+            try:
+                if(expected is ValueError):
+                    with self.assertRaises(ValueError):
+                        parse_request(body)
+                else:
+                    self.assertEqual(parse_request(body.encode("utf-8")), expected)
+            except AssertionError as e:
+                print("Failed on:", body, expected)
+                raise e
+
+
+if(__name__ == "__main__"):
+    unittest.main()
@@ -0,0 +1,180 @@
+import email
+import os
+import shutil
+import tempfile
+import unittest
+from mail_to_sms import (
+    DirectDelivery, MailToSMSBatch, MXCache, MXRecord, MetricsRegistry, ResultsStore, RetryPolicy,
+    CircuitBreakerRegistry, SMTPConnectionPool
+)
+from mail_to_sms.direct import MXConnection
+from mail_to_sms.local_smtp_server import LocalSMTPServer
+
+
+class Clock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeResolver:
+    def __init__(self, records, ttl=300):
+        self.records = records
+        self.ttl = ttl
+        self.lookups = []
+
+    def __call__(self, domain):
+        self.lookups.append(domain)
+        if(domain not in self.records):
+            raise ValueError("NXDOMAIN")
+        return self.records[domain], self.ttl
+
+
+class TestDirectDelivery(unittest.TestCase):
+    def test_cache(self):
+        clock = Clock()
+        resolver = FakeResolver({
+            "txt.att.net": [MXRecord(20, "mx2.att.net"), MXRecord(10, "mx1.att.net")],
+            "empty.example.com": []
+        })
+        cache = MXCache(resolver, clock=clock)
+
+        self.assertEqual(cache.lookup("txt.att.net"), ["mx1.att.net", "mx2.att.net"])
+        self.assertEqual(cache.lookup("TXT.att.net"), ["mx1.att.net", "mx2.att.net"])
+        self.assertEqual(resolver.lookups, ["txt.att.net"])
+
+        ## Answers are kept for their TTL
+        clock.now += 299
+        cache.lookup("txt.att.net")
+        clock.now += 1
+        cache.lookup("txt.att.net")
+        self.assertEqual(resolver.lookups, ["txt.att.net"] * 2)
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+        ## Failures are cached too, for the negative TTL
+        for domain in ("nope.example.com", "empty.example.com"):
+            for _ in range(2):
+                with self.assertRaises(LookupError):
+                    cache.lookup(domain)
+        self.assertEqual(resolver.lookups.count("nope.example.com"), 1)
+        clock.now += MXCache.DEFAULT_NEGATIVE_TTL
+        with self.assertRaises(LookupError):
+            cache.lookup("nope.example.com")
+        self.assertEqual(resolver.lookups.count("nope.example.com"), 2)
+
+
+    def test_ttl_bounds(self):
+        testTuples = [
+            (0, 10),
+            (60, 60),
+            (10000, 100)
+        ]
+
+        for ttl, kept_for in testTuples:
+            try:
+                clock = Clock()
+                resolver = FakeResolver({"vtext.com": [(10, "mx.vtext.com")]}, ttl)
+                cache = MXCache(resolver, min_ttl=10, max_ttl=100, clock=clock)
+
+                cache.lookup("vtext.com")
+                clock.now = kept_for - 1
+                cache.lookup("vtext.com")
+                clock.now = kept_for
+                cache.lookup("vtext.com")
+                self.assertEqual(len(resolver.lookups), 2)
+            except AssertionError as e:
+                print("Failed on:", ttl, kept_for)
+                raise e
+
+
+    def test_send(self):
+        ## 127.0.0.2 is loopback too, but nothing listens on it so it refuses the connection
+        resolver = FakeResolver({
+            "txt.att.net": [(5, "127.0.0.2"), (10, "127.0.0.1")],
+            "vtext.com": [(10, "localhost")],
+            "messaging.sprintpcs.com": [(10, "127.0.0.1")]
+        })
+        recipients = [(8663454897, "att"), (8663454897, "verizon"), (8663454897, "sprint"), (8663454897, "cricket")]
+
+        with LocalSMTPServer() as server:
+            direct = DirectDelivery("alerts@example.com", resolver, port=server.port, timeout=5)
+            self.addCleanup(direct.close)
+            kwargs = {
+                "quiet": True,
+                "direct": direct,
+                "retry": RetryPolicy(max_attempts=1),
+                "breakers": CircuitBreakerRegistry(),
+                "metrics": MetricsRegistry()
+            }
+
+            batch = MailToSMSBatch(recipients, None, None, **kwargs)
+            for _ in range(2):
+                results = batch.send("hello")
+                self.assertEqual([result.success for result in results], [True, True, True, False])
+            self.assertIn("mms.cricketwireless.net", results[3].error)
+
+            ## One session per MX host (AT&T and Sprint share one), and they're reused by the second send
+            self.assertEqual(server.connection_count, 2)
+            self.assertEqual(
+                [recipients for recipients, _ in server.messages[:3]],
+                [["8663454897@txt.att.net"], ["8663454897@vtext.com"], ["8663454897@messaging.sprintpcs.com"]]
+            )
+            self.assertEqual(resolver.lookups.count("txt.att.net"), 1)
+
+
+    def test_closed_sessions(self):
+        ## Sessions that get closed mid lease are discarded rather than leaking their pool slot, so a host that keeps
+        ## failing never exhausts the pool
+        resolver = FakeResolver({"txt.att.net": [(10, "127.0.0.1")]})
+
+        with LocalSMTPServer() as server:
+            pool = SMTPConnectionPool(size=1, acquire_timeout=1, connection_factory=MXConnection)
+            direct = DirectDelivery("alerts@example.com", resolver, port=server.port, timeout=5, pool=pool)
+            self.addCleanup(direct.close)
+
+            lease = direct.lease()
+            for _ in range(3):
+                connection = lease.for_address("8663454897@txt.att.net")
+                self.assertFalse(connection.is_closed)
+                connection.close()
+            lease.close()
+
+            self.assertEqual(server.connection_count, 3)
+            self.assertEqual(list(pool.stats().values()), [{"open": 1, "idle": 1}])
+
+
+    def test_send_with_results(self):
+        ## Direct sessions build their own messages, so they have to carry the recorded Message-ID too
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        store = ResultsStore(os.path.join(directory, "results.sqlite3"))
+        self.addCleanup(store.close)
+
+        with LocalSMTPServer() as server:
+            direct = DirectDelivery("alerts@example.com", FakeResolver({"txt.att.net": [(10, "127.0.0.1")]}),
+                                    port=server.port, timeout=5)
+            self.addCleanup(direct.close)
+
+            for max_recipients in (None, 10):
+                batch = MailToSMSBatch(
+                    [(8663454897, "att")], None, None, quiet=True, direct=direct, results=store,
+                    max_recipients=max_recipients, retry=RetryPolicy(max_attempts=1), breakers=CircuitBreakerRegistry()
+                )
+                try:
+                    self.assertEqual([result.success for result in batch.send("hello")], [True])
+                except AssertionError as e:
+                    print("Failed on:", max_recipients)
+                    raise e
+
+            deliveries = store.get_deliveries(address="8663454897@txt.att.net")
+            self.assertEqual(len(deliveries), 2)
+            self.assertEqual(
+                sorted(email.message_from_bytes(data)["Message-ID"] for _, data in server.messages),
+                sorted(delivery.message_id for delivery in deliveries)
+            )
+
+
+if(__name__ == "__main__"):
+    unittest.main()
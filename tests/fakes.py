@@ -0,0 +1,82 @@
+import smtplib
+
+
+class FakeSMTP:
+    ## Stands in for the smtplib.SMTP that a yagmail connection holds, and keeps every message that it's sent as a
+    ## (sender, recipients, message) tuple. See FakeConnection for how to make its sends fail, or set error to an
+    ## exception to raise on every send.
+    def __init__(self, errors=None, fail_for=(), fail_code=550, disconnect_for=()):
+        self.errors = errors if errors is not None else []
+        self.error = None
+        self.fail_for = fail_for
+        self.fail_code = fail_code
+        self.disconnect_for = disconnect_for
+        self.healthy = True
+        self.attempts = 0
+        self.sent = []
+
+    def noop(self):
+        if(not self.healthy):
+            raise smtplib.SMTPServerDisconnected("gone")
+        return (250, b"OK")
+
+    def sendmail(self, sender, recipients, message):
+        self.attempts += 1
+        error = self.errors.pop(0) if self.errors else self.error
+        if(error):
+            raise error
+        if(set(recipients) & set(self.disconnect_for)):
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        if(set(recipients) & set(self.fail_for)):
+            raise smtplib.SMTPRecipientsRefused({recipient: (self.fail_code, b"try later") for recipient in recipients})
+        self.sent.append((sender, recipients, message))
+
+
+class FakeConnection:
+    ## Mimics the parts of yagmail.SMTP that Sender, SMTPConnectionPool, and SpoolWorker rely on. The class attributes
+    ## apply to every connection's FakeSMTP, so set them before sending, and reset() them in setUp().
+    ##   errors: Exceptions (or None for a success) to respond to each send with, shared between every connection
+    ##   fail_for: Recipients to refuse with fail_code
+    ##   disconnect_for: Recipients to hang up on
+    ## Subclasses can set smtp_class to a FakeSMTP subclass of their own.
+    smtp_class = FakeSMTP
+    instances = []
+    errors = []
+    fail_for = ()
+    fail_code = 550
+    disconnect_for = ()
+
+    def __init__(self, user=None, password=None, host="smtp.gmail.com", port=None, *args):
+        ## The same leading args as yagmail.SMTP, so that the pool keys its connections the same way
+        self.user = user or "sender@example.com"
+        self.password = password
+        self.host = host
+        self.smtp = None
+        self.is_closed = None
+        self.logins = 0
+        FakeConnection.instances.append(self)
+
+    @classmethod
+    def reset(cls):
+        FakeConnection.instances = []
+        FakeConnection.errors = []
+        FakeConnection.fail_for = ()
+        FakeConnection.fail_code = 550
+        FakeConnection.disconnect_for = ()
+
+    def login(self):
+        self.logins += 1
+        self.smtp = self.smtp_class(FakeConnection.errors, self.fail_for, self.fail_code, self.disconnect_for)
+        self.is_closed = False
+
+    def prepare_send(self, to=None, subject=None, contents=None, message_id=None):
+        return [to], "Subject: {0}\n\n{1}".format(subject, contents)
+
+    def close(self):
+        self.is_closed = True
+
+
+def get_body(message):
+    """Returns the contents of a message built by FakeConnection.prepare_send(), without its subject line."""
+
+    return message.split("\n\n", 1)[1]
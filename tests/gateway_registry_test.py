@@ -0,0 +1,214 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from mail_to_sms import GatewayRegistry, MailToSMS, Sender, get_gateway_registry, reload_gateway_registry
+from mail_to_sms.gateway_registry import GATEWAYS_ENV_VAR, COMPILED_DIR_ENV_VAR, validate_gateways
+
+
+class TestGatewayRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = GatewayRegistry([
+            {"carrier_names": ["att", "at&t"], "sms": "txt.att.net", "mms": "mms.att.net"},
+            {"carrier_names": ["fi"], "mms": "msg.fi.google.com"},
+            {"carrier_names": ["sms only"], "sms": "sms.example.com"},
+            ## Duplicate alias, the first gateway should win
+            {"carrier_names": ["att"], "sms": "duplicate.example.com"}
+        ])
+
+
+    def test_resolve(self):
+        testTuples = [
+            ## (Carrier, MMS, Expected Return)
+            ## Good inputs
+            ("att", False, "txt.att.net"),
+            ("att", True, "mms.att.net"),
+            ("at&t", False, "txt.att.net"),
+            (" att ", False, "txt.att.net"),
+            ("fi", False, "msg.fi.google.com"),
+            ("fi", True, "msg.fi.google.com"),
+            ("sms only", True, "sms.example.com"),
+            ## Bad inputs
+            (None, False, None),
+            (12345, True, None),
+            ("", False, None),
+            ("at t", False, None)
+        ]
+
+        for carrier, mms, result in testTuples:
+            try:
+                self.assertEqual(self.registry.resolve(carrier, mms), result)
+            except AssertionError as e:
+                ## Catch the error and dump some useful info, then re-raise it so that the test fails properly
+                print("AssertionError: {0} for args: {1}, {2}, {3}.".format(e, carrier, mms, result))
+                raise AssertionError(e)
+
+
+    def test_contains(self):
+        self.assertIn("att", self.registry)
+        self.assertIn("at&t ", self.registry)
+        self.assertNotIn("verizon", self.registry)
+        self.assertNotIn(None, self.registry)
+        self.assertEqual(len(self.registry), 4)
+
+
+    def test_immutable(self):
+        with self.assertRaises(AttributeError):
+            self.registry.gateways = ()
+        with self.assertRaises(TypeError):
+            self.registry._index["new"] = None
+
+
+    def test_shared_registry(self):
+        registries = []
+        threads = [threading.Thread(target=lambda: registries.append(get_gateway_registry())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(set(id(registry) for registry in registries)), 1)
+        self.assertIs(registries[0], get_gateway_registry())
+
+
+    def test_reload(self):
+        original = get_gateway_registry()
+        sender = Sender(quiet=True)
+        reloaded = reload_gateway_registry()
+
+        self.assertIsNot(original, reloaded)
+        self.assertIs(reloaded, get_gateway_registry())
+        self.assertEqual(original.carriers(), reloaded.carriers())
+
+        ## Senders keep the registry they were made with, and don't look it up again for every recipient
+        with mock.patch("mail_to_sms.gateway_registry.get_gateway_registry") as get:
+            self.assertEqual(sender.recipient(8663454897, "att").get_address(), "8663454897@txt.att.net")
+            get.assert_not_called()
+        self.assertIs(sender.gateways, original)
+
+
+
+class TestGatewayFiles(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.compiled_dir = os.path.join(self.directory, "compiled")
+
+        self.regional = self._write("regional.json", [
+            {"carrier_names": ["rogers"], "sms": "pcs.rogers.com", "mms": "MMS.Rogers.com"},
+            ## Overrides the bundled AT&T gateways
+            {"carrier_names": ["att "], "sms": "regional.att.example.com"}
+        ])
+        self.overrides = self._write("overrides.json", [{"carrier_names": ["rogers"], "sms": "override.example.com"}])
+
+
+    def _write(self, name, gateways):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as fd:
+            json.dump({"gateways": gateways}, fd)
+        return path
+
+
+    def _compiled_files(self):
+        return os.listdir(self.compiled_dir) if os.path.isdir(self.compiled_dir) else []
+
+
+    def test_validate(self):
+        testTuples = [
+            ## (Gateways, Expected error)
+            ({"carrier_names": ["x"]}, "list of gateways"),
+            (["x"], "gateway #1 should be an object"),
+            ([{"sms": "sms.example.com"}], "non-empty list of 'carrier_names'"),
+            ([{"carrier_names": ["x", " "], "sms": "sms.example.com"}], "invalid carrier name"),
+            ([{"carrier_names": ["x"]}], "needs an 'sms' or 'mms' domain"),
+            ([{"carrier_names": ["x"], "sms": "sms.example.com"}, {"carrier_names": ["y"], "mms": "no domain"}],
+                "gateway #2 has an invalid 'mms' domain"),
+            ([{"carrier_names": ["x"], "sms": 12345}], "invalid 'sms' domain")
+        ]
+
+        for gateways, error in testTuples:
+            try:
+                with self.assertRaises(ValueError) as context:
+                    validate_gateways(gateways, "test.json")
+                self.assertIn(error, str(context.exception))
+                self.assertTrue(str(context.exception).startswith("test.json"))
+            except AssertionError as e:
+                print("Failed on:", gateways, error)
+                raise e
+
+
+    def test_merge(self):
+        registry = GatewayRegistry.from_files(
+            [MailToSMS.GATEWAYS_JSON_PATH, self.regional, self.overrides], compiled_dir=""
+        )
+
+        self.assertEqual(registry.resolve("rogers"), "override.example.com")
+        self.assertEqual(registry.resolve("rogers", True), "override.example.com")
+        self.assertEqual(registry.resolve("att"), "regional.att.example.com")
+        ## Aliases that weren't overridden still resolve to the bundled gateway
+        self.assertEqual(registry.resolve("at&t"), "txt.att.net")
+        self.assertEqual(registry.resolve("verizon"), "vtext.com")
+        self.assertEqual(self._compiled_files(), [])
+
+
+    def test_compiled(self):
+        paths = [MailToSMS.GATEWAYS_JSON_PATH, self.regional]
+        built = GatewayRegistry.from_files(paths, self.compiled_dir)
+        self.assertEqual(len(self._compiled_files()), 1)
+
+        ## Loading the compiled registry skips parsing the files altogether
+        with mock.patch("mail_to_sms.gateway_registry.load_gateways_file") as load:
+            compiled = GatewayRegistry.from_files(paths, self.compiled_dir)
+            load.assert_not_called()
+        self.assertEqual(compiled.gateways, built.gateways)
+        self.assertEqual(compiled.carriers(), built.carriers())
+        self.assertEqual(compiled.resolve("rogers", True), "mms.rogers.com")
+        self.assertEqual(compiled.get_mms_domain("pcs.rogers.com"), "mms.rogers.com")
+        with self.assertRaises(TypeError):
+            compiled._index["new"] = None
+
+        ## The compiled file is plain JSON, keyed on a hash of each file's contents
+        with open(os.path.join(self.compiled_dir, self._compiled_files()[0]), "r") as fd:
+            self.assertEqual([path for path, _ in json.load(fd)["sources"]], [os.path.abspath(path) for path in paths])
+
+        ## Changing a file makes the compiled registry stale
+        self._write("regional.json", [{"carrier_names": ["rogers"], "sms": "changed.example.com"}])
+        os.utime(self.regional, ns=(0, 0))
+        self.assertEqual(GatewayRegistry.from_files(paths, self.compiled_dir).resolve("rogers"), "changed.example.com")
+        self.assertEqual(len(self._compiled_files()), 1)
+
+        ## As does a corrupt compiled file
+        with open(os.path.join(self.compiled_dir, self._compiled_files()[0]), "wb") as fd:
+            fd.write(b"garbage")
+        self.assertEqual(GatewayRegistry.from_files(paths, self.compiled_dir).resolve("rogers"), "changed.example.com")
+
+
+    def test_environment(self):
+        environment = {GATEWAYS_ENV_VAR: os.pathsep.join([self.regional, ""]), COMPILED_DIR_ENV_VAR: self.compiled_dir}
+        with mock.patch.dict(os.environ, environment):
+            registry = get_gateway_registry()
+            self.assertEqual(registry.resolve("rogers"), "pcs.rogers.com")
+            self.assertIs(registry, get_gateway_registry())
+            self.assertIsNot(registry, get_gateway_registry(extra_paths=[self.overrides]))
+
+            mail = MailToSMS(4165551234, "rogers", None, None, quiet=True, gateway_files=[self.overrides])
+            self.assertEqual(mail.address, "4165551234@override.example.com")
+
+        self.assertNotIn("rogers", get_gateway_registry())
+        self.assertEqual(len(self._compiled_files()), 2)
+
+
+    def test_invalid_file(self):
+        broken = self._write("broken.json", [{"carrier_names": ["broken"]}])
+
+        with self.assertRaises(ValueError) as context:
+            reload_gateway_registry(extra_paths=[broken])
+        self.assertIn(broken, str(context.exception))
+        self.assertIsNone(MailToSMS(4165551234, "att", None, None, quiet=True, gateway_files=[broken]).gateways)
+
+
+if(__name__ == "__main__"):
+    unittest.main()
@@ -0,0 +1,214 @@
+import smtplib
+import unittest
+from mail_to_sms import (
+    Identity, IdentityPool, IdentityPoolExhausted, MailToSMSBatch, MetricsRegistry, SMTPConnectionPool, RetryPolicy,
+    CircuitBreakerRegistry
+)
+from mail_to_sms.identities import AUTH, QUOTA, LEAST_LOADED, IdentityLease
+from mail_to_sms.metrics import FAILOVERS
+from fakes import FakeConnection
+
+
+class IdentityConnection(FakeConnection):
+    ## A FakeConnection with per user failures
+    login_errors = {}
+    send_errors = {}
+
+    def login(self):
+        if(self.user in self.login_errors):
+            raise self.login_errors[self.user]
+        super(IdentityConnection, self).login()
+        self.smtp.error = self.send_errors.get(self.user)
+
+
+class Clock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestIdentityPool(unittest.TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+        IdentityConnection.login_errors = {}
+        IdentityConnection.send_errors = {}
+        self.metrics = MetricsRegistry()
+        self.clock = Clock(1000.0)
+
+
+    def _pick(self, identities, count):
+        picked = []
+        for _ in range(count):
+            identity = identities.acquire()
+            identities.release(identity)
+            picked.append(identity.name)
+
+        return picked
+
+
+    def test_identity(self):
+        testTuples = [
+            (Identity("user", "password"), ["user", "password"], "user"),
+            (Identity("user", "password", ["smtp.example.com", 587]), ["user", "password", "smtp.example.com", 587], "user"),
+            (Identity(yagmail=["smtp.example.com"]), ["smtp.example.com"], "smtp.example.com"),
+            (Identity("user", name="primary"), ["user", None], "primary")
+        ]
+
+        for identity, yagmail_args, name in testTuples:
+            try:
+                self.assertEqual(identity.yagmail_args, yagmail_args)
+                self.assertEqual(identity.name, name)
+            except AssertionError as e:
+                print("Failed on:", identity, yagmail_args, name)
+                raise e
+
+
+    def test_round_robin(self):
+        identities = IdentityPool([Identity("a"), Identity("b", weight=2)], clock=self.clock, metrics=self.metrics)
+
+        ## Smooth weighted round robin interleaves the heavier identity rather than sending it runs of traffic
+        self.assertEqual(self._pick(identities, 6), ["b", "a", "b", "b", "a", "b"])
+
+        with self.assertRaises(ValueError):
+            IdentityPool([Identity("a")], strategy="random")
+        with self.assertRaises(ValueError):
+            IdentityPool([])
+
+
+    def test_least_loaded(self):
+        identities = IdentityPool(
+            [Identity("a"), Identity("b"), Identity("c", weight=2)], strategy=LEAST_LOADED, clock=self.clock
+        )
+
+        held = [identities.acquire() for _ in range(4)]
+        self.assertEqual(sorted(identity.name for identity in held), ["a", "b", "c", "c"])
+        self.assertEqual(identities.snapshot()["c"]["in_flight"], 2)
+
+        identities.release(held[0])
+        self.assertIs(identities.acquire(), held[0])
+
+
+    def test_quota(self):
+        identities = IdentityPool([Identity("a", quota=2), Identity("b", quota=1)], clock=self.clock)
+        a, b = identities.identities
+
+        identities.record_sent(a, 2)
+        self.assertEqual(self._pick(identities, 2), ["b", "b"])
+
+        identities.record_sent(b)
+        with self.assertRaises(IdentityPoolExhausted):
+            identities.acquire()
+
+        ## Quotas start over in the next period
+        self.clock.now += IdentityPool.DEFAULT_QUOTA_PERIOD
+        self.assertEqual(identities.snapshot()["a"], {"sent": 0, "quota": 2, "in_flight": 0, "available": True})
+
+
+    def test_mark_failed(self):
+        identities = IdentityPool([Identity("a"), Identity("b")], cooldown=60, clock=self.clock, metrics=self.metrics)
+        a, b = identities.identities
+
+        identities.mark_failed(a, AUTH)
+        identities.mark_failed(b, QUOTA)
+        with self.assertRaises(IdentityPoolExhausted):
+            identities.acquire()
+
+        self.clock.now += 60
+        self.assertEqual(self._pick(identities, 2), ["a", "a"])
+        self.assertEqual(self.metrics.get(FAILOVERS, identity="b", reason=QUOTA), 1)
+
+        ## Quota failures last until the end of the period
+        self.clock.now = IdentityPool.DEFAULT_QUOTA_PERIOD
+        self.assertEqual(sorted(self._pick(identities, 2)), ["a", "b"])
+
+
+    def test_get_failure_kind(self):
+        identities = IdentityPool([Identity("a")])
+
+        testTuples = [
+            (smtplib.SMTPAuthenticationError(535, b"5.7.8 Username and Password not accepted"), AUTH),
+            (smtplib.SMTPSenderRefused(530, b"5.7.0 Authentication Required", "a"), AUTH),
+            (smtplib.SMTPDataError(550, b"5.4.5 Daily user sending quota exceeded."), QUOTA),
+            (smtplib.SMTPDataError(421, b"4.7.0 Rate limit exceeded, try again later"), QUOTA),
+            (smtplib.SMTPRecipientsRefused({"5551234567@txt.att.net": (550, b"Sending quota exceeded")}), QUOTA),
+            (smtplib.SMTPRecipientsRefused({"5551234567@txt.att.net": (550, b"No such user")}), None),
+            (smtplib.SMTPServerDisconnected("gone"), None),
+            (ValueError("quota"), None)
+        ]
+
+        for exception, kind in testTuples:
+            try:
+                self.assertEqual(identities.get_failure_kind(exception), kind)
+            except AssertionError as e:
+                print("Failed on:", exception, kind)
+                raise e
+
+
+    def test_failover(self):
+        IdentityConnection.login_errors = {"locked": smtplib.SMTPAuthenticationError(535, b"5.7.8 Bad credentials")}
+        IdentityConnection.send_errors = {"busy": smtplib.SMTPDataError(550, b"5.4.5 Daily user sending quota exceeded.")}
+        identities = IdentityPool(
+            [Identity("locked", "password"), Identity("busy", "password"), Identity("spare", "password", quota=2)],
+            clock=self.clock,
+            metrics=self.metrics
+        )
+        kwargs = {
+            "quiet": True,
+            "pool": SMTPConnectionPool(connection_factory=IdentityConnection),
+            "retry": RetryPolicy(max_attempts=1),
+            "breakers": CircuitBreakerRegistry(),
+            "metrics": self.metrics,
+            "identities": identities
+        }
+
+        recipients = [(8663454897, "att"), (8663454897, "verizon"), (8663454897, "sprint")]
+        batch = MailToSMSBatch(recipients, None, None, "hello", **kwargs)
+
+        ## The first two identities fail over to the spare, which runs out of quota before the last recipient
+        self.assertEqual([result.success for result in batch.results], [True, True, False])
+        self.assertIn("Every identity", batch.results[2].error)
+        self.assertEqual([connection.user for connection in FakeConnection.instances], ["locked", "busy", "spare"])
+        self.assertEqual(len(FakeConnection.instances[2].smtp.sent), 2)
+
+        self.assertEqual(self.metrics.get(FAILOVERS, identity="locked", reason=AUTH), 1)
+        self.assertEqual(self.metrics.get(FAILOVERS, identity="busy", reason=QUOTA), 1)
+        snapshot = identities.snapshot()
+        self.assertEqual(snapshot["spare"], {"sent": 2, "quota": 2, "in_flight": 0, "available": False})
+        self.assertFalse(snapshot["locked"]["available"])
+
+
+    def test_switch_release(self):
+        ## Connections are only discarded when the identity's credentials failed, ones that are just out of quota are
+        ## left in the pool for when the quota resets
+        names = ["second", "third", "fourth"]
+        identities = IdentityPool(
+            [Identity("first", "password", quota=1)] + [Identity(name, "password") for name in names],
+            clock=self.clock,
+            metrics=self.metrics
+        )
+        pool = SMTPConnectionPool(connection_factory=FakeConnection)
+        lease = IdentityLease(identities, pool)
+
+        lease.record_sent()
+        lease.check_available()
+        self.assertEqual(lease.identity.name, "second")
+        self.assertFalse(FakeConnection.instances[0].is_closed)
+
+        self.assertTrue(lease.fail_over(smtplib.SMTPDataError(550, b"5.4.5 Daily user sending quota exceeded.")))
+        self.assertEqual(lease.identity.name, "third")
+        self.assertFalse(FakeConnection.instances[1].is_closed)
+
+        connection = lease.connection
+        self.assertTrue(lease.fail_over(smtplib.SMTPAuthenticationError(535, b"5.7.8 Bad credentials")))
+        self.assertTrue(connection.is_closed)
+        self.assertEqual(lease.identity.name, "fourth")
+        lease.close()
+
+        ## Only the connection that failed to authenticate was closed, the others can be leased again
+        self.assertEqual(sum(stats["idle"] for stats in pool.stats().values()), 3)
+
+
+if(__name__ == "__main__"):
+    unittest.main()
@@ -0,0 +1,126 @@
+import re
+import socketserver
+import threading
+
+
+class _IMAPHandler(socketserver.StreamRequestHandler):
+    ## Speaks just enough IMAP4rev1 for imaplib to log in, and search, fetch, flag, and expunge by UID
+
+    def _send(self, line):
+        self.wfile.write(line if isinstance(line, bytes) else line.encode("utf-8"))
+
+
+    def _reply(self, tag, status="OK", text="Completed"):
+        self._send("{0} {1} {2}\r\n".format(tag, status, text))
+
+
+    def handle(self):
+        server = self.server.stand_in
+        self._send("* OK IMAP4rev1 stand-in ready\r\n")
+
+        while True:
+            line = self.rfile.readline()
+            if(not line):
+                return
+
+            parts = line.decode("utf-8").strip().split(" ")
+            tag, command, args = parts[0], parts[1].upper() if len(parts) > 1 else "", parts[2:]
+            if(command == "CAPABILITY"):
+                self._send("* CAPABILITY IMAP4rev1\r\n")
+                self._reply(tag)
+            elif(command == "LOGIN"):
+                username, password = (arg.strip('"') for arg in args[:2])
+                if((username, password) == (server.username, server.password)):
+                    self._reply(tag)
+                else:
+                    self._reply(tag, "NO", "Invalid credentials")
+            elif(command == "SELECT"):
+                self._send("* {0} EXISTS\r\n* 0 RECENT\r\n* FLAGS (\\Seen \\Deleted)\r\n".format(len(server.messages)))
+                self._reply(tag, "OK", "[READ-WRITE] Selected")
+            elif(command == "UID"):
+                self._handle_uid(tag, args[0].upper(), args[1:], server)
+            elif(command == "EXPUNGE"):
+                with server.lock:
+                    server.messages = [message for message in server.messages if "\\Deleted" not in message["flags"]]
+                self._reply(tag)
+            elif(command == "LOGOUT"):
+                self._send("* BYE Logging out\r\n")
+                self._reply(tag)
+                return
+            else:
+                self._reply(tag, "BAD", "Command not implemented")
+
+
+    def _handle_uid(self, tag, command, args, server):
+        with server.lock:
+            messages = list(server.messages)
+
+        if(command == "SEARCH"):
+            uids = [str(message["uid"]) for message in messages if "\\Seen" not in message["flags"]]
+            self._send("* SEARCH{0}\r\n".format("".join(" " + uid for uid in uids)))
+        elif(command in ("FETCH", "STORE")):
+            uid = int(args[0])
+            for sequence, message in enumerate(messages, 1):
+                if(message["uid"] != uid):
+                    continue
+                if(command == "FETCH"):
+                    self._send("* {0} FETCH (UID {1} RFC822 {{{2}}}\r\n".format(sequence, uid, len(message["data"])))
+                    self._send(message["data"] + b")\r\n")
+                else:
+                    message["flags"].update(re.findall(r"\\\w+", " ".join(args[2:])))
+                    self._send("* {0} FETCH (UID {1} FLAGS ({2}))\r\n".format(
+                        sequence, uid, " ".join(sorted(message["flags"]))
+                    ))
+
+        self._reply(tag)
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class LocalIMAPServer:
+    """LocalIMAPServer
+
+    A tiny in-process IMAP server stand-in with a single mailbox, for testing bounce ingestion. It runs on a background
+    thread, with a thread per connection.
+
+    Arguments:
+        messages {list}: The emails (as bytes) in the mailbox.
+        username {string} [optional]: The username to accept. Defaults to "user".
+        password {string} [optional]: The password to accept. Defaults to "password".
+
+    Examples:
+        with LocalIMAPServer([bounce]) as server:
+            BounceIngester(store).ingest_imap(server.host, "user", "password", server.port, ssl=False)
+    """
+
+    def __init__(self, messages, username="user", password="password"):
+        self.username = username
+        self.password = password
+        self.messages = [{"uid": uid, "data": data, "flags": set()} for uid, data in enumerate(messages, 1)]
+        self.lock = threading.Lock()
+
+        self._server = _ThreadingServer(("127.0.0.1", 0), _IMAPHandler)
+        self._server.stand_in = self
+        self._thread = None
+
+    @property
+    def host(self):
+        return self._server.server_address[0]
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        return False
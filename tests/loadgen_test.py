@@ -0,0 +1,110 @@
+import smtplib
+import unittest
+from mail_to_sms import loadgen
+from mail_to_sms.local_smtp_server import LocalSMTPServer
+
+
+MESSAGE = "Subject: hi\r\n\r\nhello\r\n"
+
+
+class TestCarrierFaults(unittest.TestCase):
+    def _sendmail(self, server, recipients):
+        smtp = smtplib.SMTP(server.host, server.port)
+        try:
+            return smtp.sendmail("me@example.com", recipients, MESSAGE)
+        finally:
+            smtp.close()
+
+
+    def test_faults(self):
+        testTuples = [
+            ## (Server kwargs, Expected exception)
+            ({"throttle_rate": 1}, smtplib.SMTPSenderRefused),
+            ({"disconnect_rate": 1}, smtplib.SMTPServerDisconnected)
+        ]
+
+        for kwargs, exception in testTuples:
+            try:
+                with LocalSMTPServer(pipelining=False, **kwargs) as server:
+                    with self.assertRaises(exception) as context:
+                        self._sendmail(server, ["a@example.com"])
+                    if(exception is smtplib.SMTPSenderRefused):
+                        self.assertEqual(context.exception.smtp_code, 421)
+                    self.assertEqual(server.message_count, 0)
+                    self.assertEqual(server.throttled_count + server.disconnected_count, 1)
+            except AssertionError as e:
+                print("Failed on:", kwargs, exception)
+                raise e
+
+
+    def test_seeded_faults(self):
+        ## The same seed misbehaves on the same transactions
+        def get_faults(seed):
+            server = LocalSMTPServer(throttle_rate=0.3, disconnect_rate=0.2, seed=seed)
+            return [server._get_fault() for _ in range(50)]
+
+        self.assertEqual(get_faults(7), get_faults(7))
+        self.assertIn(None, get_faults(7))
+
+
+    def test_domain_limits(self):
+        with LocalSMTPServer(domain_limits={"vtext.com": 2}) as server:
+            refused = self._sendmail(server, ["1@vtext.com", "2@vtext.com", "3@vtext.com", "4@txt.att.net"])
+
+            self.assertEqual(list(refused), ["3@vtext.com"])
+            self.assertEqual(refused["3@vtext.com"][0], 450)
+            self.assertEqual(server.messages[0][0], ["1@vtext.com", "2@vtext.com", "4@txt.att.net"])
+            self.assertEqual(server.rate_limited_count, 1)
+
+
+class TestLoadgen(unittest.TestCase):
+    def test_run(self):
+        ## Just make sure that every path still runs and reports, the numbers themselves don't mean anything here
+        results = loadgen.run(messages=6, rate=200, batch_size=3, workers=2, max_recipients=3)
+
+        for path in loadgen.PATHS:
+            summary = results["paths"][path]
+            if(summary is None and path == "async"):
+                continue
+
+            try:
+                self.assertEqual(summary["sent"], 6)
+                self.assertEqual(summary["error_rate"], 0)
+                self.assertIsNotNone(summary["p99_latency_ms"])
+                self.assertEqual(summary["server"]["throttled"], 0)
+            except AssertionError as e:
+                print(path, summary)
+                raise e
+
+
+    def test_throttled(self):
+        ## Every transaction is throttled, so nothing gets through and every failure is accounted for. After five
+        ## straight 421s the relay's breaker opens, and the last message fails fast without reaching the server.
+        with LocalSMTPServer(throttle_rate=1) as server:
+            summary = loadgen.run_path("single", server, 3, max_attempts=2)
+
+        self.assertEqual(summary["sent"], 0)
+        self.assertEqual(summary["error_rate"], 1)
+        self.assertEqual(summary["errors"], {"smtp_421": 2, "CircuitOpenError": 1})
+        self.assertEqual(summary["retries"], 3)
+        self.assertEqual(summary["server"]["throttled"], 5)
+
+
+    def test_get_ticks(self):
+        testTuples = [
+            ## (Count, Rate, Batch size, Expected ticks)
+            (3, None, 2, [(0, 2, 0), (2, 3, 0)]),
+            (3, 2, 1, [(0, 1, 0), (1, 2, 0.5), (2, 3, 1)]),
+            (5, 10, 2, [(0, 2, 0.1), (2, 4, 0.3), (4, 5, 0.4)])
+        ]
+
+        for count, rate, batch_size, expected in testTuples:
+            try:
+                self.assertEqual(list(loadgen.get_ticks(count, rate, batch_size)), expected)
+            except AssertionError as e:
+                print(count, rate, batch_size, expected)
+                raise e
+
+
+if(__name__ == "__main__"):
+    unittest.main()
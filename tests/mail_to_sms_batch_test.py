@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from mail_to_sms import MailToSMSBatch, SMTPConnectionPool, Spool
+from fakes import FakeConnection
+
+
+class TestMailToSMSBatch(unittest.TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+        patcher = mock.patch("yagmail.SMTP", FakeConnection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = SMTPConnectionPool()
+
+
+    def test_send_single_session(self):
+        recipients = [(8663454897, "att"), ("8663454897", "sprint"), ("8663454897", "virgin mobile")]
+        batch = MailToSMSBatch(recipients, "username", "password", "hello", quiet=True, pool=self.pool)
+
+        self.assertEqual(len(FakeConnection.instances), 1)
+        connection = FakeConnection.instances[0]
+        self.assertEqual((connection.user, connection.password), ("username", "password"))
+        self.assertEqual(connection.logins, 1)
+        self.assertEqual(len(connection.smtp.sent), 3)
+        self.assertEqual([result.success for result in batch.results], [True, True, True])
+        self.assertEqual(
+            [result.address for result in batch.results],
+            ["8663454897@txt.att.net", "8663454897@messaging.sprintpcs.com", "8663454897@vmobl.com"]
+        )
+
+
+    def test_send_reports_per_recipient(self):
+        recipients = [(8663454897, "att"), ("abcdefg", "att"), (8663454897, "not a carrier"), (8663454897, "vzw")]
+        batch = MailToSMSBatch(recipients, quiet=True, pool=self.pool)
+        FakeConnection.fail_for = ("8663454897@vtext.com",)
+
+        results = batch.send("hello")
+        connection = FakeConnection.instances[0]
+
+        self.assertEqual([result.success for result in results], [True, False, False, False])
+        self.assertEqual([result.number for result in results], [8663454897, "abcdefg", 8663454897, 8663454897])
+        self.assertIsNone(results[1].address)
+        self.assertIsNotNone(results[2].error)
+        self.assertEqual(results[3].address, "8663454897@vtext.com")
+        self.assertIsNotNone(results[3].error)
+        self.assertEqual(len(connection.smtp.sent), 1)
+
+
+    def test_no_valid_recipients(self):
+        batch = MailToSMSBatch([("abcdefg", "att")], contents="hello", quiet=True, pool=self.pool)
+
+        self.assertEqual(FakeConnection.instances, [])
+        self.assertFalse(batch.results[0].success)
+
+
+    def test_send_to(self):
+        ## Outside of a with block, each call leases a connection and hands it right back
+        batch = MailToSMSBatch([], quiet=True, pool=self.pool)
+
+        testTuples = [
+            ## (Number, Carrier, Expected success)
+            (8663454897, "att", True),
+            ("abcdefg", "att", False),
+            (8663454898, "vzw", True)
+        ]
+
+        for number, carrier, success in testTuples:
+            try:
+                self.assertEqual(batch.send_to(number, carrier, "hello").success, success)
+                self.assertIsNone(batch.connection)
+                self.assertEqual(self.pool.stats()[("smtp.gmail.com", None, None)], {"open": 1, "idle": 1})
+            except AssertionError as e:
+                print("Failed on:", number, carrier, success)
+                raise e
+
+        self.assertEqual(sum(connection.logins for connection in FakeConnection.instances), 1)
+
+
+    def test_enqueue(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        spool = Spool(os.path.join(directory, "spool.sqlite3"))
+        self.addCleanup(spool.close)
+
+        recipients = [(8663454897, "att"), ("abcdefg", "att"), (8663454897, "vzw")]
+        ids = MailToSMSBatch(recipients, quiet=True, pool=self.pool, spool=spool, subject="hi").enqueue("hello")
+
+        self.assertEqual(len(ids), 3)
+        self.assertIsNone(ids[1])
+        self.assertEqual(
+            [(message.id, message.address, message.subject, message.contents) for message in spool.claim(10)],
+            [(ids[0], "8663454897@txt.att.net", "hi", "hello"), (ids[2], "8663454897@vtext.com", "hi", "hello")]
+        )
+        ## Nothing was sent, so nothing connected
+        self.assertEqual(FakeConnection.instances, [])
+
+
+if(__name__ == "__main__"):
+    unittest.main()
@@ -0,0 +1,185 @@
+import json
+import mailbox
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from click.testing import CliRunner
+from mail_to_sms import ResultsStore, SendDaemon, SMTPConnectionPool, Spool
+from mail_to_sms.mail_to_sms_cli import main
+from mail_to_sms.local_smtp_server import LocalSMTPServer
+from fakes import FakeConnection
+
+
+class TestMailToSMSCLI(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.spool_path = os.path.join(self.directory, "spool.sqlite3")
+
+
+    def test_default_command(self):
+        ## The original positional style should still route to the send command
+        ## Enqueueing only resolves the address, it never connects to the SMTP server
+        with mock.patch("yagmail.SMTP") as smtp:
+            result = self.runner.invoke(main, ["8663454897", "att", "hello", "--enqueue", "--spool", self.spool_path])
+            self.assertEqual(result.exit_code, 0, result.output)
+
+            result = self.runner.invoke(main, ["send", "8663454897", "vzw", "hello", "-q", "--spool", self.spool_path])
+            self.assertEqual(result.exit_code, 0, result.output)
+
+            result = self.runner.invoke(main, ["send", "123", "vzw", "hello", "-q", "--spool", self.spool_path])
+            self.assertEqual(result.exit_code, 1, result.output)
+            smtp.assert_not_called()
+
+        with Spool(self.spool_path) as spool:
+            self.assertEqual(
+                [message.address for message in spool.claim(10)],
+                ["8663454897@txt.att.net", "8663454897@vtext.com"]
+            )
+
+
+    def test_bulk(self):
+        FakeConnection.reset()
+        pool = SMTPConnectionPool(connection_factory=FakeConnection)
+        patcher = mock.patch("mail_to_sms.mail_to_sms.get_default_pool", return_value=pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        csv_input = "carrier,number,message\natt,8663454897,\nvzw,8663454897,custom\nnope,8663454897,\n,,\natt\n"
+        result = self.runner.invoke(main, ["bulk", "-", "-m", "hello", "-u", "username"], input=csv_input)
+        self.assertEqual(result.exit_code, 1, result.output)
+
+        records = [json.loads(line) for line in result.stdout.splitlines()]
+        self.assertEqual([record["line"] for record in records], [2, 3, 4, 6])
+        self.assertEqual([record["success"] for record in records], [True, True, False, False])
+        self.assertEqual(records[1]["address"], "8663454897@vtext.com")
+        self.assertIn("2 sent, 2 failed, 0 deferred", result.stderr)
+
+        ## Every recipient goes over the same connection
+        self.assertEqual(len(FakeConnection.instances), 1)
+        sent = FakeConnection.instances[0].smtp.sent
+        self.assertEqual([recipients for _, recipients, _ in sent], [["8663454897@txt.att.net"], ["8663454897@vtext.com"]])
+        self.assertTrue(sent[1][2].endswith("custom"))
+
+        results_path = os.path.join(self.directory, "results.jsonl")
+        jsonl_input = '{"number": 8663454897, "carrier": "att"}\n\n{"number": "8663454897", "carrier": "vzw"}\n'
+        result = self.runner.invoke(main, ["bulk", "-m", "hi", "-r", results_path, "-u", "username"], input=jsonl_input)
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        with open(results_path) as fd:
+            records = [json.loads(line) for line in fd]
+        self.assertEqual([(record["line"], record["success"]) for record in records], [(1, True), (3, True)])
+
+
+    def test_bulk_template(self):
+        FakeConnection.reset()
+        pool = SMTPConnectionPool(connection_factory=FakeConnection)
+        patcher = mock.patch("mail_to_sms.mail_to_sms.get_default_pool", return_value=pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        csv_input = "8663454897,att\n8663454897,vzw,custom $5\n"
+        result = self.runner.invoke(main, ["bulk", "-", "-t", "-m", "hi $number on $carrier", "-u", "username"], input=csv_input)
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        ## Only the default message is a template, so per row messages are sent as they are
+        sent = FakeConnection.instances[0].smtp.sent
+        self.assertTrue(sent[0][2].endswith("hi 8663454897 on att"))
+        self.assertTrue(sent[1][2].endswith("custom $5"))
+
+        result = self.runner.invoke(main, ["bulk", "-", "-t", "-m", "costs $5", "-u", "username"], input=csv_input)
+        self.assertEqual(result.exit_code, 2)
+
+
+    def test_dry_run(self):
+        result = self.runner.invoke(main, ["8663454897", "att", "hello", "--dry-run"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(result.stdout.strip(), "8663454897@txt.att.net")
+
+        result = self.runner.invoke(main, ["8663454897", "nope", "hello", "--dry-run"])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("'nope' isn't a valid carrier.", result.stderr)
+
+        csv_input = "8663454897,att,hello\n123,att,hello\n8663454897,vzw\n"
+        result = self.runner.invoke(main, ["bulk", "-", "--dry-run"], input=csv_input)
+        self.assertEqual(result.exit_code, 1, result.output)
+
+        records = [json.loads(line) for line in result.stdout.splitlines()]
+        self.assertEqual([record["success"] for record in records], [True, False, False])
+        self.assertEqual(records[0]["address"], "8663454897@txt.att.net")
+        self.assertEqual(records[2]["error"], "No message to send.")
+        self.assertIn("1 resolved, 2 failed", result.stderr)
+
+
+    def test_bounces(self):
+        results_path = os.path.join(self.directory, "results.sqlite3")
+        with ResultsStore(results_path) as store:
+            store.record("<one@example.com>", "8663454897@txt.att.net", True)
+
+        mbox_path = os.path.join(self.directory, "replies.mbox")
+        mbox = mailbox.mbox(mbox_path)
+        mbox.add(b"From: 8663454897@txt.att.net\nIn-Reply-To: <one@example.com>\n\nSTOP\n")
+        mbox.add(b"From: 8663454898@txt.att.net\n\nSTOP\n")
+        mbox.close()
+
+        result = self.runner.invoke(main, ["bounces", "--mbox", mbox_path, "--results-db", results_path])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(result.stdout.strip(), "8663454897@txt.att.net")
+        self.assertIn("2 emails, 2 bounces, 1 matched, 1 marked undeliverable", result.stderr)
+
+        with ResultsStore(results_path) as store:
+            self.assertTrue(store.is_undeliverable("8663454897@txt.att.net"))
+
+        self.assertEqual(self.runner.invoke(main, ["bounces", "--results-db", results_path]).exit_code, 2)
+
+
+    def test_client(self):
+        with LocalSMTPServer() as server:
+            with SendDaemon("sender@example.com", None, port=0, quiet=True, yagmail=server.yagmail_args) as daemon:
+                result = self.runner.invoke(main, ["client", "8663454897", "att", "hello", "--url", daemon.url])
+                self.assertEqual(result.exit_code, 0, result.output)
+                self.assertEqual(result.stdout.strip(), "8663454897@txt.att.net")
+
+                result = self.runner.invoke(main, ["client", "123", "att", "hello", "--url", daemon.url])
+                self.assertEqual(result.exit_code, 1)
+                self.assertIn("Unable to build an address", result.stderr)
+
+            self.assertEqual(server.message_count, 1)
+
+        result = self.runner.invoke(main, ["client", "8663454897", "att", "hello", "--url", daemon.url, "--timeout", "1"])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("Unable to reach the mail_to_sms daemon", result.stderr)
+
+
+    def test_loadtest(self):
+        result = self.runner.invoke(main, [
+            "loadtest", "--path", "single", "--path", "batch", "--messages", "4", "--batch-size", "2",
+            "--domain-limit", "vtext.com=50", "--seed", "1"
+        ])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        results = json.loads(result.stdout)
+        self.assertEqual(list(results["paths"]), ["single", "batch"])
+        self.assertEqual(results["parameters"]["domain_limits"], {"vtext.com": 50})
+        for summary in results["paths"].values():
+            self.assertEqual(summary["sent"], 4)
+
+        result = self.runner.invoke(main, ["loadtest", "--domain-limit", "vtext.com"])
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn("DOMAIN=MESSAGES_PER_SECOND", result.output)
+
+
+    def test_help(self):
+        result = self.runner.invoke(main, ["--help"])
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("worker", result.output)
+        self.assertIn("daemon", result.output)
+        self.assertIn("loadtest", result.output)
+
+
+if(__name__ == "__main__"):
+    unittest.main()
@@ -0,0 +1,112 @@
+import threading
+import time
+import unittest
+from unittest import mock
+from mail_to_sms import MailToSMSParallel, SMTPConnectionPool
+from mail_to_sms.mail_to_sms_parallel import DispatchReport
+from mail_to_sms.mail_to_sms import SendResult
+from fakes import FakeConnection, FakeSMTP
+
+
+class Tracker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.max_in_flight = {}
+        self.sent = []
+
+    def start(self, domain):
+        with self.lock:
+            self.in_flight[domain] = self.in_flight.get(domain, 0) + 1
+            self.max_in_flight[domain] = max(self.max_in_flight.get(domain, 0), self.in_flight[domain])
+
+    def finish(self, domain, address):
+        with self.lock:
+            self.in_flight[domain] -= 1
+            self.sent.append(address)
+
+
+class TrackedSMTP(FakeSMTP):
+    ## Takes a moment to send, so that the sends in flight to each gateway domain can be tracked
+    tracker = None
+
+    def sendmail(self, sender, recipients, message):
+        domain = recipients[0].rsplit("@", 1)[-1]
+        self.tracker.start(domain)
+        time.sleep(0.01)
+        self.tracker.finish(domain, recipients[0])
+        super(TrackedSMTP, self).sendmail(sender, recipients, message)
+
+
+class TrackedConnection(FakeConnection):
+    smtp_class = TrackedSMTP
+
+
+class TestMailToSMSParallel(unittest.TestCase):
+    def setUp(self):
+        self.tracker = Tracker()
+        TrackedSMTP.tracker = self.tracker
+        FakeConnection.reset()
+        self.connections = FakeConnection.instances
+        self.pool = SMTPConnectionPool(size=4, connection_factory=TrackedConnection)
+
+
+    def test_send(self):
+        recipients = [(8663454897, "att")] * 12 + [(8663454897, "vzw")] * 12 + [("abcdefg", "att")]
+        parallel = MailToSMSParallel(
+            recipients, contents="hello", quiet=True, pool=self.pool, workers=4, gateway_limit=3,
+            gateway_limits={"vtext.com": 1}
+        )
+        report = parallel.results
+
+        self.assertEqual(len(report), 25)
+        self.assertEqual(len(report.succeeded), 24)
+        self.assertEqual(report[-1].number, "abcdefg")
+        self.assertFalse(report[-1].success)
+        self.assertEqual(report[0].address, "8663454897@txt.att.net")
+        self.assertEqual(report[12].address, "8663454897@vtext.com")
+        self.assertTrue(all(result.latency > 0 for result in report.succeeded))
+
+        ## One connection per worker, and the carrier limits were honored
+        self.assertLessEqual(len(self.connections), 4)
+        self.assertLessEqual(self.tracker.max_in_flight["txt.att.net"], 3)
+        self.assertEqual(self.tracker.max_in_flight["vtext.com"], 1)
+        self.assertEqual(self.pool.stats()[("smtp.gmail.com", None, None)]["idle"], len(self.connections))
+
+
+    def test_own_pool(self):
+        ## Without a pool, the one made for the dispatch is closed afterwards so nothing's left open at exit
+        with mock.patch("yagmail.SMTP", TrackedConnection):
+            with MailToSMSParallel([(8663454897, "att")] * 4, quiet=True, workers=2) as parallel:
+                self.assertEqual(len(parallel.send("hello").succeeded), 4)
+                self.assertEqual(
+                    {key: stats for key, stats in parallel.pool.stats().items() if stats["open"] or stats["idle"]}, {}
+                )
+                self.assertTrue(all(connection.is_closed for connection in self.connections))
+
+                ## And it can still be sent with again
+                self.assertEqual(len(parallel.send("hello").succeeded), 4)
+
+        ## Given pools are left alone
+        MailToSMSParallel([(8663454897, "att")], contents="hello", quiet=True, pool=self.pool, workers=1)
+        self.assertEqual(self.pool.stats()[("smtp.gmail.com", None, None)]["idle"], 1)
+
+
+    def test_report(self):
+        results = [
+            SendResult(1, "att", "1@txt.att.net", True, None, 0.1),
+            SendResult(2, "att", "2@txt.att.net", True, None, 0.3),
+            SendResult(3, "att", "3@txt.att.net", False, "oops", 0.2),
+            SendResult(4, "att", None, False, "invalid")
+        ]
+        report = DispatchReport(results, 2.0)
+
+        self.assertEqual(len(report.failed), 2)
+        self.assertEqual(report.throughput, 1.0)
+        self.assertEqual(report.latency_percentile(50), 0.2)
+        self.assertEqual(report.latency_percentile(100), 0.3)
+        self.assertIsNone(DispatchReport([], 0).latency_percentile(50))
+
+
+if(__name__ == "__main__"):
+    unittest.main()
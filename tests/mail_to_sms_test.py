@@ -1,5 +1,10 @@
+import os
+import shutil
+import tempfile
 import unittest
-from mail_to_sms import MailToSMS
+from mail_to_sms import MailToSMS, MetricsRegistry, ResultsStore, SMTPConnectionPool
+from mail_to_sms.metrics import FAILED
+from mail_to_sms.local_smtp_server import LocalSMTPServer
 
 
 class TestMailToSMS(unittest.TestCase):
@@ -31,7 +36,10 @@ class TestMailToSMS(unittest.TestCase):
 
 
     def test_load_gateways(self):
-        pass
+        gateways = self.connection._load_gateways()
+
+        self.assertTrue(gateways)
+        self.assertIs(gateways, MailToSMS(None, None, None, None, quiet=True)._load_gateways())
 
 
     def test_validate_number(self):
@@ -140,6 +148,8 @@ class TestMailToSMS(unittest.TestCase):
             (8663454897, "att", "8663454897@txt.att.net"),
             ("8663454897", "sprint", "8663454897@messaging.sprintpcs.com"),
             ("8663454897", "virgin mobile", "8663454897@vmobl.com"),
+            ("866-345-4897", "att", "8663454897@txt.att.net"),
+            ("+1 (866) 345 4897", "vzw", "8663454897@vtext.com"),
             ## Bad inputs
             (None, None, None),
             ("", "att", None),
@@ -158,7 +168,43 @@ class TestMailToSMS(unittest.TestCase):
 
 
     def test_send(self):
-        pass
+        with LocalSMTPServer() as server:
+            pool = SMTPConnectionPool()
+            self.addCleanup(pool.close)
+
+            mail = MailToSMS(8663454897, "att", "sender@example.com", None, quiet=True, yagmail=server.yagmail_args, pool=pool)
+            with mail:
+                self.assertTrue(mail.send("hello"))
+                self.assertTrue(mail.send("world"))
+
+            self.assertEqual(server.connection_count, 1)
+            self.assertEqual([recipients for recipients, _ in server.messages], [["8663454897@txt.att.net"]] * 2)
+
+
+    def test_send_undeliverable(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        store = ResultsStore(os.path.join(directory, "results.sqlite3"))
+        self.addCleanup(store.close)
+        store.mark_undeliverable("8663454897@txt.att.net")
+        metrics = MetricsRegistry()
+
+        ## Undeliverable addresses are skipped before connecting to the server at all
+        with LocalSMTPServer() as server:
+            pool = SMTPConnectionPool()
+            self.addCleanup(pool.close)
+
+            mail = MailToSMS(
+                8663454897, "att", "sender@example.com", None, "hello", quiet=True, yagmail=server.yagmail_args,
+                pool=pool, results=store, metrics=metrics
+            )
+            with mail:
+                self.assertFalse(mail.send("world"))
+
+            self.assertEqual(server.connection_count, 0)
+            self.assertEqual(server.message_count, 0)
+            self.assertEqual(store.get_deliveries(), [])
+            self.assertEqual(metrics.get(FAILED, reason="undeliverable"), 2)
 
 
 if(__name__ == "__main__"):
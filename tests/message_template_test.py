@@ -0,0 +1,152 @@
+import email
+import unittest
+from mail_to_sms import (
+    MailToSMS, MailToSMSBatch, MailToSMSParallel, MessageTemplate, Sender, SMTPConnectionPool, RetryPolicy,
+    CircuitBreakerRegistry
+)
+from mail_to_sms.message_template import add_fields
+from mail_to_sms.local_smtp_server import LocalSMTPServer
+
+
+class TestMessageTemplate(unittest.TestCase):
+    def _parse(self, message):
+        parsed = email.message_from_string(message)
+        return parsed, parsed.get_payload(decode=True).decode(parsed.get_content_charset())
+
+
+    def test_parse(self):
+        testTuples = [
+            ("hello", frozenset(), "hello"),
+            ("hi $name", frozenset(["name"]), "hi bob"),
+            ("${name}s $address", frozenset(["name", "address"]), "bobs 5551234567@txt.att.net"),
+            ("costs $$5, $name", frozenset(["name"]), "costs $5, bob"),
+            (["line $name", "line two"], frozenset(["name"]), "line bob\nline two")
+        ]
+
+        for contents, fields, text in testTuples:
+            try:
+                template = MessageTemplate(contents)
+                self.assertEqual(template.fields, fields)
+                self.assertEqual(template.get_text("5551234567@txt.att.net", {"name": "bob"}), text)
+            except AssertionError as e:
+                print("Failed on:", contents, fields, text)
+                raise e
+
+        with self.assertRaises(ValueError):
+            MessageTemplate("costs $5")
+        with self.assertRaises(TypeError):
+            MessageTemplate({"not": "text"})
+        with self.assertRaises(KeyError):
+            MessageTemplate("hi $name").get_text("5551234567@txt.att.net")
+
+
+    def test_render(self):
+        template = MessageTemplate("hi $name", subject="alert")
+        message = template.render("sender@example.com", "5551234567@txt.att.net", fields={"name": "bob"})
+        parsed, body = self._parse(message)
+
+        self.assertEqual(parsed["Subject"], "alert")
+        self.assertEqual(parsed["From"], "sender@example.com")
+        self.assertEqual(parsed["To"], "5551234567@txt.att.net")
+        self.assertEqual(parsed["Content-Transfer-Encoding"], "7bit")
+        self.assertTrue(parsed["Message-ID"].endswith("@example.com>"))
+        self.assertEqual(body, "hi bob")
+
+        ## The template's subject wins over the sender's, which is only used as a fallback
+        parsed, _ = self._parse(template.render("sender@example.com", "5551234567@txt.att.net", "other", {"name": "x"}))
+        self.assertEqual(parsed["Subject"], "alert")
+        parsed, _ = self._parse(MessageTemplate("hi").render("sender@example.com", "5551234567@txt.att.net", "other"))
+        self.assertEqual(parsed["Subject"], "other")
+
+
+    def test_render_unicode(self):
+        template = MessageTemplate("¡hola $name! ✓", subject="¿qué?")
+        message = template.render("sender@example.com", "5551234567@txt.att.net", fields={"name": "José"})
+        message.encode("ascii")
+        parsed, body = self._parse(message)
+
+        self.assertEqual(parsed["Content-Transfer-Encoding"], "quoted-printable")
+        self.assertEqual(str(email.header.make_header(email.header.decode_header(parsed["Subject"]))), "¿qué?")
+        self.assertEqual(body, "¡hola José! ✓")
+
+
+    def test_headers_cached(self):
+        template = MessageTemplate("hi $address")
+        for index in range(5):
+            template.render("sender@example.com", "555123456{0}@txt.att.net".format(index))
+
+        self.assertEqual(len(template._headers), 1)
+
+
+    def test_add_fields(self):
+        template = MessageTemplate("$number $carrier $name")
+        bound = add_fields(template.bind(name="bob", carrier="mine"), number=5551234567, carrier="att")
+
+        self.assertEqual(bound.get_text("5551234567@txt.att.net"), "5551234567 mine bob")
+        self.assertEqual(add_fields("plain", number=5551234567), "plain")
+
+
+    def test_batch_send(self):
+        recipients = [(8663454897, "att"), ("8663454897", "verizon")]
+        template = MessageTemplate("hi $name, this is $number on $carrier", subject="alert")
+
+        with LocalSMTPServer() as server:
+            pool = SMTPConnectionPool()
+            self.addCleanup(pool.close)
+            kwargs = {
+                "quiet": True,
+                "yagmail": server.yagmail_args,
+                "pool": pool,
+                "retry": RetryPolicy(max_attempts=1),
+                "breakers": CircuitBreakerRegistry()
+            }
+
+            batch = MailToSMSBatch(recipients, "sender@example.com", None, template.bind(name="bob"), **kwargs)
+            self.assertEqual([result.success for result in batch.results], [True, True])
+
+            parallel = MailToSMSParallel(recipients, "sender@example.com", None, **dict(kwargs, workers=2))
+            report = parallel.send(template.bind(name="ann"))
+            self.assertEqual(len(report.succeeded), 2)
+
+            ## A missing field fails that recipient, without sending anything
+            results = batch.send(template)
+            self.assertEqual([result.success for result in results], [False, False])
+
+            bodies = sorted(self._parse(data.decode("ascii"))[1].rstrip() for _, data in server.messages)
+            self.assertEqual(bodies, [
+                "hi ann, this is 8663454897 on att",
+                "hi ann, this is 8663454897 on verizon",
+                "hi bob, this is 8663454897 on att",
+                "hi bob, this is 8663454897 on verizon"
+            ])
+
+
+
+    def test_number_field(self):
+        ## $number is the national number, however the message is sent and however the number was written
+        template = MessageTemplate("$number on $carrier")
+        number = "+1 (866) 345-4897"
+
+        with LocalSMTPServer() as server:
+            pool = SMTPConnectionPool()
+            self.addCleanup(pool.close)
+            kwargs = {
+                "quiet": True,
+                "yagmail": server.yagmail_args,
+                "pool": pool,
+                "retry": RetryPolicy(max_attempts=1),
+                "breakers": CircuitBreakerRegistry()
+            }
+
+            sender = Sender("sender@example.com", None, **kwargs)
+            self.assertTrue(sender.send(sender.recipient(number, " att"), template).success)
+            MailToSMS(number, " att", "sender@example.com", None, template, **kwargs)
+            MailToSMSBatch([(number, " att")], "sender@example.com", None, template, **kwargs)
+            MailToSMSParallel([(number, " att")], "sender@example.com", None, **kwargs).send(template)
+
+            bodies = [self._parse(data.decode("ascii"))[1].rstrip() for _, data in server.messages]
+            self.assertEqual(bodies, ["8663454897 on att"] * 4)
+
+
+if(__name__ == "__main__"):
+    unittest.main()
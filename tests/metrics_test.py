@@ -0,0 +1,129 @@
+import os
+import shutil
+import smtplib
+import tempfile
+import unittest
+from mail_to_sms import CircuitBreakerRegistry, MailToSMS, MetricsRegistry, RetryPolicy, SMTPConnectionPool
+from mail_to_sms import metrics as metric_names
+from fakes import FakeConnection
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def test_record(self):
+        metrics = MetricsRegistry(buckets=(0.1, 1))
+        recorded = []
+        metrics.add_hook(lambda *args: recorded.append(args))
+
+        metrics.increment("sent", domain="vtext.com")
+        metrics.increment("sent", 2, domain="vtext.com")
+        metrics.set_gauge("depth", 5)
+        metrics.observe("latency", 0.5, domain="vtext.com")
+        metrics.observe("latency", 2, domain="vtext.com")
+
+        self.assertEqual(metrics.get("sent", domain="vtext.com"), 3)
+        self.assertIsNone(metrics.get("sent", domain="txt.att.net"))
+        self.assertEqual(metrics.get("depth"), 5)
+        self.assertEqual(metrics.get("latency", domain="vtext.com"), (2, 2.5))
+        self.assertEqual(len(recorded), 5)
+        self.assertEqual(recorded[0], (metric_names.COUNTER, "sent", 1, {"domain": "vtext.com"}))
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot[metric_names.COUNTER]["sent"], {"domain=vtext.com": 3})
+        self.assertEqual(snapshot[metric_names.HISTOGRAM]["latency"]["domain=vtext.com"], {"count": 2, "sum": 2.5})
+
+        metrics.reset()
+        self.assertIsNone(metrics.get("sent", domain="vtext.com"))
+
+
+    def test_to_prometheus(self):
+        metrics = MetricsRegistry(buckets=(0.1, 1))
+        metrics.increment(metric_names.SENT, domain="vtext.com")
+        metrics.observe("latency", 0.5, domain="a\"b")
+
+        lines = metrics.to_prometheus().splitlines()
+        testTuples = [
+            "# HELP mail_to_sms_sent_total Messages accepted by the SMTP server, by gateway domain.",
+            "# TYPE mail_to_sms_sent_total counter",
+            "mail_to_sms_sent_total{domain=\"vtext.com\"} 1.0",
+            "# TYPE latency histogram",
+            "latency_bucket{domain=\"a\\\"b\",le=\"0.1\"} 0",
+            "latency_bucket{domain=\"a\\\"b\",le=\"1.0\"} 1",
+            "latency_bucket{domain=\"a\\\"b\",le=\"+Inf\"} 1",
+            "latency_sum{domain=\"a\\\"b\"} 0.5",
+            "latency_count{domain=\"a\\\"b\"} 1"
+        ]
+
+        for line in testTuples:
+            try:
+                self.assertIn(line, lines)
+            except AssertionError as e:
+                print(line, lines)
+                raise e
+
+        self.assertEqual(MetricsRegistry().to_prometheus(), "")
+
+
+    def test_write_prometheus(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "mail_to_sms.prom")
+
+        metrics = MetricsRegistry()
+        metrics.set_gauge("depth", 1)
+        metrics.write_prometheus(path)
+
+        with open(path) as fd:
+            self.assertEqual(fd.read(), metrics.to_prometheus())
+        self.assertEqual(os.listdir(directory), ["mail_to_sms.prom"])
+
+
+class TestMailToSMSMetrics(unittest.TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+        self.metrics = MetricsRegistry()
+        self.pool = SMTPConnectionPool(connection_factory=FakeConnection, metrics=self.metrics)
+
+
+    def build(self, number=8663454897, carrier="att"):
+        return MailToSMS(
+            number, carrier, quiet=True, pool=self.pool, metrics=self.metrics,
+            retry=RetryPolicy(max_attempts=2, base_delay=0), breakers=CircuitBreakerRegistry()
+        )
+
+
+    def test_send(self):
+        FakeConnection.errors = [smtplib.SMTPServerDisconnected("gone"), smtplib.SMTPServerDisconnected("gone")]
+        mail = self.build()
+
+        self.assertTrue(mail.send("hello"))
+        self.assertEqual(self.metrics.get(metric_names.SENT, domain="txt.att.net"), 1)
+        self.assertEqual(self.metrics.get(metric_names.RETRIES, domain="txt.att.net"), 1)
+        self.assertEqual(self.metrics.get(metric_names.SEND_SECONDS, domain="txt.att.net")[0], 1)
+        ## Logged in once, and again after the first disconnect
+        self.assertEqual(self.metrics.get(metric_names.CONNECT_SECONDS, host="smtp.gmail.com")[0], 2)
+        self.assertEqual(self.metrics.get(metric_names.PARSE_SECONDS)[0], 1)
+        self.assertEqual(self.metrics.get(metric_names.POOL_CONNECTIONS, host="smtp.gmail.com", user=None, state="idle"), 1)
+
+
+    def test_failures(self):
+        FakeConnection.errors = [smtplib.SMTPRecipientsRefused({"8663454897@txt.att.net": (550, b"nope")})]
+
+        self.assertFalse(self.build().send("hello"))
+        self.build(number="123")
+        self.build(carrier="nope")
+
+        self.assertEqual(self.metrics.get(metric_names.FAILED, reason="smtp_550"), 1)
+        self.assertEqual(self.metrics.get(metric_names.FAILED, reason="invalid_number"), 1)
+        self.assertEqual(self.metrics.get(metric_names.FAILED, reason="unknown_carrier"), 1)
+
+
+    def test_logging(self):
+        mail = MailToSMS(None, None, quiet=False, metrics=self.metrics)
+        with self.assertLogs("mail_to_sms", level="ERROR") as logs:
+            self.assertEqual(mail._print_error(None, "test message"), "test message")
+
+        self.assertEqual(logs.output, ["ERROR:mail_to_sms.mail_to_sms:test message"])
+
+
+if(__name__ == "__main__"):
+    unittest.main()
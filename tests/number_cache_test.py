@@ -0,0 +1,63 @@
+import unittest
+from mail_to_sms import NumberCache
+
+
+class TestNumberCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = NumberCache(size=2)
+
+
+    def test_get(self):
+        testTuples = [
+            ## (Phone number, Region, Expected Validity, Expected E.164, Expected National)
+            ## Good inputs
+            ("8663454897", "US", True, "+18663454897", "8663454897"),
+            (8663454897, "US", True, "+18663454897", "8663454897"),
+            (" 866-345-4897 ", "US", True, "+18663454897", "8663454897"),
+            ("+1 866 345 4897", None, True, "+18663454897", "8663454897"),
+            ## Bad inputs
+            ("8663454897", None, False, None, None),
+            (8663454897, "GB", False, None, None),
+            ("abcdefghij", None, False, None, None)
+        ]
+
+        for number, region, valid, e164, national in testTuples:
+            try:
+                parsed = self.cache.get(number, region)
+                self.assertEqual((parsed.valid, parsed.e164, parsed.national), (valid, e164, national))
+                self.assertEqual(parsed.error is None, valid)
+            except AssertionError as e:
+                ## Catch the error and dump some useful info, then re-raise it so that the test fails properly
+                print("AssertionError: {0} for args: {1}, {2}.".format(e, number, region))
+                raise AssertionError(e)
+
+
+    def test_hits_and_misses(self):
+        first = self.cache.get("8663454897", "US")
+        self.assertIs(self.cache.get(8663454897, "US"), first)
+        self.cache.get("8663454897", "CA")
+
+        self.assertEqual(self.cache.info(), {"hits": 1, "misses": 2, "size": 2, "length": 2})
+
+
+    def test_eviction(self):
+        self.cache.get("8663454897", "US")
+        self.cache.get("8663454897", "CA")
+        ## Touch the US entry so that the CA one is the least recently used
+        self.cache.get("8663454897", "US")
+        self.cache.get("abcdefghij", None)
+
+        self.assertEqual(len(self.cache), 2)
+        self.cache.get("8663454897", "US")
+        self.assertEqual(self.cache.hits, 2)
+        self.cache.get("8663454897", "CA")
+        self.assertEqual(self.cache.misses, 4)
+
+        self.cache.resize(1)
+        self.assertEqual(len(self.cache), 1)
+        self.cache.clear()
+        self.assertEqual(self.cache.info(), {"hits": 0, "misses": 0, "size": 1, "length": 0})
+
+
+if(__name__ == "__main__"):
+    unittest.main()
@@ -0,0 +1,118 @@
+import email
+import smtplib
+import unittest
+from unittest import mock
+from mail_to_sms import MailToSMSBatch, MetricsRegistry, RetryPolicy, CircuitBreakerRegistry, Sender, SMTPConnectionPool
+from mail_to_sms.metrics import FAILED, SENT
+from mail_to_sms.pipelining import send_transaction
+from mail_to_sms.local_smtp_server import LocalSMTPServer
+
+
+MESSAGE = "Subject: hi\r\n\r\nhello\r\n.leading dot\r\n"
+
+
+class TestSendTransaction(unittest.TestCase):
+    def _connect(self, server):
+        smtp = smtplib.SMTP(server.host, server.port)
+        self.addCleanup(smtp.close)
+        smtp.ehlo()
+        return smtp
+
+
+    def test_send_transaction(self):
+        testTuples = [
+            ## (Server pipelining, Expected sends)
+            (True, 2),
+            (False, 5)
+        ]
+
+        for pipelining, sends in testTuples:
+            try:
+                with LocalSMTPServer(pipelining=pipelining, rejected=["b@example.com"]) as server:
+                    smtp = self._connect(server)
+                    with mock.patch.object(smtp, "send", wraps=smtp.send) as send:
+                        refused = send_transaction(smtp, "me@example.com", ["a@example.com", "b@example.com"], MESSAGE)
+
+                    self.assertEqual(list(refused), ["b@example.com"])
+                    self.assertEqual(refused["b@example.com"][0], 550)
+                    ## One write for the whole envelope and one for the data when pipelining, instead of one each
+                    self.assertEqual(send.call_count, sends)
+                    self.assertEqual(server.messages, [(["a@example.com"], MESSAGE.encode("ascii"))])
+            except AssertionError as e:
+                print("Failed on:", pipelining, sends)
+                raise e
+
+
+    def test_refused(self):
+        with LocalSMTPServer(rejected=["a@example.com", "b@example.com"]) as server:
+            smtp = self._connect(server)
+            with self.assertRaises(smtplib.SMTPRecipientsRefused) as context:
+                send_transaction(smtp, "me@example.com", ["a@example.com", "b@example.com"], MESSAGE)
+            self.assertEqual(sorted(context.exception.recipients), ["a@example.com", "b@example.com"])
+
+            ## The session is left ready for the next transaction
+            self.assertEqual(send_transaction(smtp, "me@example.com", ["c@example.com"], MESSAGE), {})
+            self.assertEqual(server.message_count, 1)
+
+
+class TestGroupedSends(unittest.TestCase):
+    def _kwargs(self, server, **kwargs):
+        self.metrics = MetricsRegistry()
+        kwargs.update({
+            "quiet": True,
+            "yagmail": server.yagmail_args,
+            "pool": SMTPConnectionPool(),
+            "retry": RetryPolicy(max_attempts=1),
+            "breakers": CircuitBreakerRegistry(),
+            "metrics": self.metrics
+        })
+        return kwargs
+
+
+    def test_batch(self):
+        recipients = [
+            (8663454897, "att"), (8663454898, "att"), (8663454899, "verizon"), (8663454890, "att"), ("123", "att"),
+            (8663454891, "att")
+        ]
+
+        with LocalSMTPServer(rejected=["8663454891@txt.att.net"], max_recipients=2) as server:
+            batch = MailToSMSBatch(recipients, "sender@example.com", None, **self._kwargs(server, max_recipients=3))
+            results = batch.send("hello")
+
+            self.assertEqual([result.success for result in results], [True, True, True, True, False, False])
+            self.assertIsNone(results[4].address)
+            self.assertIn("550", results[5].error)
+
+            ## Three AT&T recipients per transaction, the server only takes two so the third goes in its own
+            self.assertEqual([recipients for recipients, _ in server.messages], [
+                ["8663454897@txt.att.net", "8663454898@txt.att.net"],
+                ["8663454890@txt.att.net"],
+                ["8663454899@vtext.com"]
+            ])
+            ## Nobody's number ends up in anyone else's headers
+            self.assertNotIn(b"8663454898", server.messages[0][1])
+            self.assertEqual(server.connection_count, 1)
+            self.assertEqual(self.metrics.get(SENT, domain="txt.att.net"), 3)
+            self.assertEqual(self.metrics.get(FAILED, reason="smtp_550"), 1)
+
+
+    def test_send_many(self):
+        with LocalSMTPServer() as server:
+            kwargs = self._kwargs(server, max_recipients=10, long_messages="segment")
+            sender = Sender("sender@example.com", None, **kwargs)
+            recipients = [sender.recipient(number, "att") for number in (8663454897, 8663454898)]
+
+            results = sender.send_many(recipients, "x" * 200)
+
+            self.assertEqual([result.success for result in results], [True, True])
+            self.assertEqual(server.message_count, 2)
+            self.assertTrue(all(len(recipients) == 2 for recipients, _ in server.messages))
+            texts = [
+                part.get_payload(decode=True) for _, data in server.messages
+                for part in email.message_from_bytes(data).walk() if part.get_content_type() == "text/plain"
+            ]
+            self.assertEqual([text[:5] for text in texts], [b"(1/2)", b"(2/2)"])
+
+
+if(__name__ == "__main__"):
+    unittest.main()
@@ -0,0 +1,102 @@
+import asyncio
+import time
+import unittest
+from mail_to_sms import MailToSMSBatch, RateLimiter, SMTPConnectionPool, TokenBucket
+from fakes import FakeConnection
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_try_acquire(self):
+        bucket = TokenBucket(rate=0.001, capacity=2)
+
+        self.assertTrue(bucket.try_acquire())
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+
+        bucket.refund()
+        self.assertTrue(bucket.try_acquire())
+
+
+    def test_acquire(self):
+        bucket = TokenBucket(rate=100, capacity=1)
+        self.assertTrue(bucket.acquire())
+
+        ## The next token takes about 10ms to refill
+        started_at = time.monotonic()
+        self.assertTrue(bucket.acquire())
+        self.assertGreaterEqual(time.monotonic() - started_at, 0.005)
+        self.assertFalse(bucket.acquire(timeout=0.001))
+
+
+    def test_acquire_async(self):
+        bucket = TokenBucket(rate=100, capacity=1)
+
+        async def run():
+            started_at = time.monotonic()
+            await bucket.acquire_async()
+            await bucket.acquire_async()
+            return time.monotonic() - started_at
+
+        self.assertGreaterEqual(asyncio.run(run()), 0.005)
+
+
+    def test_invalid(self):
+        ## Buckets that could never refill (or never hold a whole token) would block forever
+        testTuples = [
+            (TokenBucket, {"rate": 0}),
+            (TokenBucket, {"rate": -1, "capacity": 5}),
+            (TokenBucket, {"rate": 1, "capacity": 0.5}),
+            (RateLimiter, {"account_rate": 0}),
+            (RateLimiter, {"gateway_rate": 1, "gateway_burst": 0}),
+            (RateLimiter, {"gateway_rates": {"vtext.com": (0, 5)}})
+        ]
+
+        for cls, kwargs in testTuples:
+            try:
+                with self.assertRaises(ValueError):
+                    cls(**kwargs)
+            except AssertionError as e:
+                print("AssertionError: {0} for args: {1}, {2}.".format(e, cls.__name__, kwargs))
+                raise AssertionError(e)
+
+        self.assertEqual(TokenBucket(rate=0.5).capacity, 1)
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_buckets_for(self):
+        limiter = RateLimiter(account_rate=1, gateway_rate=2, gateway_rates={"vtext.com": (0.5, 5)})
+
+        account, gateway = limiter.buckets_for("user", "8663454897@vtext.com")
+        self.assertEqual((account.rate, account.capacity), (1, 1))
+        self.assertEqual((gateway.rate, gateway.capacity), (0.5, 5))
+        self.assertIs(limiter.buckets_for("user", "8663454897@txt.att.net")[0], account)
+        self.assertEqual(limiter.buckets_for("user", "8663454897@txt.att.net")[1].rate, 2)
+        self.assertEqual(RateLimiter().buckets_for("user", "8663454897@vtext.com"), [])
+
+        with self.assertRaises(ValueError):
+            RateLimiter(mode="sometimes")
+
+
+    def test_try_acquire_is_atomic(self):
+        limiter = RateLimiter(account_rate=0.001, account_burst=2, gateway_rate=0.001, gateway_burst=1)
+
+        self.assertTrue(limiter.try_acquire("user", "8663454897@vtext.com"))
+        ## The gateway is out of tokens, so the account's token shouldn't be spent
+        self.assertFalse(limiter.try_acquire("user", "8663454897@vtext.com"))
+        self.assertTrue(limiter.try_acquire("user", "8663454897@txt.att.net"))
+        self.assertEqual(round(limiter.snapshot()["account:user"]), 0)
+
+
+    def test_deferred_batch(self):
+        limiter = RateLimiter(gateway_rate=0.001, gateway_burst=2, mode=RateLimiter.DEFER)
+        recipients = [(8663454897, "att")] * 3 + [(8663454897, "vzw")]
+        pool = SMTPConnectionPool(connection_factory=FakeConnection)
+
+        batch = MailToSMSBatch(recipients, contents="hello", quiet=True, pool=pool, rate_limiter=limiter)
+
+        self.assertEqual([result.success for result in batch.results], [True, True, False, True])
+        self.assertEqual([result.deferred for result in batch.results], [False, False, True, False])
+
+
+if(__name__ == "__main__"):
+    unittest.main()
@@ -0,0 +1,101 @@
+import pickle
+import unittest
+from mail_to_sms import MailToSMS, Recipient, Sender, SMTPConnectionPool, RetryPolicy, CircuitBreakerRegistry
+from fakes import FakeConnection
+
+
+class TestRecipient(unittest.TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+        self.pool = SMTPConnectionPool(connection_factory=FakeConnection)
+        self.kwargs = {
+            "quiet": True,
+            "pool": self.pool,
+            "retry": RetryPolicy(max_attempts=1),
+            "breakers": CircuitBreakerRegistry()
+        }
+
+
+    def test_immutable(self):
+        recipient = Recipient("+18663454897", "8663454897", "att", "txt.att.net", "mms.att.net")
+
+        with self.assertRaises(AttributeError):
+            recipient.number = "+15551234567"
+        with self.assertRaises(AttributeError):
+            del recipient.carrier
+        self.assertFalse(hasattr(recipient, "__dict__"))
+
+
+    def test_equality(self):
+        recipient = Recipient("+18663454897", "8663454897", "att", "txt.att.net", "mms.att.net")
+        same = Recipient("+18663454897", "8663454897", "att", "txt.att.net", "mms.att.net")
+        other = Recipient("+18663454897", "8663454897", "verizon", "vtext.com", "vzwpix.com")
+
+        self.assertEqual(recipient, same)
+        self.assertNotEqual(recipient, other)
+        self.assertEqual(len({recipient, same, other}), 2)
+        self.assertEqual(pickle.loads(pickle.dumps(recipient)), recipient)
+
+
+    def test_get_address(self):
+        recipient = Recipient("+18663454897", "8663454897", "att", "txt.att.net", "mms.att.net")
+
+        self.assertEqual(recipient.get_address(), "8663454897@txt.att.net")
+        self.assertEqual(recipient.get_address(mms=True), "8663454897@mms.att.net")
+
+
+    def test_sender_recipient(self):
+        sender = Sender("username", "password", **self.kwargs)
+
+        testTuples = [
+            ((8663454897, "att"), ("+18663454897", "8663454897", "att", "8663454897@txt.att.net")),
+            (("866-345-4897", " att "), ("+18663454897", "8663454897", "att", "8663454897@txt.att.net")),
+            ((8663454897, "virgin mobile"), ("+18663454897", "8663454897", "virgin mobile", "8663454897@vmobl.com")),
+            ((123, "att"), None),
+            ((8663454897, "not a carrier"), None)
+        ]
+
+        for args, expected in testTuples:
+            try:
+                recipient = sender.recipient(*args)
+                if(expected is None):
+                    self.assertIsNone(recipient)
+                else:
+                    actual = (recipient.number, recipient.national, recipient.carrier, recipient.get_address())
+                    self.assertEqual(actual, expected)
+            except AssertionError as e:
+                print("Failed on:", args, expected)
+                raise e
+
+        ## No connection is needed to resolve recipients
+        self.assertEqual(FakeConnection.instances, [])
+
+
+    def test_sender_send_many(self):
+        FakeConnection.fail_for = ["8663454897@vtext.com"]
+        sender = Sender("username", "password", subject="hey", **self.kwargs)
+        roster = [sender.recipient(8663454897, carrier) for carrier in ("att", "verizon", "sprint")]
+
+        results = sender.send_many(roster, "hello")
+
+        self.assertEqual([result.success for result in results], [True, False, True])
+        self.assertEqual(
+            [result.address for result in results],
+            ["8663454897@txt.att.net", "8663454897@vtext.com", "8663454897@messaging.sprintpcs.com"]
+        )
+        self.assertEqual(results[0].number, "+18663454897")
+        self.assertIsNotNone(results[1].error)
+
+        ## Every recipient shared the one connection
+        self.assertEqual(len(FakeConnection.instances), 1)
+        self.assertEqual(FakeConnection.instances[0].logins, 1)
+        self.assertEqual(len(FakeConnection.instances[0].smtp.sent), 2)
+        self.assertIsNone(sender.connection)
+
+
+    def test_mail_to_sms_compatible(self):
+        mail = MailToSMS(8663454897, "att", "username", "password", "hello", **self.kwargs)
+
+        self.assertIsInstance(mail, Sender)
+        self.assertEqual(mail.address, "8663454897@txt.att.net")
+        self.assertEqual(len(FakeConnection.instances[0].smtp.sent), 1)
@@ -0,0 +1,207 @@
+import smtplib
+import unittest
+from mail_to_sms import CircuitBreaker, CircuitBreakerRegistry, CircuitOpenError, MailToSMS, RetryPolicy, SMTPConnectionPool
+from mail_to_sms.resilience import call_with_retries, get_failure_kind
+from fakes import FakeConnection
+
+try:
+    import aiosmtplib
+except ImportError:
+    aiosmtplib = None
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def setUp(self):
+        self.policy = RetryPolicy(max_attempts=3, base_delay=1, max_delay=3, jitter=0)
+
+
+    def test_is_retryable(self):
+        testTuples = [
+            ## (Exception, Expected Return)
+            ## Transient errors
+            (smtplib.SMTPServerDisconnected("gone"), True),
+            (smtplib.SMTPConnectError(421, b"busy"), True),
+            (smtplib.SMTPDataError(451, b"try later"), True),
+            (smtplib.SMTPSenderRefused(421, b"slow down", "sender@example.com"), True),
+            (smtplib.SMTPRecipientsRefused({"a": (450, b"busy"), "b": (451, b"busy")}), True),
+            (ConnectionRefusedError(), True),
+            ## Permanent errors
+            (smtplib.SMTPDataError(550, b"no such user"), False),
+            (smtplib.SMTPRecipientsRefused({"a": (450, b"busy"), "b": (550, b"nope")}), False),
+            (smtplib.SMTPAuthenticationError(535, b"bad credentials"), False),
+            (CircuitOpenError("open"), False),
+            (ValueError("oops"), False)
+        ]
+
+        for exception, result in testTuples:
+            try:
+                self.assertEqual(self.policy.is_retryable(exception), result)
+            except AssertionError as e:
+                ## Catch the error and dump some useful info, then re-raise it so that the test fails properly
+                print("AssertionError: {0} for args: {1}, {2}.".format(e, repr(exception), result))
+                raise AssertionError(e)
+
+
+    @unittest.skipUnless(aiosmtplib, "aiosmtplib is required for its exceptions")
+    def test_is_retryable_async(self):
+        def refused(*codes):
+            return aiosmtplib.SMTPRecipientsRefused([
+                aiosmtplib.SMTPRecipientRefused(code, "refused", "{0}@example.com".format(code)) for code in codes
+            ])
+
+        testTuples = [
+            ## (Exception, Expected Return)
+            (refused(450), True),
+            (refused(450, 452), True),
+            (refused(450, 550), False),
+            (aiosmtplib.SMTPSenderRefused(421, "slow down", "sender@example.com"), True),
+            (aiosmtplib.SMTPServerDisconnected("gone"), True)
+        ]
+
+        for exception, result in testTuples:
+            try:
+                self.assertEqual(self.policy.is_retryable(exception), result)
+            except AssertionError as e:
+                print("AssertionError: {0} for args: {1}, {2}.".format(e, repr(exception), result))
+                raise AssertionError(e)
+
+
+    def test_get_delay(self):
+        self.assertEqual([self.policy.get_delay(attempt) for attempt in range(1, 5)], [1, 2, 3, 3])
+
+        self.policy.jitter = 0.5
+        for _ in range(100):
+            self.assertTrue(1 <= self.policy.get_delay(2) <= 2)
+
+
+    def test_call_with_retries(self):
+        responses = [smtplib.SMTPDataError(451, b"try later"), smtplib.SMTPServerDisconnected("gone"), None]
+        sleeps = []
+
+        def send():
+            response = responses.pop(0)
+            if(response):
+                raise response
+            return "sent"
+
+        self.assertEqual(call_with_retries(send, self.policy, sleep=sleeps.append), "sent")
+        self.assertEqual(sleeps, [1, 2])
+
+        ## Permanent errors are raised right away
+        responses = [smtplib.SMTPDataError(550, b"nope")]
+        with self.assertRaises(smtplib.SMTPDataError):
+            call_with_retries(send, self.policy, sleep=sleeps.append)
+        self.assertEqual(sleeps, [1, 2])
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_open_and_recover(self):
+        breaker = CircuitBreaker("gateway:vtext.com", failure_threshold=2, reset_timeout=60)
+
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+        ## After the reset timeout, exactly one trial is let through
+        breaker.reset_timeout = 0
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+        self.assertEqual(
+            breaker.snapshot(),
+            {"state": "closed", "consecutive_failures": 0, "successes": 1, "failures": 2, "rejections": 2, "opens": 1}
+        )
+
+
+    def test_half_open_failure(self):
+        breaker = CircuitBreaker("host:smtp.gmail.com", failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+
+        breaker.reset_timeout = 60
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(breaker.opens, 2)
+
+
+    def test_get_failure_kind(self):
+        testTuples = [
+            ## (Exception, Expected kind)
+            (smtplib.SMTPServerDisconnected("gone"), "host"),
+            (smtplib.SMTPConnectError(421, b"busy"), "host"),
+            (smtplib.SMTPSenderRefused(421, b"slow down", "sender@example.com"), "host"),
+            (smtplib.SMTPDataError(421, b"closing"), "host"),
+            (smtplib.SMTPAuthenticationError(454, b"try later"), "host"),
+            (ConnectionRefusedError(), "host"),
+            (smtplib.SMTPRecipientsRefused({"a": (450, b"busy")}), "gateway"),
+            (smtplib.SMTPDataError(451, b"try later"), "gateway")
+        ]
+
+        for exception, kind in testTuples:
+            try:
+                self.assertEqual(get_failure_kind(exception), kind)
+            except AssertionError as e:
+                print("Failed on:", repr(exception), kind)
+                raise e
+
+
+    def test_gateway_failures(self):
+        ## A carrier refusing recipients says nothing about the relay, so only the gateway's breaker opens
+        breakers = CircuitBreakerRegistry(failure_threshold=2, reset_timeout=60)
+        refused = smtplib.SMTPRecipientsRefused({"8663454897@vtext.com": (450, b"busy")})
+        attempts = []
+
+        def send():
+            attempts.append(None)
+            raise refused
+
+        with self.assertRaises(CircuitOpenError):
+            call_with_retries(
+                send, RetryPolicy(max_attempts=3, base_delay=0), breakers.for_send("smtp.example.com", "a@vtext.com")
+            )
+
+        self.assertEqual(len(attempts), 2)
+        snapshot = breakers.snapshot()
+        self.assertEqual(snapshot["gateway:vtext.com"]["state"], "open")
+        self.assertEqual(snapshot["host:smtp.example.com"]["state"], "closed")
+        self.assertEqual(snapshot["host:smtp.example.com"]["failures"], 0)
+
+        ## Other gateways on the same relay are unaffected
+        self.assertEqual(
+            call_with_retries(lambda: "sent", RetryPolicy(), breakers.for_send("smtp.example.com", "a@txt.att.net")),
+            "sent"
+        )
+
+
+    def test_mail_to_sms(self):
+        breakers = CircuitBreakerRegistry(failure_threshold=2, reset_timeout=60)
+        policy = RetryPolicy(max_attempts=3, base_delay=0)
+        FakeConnection.reset()
+        FakeConnection.errors = [smtplib.SMTPDataError(421, b"busy")] * 2
+
+        pool = SMTPConnectionPool(connection_factory=FakeConnection)
+        mail = MailToSMS(8663454897, "vzw", quiet=True, pool=pool, retry=policy, breakers=breakers)
+
+        ## Two consecutive 421s open the relay's breaker, so the third attempt never happens. The relay closing the
+        ## session isn't the carrier's fault, so its gateway's breaker stays closed.
+        self.assertFalse(mail.send("hello"))
+        smtp = FakeConnection.instances[0].smtp
+        self.assertEqual(smtp.attempts, 2)
+        snapshot = breakers.snapshot()
+        self.assertEqual(snapshot["host:smtp.gmail.com"]["state"], "open")
+        self.assertEqual(snapshot["gateway:vtext.com"]["state"], "closed")
+
+        ## While open, sends fail fast without touching the network
+        self.assertFalse(mail.send("hello"))
+        self.assertEqual(smtp.attempts, 2)
+        self.assertEqual(breakers.snapshot()["host:smtp.gmail.com"]["rejections"], 2)
+
+
+if(__name__ == "__main__"):
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+from unittest import mock
+from mail_to_sms import GatewayRegistry, NumberCache, resolve_addresses
+from mail_to_sms import resolver
+
+
+class TestResolver(unittest.TestCase):
+    def test_resolve_addresses(self):
+        rows = [
+            (8663454897, "att"),
+            ("866-345-4897", " vzw "),
+            ("8663454897", "nope"),
+            ("123", "att"),
+            ("8663454897", "att"),
+        ]
+        testTuples = [
+            ("8663454897@txt.att.net", None),
+            ("8663454897@vtext.com", None),
+            (None, resolver.UNKNOWN_CARRIER),
+            (None, resolver.INVALID_NUMBER),
+            ("8663454897@txt.att.net", None)
+        ]
+
+        ## Small batches, so rows span more than one of them
+        resolutions = list(resolve_addresses(rows, batch_size=2, number_cache=NumberCache()))
+        self.assertEqual(len(resolutions), len(rows))
+
+        for row, resolution, (address, reason) in zip(rows, resolutions, testTuples):
+            try:
+                self.assertEqual((resolution.number, resolution.carrier), row)
+                self.assertEqual(resolution.address, address)
+                self.assertEqual(resolution.reason, reason)
+                self.assertEqual(resolution.error is None, reason is None)
+            except AssertionError as e:
+                print(row, resolution, address, reason)
+                raise e
+
+
+    def test_resolve_addresses_mms(self):
+        resolution = next(resolve_addresses([(8663454897, "att")], mms=True))
+        self.assertEqual(resolution.address, "8663454897@mms.att.net")
+
+
+    def test_resolve_addresses_no_gateway(self):
+        registry = GatewayRegistry([{"carrier_names": ["empty"]}])
+
+        resolution = next(resolve_addresses([(8663454897, "empty")], registry=registry))
+        self.assertEqual(resolution.reason, resolver.NO_GATEWAY)
+
+
+    def test_resolve_addresses_parses_once_per_batch(self):
+        cache = NumberCache()
+        with mock.patch.object(cache, "get", wraps=cache.get) as get:
+            list(resolve_addresses([(8663454897, "att")] * 10, number_cache=cache))
+
+        self.assertEqual(get.call_count, 1)
+
+
+    def test_resolve_addresses_processes(self):
+        rows = [(8663454897, "att"), ("123", "att"), ("8663454897", "vzw")] * 5
+        serial = list(resolve_addresses(rows, batch_size=2))
+        parallel = list(resolve_addresses(rows, batch_size=2, processes=2))
+
+        self.assertEqual(parallel, serial)
+
+
+if(__name__ == "__main__"):
+    unittest.main()
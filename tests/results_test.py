@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mail_to_sms import ResultsStore
+
+
+class TestResultsStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.store = ResultsStore(os.path.join(self.directory, "nested", "results.sqlite3"))
+        self.addCleanup(self.store.close)
+
+
+    def test_record(self):
+        self.store.record("<one@example.com>", "8663454897@TXT.att.net", True)
+        self.store.record("<two@example.com>", "8663454897@txt.att.net", False, 550, "No such user")
+        self.store.record("<three@example.com>", "8663454898@vtext.com", True)
+
+        deliveries = self.store.get_deliveries(address="8663454897@txt.att.net")
+        self.assertEqual([delivery.message_id for delivery in deliveries], ["<two@example.com>", "<one@example.com>"])
+        self.assertEqual(
+            (deliveries[0].number, deliveries[0].gateway, deliveries[0].success, deliveries[0].code),
+            ("8663454897", "txt.att.net", False, 550)
+        )
+        self.assertTrue(deliveries[1].success)
+        self.assertEqual(len(self.store.get_deliveries(limit=2)), 2)
+        self.assertEqual(len(self.store.get_deliveries(message_id="<three@example.com>")), 1)
+
+
+    def test_record_bounce(self):
+        testTuples = [
+            ## (Message-ID, Address, Expected match)
+            ("<one@example.com>", "8663454897@txt.att.net", "<one@example.com>"),
+            ## Unknown or missing Message-IDs fall back to the latest message to the address
+            ("<unknown@example.com>", "8663454897@txt.att.net", "<two@example.com>"),
+            (None, "8663454897@txt.att.net", "<two@example.com>"),
+            ("<one@example.com>", "8663454898@txt.att.net", None)
+        ]
+
+        self.store.record("<one@example.com>", "8663454897@txt.att.net", True)
+        self.store.record("<two@example.com>", "8663454897@txt.att.net", True)
+
+        for message_id, address, expected in testTuples:
+            try:
+                matched = self.store.record_bounce(message_id, address, "5.1.1", "No such user")
+                if(expected is None):
+                    self.assertIsNone(matched)
+                else:
+                    delivery = self.store.get_deliveries(message_id=expected)[0]
+                    self.assertEqual(matched, delivery.id)
+                    self.assertEqual((delivery.bounce_status, delivery.bounce_reason), ("5.1.1", "No such user"))
+            except AssertionError as e:
+                print("Failed on:", message_id, address, expected)
+                raise e
+
+
+    def test_undeliverable(self):
+        self.assertFalse(self.store.is_undeliverable("8663454897@txt.att.net"))
+
+        self.store.mark_undeliverable("8663454897@txt.att.net ", detail="550 No such user")
+        self.store.mark_undeliverable("8663454898@vtext.com", "opted_out", "STOP")
+        self.assertTrue(self.store.is_undeliverable("8663454897@TXT.ATT.NET"))
+        self.assertEqual(
+            [(entry.address, entry.reason) for entry in self.store.get_undeliverable()],
+            [("8663454897@txt.att.net", "bounced"), ("8663454898@vtext.com", "opted_out")]
+        )
+
+        self.store.clear_undeliverable("8663454897@txt.att.net")
+        self.assertFalse(self.store.is_undeliverable("8663454897@txt.att.net"))
+
+
+if(__name__ == "__main__"):
+    unittest.main()
@@ -0,0 +1,127 @@
+import unittest
+from mail_to_sms import MailToSMS, MessageTemplate, SMTPConnectionPool, get_gateway_registry
+from mail_to_sms import segmentation
+from fakes import FakeConnection, get_body
+
+
+class TestSegmentation(unittest.TestCase):
+    def setUp(self):
+        self.registry = get_gateway_registry()
+
+
+    def test_measure(self):
+        testTuples = [
+            ## (Text, Expected Encoding, Expected Length)
+            ("hello", segmentation.GSM7, 5),
+            ("price: 5€ [approx]", segmentation.GSM7, 21),
+            ("Ünïcödé", segmentation.UCS2, 7),
+            ("héllo ✓", segmentation.UCS2, 7),
+            ("emoji 🚨", segmentation.UCS2, 8)
+        ]
+
+        for text, encoding, length in testTuples:
+            try:
+                self.assertEqual(segmentation.get_encoding(text), encoding)
+                self.assertEqual(segmentation.measure(text), length)
+            except AssertionError as e:
+                ## Catch the error and dump some useful info, then re-raise it so that the test fails properly
+                print("AssertionError: {0} for args: {1}, {2}, {3}.".format(e, text, encoding, length))
+                raise AssertionError(e)
+
+
+    def test_segment(self):
+        self.assertEqual(segmentation.segment("short"), ["short"])
+
+        text = " ".join("word{0}".format(index) for index in range(100))
+        segments = segmentation.segment(text)
+        self.assertEqual(len(segments), 5)
+        self.assertTrue(segments[0].startswith("(1/5) word0 "))
+        self.assertTrue(all(segmentation.measure(segment) <= 160 for segment in segments))
+        ## Nothing was lost, and words weren't split
+        self.assertEqual(" ".join(segment.split(" ", 1)[1] for segment in segments), text)
+
+        segments = segmentation.segment("✓" * 150)
+        self.assertEqual(len(segments), 3)
+        self.assertTrue(all(segmentation.measure(segment) <= 70 for segment in segments))
+
+
+    def test_prepare(self):
+        long_text = "x" * 200
+        testTuples = [
+            ## (Address, Contents, Mode, Expected Addresses)
+            ("8663454897@txt.att.net", "short", segmentation.SEGMENT, ["8663454897@txt.att.net"]),
+            ("8663454897@txt.att.net", long_text, None, ["8663454897@txt.att.net"]),
+            ("8663454897@txt.att.net", long_text, segmentation.SEGMENT, ["8663454897@txt.att.net"] * 2),
+            ("8663454897@txt.att.net", long_text, segmentation.MMS, ["8663454897@mms.att.net"]),
+            ("8663454897@txt.att.net", [long_text[:100], long_text[100:]], segmentation.MMS, ["8663454897@mms.att.net"]),
+            ("8663454897@mms.att.net", long_text, segmentation.SEGMENT, ["8663454897@mms.att.net"]),
+            ("8663454897@tmomail.net", long_text, segmentation.SEGMENT, ["8663454897@tmomail.net"]),
+            ("8663454897@example.com", long_text, segmentation.MMS, ["8663454897@example.com"] * 2),
+            ## Attachments can't be split
+            ("8663454897@txt.att.net", [long_text, {"file": "name"}], segmentation.SEGMENT, ["8663454897@txt.att.net"])
+        ]
+
+        for address, contents, mode, result in testTuples:
+            try:
+                prepared = segmentation.prepare(address, contents, mode, self.registry)
+                self.assertEqual([prepared_address for prepared_address, _ in prepared], result)
+            except AssertionError as e:
+                ## Catch the error and dump some useful info, then re-raise it so that the test fails properly
+                print("AssertionError: {0} for args: {1}, {2}.".format(e, address, mode))
+                raise AssertionError(e)
+
+        ## Above the threshold long messages are promoted, and below it they're segmented
+        prepared = segmentation.prepare("8663454897@txt.att.net", long_text, segmentation.MMS, self.registry, 300)
+        self.assertEqual(len(prepared), 2)
+
+
+    def test_prepare_subject(self):
+        address = "8663454897@txt.att.net"
+        text = "x" * 155
+
+        ## The subject (and the line break after it) count towards every segment's length
+        self.assertEqual(len(segmentation.prepare(address, text, segmentation.SEGMENT, self.registry)), 1)
+        prepared = segmentation.prepare(address, text, segmentation.SEGMENT, self.registry, subject="an alert")
+        self.assertEqual(len(prepared), 2)
+        self.assertTrue(all(segmentation.measure("an alert\n" + chunk) <= 160 for _, chunk in prepared))
+
+        ## A non GSM-7 subject makes the whole message UCS-2
+        prepared = segmentation.prepare(address, "x" * 65, segmentation.SEGMENT, self.registry, subject="✓")
+        self.assertEqual(len(prepared), 1)
+        prepared = segmentation.prepare(address, "x" * 100, segmentation.SEGMENT, self.registry, subject="✓")
+        self.assertEqual(len(prepared), 2)
+
+        ## A subject with no room left over for the text is left to the gateway
+        prepared = segmentation.prepare(address, text, segmentation.SEGMENT, self.registry, subject="y" * 200)
+        self.assertEqual(prepared, [(address, text)])
+
+
+    def test_prepare_template(self):
+        address = "8663454897@txt.att.net"
+        template = MessageTemplate("$name costs $$5. " + " ".join(["word"] * 30), subject="alert")
+
+        ## Templates are measured once they're filled in, along with their own subject rather than the given one
+        contents = template.bind(name="it")
+        prepared = segmentation.prepare(address, contents, segmentation.SEGMENT, self.registry, subject="x")
+        self.assertEqual(len(prepared), 2)
+        self.assertTrue(all(isinstance(chunk, MessageTemplate) for _, chunk in prepared))
+        self.assertEqual([chunk.subject for _, chunk in prepared], ["alert", "alert"])
+        self.assertTrue(prepared[0][1].get_text(address).startswith("(1/2) it costs $5. "))
+
+        short = MessageTemplate("hi $name")
+        prepared = segmentation.prepare(address, short.bind(name="bob"), segmentation.SEGMENT, self.registry)
+        self.assertEqual(len(prepared), 1)
+
+
+    def test_mail_to_sms(self):
+        pool = SMTPConnectionPool(connection_factory=FakeConnection)
+        with MailToSMS(8663454897, "att", quiet=True, pool=pool, long_messages="segment") as mail:
+            self.assertTrue(mail.send("y" * 400))
+            sent = mail.connection.smtp.sent
+
+        self.assertEqual(len(sent), 3)
+        self.assertEqual([get_body(message)[:6] for _, _, message in sent], ["(1/3) ", "(2/3) ", "(3/3) "])
+
+
+if(__name__ == "__main__"):
+    unittest.main()
@@ -0,0 +1,123 @@
+import smtplib
+import threading
+import unittest
+from mail_to_sms import MailToSMS, SMTPConnectionPool, SMTPPoolTimeout
+from fakes import FakeConnection
+
+
+class TestSMTPConnectionPool(unittest.TestCase):
+    def setUp(self):
+        FakeConnection.reset()
+        self.pool = SMTPConnectionPool(size=2, acquire_timeout=0.1, connection_factory=FakeConnection)
+
+
+    def test_key_for(self):
+        testTuples = [
+            ## (yagmail args, Expected Key)
+            ((), ("smtp.gmail.com", None, None)),
+            (("user", "pass"), ("smtp.gmail.com", None, "user")),
+            (("user", "pass", "smtp.example.com", 25), ("smtp.example.com", "25", "user")),
+            (("user", "pass", "smtp.example.com", "25"), ("smtp.example.com", "25", "user"))
+        ]
+
+        for args, result in testTuples:
+            try:
+                self.assertEqual(self.pool.key_for(*args), result)
+            except AssertionError as e:
+                ## Catch the error and dump some useful info, then re-raise it so that the test fails properly
+                print("AssertionError: {0} for args: {1}, {2}.".format(e, args, result))
+                raise AssertionError(e)
+
+
+    def test_reuse(self):
+        with self.pool.connection("user", "pass") as first:
+            pass
+        with self.pool.connection("user", "pass") as second:
+            pass
+        with self.pool.connection("other", "pass") as third:
+            pass
+
+        self.assertIs(first, second)
+        self.assertIsNot(first, third)
+
+
+    def test_idle_timeout(self):
+        self.pool.idle_timeout = -1
+        with self.pool.connection("user", "pass") as first:
+            pass
+        with self.pool.connection("user", "pass") as second:
+            pass
+
+        self.assertIsNot(first, second)
+        self.assertTrue(first.is_closed)
+
+
+    def test_health_check(self):
+        with self.pool.connection("user", "pass") as first:
+            first.login()
+        first.smtp.healthy = False
+        with self.pool.connection("user", "pass") as second:
+            pass
+
+        self.assertIsNot(first, second)
+        self.assertTrue(first.is_closed)
+        self.assertEqual(self.pool.stats()[("smtp.gmail.com", None, "user")]["open"], 1)
+
+
+    def test_size_limit(self):
+        first = self.pool.acquire("user", "pass")
+        second = self.pool.acquire("user", "pass")
+        with self.assertRaises(SMTPPoolTimeout):
+            self.pool.acquire("user", "pass")
+
+        ## A blocked acquire should pick up the connection as soon as it's released
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(self.pool.acquire("user", "pass")))
+        self.pool.acquire_timeout = 5
+        thread.start()
+        self.pool.release(first)
+        thread.join()
+
+        self.assertIs(acquired[0], first)
+        self.pool.release(second)
+
+
+    def test_discard_on_disconnect(self):
+        with self.assertRaises(smtplib.SMTPServerDisconnected):
+            with self.pool.connection("user", "pass") as first:
+                raise smtplib.SMTPServerDisconnected("gone")
+        with self.pool.connection("user", "pass") as second:
+            pass
+
+        self.assertIsNot(first, second)
+        self.assertTrue(first.is_closed)
+
+
+    def test_close(self):
+        with self.pool.connection("user", "pass") as connection:
+            pass
+        self.pool.close()
+
+        self.assertTrue(connection.is_closed)
+        self.assertEqual(self.pool.stats()[("smtp.gmail.com", None, "user")], {"open": 0, "idle": 0})
+
+
+    def test_mail_to_sms_context_manager(self):
+        with MailToSMS(8663454897, "att", "user", "pass", quiet=True, pool=self.pool) as mail:
+            self.assertTrue(mail.send("one"))
+            FakeConnection.errors.append(smtplib.SMTPServerDisconnected("gone"))
+            self.assertTrue(mail.send("two"))
+            connection = mail.connection
+
+        self.assertIsNone(mail.connection)
+        ## One reconnect after the server dropped the session
+        self.assertEqual(connection.logins, 2)
+        self.assertEqual(self.pool.stats()[("smtp.gmail.com", None, "user")], {"open": 1, "idle": 1})
+
+        ## Later sends reuse the pooled connection
+        self.assertTrue(MailToSMS(8663454897, "att", "user", "pass", quiet=True, pool=self.pool).send("three"))
+        self.assertEqual(len(connection.smtp.sent), 2)
+
+
+if(__name__ == "__main__"):
+    unittest.main()
@@ -0,0 +1,205 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mail_to_sms import (
+    CircuitBreakerRegistry, MailToSMS, MailToSMSBatch, MessageTemplate, MetricsRegistry, RateLimiter, ResultsStore,
+    SMTPConnectionPool, Spool, SpoolWorker
+)
+from mail_to_sms.metrics import FAILED, SENT
+from fakes import FakeConnection
+
+
+class TestSpool(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, "spool.sqlite3")
+        self.spool = Spool(self.path)
+        self.addCleanup(self.spool.close)
+
+        FakeConnection.reset()
+        FakeConnection.fail_code = 451
+        self.pool = SMTPConnectionPool(connection_factory=FakeConnection)
+
+
+    def build_worker(self, **kwargs):
+        kwargs.setdefault("breakers", CircuitBreakerRegistry())
+        return SpoolWorker(self.spool, ["user", "pass"], pool=self.pool, quiet=True, **kwargs)
+
+
+    def test_enqueue_and_claim(self):
+        first = self.spool.enqueue("8663454897@txt.att.net", "hello", "subject")
+        second = self.spool.enqueue("8663454897@vtext.com", ["line one", "line two"])
+
+        claimed = self.spool.claim(10)
+        self.assertEqual([message.id for message in claimed], [first, second])
+        self.assertEqual(claimed[1].contents, ["line one", "line two"])
+        self.assertEqual(claimed[0].subject, "subject")
+        ## Leased messages can't be claimed again until their lease expires
+        self.assertEqual(self.spool.claim(10), [])
+        self.assertEqual(self.spool.counts()["sending"], 2)
+
+
+    def test_survives_restart(self):
+        self.spool.enqueue("8663454897@txt.att.net", "hello")
+        self.spool.claim(10, lease=-1)
+        self.spool.close()
+
+        ## The worker that claimed the message died, so its expired lease makes it available again
+        self.spool = Spool(self.path)
+        self.assertEqual(len(self.spool.claim(10)), 1)
+
+
+    def test_mail_to_sms_enqueue(self):
+        message_id = MailToSMS(8663454897, "att", quiet=True, spool=self.spool, subject="hey").enqueue("hello")
+
+        self.assertIsNotNone(message_id)
+        self.assertEqual(FakeConnection.instances, [])
+        self.assertEqual(self.spool.claim(1)[0][1:], ("8663454897@txt.att.net", "hey", "hello", 0))
+
+
+    def test_enqueue_templates(self):
+        ## Templates are filled in for each recipient when they're queued, since only JSON is stored
+        template = MessageTemplate("Hi $number on $carrier, $what", subject="alert")
+        MailToSMS(8663454897, "att", quiet=True, spool=self.spool).enqueue(template.bind(what="db01 is down"))
+        MailToSMSBatch([(8663454898, "vzw"), (123, "att")], quiet=True, spool=self.spool).enqueue(
+            template.bind(what="ok")
+        )
+
+        self.assertEqual(
+            [message[1:4] for message in self.spool.claim(10)],
+            [
+                ("8663454897@txt.att.net", "alert", "Hi 8663454897 on att, db01 is down"),
+                ("8663454898@vtext.com", "alert", "Hi 8663454898 on vzw, ok")
+            ]
+        )
+
+        ## Contents that can't be spooled are raised up front, rather than logged
+        testTuples = [
+            ## (Contents, Expected exception)
+            (template, KeyError),
+            ({"not": object()}, TypeError)
+        ]
+
+        for contents, exception in testTuples:
+            try:
+                with self.assertRaises(exception):
+                    MailToSMS(8663454897, "att", quiet=True, spool=self.spool).enqueue(contents)
+                with self.assertRaises(exception):
+                    MailToSMSBatch([(8663454897, "att")], quiet=True, spool=self.spool).enqueue(contents)
+            except AssertionError as e:
+                print("Failed on:", contents, exception)
+                raise e
+
+        self.assertEqual(self.spool.counts()["pending"], 0)
+
+
+    def test_worker(self):
+        for index in range(5):
+            self.spool.enqueue("8663454897@txt.att.net", "hello {0}".format(index))
+        self.spool.enqueue("8663454897@vtext.com", "this one fails")
+        FakeConnection.fail_for = ("8663454897@vtext.com",)
+
+        worker = self.build_worker(batch_size=2, max_attempts=2, backoff=0)
+        worker.run(drain=True)
+
+        ## All of the good messages went out over one pooled connection
+        self.assertEqual(len(FakeConnection.instances), 1)
+        self.assertEqual(len(FakeConnection.instances[0].smtp.sent), 5)
+
+        ## And the bad one was retried, then dead lettered
+        self.assertEqual(self.spool.counts(), {"pending": 0, "sending": 0, "dead": 1})
+        message, error = self.spool.dead_letters()[0]
+        self.assertEqual(message.address, "8663454897@vtext.com")
+        self.assertEqual(message.attempts, 2)
+        self.assertIn("try later", error)
+
+
+    def test_worker_backoff(self):
+        self.spool.enqueue("8663454897@vtext.com", "this one fails")
+        FakeConnection.fail_for = ("8663454897@vtext.com",)
+
+        worker = self.build_worker(backoff=60)
+        self.assertEqual(worker.run_once(), 1)
+        ## It's waiting out its backoff, so there's nothing to claim yet
+        self.assertEqual(worker.run_once(), 0)
+        self.assertEqual(self.spool.counts()["pending"], 1)
+
+
+    def test_worker_permanent_failure(self):
+        ## A 550 won't go away on its own, so it's dead lettered without using up the rest of its attempts
+        self.spool.enqueue("8663454897@vtext.com", "this one fails")
+        self.spool.enqueue("8663454897@txt.att.net", "hello")
+        FakeConnection.fail_for = ("8663454897@vtext.com",)
+        FakeConnection.fail_code = 550
+
+        worker = self.build_worker(max_attempts=5, backoff=0)
+        self.assertEqual(worker.run_once(), 2)
+
+        self.assertEqual(self.spool.counts(), {"pending": 0, "sending": 0, "dead": 1})
+        message, _ = self.spool.dead_letters()[0]
+        self.assertEqual(message.address, "8663454897@vtext.com")
+        self.assertEqual(message.attempts, 1)
+
+
+    def test_worker_disconnect(self):
+        ## Once the server's gone, the rest of the batch goes back without being charged an attempt
+        for address in ("8663454897@txt.att.net", "8663454897@vtext.com", "8663454898@txt.att.net", "8663454899@txt.att.net"):
+            self.spool.enqueue(address, "hello")
+        FakeConnection.disconnect_for = ("8663454897@vtext.com",)
+
+        worker = self.build_worker(batch_size=10, backoff=60)
+        self.assertEqual(worker.run_once(), 4)
+
+        ## The connection was thrown away rather than going back to the pool
+        self.assertEqual(list(self.pool.stats().values()), [{"open": 0, "idle": 0}])
+        ## The first message went out, the one that hit the disconnect is backing off, and the rest are ready again
+        self.assertEqual(self.spool.counts(), {"pending": 3, "sending": 0, "dead": 0})
+
+        FakeConnection.disconnect_for = ()
+        self.assertEqual(
+            [(message.address, message.attempts) for message in self.spool.claim(10)],
+            [("8663454898@txt.att.net", 0), ("8663454899@txt.att.net", 0)]
+        )
+
+
+    def test_worker_sender(self):
+        ## Spooled messages go through a Sender, with the same segmenting, results, and rate limiting as any other send
+        store = ResultsStore(os.path.join(self.directory, "results.sqlite3"))
+        self.addCleanup(store.close)
+        store.mark_undeliverable("8663454899@txt.att.net")
+        metrics = MetricsRegistry()
+
+        self.spool.enqueue("8663454897@txt.att.net", "x" * 200, "subject")
+        self.spool.enqueue("8663454899@txt.att.net", "hello")
+        worker = self.build_worker(long_messages="segment", results=store, metrics=metrics, backoff=0)
+        self.assertEqual(worker.run_once(), 2)
+
+        self.assertEqual(
+            [(recipients, message[:23]) for _, recipients, message in FakeConnection.instances[0].smtp.sent],
+            [
+                (["8663454897@txt.att.net"], "Subject: subject\n\n(1/2)"),
+                (["8663454897@txt.att.net"], "Subject: subject\n\n(2/2)")
+            ]
+        )
+        self.assertEqual(len(store.get_deliveries()), 2)
+        self.assertEqual(metrics.get(SENT, domain="txt.att.net"), 2)
+        self.assertEqual(metrics.get(FAILED, reason="undeliverable"), 1)
+        ## Undeliverable addresses won't ever go through, so they're dead lettered right away
+        message, error = self.spool.dead_letters()[0]
+        self.assertEqual((message.address, message.attempts), ("8663454899@txt.att.net", 1))
+        self.assertIn("undeliverable", error)
+
+        ## Messages deferred by the rate limiter go back without using up an attempt
+        self.spool.enqueue("8663454897@txt.att.net", "one")
+        self.spool.enqueue("8663454897@txt.att.net", "two")
+        worker = self.build_worker(rate_limiter=RateLimiter(account_rate=0.001, mode="defer"), backoff=0)
+        self.assertEqual(worker.run_once(), 2)
+        self.assertEqual(
+            [(message.contents, message.attempts) for message in self.spool.claim(10)], [("two", 0)]
+        )
+
+
+if(__name__ == "__main__"):
+    unittest.main()
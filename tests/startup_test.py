@@ -0,0 +1,63 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+
+class TestStartup(unittest.TestCase):
+    ## Slow to import modules that the CLI shouldn't load until it actually needs them
+    LAZY_MODULES = (
+        "yagmail", "keyring", "phonenumbers", "asyncio", "aiosmtplib", "sqlite3", "smtplib", "concurrent.futures"
+    )
+
+
+    def _import(self, statement):
+        ## Runs the statement in a fresh interpreter, and returns the modules that it imported
+        code = "\n".join([
+            "import json, sys",
+            "before = set(sys.modules)",
+            statement,
+            "print(json.dumps(sorted(set(sys.modules) - before)))"
+        ])
+        process = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            check=True
+        )
+
+        return set(json.loads(process.stdout))
+
+
+    def _assert_not_imported(self, imported, modules):
+        for module in modules:
+            with self.subTest(module=module):
+                self.assertNotIn(module, imported)
+
+
+    def test_cli_startup(self):
+        ## Which modules get imported is what matters here, rather than a wall clock budget that depends on the machine
+        imported = self._import("import mail_to_sms.mail_to_sms_cli")
+
+        self._assert_not_imported(imported, self.LAZY_MODULES)
+
+
+    def test_resolve_without_yagmail(self):
+        ## Resolving addresses needs phonenumbers, but nothing to do with sending
+        imported = self._import("import mail_to_sms; list(mail_to_sms.resolve_addresses([(8663454897, 'att')]))")
+
+        self.assertIn("phonenumbers", imported)
+        self._assert_not_imported(imported, ("yagmail", "keyring", "asyncio", "smtplib"))
+
+
+    def test_lazy_async_import(self):
+        imported = self._import("from mail_to_sms import AsyncMailToSMS")
+
+        self.assertIn("mail_to_sms.async_mail_to_sms", imported)
+
+
+if(__name__ == "__main__"):
+    unittest.main()